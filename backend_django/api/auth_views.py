@@ -10,7 +10,10 @@ from datetime import datetime
 import hashlib
 import re
 
-from storage import get_storage_manager
+import jwt
+
+from storage import get_storage_backend
+from .authentication import REFRESH, TokenUser, decode_token, issue_tokens
 
 
 def hash_password(password: str) -> str:
@@ -25,20 +28,8 @@ def validate_email(email: str) -> bool:
 
 
 def generate_padrino_id() -> str:
-    """Generate next padrino ID (P001, P002, etc.)"""
-    storage = get_storage_manager()
-    padrinos = storage.list_all('padrinos')
-    
-    if not padrinos:
-        return "P001"
-    
-    # Get highest ID number
-    max_num = 0
-    for padrino in padrinos:
-        id_num = int(padrino['id_padrino'][1:])  # Remove 'P' prefix
-        max_num = max(max_num, id_num)
-    
-    return f"P{str(max_num + 1).zfill(3)}"
+    """Generate next padrino ID (P001, P002, etc.) with the backend's atomic allocator"""
+    return get_storage_backend().allocate_ids('padrinos', 'P', 1)[0]
 
 
 @api_view(['POST'])
@@ -92,15 +83,13 @@ def register(request):
         )
     
     # Check if email already exists
-    storage = get_storage_manager()
-    padrinos = storage.list_all('padrinos')
+    storage = get_storage_backend()
     
-    for padrino in padrinos:
-        if padrino['email'].lower() == email:
-            return Response(
-                {'error': 'Este email ya está registrado'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+    if storage.find('padrinos', email=email):
+        return Response(
+            {'error': 'Este email ya está registrado'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
     
     # Create new padrino
     new_padrino = {
@@ -124,7 +113,8 @@ def register(request):
     return Response(
         {
             'message': 'Registro exitoso',
-            'padrino': response_data
+            'padrino': response_data,
+            **issue_tokens(new_padrino)
         },
         status=status.HTTP_201_CREATED
     )
@@ -151,20 +141,21 @@ def login(request):
         )
     
     # Find padrino by email
-    storage = get_storage_manager()
-    padrinos = storage.list_all('padrinos')
+    storage = get_storage_backend()
+    padrinos = storage.find('padrinos', email=email)
     
     password_hash = hash_password(password)
     
     for padrino in padrinos:
-        if padrino['email'].lower() == email:
+        if padrino['email'].strip().lower() == email:
             if padrino['password_hash'] == password_hash:
                 # Login successful
                 response_data = {k: v for k, v in padrino.items() if k != 'password_hash'}
                 return Response(
                     {
                         'message': 'Login exitoso',
-                        'padrino': response_data
+                        'padrino': response_data,
+                        **issue_tokens(padrino)
                     },
                     status=status.HTTP_200_OK
                 )
@@ -182,13 +173,58 @@ def login(request):
     )
 
 
+@api_view(['POST'])
+def refresh_token(request):
+    """
+    Exchange a refresh token for new tokens
+    
+    POST /api/auth/token/refresh/
+    Body: {
+        "refresh": "<refresh token>"
+    }
+    """
+    token = request.data.get('refresh', '') if isinstance(request.data, dict) else ''
+    
+    if not token:
+        return Response(
+            {'error': 'refresh es requerido'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    try:
+        claims = decode_token(token, REFRESH)
+    except jwt.InvalidTokenError:
+        return Response(
+            {'error': 'Token inválido o expirado'},
+            status=status.HTTP_401_UNAUTHORIZED
+        )
+    
+    # Único acceso a storage de la sesión: renueva el perfil que viaja en el access token
+    storage = get_storage_backend()
+    padrino = storage.load('padrinos', claims['sub'])
+    
+    if not padrino:
+        return Response(
+            {'error': 'Padrino no encontrado'},
+            status=status.HTTP_401_UNAUTHORIZED
+        )
+    
+    return Response(issue_tokens(padrino), status=status.HTTP_200_OK)
+
+
 @api_view(['GET'])
 def get_current_user(request):
     """
-    Get current padrino by ID
+    Get current padrino
     
+    GET /api/auth/me/  (Authorization: Bearer <access token>)
     GET /api/auth/me/?padrino_id=P001
+    
+    With a token the profile comes from its claims, without reading storage.
     """
+    if isinstance(request.user, TokenUser):
+        return Response(request.user.profile(), status=status.HTTP_200_OK)
+    
     padrino_id = request.query_params.get('padrino_id')
     
     if not padrino_id:
@@ -197,13 +233,12 @@ def get_current_user(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    storage = get_storage_manager()
-    padrinos = storage.list_all('padrinos')
+    storage = get_storage_backend()
+    padrino = storage.load('padrinos', padrino_id)
     
-    for padrino in padrinos:
-        if padrino['id_padrino'] == padrino_id:
-            response_data = {k: v for k, v in padrino.items() if k != 'password_hash'}
-            return Response(response_data, status=status.HTTP_200_OK)
+    if padrino:
+        response_data = {k: v for k, v in padrino.items() if k != 'password_hash'}
+        return Response(response_data, status=status.HTTP_200_OK)
     
     return Response(
         {'error': 'Padrino no encontrado'},
@@ -214,7 +249,7 @@ def get_current_user(request):
 @api_view(['POST'])
 def logout(request):
     """
-    Logout (client-side only, just returns success)
+    Logout (client-side only: the client discards its tokens, which expire on their own)
     
     POST /api/auth/logout/
     """
@@ -0,0 +1,131 @@
+"""
+JWT authentication for SmileLink API
+Issues signed access/refresh tokens and verifies them without touching storage
+"""
+
+import time
+import uuid
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
+import jwt
+from django.conf import settings
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+
+
+# Campos del padrino que viajan en el access token y sirven /auth/me/ sin leer storage
+PROFILE_CLAIMS = ('nombre', 'email', 'fecha_registro', 'id_google_auth', 'direccion', 'telefono')
+
+ACCESS = 'access'
+REFRESH = 'refresh'
+
+
+def _encode(claims: Dict[str, Any]) -> str:
+    return jwt.encode(claims, settings.JWT_SECRET_KEY, algorithm=settings.JWT_ALGORITHM)
+
+
+def issue_tokens(padrino: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Access y refresh token para un padrino
+
+    El access token lleva el perfil (PROFILE_CLAIMS); el refresh sólo el ID,
+    y al usarlo se vuelve a leer el padrino para renovar esos datos.
+    """
+    now = int(time.time())
+    access_seconds = settings.JWT_EXPIRATION_HOURS * 3600
+    subject = padrino['id_padrino']
+    access = _encode({
+        'sub': subject,
+        'type': ACCESS,
+        'iat': now,
+        'exp': now + access_seconds,
+        'jti': uuid.uuid4().hex,
+        **{claim: padrino.get(claim) for claim in PROFILE_CLAIMS},
+    })
+    refresh = _encode({
+        'sub': subject,
+        'type': REFRESH,
+        'iat': now,
+        'exp': now + settings.JWT_REFRESH_EXPIRATION_DAYS * 86400,
+        'jti': uuid.uuid4().hex,
+    })
+    return {
+        'access': access,
+        'refresh': refresh,
+        'token_type': 'Bearer',
+        'expires_in': access_seconds,
+    }
+
+
+@lru_cache(maxsize=4096)
+def _verified_claims(token: str) -> Dict[str, Any]:
+    """Firma verificada una vez por token y proceso; la expiración se revisa en cada uso"""
+    return jwt.decode(
+        token,
+        settings.JWT_SECRET_KEY,
+        algorithms=[settings.JWT_ALGORITHM],
+        options={'require': ['sub', 'type', 'exp']},
+    )
+
+
+def decode_token(token: str, expected_type: str = ACCESS) -> Dict[str, Any]:
+    """
+    Claims de un token válido del tipo esperado
+
+    Raises:
+        jwt.InvalidTokenError: Firma inválida, token expirado o de otro tipo
+    """
+    claims = _verified_claims(token)
+    if claims['exp'] <= time.time():
+        raise jwt.ExpiredSignatureError('Signature has expired')
+    if claims['type'] != expected_type:
+        raise jwt.InvalidTokenError(f"Expected a {expected_type} token")
+    return claims
+
+
+class TokenUser:
+    """Padrino autenticado por token: sólo los claims, sin leer storage"""
+
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, claims: Dict[str, Any]):
+        self.claims = claims
+        self.id_padrino = claims['sub']
+
+    @property
+    def pk(self) -> str:
+        return self.id_padrino
+
+    def profile(self) -> Dict[str, Any]:
+        """Perfil del padrino tal como estaba al emitir el token"""
+        return {'id_padrino': self.id_padrino, **{claim: self.claims.get(claim) for claim in PROFILE_CLAIMS}}
+
+    def __str__(self) -> str:
+        return self.id_padrino
+
+
+class JWTAuthentication(BaseAuthentication):
+    """
+    DRF authentication: 'Authorization: Bearer <access token>'
+
+    Sin header el request sigue como anónimo; un token inválido o expirado es 401.
+    """
+
+    keyword = b'bearer'
+
+    def authenticate(self, request) -> Optional[tuple]:
+        header = get_authorization_header(request).split()
+        if not header or header[0].lower() != self.keyword:
+            return None
+        if len(header) != 2:
+            raise exceptions.AuthenticationFailed('Header Authorization inválido')
+        try:
+            claims = decode_token(header[1].decode('ascii'), ACCESS)
+        except (jwt.InvalidTokenError, UnicodeDecodeError):
+            raise exceptions.AuthenticationFailed('Token inválido o expirado')
+        return TokenUser(claims), claims
+
+    def authenticate_header(self, request) -> str:
+        return 'Bearer'
@@ -0,0 +1,170 @@
+"""
+Batch view for SmileLink API
+Executes several API sub-requests inside a single HTTP round trip
+"""
+
+import contextvars
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.urls import Resolver404, resolve
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
+from rest_framework import status
+
+from storage import get_storage_backend
+
+
+API_PREFIX = '/api/'
+ALLOWED_METHODS = {'GET', 'POST', 'PUT', 'PATCH', 'DELETE'}
+
+# Headers that describe the outer request body and must not leak into sub-requests
+_SKIPPED_META = {
+    'wsgi.input', 'CONTENT_LENGTH', 'CONTENT_TYPE',
+    'PATH_INFO', 'QUERY_STRING', 'REQUEST_METHOD',
+}
+
+
+def _normalize_path(path: str) -> str:
+    """Accept both '/api/ninos/' and 'ninos/' forms"""
+    if not path.startswith('/'):
+        path = API_PREFIX + path
+    return path
+
+
+def _build_sub_request(parent, method: str, path: str, query: str, body) -> WSGIRequest:
+    """Build a WSGIRequest that shares headers and identity with the parent"""
+    body_bytes = json.dumps(body).encode('utf-8') if body is not None else b''
+
+    environ = {k: v for k, v in parent.META.items() if k not in _SKIPPED_META}
+    environ.update({
+        'REQUEST_METHOD': method,
+        'PATH_INFO': path,
+        'QUERY_STRING': query,
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(body_bytes)),
+        'wsgi.input': io.BytesIO(body_bytes),
+    })
+    sub_request = WSGIRequest(environ)
+
+    # Middleware does not run for sub-requests, reuse what it set on the parent
+    for attr in ('session', 'user'):
+        if hasattr(parent, attr):
+            setattr(sub_request, attr, getattr(parent, attr))
+
+    return sub_request
+
+
+def _response_body(response):
+    """Extract a JSON-compatible body from a DRF or plain Django response"""
+    data = getattr(response, 'data', None)
+    if data is not None:
+        return data
+
+    if hasattr(response, 'render') and not response.is_rendered:
+        response.render()
+
+    content = getattr(response, 'content', b'')
+    if not content:
+        return None
+    try:
+        return json.loads(content)
+    except ValueError:
+        return content.decode('utf-8', errors='replace')
+
+
+def _execute(parent, item) -> dict:
+    """Run a single sub-request and return its status and body"""
+    result = {'id': item.get('id')} if isinstance(item, dict) and 'id' in item else {}
+
+    if not isinstance(item, dict) or not item.get('path'):
+        result.update(status=status.HTTP_400_BAD_REQUEST, body={'error': 'Cada sub-request requiere path'})
+        return result
+
+    method = str(item.get('method', 'GET')).upper()
+    if method not in ALLOWED_METHODS:
+        result.update(status=status.HTTP_405_METHOD_NOT_ALLOWED, body={'error': f'Método no permitido: {method}'})
+        return result
+
+    parts = urlsplit(_normalize_path(item['path']))
+
+    try:
+        match = resolve(parts.path)
+    except Resolver404:
+        result.update(status=status.HTTP_404_NOT_FOUND, body={'error': 'Ruta no encontrada'})
+        return result
+
+    if match.func is batch:
+        result.update(status=status.HTTP_400_BAD_REQUEST, body={'error': 'No se permiten batches anidados'})
+        return result
+
+    sub_request = _build_sub_request(parent, method, parts.path, parts.query, item.get('body'))
+
+    try:
+        response = match.func(sub_request, *match.args, **match.kwargs)
+        result.update(status=response.status_code, body=_response_body(response))
+    except Exception as e:
+        print(f"Error executing batch item {method} {parts.path}: {e}")
+        result.update(status=status.HTTP_500_INTERNAL_SERVER_ERROR, body={'error': 'Error interno'})
+
+    return result
+
+
+@api_view(['POST'])
+def batch(request):
+    """
+    Execute several sub-requests in one round trip
+
+    Storage reads are shared between sub-requests, so an entity or index
+    loaded by one item is decrypted only once for the whole batch.
+
+    POST /api/batch/
+    Body: {
+        "parallel": false,
+        "requests": [
+            {"id": "me", "method": "GET", "path": "auth/me/?padrino_id=P001"},
+            {"id": "ninos", "method": "GET", "path": "/api/ninos/"}
+        ]
+    }
+    """
+    if not isinstance(request.data, dict):
+        return Response(
+            {'error': 'El body debe ser un objeto con requests'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    items = request.data.get('requests')
+
+    if not isinstance(items, list) or not items:
+        return Response(
+            {'error': 'requests debe ser una lista no vacía'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    if len(items) > settings.BATCH_MAX_REQUESTS:
+        return Response(
+            {'error': f'Máximo {settings.BATCH_MAX_REQUESTS} sub-requests por batch'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    parent = request._request
+    parallel = bool(request.data.get('parallel', False))
+
+    with get_storage_backend().read_cache():
+        if parallel and len(items) > 1:
+            workers = min(settings.BATCH_MAX_WORKERS, len(items))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                # Each thread runs in a copy of this context so it sees the shared read cache
+                futures = [
+                    executor.submit(contextvars.copy_context().run, _execute, parent, item)
+                    for item in items
+                ]
+                responses = [future.result() for future in futures]
+        else:
+            responses = [_execute(parent, item) for item in items]
+
+    return Response({'responses': responses}, status=status.HTTP_200_OK)
@@ -0,0 +1,297 @@
+"""
+SmileLink API - Campaigns
+Genera una entrega pendiente por cada apadrinamiento activo de un evento
+(Navidad, Día del Niño) como job en segundo plano reanudable
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+from storage import get_storage_backend, get_sync_manager, get_job_store
+
+
+# Jobs que corren en este proceso: {job_id: Thread}
+_running: Dict[str, threading.Thread] = {}
+_running_lock = threading.Lock()
+
+
+def campaign_job_id(evento_id: str) -> str:
+    """ID del job de generación de entregas para un evento"""
+    return f"generar-entregas-{evento_id}"
+
+
+def _as_date(value) -> date:
+    """Acepta date o string ISO"""
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+class EntregasCampaign:
+    """
+    Job que crea una Entrega 'Pendiente' por apadrinamiento 'Activo'
+
+    Los IDs de apadrinamientos se congelan al inicio y se procesan en chunks
+    en paralelo. Antes de escribir un chunk se guarda su plan
+    {id_apadrinamiento: id_entrega}; al reanudar, un chunk a medias se
+    re-aplica con el mismo plan, así que nunca se duplican entregas.
+    """
+
+    def __init__(self, evento: Dict[str, Any], options: Optional[Dict[str, Any]] = None):
+        options = options or {}
+        self.storage = get_storage_backend()
+        self.sync = get_sync_manager()
+        self.jobs = get_job_store()
+
+        self.evento = evento
+        self.evento_id = evento['id_evento']
+        self.job_id = campaign_job_id(self.evento_id)
+        chunk_size = int(options.get('chunk_size') or settings.CAMPAIGN_CHUNK_SIZE)
+        workers = int(options.get('workers') or settings.CAMPAIGN_WORKERS)
+        self.chunk_size = min(max(1, chunk_size), settings.CAMPAIGN_MAX_CHUNK_SIZE)
+        self.workers = min(max(1, workers), settings.CAMPAIGN_MAX_WORKERS)
+        self.descripcion_regalo = options.get('descripcion_regalo') or f"Regalo {evento.get('nombre_evento', '')}".strip()
+
+        self._lock = threading.Lock()
+        self.state: Dict[str, Any] = {}
+        self._ap_ids: List[str] = []
+
+    # ------------------------------------------------------------------
+    # Estado
+    # ------------------------------------------------------------------
+
+    def _load_or_init_state(self) -> Tuple[Dict[str, Any], List[str]]:
+        """Carga el checkpoint existente o congela los IDs para un job nuevo"""
+        state = self.jobs.load(self.job_id)
+        ids_state = self.jobs.load(f"{self.job_id}-ids")
+
+        if state is None or ids_state is None:
+            ap_ids = self.storage.list_ids('apadrinamientos')
+            ids_state = {'ids': ap_ids}
+            self.jobs.save(f"{self.job_id}-ids", ids_state)
+            state = {
+                'job_id': self.job_id,
+                'id_evento': self.evento_id,
+                'status': 'running',
+                'total': len(ap_ids),
+                'processed': 0,
+                'created': 0,
+                'chunk_size': self.chunk_size,
+                'chunks_total': (len(ap_ids) + self.chunk_size - 1) // self.chunk_size,
+                'chunks_done': [],
+                'plans': {},
+                'descripcion_regalo': self.descripcion_regalo,
+                'started_at': time.time(),
+                'updated_at': time.time(),
+                'error': None,
+            }
+        else:
+            # Un job reanudado conserva su partición original en chunks
+            self.chunk_size = state['chunk_size']
+            self.descripcion_regalo = state.get('descripcion_regalo', self.descripcion_regalo)
+            state['status'] = 'running'
+            state['error'] = None
+
+        return state, ids_state['ids']
+
+    def _checkpoint(self):
+        """Persiste el estado actual; llamar con self._lock tomado"""
+        self.state['updated_at'] = time.time()
+        self.jobs.save(self.job_id, self.state)
+
+    # ------------------------------------------------------------------
+    # Asignación
+    # ------------------------------------------------------------------
+
+    def _active_puntos(self) -> List[str]:
+        """IDs de puntos de entrega activos, en orden estable"""
+        puntos = [
+            p for p in self.storage.list_all('puntos_entrega')
+            if p.get('estado_punto', 'Activo') == 'Activo'
+        ]
+        return sorted(p['id_punto_entrega'] for p in puntos)
+
+    def _schedule(self, position: int) -> str:
+        """Reparte fecha_programada uniformemente dentro de la ventana del evento"""
+        inicio = _as_date(self.evento['fecha_inicio'])
+        fin = _as_date(self.evento['fecha_fin'])
+        days = max((fin - inicio).days, 0) + 1
+        return (inicio + timedelta(days=position % days)).isoformat()
+
+    def _allocate(self, count: int) -> List[str]:
+        """Reserva IDs de entrega con el allocator del motor, único entre procesos"""
+        if not count:
+            return []
+        return self.storage.allocate_ids('entregas', 'E', count)
+
+    # ------------------------------------------------------------------
+    # Ejecución
+    # ------------------------------------------------------------------
+
+    def _process_chunk(self, chunk_no: int, offset: int, ap_ids: List[str], puntos: List[str]):
+        """Crea las entregas de un chunk y enlaza cada una a su apadrinamiento"""
+        apadrinamientos = {}
+        positions = {}
+        for position, ap_id in enumerate(ap_ids, start=offset):
+            apadrinamiento = self.storage.load('apadrinamientos', ap_id)
+            if apadrinamiento and apadrinamiento.get('estado_apadrinamiento_registro') == 'Activo':
+                apadrinamientos[ap_id] = apadrinamiento
+                positions[ap_id] = position
+
+        with self._lock:
+            plan = self.state['plans'].get(str(chunk_no))
+            if plan is None:
+                active_ids = list(apadrinamientos)
+                plan = dict(zip(active_ids, self._allocate(len(active_ids))))
+                self.state['plans'][str(chunk_no)] = plan
+                self._checkpoint()
+
+        entregas = {}
+        for ap_id, entrega_id in plan.items():
+            entregas[entrega_id] = {
+                'id_entrega': entrega_id,
+                'id_apadrinamiento': ap_id,
+                'id_evento': self.evento_id,
+                'descripcion_regalo': self.descripcion_regalo,
+                'fecha_programada': self._schedule(positions.get(ap_id, 0)),
+                'fecha_entrega_real': None,
+                'estado_entrega': 'Pendiente',
+                'observaciones': '',
+                'id_punto_entrega': puntos[positions.get(ap_id, 0) % len(puntos)],
+                'evidencia_foto_path': None,
+            }
+        saved_entregas = self.storage.save_many('entregas', entregas)
+
+        updated = {}
+        for ap_id, entrega_id in plan.items():
+            apadrinamiento = apadrinamientos.get(ap_id)
+            if apadrinamiento is None:
+                continue
+            entregas_ids = apadrinamiento.setdefault('entregas_ids', [])
+            if entrega_id not in entregas_ids:
+                entregas_ids.append(entrega_id)
+                updated[ap_id] = apadrinamiento
+        saved_apadrinamientos = self.storage.save_many('apadrinamientos', updated)
+
+        self.sync.sync_entities('entregas', saved_entregas)
+        self.sync.sync_entities('apadrinamientos', saved_apadrinamientos)
+
+        with self._lock:
+            self.state['plans'].pop(str(chunk_no), None)
+            self.state['chunks_done'].append(chunk_no)
+            self.state['processed'] += len(ap_ids)
+            self.state['created'] += len(plan)
+            self._checkpoint()
+
+    def prepare(self):
+        """Carga o crea el checkpoint y lo marca como 'running'"""
+        self.state, self._ap_ids = self._load_or_init_state()
+        with self._lock:
+            self._checkpoint()
+
+    def run(self) -> Dict[str, Any]:
+        """Ejecuta (o reanuda) el job hasta terminar y retorna el estado final"""
+        if not self.state:
+            self.prepare()
+        ap_ids = self._ap_ids
+
+        try:
+            puntos = self._active_puntos()
+            if not puntos:
+                raise ValueError('No hay puntos de entrega activos')
+
+            done = set(self.state['chunks_done'])
+            pending = [
+                (chunk_no, offset)
+                for chunk_no, offset in enumerate(range(0, len(ap_ids), self.chunk_size))
+                if chunk_no not in done
+            ]
+
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                futures = [
+                    executor.submit(
+                        self._process_chunk, chunk_no, offset,
+                        ap_ids[offset:offset + self.chunk_size], puntos
+                    )
+                    for chunk_no, offset in pending
+                ]
+                for future in futures:
+                    future.result()
+
+            with self._lock:
+                self.state['status'] = 'completed'
+                self._checkpoint()
+        except Exception as e:
+            print(f"Error running campaign {self.job_id}: {e}")
+            with self._lock:
+                self.state['status'] = 'failed'
+                self.state['error'] = str(e)
+                self._checkpoint()
+
+        return self.state
+
+
+def get_campaign_status(evento_id: str) -> Optional[Dict[str, Any]]:
+    """Retorna el progreso del job de un evento sin los planes internos"""
+    state = get_job_store().load(campaign_job_id(evento_id))
+    if state is None:
+        return None
+
+    summary = {k: v for k, v in state.items() if k != 'plans'}
+    summary['chunks_done'] = len(state.get('chunks_done', []))
+    return summary
+
+
+def _run_holding_lock(campaign: 'EntregasCampaign', lock_fd: int):
+    """Corre el job y suelta su lock al terminar (también si falla)"""
+    try:
+        campaign.run()
+    finally:
+        get_job_store().unlock(lock_fd)
+
+
+def start_campaign(evento: Dict[str, Any], options: Optional[Dict[str, Any]] = None) -> Tuple[Dict[str, Any], bool]:
+    """
+    Lanza o reanuda en segundo plano el job de un evento
+
+    El lock del job (flock en el JobStore) se toma antes de prepare() y lo
+    conserva el hilo hasta terminar: otro worker o el comando
+    generar_entregas no pueden correr el mismo job a la vez. Si el proceso
+    muere el lock se libera solo y el job se puede reanudar.
+
+    Returns:
+        tuple: (estado actual, True si se lanzó un hilo nuevo)
+    """
+    job_id = campaign_job_id(evento['id_evento'])
+    jobs = get_job_store()
+
+    with _running_lock:
+        thread = _running.get(job_id)
+        if thread is not None and thread.is_alive():
+            return get_campaign_status(evento['id_evento']), False
+
+        lock_fd = jobs.try_lock(job_id)
+        if lock_fd is None:
+            # Lo está corriendo otro proceso
+            return get_campaign_status(evento['id_evento']), False
+
+        try:
+            state = jobs.load(job_id)
+            if state and state.get('status') == 'completed':
+                jobs.unlock(lock_fd)
+                return get_campaign_status(evento['id_evento']), False
+
+            campaign = EntregasCampaign(evento, options)
+            campaign.prepare()
+            thread = threading.Thread(target=_run_holding_lock, args=(campaign, lock_fd), name=job_id, daemon=True)
+            thread.start()
+        except BaseException:
+            jobs.unlock(lock_fd)
+            raise
+        _running[job_id] = thread
+
+    return get_campaign_status(evento['id_evento']), True
@@ -0,0 +1,21 @@
+"""
+Exception handling for SmileLink API
+Maps storage-layer failures to HTTP responses
+"""
+
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.views import exception_handler as drf_exception_handler
+
+from storage.nfs_health import StorageUnavailable
+
+
+def exception_handler(exc, context):
+    """DRF exception handler: StorageUnavailable -> 503 con Retry-After"""
+    if isinstance(exc, StorageUnavailable):
+        return Response(
+            {'error': 'Almacenamiento no disponible temporalmente, intente de nuevo', 'detail': str(exc)},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={'Retry-After': '10'},
+        )
+    return drf_exception_handler(exc, context)
@@ -0,0 +1,153 @@
+"""
+Management command to measure cold start: command startup and time to first request
+"""
+import http.client
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _get(port, path, timeout):
+    """(status, segundos) de un GET; lanza OSError si el servidor no acepta conexiones"""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    try:
+        started = time.perf_counter()
+        conn.request('GET', path)
+        response = conn.getresponse()
+        response.read()
+        return response.status, time.perf_counter() - started
+    finally:
+        conn.close()
+
+
+class Command(BaseCommand):
+    help = 'Measure cold start: `manage.py check` wall time and server spawn -> first successful response'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='Cold starts per measurement (default: 5)')
+        parser.add_argument('--server', choices=['gunicorn', 'runserver'], default='gunicorn',
+                            help='Server to boot (default: gunicorn, as in production)')
+        parser.add_argument('--path', default='/api/puntos-entrega/', help='First request (default: /api/puntos-entrega/)')
+        parser.add_argument('--data-dir', help='Storage directory (default: a fresh temp dir per run)')
+        parser.add_argument('--timeout', type=float, default=60, help='Seconds to wait for the server (default: 60)')
+        parser.add_argument('--output', help='Write results as JSON to this file')
+
+    def _env(self, data_dir):
+        return {
+            **os.environ,
+            'LOCAL_STORAGE_PATH': str(data_dir),
+            'SQLITE_STORAGE_PATH': str(Path(data_dir) / 'smilelink.sqlite3'),
+            'HDFS_QUEUE_PATH': str(Path(data_dir) / '_queue'),
+            'USE_NFS': 'False',
+            'PYTHONDONTWRITEBYTECODE': '1',
+        }
+
+    def _command_start(self, env):
+        started = time.perf_counter()
+        completed = subprocess.run(
+            [sys.executable, str(Path(settings.BASE_DIR) / 'manage.py'), 'check'],
+            env=env, capture_output=True, text=True,
+        )
+        elapsed = time.perf_counter() - started
+        if completed.returncode != 0:
+            raise CommandError(f"manage.py check failed:\n{completed.stderr[-2000:]}")
+        return elapsed
+
+    def _server_start(self, env, options):
+        port = _free_port()
+        if options['server'] == 'gunicorn':
+            command = [sys.executable, '-m', 'gunicorn', 'smilelink.wsgi:application',
+                       '--bind', f"127.0.0.1:{port}", '--workers', '1', '--log-level', 'warning']
+        else:
+            command = [sys.executable, str(Path(settings.BASE_DIR) / 'manage.py'), 'runserver',
+                       '--noreload', f"127.0.0.1:{port}"]
+        started = time.perf_counter()
+        server = subprocess.Popen(command, cwd=settings.BASE_DIR, env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        try:
+            deadline = started + options['timeout']
+            while True:
+                if server.poll() is not None:
+                    raise CommandError(f"Server exited:\n{server.stderr.read()[-2000:]}")
+                if time.perf_counter() > deadline:
+                    raise CommandError(f"Server not ready after {options['timeout']}s")
+                try:
+                    status, first = _get(port, options['path'], options['timeout'])
+                except OSError:
+                    time.sleep(0.005)
+                    continue
+                if status >= 400:
+                    raise CommandError(f"GET {options['path']} returned {status}")
+                ready = time.perf_counter() - started
+                _, second = _get(port, options['path'], options['timeout'])
+                return {'ready': ready, 'first_request': first, 'second_request': second}
+        finally:
+            server.terminate()
+            try:
+                server.wait(10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+
+    def handle(self, *args, **options):
+        if options['server'] == 'gunicorn' and shutil.which('gunicorn') is None:
+            try:
+                import gunicorn  # noqa: F401
+            except ImportError:
+                raise CommandError('gunicorn is not installed; use --server runserver')
+
+        samples = {'command': [], 'ready': [], 'first_request': [], 'second_request': []}
+        for run in range(1, options['runs'] + 1):
+            data_dir = Path(options['data_dir']) if options['data_dir'] else Path(tempfile.mkdtemp(prefix='smilelink-startup-'))
+            try:
+                env = self._env(data_dir)
+                samples['command'].append(self._command_start(env))
+                for name, value in self._server_start(env, options).items():
+                    samples[name].append(value)
+            finally:
+                if not options['data_dir']:
+                    shutil.rmtree(data_dir, ignore_errors=True)
+            self.stdout.write(
+                f"  run {run}: check {samples['command'][-1] * 1000:.0f} ms, "
+                f"first response after {samples['ready'][-1] * 1000:.0f} ms"
+            )
+
+        labels = {
+            'command': 'manage.py check',
+            'ready': f"{options['server']} spawn -> first response",
+            'first_request': 'first request latency',
+            'second_request': 'second request latency',
+        }
+        report = {'server': options['server'], 'path': options['path'], 'runs': options['runs'], 'results': {}}
+        self.stdout.write(f"\n{'measurement':<36}{'median ms':>11}{'min ms':>9}{'max ms':>9}")
+        for name, values in samples.items():
+            summary = {
+                'median_ms': round(statistics.median(values) * 1000, 1),
+                'min_ms': round(min(values) * 1000, 1),
+                'max_ms': round(max(values) * 1000, 1),
+            }
+            report['results'][name] = summary
+            self.stdout.write(
+                f"{labels[name]:<36}{summary['median_ms']:>11.1f}{summary['min_ms']:>9.1f}{summary['max_ms']:>9.1f}"
+            )
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"\nResults written to {options['output']}")
+        self.stdout.write(self.style.SUCCESS('\n✅ Startup benchmark finished'))
@@ -0,0 +1,248 @@
+"""
+Management command to benchmark storage, encryption and API hot paths at several dataset sizes
+"""
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from api.synthetic_data import GENERATED_PASSWORD, SyntheticDataGenerator, entity_id
+
+
+def _summary(samples):
+    """Estadísticas en ms de una lista de duraciones en segundos"""
+    ordered = sorted(samples)
+    return {
+        'iterations': len(ordered),
+        'mean_ms': round(statistics.fmean(ordered) * 1000, 4),
+        'p50_ms': round(ordered[len(ordered) // 2] * 1000, 4),
+        'p95_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 4),
+        'min_ms': round(ordered[0] * 1000, 4),
+        'max_ms': round(ordered[-1] * 1000, 4),
+        'ops_per_sec': round(len(ordered) / sum(ordered), 1) if sum(ordered) else None,
+    }
+
+
+def _measure(fn, iterations, warmup=1):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return _summary(samples)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark storage, encryption and API endpoints at 1k/10k/100k records per type; JSON output and baseline comparison'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', default='1000,10000',
+                            help='Comma-separated records per entity type (default: 1000,10000; e.g. 1000,10000,100000)')
+        parser.add_argument('--ops', type=int, default=200, help='Iterations for cheap operations (default: 200)')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Iterations for whole-collection operations (default: 5)')
+        parser.add_argument('--output', help='Write results as JSON to this file')
+        parser.add_argument('--baseline', help='Compare against a previous --output file')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Flag a regression when p50 grows more than this fraction (default: 0.2)')
+        parser.add_argument('--seed', type=int, default=42, help='Dataset seed (default: 42)')
+        parser.add_argument('--keep', action='store_true', help='Keep the temp datasets')
+        # Interno: corre una escala en un proceso aislado
+        parser.add_argument('--worker-scale', type=int, help='(internal)')
+        parser.add_argument('--worker-output', help='(internal)')
+
+    # ------------------------------------------------------------------
+    # Proceso hijo: una escala sobre un dataset temporal
+    # ------------------------------------------------------------------
+
+    def _run_scale(self, scale, options):
+        from django.test import Client
+        from storage import get_encryption_manager, get_storage_manager
+
+        storage = get_storage_manager()
+        generator = SyntheticDataGenerator({t: scale for t in storage.ENTITY_TYPES}, seed=options['seed'])
+        results = {}
+
+        started = time.perf_counter()
+        for entity_type in storage.ENTITY_TYPES:
+            storage.save_many(entity_type, generator.records(entity_type, 1, scale + 1))
+        results['setup.populate'] = {'iterations': 1, 'seconds': round(time.perf_counter() - started, 3)}
+
+        ops, repeat = options['ops'], options['repeat']
+        rng = random.Random(options['seed'])
+        ids = [entity_id('ninos', rng.randint(1, scale)) for _ in range(ops)]
+        sample = storage.load('ninos', ids[0])
+
+        # Storage
+        pending = iter(range(scale + 1, scale + 10 * ops + 2))
+        created = []
+
+        def save():
+            new_id = entity_id('ninos', next(pending))
+            storage.save('ninos', new_id, {**sample, 'id_nino': new_id})
+            created.append(new_id)
+
+        reads = iter(ids * 3)
+        results['storage.save'] = _measure(save, ops)
+        results['storage.load'] = _measure(lambda: storage.load('ninos', next(reads)), ops)
+        results['storage.list_all'] = _measure(lambda: storage.list_all('ninos'), repeat)
+        results['storage.get_next_id'] = _measure(lambda: storage.get_next_id('ninos', 'N'), ops)
+        deletes = iter(created)
+        results['storage.delete'] = _measure(lambda: storage.delete('ninos', next(deletes)), ops, warmup=0)
+
+        # Encriptación
+        encryption = get_encryption_manager()
+        encrypted = encryption.encrypt_data(sample)
+        results['encryption.encrypt_data'] = _measure(lambda: encryption.encrypt_data(sample), ops * 10)
+        results['encryption.decrypt_data'] = _measure(lambda: encryption.decrypt_data(encrypted), ops * 10)
+
+        # API (mismo stack de middleware que en producción)
+        client = Client(HTTP_HOST='localhost')
+        detail_ids = iter(ids * 3)
+        login_body = json.dumps({
+            'email': generator.record('padrinos', max(1, scale // 2))['email'], 'password': GENERATED_PASSWORD,
+        })
+        endpoints = {
+            'api.dashboard_kpis': (lambda: client.get('/api/dashboard/kpis/'), repeat),
+            'api.auth_login': (
+                lambda: client.post('/api/auth/login/', login_body, content_type='application/json'), ops // 4 or 1
+            ),
+            'api.ninos_list': (lambda: client.get('/api/ninos/'), repeat),
+            'api.ninos_detail': (lambda: client.get(f"/api/ninos/{next(detail_ids)}/"), ops),
+            'api.padrinos_list': (lambda: client.get('/api/padrinos/'), repeat),
+            'api.entregas_list': (lambda: client.get('/api/entregas/'), repeat),
+        }
+        for name, (call, iterations) in endpoints.items():
+            response = call()
+            if response.status_code >= 400:
+                raise CommandError(f"{name} returned {response.status_code}: {response.content[:200]!r}")
+            results[name] = _measure(call, iterations, warmup=0)
+        return results
+
+    # ------------------------------------------------------------------
+    # Proceso padre
+    # ------------------------------------------------------------------
+
+    def _spawn(self, scale, workdir, options):
+        data_dir = workdir / f"data-{scale}"
+        output = workdir / f"result-{scale}.json"
+        env = {
+            **os.environ,
+            'STORAGE_BACKEND': 'file',
+            'USE_NFS': 'False',
+            'USE_HDFS_REPLICATION': 'False',
+            'LOCAL_STORAGE_PATH': str(data_dir),
+            'HDFS_QUEUE_PATH': str(workdir / f"queue-{scale}"),
+            'METRICS_DIR': 'none',
+            'TRACE_LOG_PATH': str(workdir / 'traces.jsonl'),
+            'PROFILE_SAMPLE_RATE': '0',
+        }
+        command = [
+            sys.executable, str(Path(settings.BASE_DIR) / 'manage.py'), 'benchmark_suite',
+            '--worker-scale', str(scale), '--worker-output', str(output),
+            '--ops', str(options['ops']), '--repeat', str(options['repeat']), '--seed', str(options['seed']),
+        ]
+        completed = subprocess.run(command, env=env, capture_output=True, text=True)
+        if completed.returncode != 0 or not output.exists():
+            raise CommandError(f"Scale {scale} failed:\n{completed.stderr[-2000:]}")
+        with open(output, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _compare(self, current, baseline, threshold):
+        """Filas (escala, benchmark, p50 base, p50 actual, cambio, regresión)"""
+        rows = []
+        for scale, benchmarks in current['results'].items():
+            for name, result in benchmarks.items():
+                base = baseline.get('results', {}).get(scale, {}).get(name)
+                if not base or 'p50_ms' not in result or not base.get('p50_ms'):
+                    continue
+                change = result['p50_ms'] / base['p50_ms'] - 1
+                rows.append((scale, name, base['p50_ms'], result['p50_ms'], change, change > threshold))
+        return rows
+
+    def handle(self, *args, **options):
+        if options['worker_scale']:
+            results = self._run_scale(options['worker_scale'], options)
+            with open(options['worker_output'], 'w', encoding='utf-8') as f:
+                json.dump(results, f)
+            return
+
+        try:
+            scales = [int(value) for value in options['scales'].split(',') if value.strip()]
+        except ValueError:
+            raise CommandError('--scales must be comma-separated integers')
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline'], 'r', encoding='utf-8') as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Cannot read baseline: {e}")
+
+        workdir = Path(tempfile.mkdtemp(prefix='smilelink-bench-'))
+        report = {
+            'meta': {
+                'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+                'scales': scales,
+                'ops': options['ops'],
+                'repeat': options['repeat'],
+                'seed': options['seed'],
+            },
+            'results': {},
+        }
+        try:
+            for scale in scales:
+                self.stdout.write(f"Running scale {scale} ({scale} records x 8 types)...")
+                report['results'][str(scale)] = self._spawn(scale, workdir, options)
+        finally:
+            if not options['keep']:
+                shutil.rmtree(workdir, ignore_errors=True)
+            else:
+                self.stdout.write(f"Datasets kept in {workdir}")
+
+        for scale, benchmarks in report['results'].items():
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f"\nScale {scale} (populated in {benchmarks['setup.populate']['seconds']}s)"
+            ))
+            self.stdout.write(f"  {'benchmark':<26}{'p50 ms':>11}{'p95 ms':>11}{'ops/s':>11}")
+            for name, result in benchmarks.items():
+                if 'p50_ms' in result:
+                    self.stdout.write(
+                        f"  {name:<26}{result['p50_ms']:>11.3f}{result['p95_ms']:>11.3f}{result['ops_per_sec']:>11.1f}"
+                    )
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
+            self.stdout.write(f"\nResults written to {options['output']}")
+
+        if baseline is None:
+            self.stdout.write(self.style.SUCCESS('\n✅ Benchmark finished'))
+            return
+
+        rows = self._compare(report, baseline, options['threshold'])
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\nComparison with {options['baseline']} (p50)"))
+        self.stdout.write(f"  {'scale':>7} {'benchmark':<26}{'base ms':>11}{'now ms':>11}{'change':>9}")
+        for scale, name, before, after, change, regressed in rows:
+            line = f"  {scale:>7} {name:<26}{before:>11.3f}{after:>11.3f}{change:>+9.1%}"
+            self.stdout.write(self.style.ERROR(line + '  REGRESSION') if regressed else line)
+        regressions = [row for row in rows if row[5]]
+        if regressions:
+            raise CommandError(
+                f"{len(regressions)} benchmark(s) regressed more than {options['threshold']:.0%} against the baseline"
+            )
+        self.stdout.write(self.style.SUCCESS('\n✅ No regressions against the baseline'))
@@ -0,0 +1,48 @@
+"""
+Management command to generate pending entregas for an evento
+"""
+from django.core.management.base import BaseCommand, CommandError
+from storage import get_storage_backend, get_job_store
+from api.campaigns import EntregasCampaign, campaign_job_id
+
+
+class Command(BaseCommand):
+    help = 'Generate (or resume generating) one pending entrega per active apadrinamiento for an evento'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('evento_id', help='ID del evento (ej: EV001)')
+        parser.add_argument('--chunk-size', type=int, default=None, help='Apadrinamientos por chunk')
+        parser.add_argument('--workers', type=int, default=None, help='Chunks procesados en paralelo')
+        parser.add_argument('--descripcion-regalo', default=None, help='Descripción del regalo')
+    
+    def handle(self, *args, **options):
+        storage = get_storage_backend()
+        
+        evento = storage.load('eventos', options['evento_id'])
+        if not evento:
+            raise CommandError(f"Evento {options['evento_id']} no encontrado")
+        
+        job_id = campaign_job_id(evento['id_evento'])
+        jobs = get_job_store()
+        lock_fd = jobs.try_lock(job_id)
+        if lock_fd is None:
+            raise CommandError(f"Job {job_id} is already running in another process")
+        
+        try:
+            campaign = EntregasCampaign(evento, {
+                'chunk_size': options['chunk_size'],
+                'workers': options['workers'],
+                'descripcion_regalo': options['descripcion_regalo'],
+            })
+            
+            self.stdout.write(f"Generating entregas for {evento['id_evento']}...")
+            state = campaign.run()
+        finally:
+            jobs.unlock(lock_fd)
+        
+        if state['status'] != 'completed':
+            raise CommandError(f"Job {state['job_id']} failed: {state.get('error')}")
+        
+        self.stdout.write(self.style.SUCCESS(
+            f"\n✅ {state['created']} entregas created from {state['processed']} apadrinamientos"
+        ))
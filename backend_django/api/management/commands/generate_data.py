@@ -0,0 +1,122 @@
+"""
+Management command to generate a large, consistent synthetic dataset
+"""
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from storage import StorageBackend, get_storage_backend
+from api.synthetic_data import GENERATED_PASSWORD, GENERATION_ORDER, SyntheticDataGenerator, default_counts
+
+
+# Estado de cada proceso del pool
+_generator = None
+
+
+def _init_worker(counts, seed, today):
+    global _generator
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+    _generator = SyntheticDataGenerator(counts, seed=seed, today=today)
+    _generator.prepare()
+
+
+def _write_chunk(entity_type, start, stop):
+    """Genera y guarda un rango de registros; retorna cuántos se guardaron"""
+    records = _generator.records(entity_type, start, stop)
+    return len(get_storage_backend().save_many(entity_type, records))
+
+
+class Command(BaseCommand):
+    help = 'Generate a seeded, referentially consistent dataset (e.g. --scale 100000) with parallel writers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=int, default=1000,
+                            help='Number of ninos; other types follow realistic ratios (default: 1000)')
+        for entity_type in StorageBackend.ENTITY_TYPES:
+            parser.add_argument(f"--{entity_type.replace('_', '-')}", type=int, dest=entity_type,
+                                help=f"Override the number of {entity_type}")
+        parser.add_argument('--seed', type=int, default=42, help='Random seed (default: 42)')
+        parser.add_argument('--today', default='2026-01-01',
+                            help='Reference date for states and dates, YYYY-MM-DD (default: 2026-01-01)')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Writer processes (default: CPU count)')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Records per write (default: 1000)')
+        parser.add_argument('--overwrite', action='store_true',
+                            help='Allow writing over existing data (same IDs are replaced)')
+
+    def handle(self, *args, **options):
+        counts = default_counts(options['scale'])
+        for entity_type in StorageBackend.ENTITY_TYPES:
+            if options[entity_type] is not None:
+                counts[entity_type] = options[entity_type]
+        if any(value < 0 for value in counts.values()):
+            raise CommandError('Counts must be positive')
+        try:
+            today = date.fromisoformat(options['today'])
+        except ValueError:
+            raise CommandError('--today must be YYYY-MM-DD')
+
+        generator = SyntheticDataGenerator(counts, seed=options['seed'], today=today)
+        generator.prepare()
+        counts = generator.counts
+        if counts['apadrinamientos'] == 0 and (options['apadrinamientos'] or options['entregas']):
+            self.stdout.write(self.style.WARNING('No ninos or padrinos: skipping apadrinamientos and entregas'))
+
+        storage = get_storage_backend()
+        if not options['overwrite']:
+            existing = [t for t in GENERATION_ORDER if counts[t] and storage.list_ids(t)]
+            if existing:
+                raise CommandError(
+                    f"Storage already has {', '.join(existing)}; use --overwrite to write over it"
+                )
+
+        chunk_size = max(1, options['chunk_size'])
+        tasks = [
+            (entity_type, start, min(start + chunk_size, counts[entity_type] + 1))
+            for entity_type in GENERATION_ORDER
+            for start in range(1, counts[entity_type] + 1, chunk_size)
+        ]
+        total = sum(counts.values())
+        self.stdout.write(
+            f"Generating {total} records on '{storage.name}' with {options['workers']} worker(s) "
+            f"(seed {options['seed']}, today {today}):"
+        )
+        for entity_type in GENERATION_ORDER:
+            self.stdout.write(f"  {entity_type}: {counts[entity_type]}")
+
+        started = time.time()
+        written = 0
+        if options['workers'] <= 1:
+            _init_worker(counts, options['seed'], today)
+            for task in tasks:
+                written += _write_chunk(*task)
+        else:
+            # spawn: procesos limpios, sin heredar conexiones ni hilos del motor de este proceso
+            with ProcessPoolExecutor(
+                max_workers=options['workers'],
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(counts, options['seed'], today),
+            ) as executor:
+                futures = [executor.submit(_write_chunk, *task) for task in tasks]
+                for done, future in enumerate(futures, 1):
+                    written += future.result()
+                    if done % 20 == 0 or done == len(futures):
+                        self.stdout.write(f"  {done}/{len(futures)} chunks ({written} records)")
+
+        # Cada proceso actualizó el índice por su cuenta: se reconstruye desde los datos
+        for entity_type in GENERATION_ORDER:
+            if counts[entity_type]:
+                storage.rebuild_index(entity_type)
+
+        elapsed = time.time() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"\n✅ {written} records generated in {elapsed:.1f}s ({written / elapsed if elapsed else 0:.0f}/s). "
+            f"Password for every padrino/admin: {GENERATED_PASSWORD}"
+        ))
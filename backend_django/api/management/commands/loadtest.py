@@ -0,0 +1,371 @@
+"""
+Management command to replay the mobile/web API request mix against a running server
+"""
+import http.client
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+from api.synthetic_data import GENERATED_PASSWORD
+
+
+# Mezcla por defecto: pantallas de la app (SmileLinkApiService.kt) y del dashboard web
+DEFAULT_WEIGHTS = {
+    'auth_login': 4,
+    'auth_me': 6,
+    'ninos_list': 14,
+    'nino_detail': 16,
+    'padrinos_list': 4,
+    'padrino_detail': 6,
+    'apadrinamientos_list': 8,
+    'apadrinamiento_detail': 5,
+    'entregas_list': 8,
+    'entrega_detail': 6,
+    'puntos_list': 5,
+    'solicitudes_list': 3,
+    'dashboard_kpis': 5,
+    'nino_patch': 4,
+    'entrega_patch': 3,
+    'apadrinamiento_create': 2,
+}
+
+# Listados de los que se toman IDs reales antes de empezar
+DISCOVERY = {
+    'ninos': ('/ninos/', 'id_nino'),
+    'padrinos': ('/padrinos/', 'id_padrino'),
+    'apadrinamientos': ('/apadrinamientos/', 'id_apadrinamiento'),
+    'entregas': ('/entregas/', 'id_entrega'),
+}
+
+METRIC_LINE = re.compile(r'^(\w+)\{(.*)\} ([0-9.eE+-]+)$')
+
+
+def _percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def _parse_metrics(text):
+    """{(nombre, etiquetas): valor} del formato de texto de Prometheus"""
+    values = {}
+    for line in text.splitlines():
+        match = METRIC_LINE.match(line)
+        if match:
+            values[(match.group(1), match.group(2))] = float(match.group(3))
+    return values
+
+
+class LoadClient:
+    """Una conexión keep-alive por hilo"""
+
+    def __init__(self, base_url, timeout, token=''):
+        parts = urlsplit(base_url)
+        if parts.scheme not in ('http', 'https'):
+            raise CommandError(f"Unsupported URL: {base_url}")
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.prefix = parts.path.rstrip('/')
+        self.timeout = timeout
+        self.token = token
+        self.conn = None
+
+    def _connect(self):
+        cls = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+        self.conn = cls(self.host, self.port, timeout=self.timeout)
+
+    # Errores de una conexión keep-alive que el servidor ya cerró: el request nunca llegó a procesarse
+    STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, BrokenPipeError)
+
+    def request(self, method, path, body=None):
+        """
+        Retorna (status, bytes)
+
+        Reintenta una vez, en una conexión nueva, sólo si una conexión
+        reutilizada resultó estar cerrada antes de recibir respuesta. Un POST
+        nunca se reintenta: podría haberse aplicado y se contaría dos veces.
+        """
+        payload = json.dumps(body).encode() if body is not None else None
+        headers = {'Content-Type': 'application/json'} if payload is not None else {}
+        if self.token:
+            headers['Authorization'] = f"Bearer {self.token}"
+        for attempt in (1, 2):
+            reused = self.conn is not None
+            if not reused:
+                self._connect()
+            try:
+                self.conn.request(method, f"{self.prefix}{path}", body=payload, headers=headers)
+                response = self.conn.getresponse()
+                return response.status, response.read()
+            except (http.client.HTTPException, OSError) as e:
+                self.conn.close()
+                self.conn = None
+                stale = reused and isinstance(e, self.STALE_CONNECTION_ERRORS)
+                if attempt == 2 or not stale or method == 'POST':
+                    raise
+
+
+class Command(BaseCommand):
+    help = 'Replay the mobile/web request mix against a running server and report throughput, latency percentiles and errors per endpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000/api', help='API base URL (default: http://127.0.0.1:8000/api)')
+        parser.add_argument('--concurrency', type=int, default=8, help='Concurrent clients (default: 8)')
+        parser.add_argument('--duration', type=float, default=30, help='Seconds to run (default: 30)')
+        parser.add_argument('--weights', default='',
+                            help="Overrides, e.g. 'nino_detail=30,apadrinamiento_create=0'")
+        parser.add_argument('--password', default=GENERATED_PASSWORD,
+                            help='Password of the padrinos used for login (default: generate_data password)')
+        parser.add_argument('--timeout', type=float, default=30, help='Per-request timeout in seconds (default: 30)')
+        parser.add_argument('--seed', type=int, default=None, help='Seed for the request sequence')
+        parser.add_argument('--metrics', action='store_true',
+                            help='Scrape /metrics/ before and after to report server-side storage work')
+        parser.add_argument('--metrics-token', default=os.getenv('OBSERVABILITY_TOKEN', ''),
+                            help='Bearer token for /metrics/ (default: OBSERVABILITY_TOKEN)')
+        parser.add_argument('--metrics-wait', type=float, default=6,
+                            help='Seconds to wait before the last scrape so workers flush (default: 6, > METRICS_FLUSH_SECONDS)')
+        parser.add_argument('--output', help='Write the report as JSON to this file')
+
+    # ------------------------------------------------------------------
+    # Preparación
+    # ------------------------------------------------------------------
+
+    def _weights(self, overrides):
+        weights = dict(DEFAULT_WEIGHTS)
+        for item in filter(None, (part.strip() for part in overrides.split(','))):
+            name, _, value = item.partition('=')
+            if name not in weights:
+                raise CommandError(f"Unknown endpoint '{name}'. Choose from: {', '.join(weights)}")
+            try:
+                weights[name] = float(value)
+            except ValueError:
+                raise CommandError(f"Invalid weight for {name}: {value}")
+        weights = {name: weight for name, weight in weights.items() if weight > 0}
+        if not weights:
+            raise CommandError('All weights are zero')
+        return weights
+
+    def _discover(self, client):
+        """IDs reales, emails de padrinos y niños disponibles"""
+        pool = {}
+        for entity_type, (path, id_field) in DISCOVERY.items():
+            status, body = client.request('GET', path)
+            if status != 200:
+                raise CommandError(f"GET {path} returned {status}; is the server running at --url?")
+            items = json.loads(body)
+            if isinstance(items, dict):
+                items = items.get('results', [])
+            pool[entity_type] = [item[id_field] for item in items if item.get(id_field)]
+            if entity_type == 'padrinos':
+                pool['emails'] = [item['email'] for item in items if item.get('email')]
+            if entity_type == 'ninos':
+                pool['disponibles'] = [
+                    item['id_nino'] for item in items if item.get('estado_apadrinamiento') == 'Disponible'
+                ]
+        return pool
+
+    def _next_request(self, name, rng, pool, lock):
+        """(método, path, body) para un endpoint, o None si no hay datos para armarlo"""
+        def pick(entity_type):
+            ids = pool.get(entity_type)
+            return rng.choice(ids) if ids else None
+
+        if name == 'auth_login':
+            email = pick('emails')
+            return email and ('POST', '/auth/login/', {'email': email, 'password': self.password})
+        if name == 'auth_me':
+            padrino = pick('padrinos')
+            return padrino and ('GET', f"/auth/me/?padrino_id={padrino}", None)
+        lists = {
+            'ninos_list': '/ninos/', 'padrinos_list': '/padrinos/', 'apadrinamientos_list': '/apadrinamientos/',
+            'entregas_list': '/entregas/', 'puntos_list': '/puntos-entrega/', 'solicitudes_list': '/solicitudes/',
+            'dashboard_kpis': '/dashboard/kpis/',
+        }
+        if name in lists:
+            return 'GET', lists[name], None
+        details = {
+            'nino_detail': ('ninos', '/ninos/{}/'), 'padrino_detail': ('padrinos', '/padrinos/{}/'),
+            'apadrinamiento_detail': ('apadrinamientos', '/apadrinamientos/{}/'),
+            'entrega_detail': ('entregas', '/entregas/{}/'),
+        }
+        if name in details:
+            entity_type, template = details[name]
+            entity_id = pick(entity_type)
+            return entity_id and ('GET', template.format(entity_id), None)
+        if name == 'nino_patch':
+            nino = pick('ninos')
+            return nino and ('PATCH', f"/ninos/{nino}/", {'descripcion': f"Actualizado {rng.randint(1, 10 ** 6)}"})
+        if name == 'entrega_patch':
+            entrega = pick('entregas')
+            return entrega and ('PATCH', f"/entregas/{entrega}/", {'observaciones': f"loadtest {rng.randint(1, 10 ** 6)}"})
+        if name == 'apadrinamiento_create':
+            # Cada niño disponible se apadrina una sola vez
+            with lock:
+                if not pool['disponibles'] or not pool['padrinos']:
+                    return None
+                nino = pool['disponibles'].pop(rng.randrange(len(pool['disponibles'])))
+            return 'POST', '/apadrinamientos/', {
+                'id_nino': nino, 'id_padrino': rng.choice(pool['padrinos']),
+                'fecha_inicio': time.strftime('%Y-%m-%d'), 'estado_apadrinamiento_registro': 'Activo',
+            }
+        return None
+
+    # ------------------------------------------------------------------
+    # Ejecución
+    # ------------------------------------------------------------------
+
+    def _worker(self, index, deadline, weights, pool, lock, results, seed):
+        rng = random.Random(None if seed is None else seed + index)
+        client = LoadClient(self.url, self.timeout)
+        names, cumulative = list(weights), list(weights.values())
+        samples = defaultdict(list)
+        errors = defaultdict(int)
+        statuses = defaultdict(lambda: defaultdict(int))
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights=cumulative)[0]
+            request = self._next_request(name, rng, pool, lock)
+            if not request:
+                continue
+            method, path, body = request
+            started = time.perf_counter()
+            try:
+                status, _ = client.request(method, path, body)
+            except Exception:
+                status = 0
+            samples[name].append(time.perf_counter() - started)
+            statuses[name][status] += 1
+            if status == 0 or status >= 400:
+                errors[name] += 1
+        results[index] = (samples, errors, statuses)
+
+    def _scrape(self, client):
+        status, body = client.request('GET', '/metrics/')
+        if status != 200:
+            raise CommandError(f"GET /metrics/ returned {status}")
+        return _parse_metrics(body.decode())
+
+    def _metrics_delta(self, before, after):
+        """Trabajo del servidor durante la corrida, por operación de storage"""
+        delta = {}
+        for (name, labels), value in after.items():
+            diff = value - before.get((name, labels), 0)
+            if diff <= 0:
+                continue
+            if name == 'smilelink_storage_operation_seconds_count':
+                key = labels
+                seconds = after.get(('smilelink_storage_operation_seconds_sum', labels), 0) \
+                    - before.get(('smilelink_storage_operation_seconds_sum', labels), 0)
+                delta[f"storage {key}"] = {'count': int(diff), 'mean_ms': round(seconds / diff * 1000, 3)}
+            elif name in ('smilelink_storage_read_bytes_total', 'smilelink_storage_written_bytes_total',
+                          'smilelink_storage_index_loads_total', 'smilelink_encryption_bytes_total',
+                          'smilelink_hdfs_failures_total'):
+                delta[f"{name} {{{labels}}}"] = int(diff)
+        return delta
+
+    def handle(self, *args, **options):
+        self.url = options['url'].rstrip('/')
+        self.password = options['password']
+        self.timeout = options['timeout']
+        weights = self._weights(options['weights'])
+
+        probe = LoadClient(self.url, self.timeout)
+        scraper = LoadClient(self.url, self.timeout, options['metrics_token'])
+        try:
+            pool = self._discover(probe)
+        except (OSError, http.client.HTTPException) as e:
+            raise CommandError(f"Cannot reach {self.url}: {e}")
+        self.stdout.write(
+            f"Discovered {len(pool['ninos'])} ninos, {len(pool['padrinos'])} padrinos, "
+            f"{len(pool['apadrinamientos'])} apadrinamientos, {len(pool['entregas'])} entregas"
+        )
+        before = self._scrape(scraper) if options['metrics'] else None
+
+        lock = threading.Lock()
+        results = {}
+        self.stdout.write(
+            f"Running {options['concurrency']} client(s) for {options['duration']:.0f}s against {self.url}..."
+        )
+        started = time.perf_counter()
+        deadline = started + options['duration']
+        threads = [
+            threading.Thread(
+                target=self._worker,
+                args=(i, deadline, weights, pool, lock, results, options['seed']),
+                daemon=True,
+            )
+            for i in range(options['concurrency'])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        samples, errors = defaultdict(list), defaultdict(int)
+        statuses = defaultdict(lambda: defaultdict(int))
+        for worker_samples, worker_errors, worker_statuses in results.values():
+            for name, values in worker_samples.items():
+                samples[name].extend(values)
+            for name, count in worker_errors.items():
+                errors[name] += count
+            for name, by_status in worker_statuses.items():
+                for code, count in by_status.items():
+                    statuses[name][code] += count
+
+        report = {'url': self.url, 'concurrency': options['concurrency'], 'seconds': round(elapsed, 3), 'endpoints': {}}
+        all_samples = []
+        for name in sorted(samples, key=lambda n: -len(samples[n])):
+            ordered = sorted(samples[name])
+            all_samples.extend(ordered)
+            report['endpoints'][name] = {
+                'requests': len(ordered),
+                'rps': round(len(ordered) / elapsed, 2),
+                'errors': errors[name],
+                'error_rate': round(errors[name] / len(ordered), 4),
+                'p50_ms': round(_percentile(ordered, 0.50) * 1000, 2),
+                'p90_ms': round(_percentile(ordered, 0.90) * 1000, 2),
+                'p99_ms': round(_percentile(ordered, 0.99) * 1000, 2),
+                'max_ms': round(ordered[-1] * 1000, 2),
+                'statuses': {str(code): count for code, count in sorted(statuses[name].items())},
+            }
+        all_samples.sort()
+        total_errors = sum(errors.values())
+        report['total'] = {
+            'requests': len(all_samples),
+            'rps': round(len(all_samples) / elapsed, 2),
+            'errors': total_errors,
+            'error_rate': round(total_errors / len(all_samples), 4) if all_samples else 0,
+            'p50_ms': round(_percentile(all_samples, 0.50) * 1000, 2),
+            'p90_ms': round(_percentile(all_samples, 0.90) * 1000, 2),
+            'p99_ms': round(_percentile(all_samples, 0.99) * 1000, 2),
+        }
+        if before is not None:
+            time.sleep(options['metrics_wait'])
+            report['server'] = self._metrics_delta(before, self._scrape(scraper))
+
+        self.stdout.write(
+            f"\n{'endpoint':<24}{'reqs':>8}{'rps':>9}{'err %':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}"
+        )
+        for name, row in list(report['endpoints'].items()) + [('TOTAL', report['total'])]:
+            line = (
+                f"{name:<24}{row['requests']:>8}{row['rps']:>9.1f}{row['error_rate'] * 100:>8.1f}"
+                f"{row['p50_ms']:>10.1f}{row['p90_ms']:>10.1f}{row['p99_ms']:>10.1f}"
+            )
+            self.stdout.write(self.style.ERROR(line) if row['errors'] else line)
+        if 'server' in report:
+            self.stdout.write('\nServer-side work during the run:')
+            for key, value in sorted(report['server'].items()):
+                self.stdout.write(f"  {key}: {value}")
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
+            self.stdout.write(f"\nReport written to {options['output']}")
+        self.stdout.write(self.style.SUCCESS('\n✅ Load test finished'))
@@ -0,0 +1,56 @@
+"""
+Observability views for SmileLink API
+Prometheus scrape endpoint and slow-request trace lookup
+
+Both are restricted to OBSERVABILITY_ALLOWED_IPS or a Bearer OBSERVABILITY_TOKEN.
+"""
+from functools import wraps
+
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.http import require_GET
+
+from storage.metrics import REGISTRY, render_prometheus
+from storage.tracing import TRACE_ID_PATTERN, get_tracer
+
+from .middleware import is_trusted_observer
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def observer_required(view):
+    """403 salvo para IPs permitidas o con el token de observabilidad"""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not is_trusted_observer(request):
+            return JsonResponse({'error': 'No autorizado'}, status=403)
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+@require_GET
+@observer_required
+def metrics(request):
+    """
+    Storage, encryption, HDFS and request metrics in Prometheus text format
+
+    GET /api/metrics/
+    """
+    return HttpResponse(render_prometheus(REGISTRY.collect()), content_type=CONTENT_TYPE)
+
+
+@require_GET
+@observer_required
+def trace_detail(request, trace_id):
+    """
+    Span waterfall of a slow request, by the X-Trace-Id it returned
+
+    GET /api/traces/<trace_id>/
+    """
+    if not TRACE_ID_PATTERN.match(trace_id):
+        return JsonResponse({'error': 'trace_id inválido'}, status=400)
+    trace = get_tracer().find(trace_id)
+    if trace is None:
+        return JsonResponse(
+            {'error': 'Trace no encontrada (sólo se guardan los requests lentos)'}, status=404
+        )
+    return JsonResponse(trace, json_dumps_params={'ensure_ascii': False})
@@ -0,0 +1,145 @@
+"""
+SmileLink API - Middleware
+"""
+import cProfile
+import hmac
+import ipaddress
+import time
+
+from django.conf import settings
+
+from storage.metrics import HTTP_REQUEST_SECONDS, REGISTRY
+from storage.profiling import get_profile_store
+from storage.tracing import get_current_trace, get_tracer, span
+
+
+def is_trusted_observer(request) -> bool:
+    """True si el request viene de OBSERVABILITY_ALLOWED_IPS o trae el OBSERVABILITY_TOKEN"""
+    token = settings.OBSERVABILITY_TOKEN
+    auth = request.headers.get('Authorization', '')
+    if token and auth.startswith('Bearer ') and hmac.compare_digest(auth[7:].strip(), token):
+        return True
+
+    try:
+        remote = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    for allowed in settings.OBSERVABILITY_ALLOWED_IPS:
+        try:
+            if remote in ipaddress.ip_network(allowed, strict=False):
+                return True
+        except ValueError:
+            continue
+    return False
+
+
+class MetricsMiddleware:
+    """
+    Latencia y status de cada request por ruta
+
+    La ruta es el nombre de la vista resuelta (ej: 'nino-detail'), no el
+    path, para que los IDs no multipliquen las series.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # Con --preload el hilo de escritura no sobrevive al fork: uno por worker
+        REGISTRY.start()
+        started = time.perf_counter()
+        response = self.get_response(request)
+        match = getattr(request, 'resolver_match', None)
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - started,
+            method=request.method,
+            route=match.view_name if match is not None else 'unmatched',
+            status=response.status_code,
+        )
+        return response
+
+
+class TracingMiddleware:
+    """
+    Cascada de spans por request y log de requests lentos
+
+    Debe ir primero en MIDDLEWARE para que la trace cubra todo el request.
+    Un X-Trace-Id entrante de un cliente de confianza (is_trusted_observer)
+    se conserva y siempre se traza; el de cualquier otro se ignora. La
+    respuesta de un request trazado lleva su X-Trace-Id.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.tracer = get_tracer()
+
+    def __call__(self, request):
+        incoming = request.headers.get('X-Trace-Id')
+        if incoming and not is_trusted_observer(request):
+            incoming = None
+        trace, token = self.tracer.start(f"{request.method} {request.path}", incoming)
+        if trace is None:
+            return self.get_response(request)
+
+        try:
+            with span('request', method=request.method, path=request.path) as root:
+                response = self.get_response(request)
+                root.set(status=response.status_code)
+        except Exception:
+            self.tracer.finish(trace, token, method=request.method, path=request.path, status=500)
+            raise
+
+        match = getattr(request, 'resolver_match', None)
+        self.tracer.finish(
+            trace, token,
+            method=request.method,
+            path=request.path,
+            route=match.view_name if match is not None else 'unmatched',
+            status=response.status_code,
+        )
+        response['X-Trace-Id'] = trace.trace_id
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    cProfile de requests muestreados (PROFILE_SAMPLE_RATE) o pedidos por un
+    admin con el header X-Profile: <PROFILE_TOKEN>
+
+    La respuesta perfilada lleva X-Profile-Id; el perfil queda en PROFILE_DIR.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.store = get_profile_store()
+
+    def __call__(self, request):
+        if not self.store.should_profile(request.headers.get('X-Profile')):
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Otro perfilador activo en este hilo
+            return self.get_response(request)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+        duration = time.perf_counter() - started
+
+        match = getattr(request, 'resolver_match', None)
+        trace = get_current_trace()
+        profile_id = self.store.save(profiler, {
+            'method': request.method,
+            'path': request.path,
+            'route': match.view_name if match is not None else 'unmatched',
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 3),
+            'trace_id': trace.trace_id if trace is not None else None,
+        })
+        if profile_id is not None:
+            response['X-Profile-Id'] = profile_id
+        return response
@@ -73,6 +73,7 @@ class EntregaSerializer(serializers.Serializer):
     observaciones = serializers.CharField(required=False, allow_blank=True)
     id_punto_entrega = serializers.CharField()
     evidencia_foto_path = serializers.CharField(required=False, allow_null=True)
+    id_evento = serializers.CharField(required=False, allow_null=True)
 
 
 class SolicitudRegaloSerializer(serializers.Serializer):
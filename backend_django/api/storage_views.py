@@ -0,0 +1,78 @@
+"""
+Storage status views for SmileLink API
+Exposes replication and storage health for operators
+"""
+
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
+from rest_framework import status
+
+from storage import FileStorageManager, get_storage_backend, get_sync_manager
+
+
+def _file_storage():
+    """
+    FileStorageManager detrás del motor activo, o None
+
+    El cache de NFS, el snapshot y el monitor de salud son del motor 'file';
+    con 'migrating' se usa su origen (o su destino) si es de ese motor.
+    """
+    backend = get_storage_backend()
+    for candidate in (backend, getattr(backend, 'source', None), getattr(backend, 'target', None)):
+        if isinstance(candidate, FileStorageManager):
+            return candidate
+    return None
+
+
+@api_view(['GET'])
+def replication_status(request):
+    """
+    HDFS replication queue depth and lag
+
+    GET /api/storage/replication/
+    """
+    return Response(get_sync_manager().replication_status(), status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+def cache_status(request):
+    """
+    Local NFS blob cache hit ratio and size
+
+    GET /api/storage/cache/
+    """
+    file_storage = _file_storage()
+    blob_cache = file_storage.blob_cache if file_storage is not None else None
+    if blob_cache is None:
+        return Response({'enabled': False}, status=status.HTTP_200_OK)
+    return Response({'enabled': True, **blob_cache.stats()}, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+def snapshot_status(request):
+    """
+    Shared entity snapshot: generation, freshness and this worker's hit ratio
+
+    GET /api/storage/snapshot/
+    """
+    file_storage = _file_storage()
+    snapshot = file_storage.snapshot if file_storage is not None else None
+    if snapshot is None or not snapshot.reads_enabled:
+        return Response({'enabled': False}, status=status.HTTP_200_OK)
+    return Response({'enabled': True, **snapshot.stats()}, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+def nfs_health(request):
+    """
+    NFS mount state and probe latency; 503 while storage is degraded
+
+    GET /api/storage/nfs/
+    """
+    file_storage = _file_storage()
+    monitor = file_storage.health if file_storage is not None else None
+    if monitor is None:
+        return Response({'enabled': False}, status=status.HTTP_200_OK)
+    state = monitor.state()
+    code = status.HTTP_200_OK if state['healthy'] else status.HTTP_503_SERVICE_UNAVAILABLE
+    return Response({'enabled': True, **state}, status=code)
@@ -0,0 +1,322 @@
+"""
+SmileLink API - Synthetic data
+Datos sintéticos deterministas y con referencias consistentes entre tipos
+
+Cada registro se deriva sólo de (semilla, tipo, número): cualquier proceso
+puede generar cualquier rango sin coordinarse y el resultado es el mismo.
+Las relaciones inversas (historial del padrino, entregas de un
+apadrinamiento, estado del niño) se calculan con prepare() recorriendo sólo
+el núcleo de cada registro, sin encriptar nada.
+"""
+import hashlib
+import random
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from storage import StorageBackend
+
+
+# Contraseña de todos los padrinos y administradores generados
+GENERATED_PASSWORD = 'smilelink123'
+
+NOMBRES = [
+    'Sofía', 'Mateo', 'Valentina', 'Santiago', 'Regina', 'Sebastián', 'Camila', 'Leonardo',
+    'Ximena', 'Emiliano', 'María José', 'Diego', 'Renata', 'Daniel', 'Fernanda', 'Carlos',
+    'Ana', 'Juan', 'Lucía', 'José', 'Isabella', 'Miguel', 'Victoria', 'Alejandro',
+]
+APELLIDOS = [
+    'Hernández', 'García', 'Martínez', 'López', 'González', 'Rodríguez', 'Pérez', 'Sánchez',
+    'Ramírez', 'Cruz', 'Flores', 'Gómez', 'Morales', 'Vázquez', 'Reyes', 'Jiménez',
+    'Torres', 'Díaz', 'Ruiz', 'Mendoza', 'Ortega', 'Castillo', 'Romero', 'Herrera',
+]
+NECESIDADES = [
+    'Mochila', 'Zapatos escolares', 'Uniforme', 'Libros', 'Útiles escolares', 'Chamarra',
+    'Balón de fútbol', 'Juego de mesa', 'Bicicleta', 'Lentes', 'Cobija', 'Despensa',
+]
+GUSTOS = [
+    'Le gusta dibujar', 'Apasionado por el fútbol', 'Quiere ser doctora', 'Le encantan los animales',
+    'Toca la guitarra', 'Lee todo lo que encuentra', 'Ama las matemáticas', 'Baila folklórico',
+]
+CALLES = ['Av. Universidad', 'Calle Madero', 'Av. López Mateos', 'Calle Hidalgo', 'Blvd. Zacatecas', 'Calle Juárez']
+
+# Proporción por defecto respecto al número de niños (ver default_counts)
+DEFAULT_RATIOS = {
+    'ninos': 1.0,
+    'padrinos': 0.4,
+    'apadrinamientos': 0.8,
+    'entregas': 2.0,
+    'solicitudes': 0.3,
+    'puntos_entrega': 0.005,
+    'eventos': 0.001,
+    'administradores': 0.0002,
+}
+MINIMUMS = {'padrinos': 1, 'puntos_entrega': 5, 'eventos': 3, 'administradores': 2}
+
+# Orden en el que conviene escribir (los referenciados primero)
+GENERATION_ORDER = [
+    'administradores', 'puntos_entrega', 'eventos', 'padrinos', 'ninos',
+    'apadrinamientos', 'entregas', 'solicitudes',
+]
+
+
+def default_counts(scale: int) -> Dict[str, int]:
+    """Conteos por tipo para una escala dada (número de niños)"""
+    return {
+        entity_type: max(MINIMUMS.get(entity_type, 0), int(scale * ratio)) if scale else 0
+        for entity_type, ratio in DEFAULT_RATIOS.items()
+    }
+
+
+def entity_id(entity_type: str, number: int) -> str:
+    """ID con el mismo formato que get_next_id (ej: 'N005', 'AP1234')"""
+    return f"{StorageBackend.ID_PREFIXES[entity_type]}{str(number).zfill(3)}"
+
+
+class SyntheticDataGenerator:
+    """Genera registros de cualquier tipo por número, de forma determinista"""
+
+    def __init__(self, counts: Dict[str, int], seed: int = 42, today: Optional[date] = None):
+        """
+        Args:
+            counts: Registros por tipo (los ausentes quedan en 0)
+            seed: Semilla; la misma semilla y conteos producen los mismos datos
+            today: Fecha de referencia para estados y fechas (por defecto 2026-01-01)
+        """
+        self.counts = {entity_type: counts.get(entity_type, 0) for entity_type in StorageBackend.ENTITY_TYPES}
+        self.seed = seed
+        self.today = today or date(2026, 1, 1)
+        self.password_hash = hashlib.sha256(GENERATED_PASSWORD.encode()).hexdigest()
+        self._prepared = False
+
+    def _rng(self, entity_type: str, number: int) -> random.Random:
+        return random.Random(f"{self.seed}:{entity_type}:{number}")
+
+    def _days_ago(self, rng: random.Random, max_days: int) -> date:
+        return self.today - timedelta(days=rng.randint(0, max_days))
+
+    def _person(self, rng: random.Random) -> Tuple[str, str]:
+        nombre = rng.choice(NOMBRES)
+        apellidos = f"{rng.choice(APELLIDOS)} {rng.choice(APELLIDOS)}"
+        return nombre, apellidos
+
+    # ------------------------------------------------------------------
+    # Núcleos: lo que otros tipos necesitan saber de un registro
+    # ------------------------------------------------------------------
+
+    def _apadrinamiento_core(self, number: int) -> Dict[str, Any]:
+        """Niño (en rondas sobre los niños), padrino (sesgado) y estado"""
+        rng = self._rng('apadrinamientos', number)
+        ninos = self.counts['ninos']
+        padrinos = self.counts['padrinos']
+        nino = (number - 1) % ninos + 1
+        # Las rondas anteriores del mismo niño ya terminaron
+        latest = number + ninos > self.counts['apadrinamientos']
+        # Algunos padrinos apadrinan a varios niños
+        padrino = min(padrinos, 1 + int(padrinos * rng.random() ** 1.6))
+        fecha_inicio = self._days_ago(rng, 3 * 365)
+        activo = latest and rng.random() < 0.85
+        return {
+            'nino': nino,
+            'padrino': padrino,
+            'fecha_inicio': fecha_inicio,
+            'activo': activo,
+            'tipo': rng.choices(
+                ['Elección Padrino', 'Asignación Automática', 'Solicitud Niño'], weights=[6, 3, 1]
+            )[0],
+            'fecha_fin': None if activo else fecha_inicio + timedelta(days=rng.randint(90, 700)),
+        }
+
+    def _entrega_core(self, number: int) -> Dict[str, Any]:
+        rng = self._rng('entregas', number)
+        fecha_programada = self.today + timedelta(days=rng.randint(-540, 90))
+        dias = (self.today - fecha_programada).days
+        if dias > 30:
+            estado = 'Entregado' if rng.random() < 0.93 else 'Pendiente'
+        elif dias > -15:
+            estado = rng.choices(['Entregado', 'En Proceso', 'Pendiente'], weights=[4, 4, 2])[0]
+        else:
+            estado = 'Pendiente'
+        return {
+            'apadrinamiento': rng.randint(1, self.counts['apadrinamientos']),
+            'punto': rng.randint(1, self.counts['puntos_entrega']) if self.counts['puntos_entrega'] else None,
+            'evento': rng.randint(1, self.counts['eventos']) if self.counts['eventos'] and rng.random() < 0.6 else None,
+            'fecha_programada': fecha_programada,
+            'estado': estado,
+            'rng': rng,
+        }
+
+    def prepare(self):
+        """Calcula las relaciones inversas; idempotente"""
+        if self._prepared:
+            return
+        n_apadrinamientos = self.counts['apadrinamientos'] if self.counts['ninos'] and self.counts['padrinos'] else 0
+        self.counts['apadrinamientos'] = n_apadrinamientos
+        if not n_apadrinamientos:
+            self.counts['entregas'] = 0
+
+        self._padrino_history: Dict[int, List[str]] = defaultdict(list)
+        self._nino_current: Dict[int, Tuple[int, Dict[str, Any]]] = {}
+        for number in range(1, n_apadrinamientos + 1):
+            core = self._apadrinamiento_core(number)
+            self._padrino_history[core['padrino']].append(entity_id('apadrinamientos', number))
+            if core['activo']:
+                self._nino_current[core['nino']] = (number, core)
+
+        self._apadrinamiento_entregas: Dict[int, List[str]] = defaultdict(list)
+        for number in range(1, self.counts['entregas'] + 1):
+            core = self._entrega_core(number)
+            self._apadrinamiento_entregas[core['apadrinamiento']].append(entity_id('entregas', number))
+        self._prepared = True
+
+    # ------------------------------------------------------------------
+    # Registros
+    # ------------------------------------------------------------------
+
+    def record(self, entity_type: str, number: int) -> Dict[str, Any]:
+        """Registro completo número `number` (1..counts[entity_type]) del tipo"""
+        self.prepare()
+        return getattr(self, f"_{entity_type}")(number)
+
+    def records(self, entity_type: str, start: int, stop: int) -> Dict[str, Dict[str, Any]]:
+        """Registros start..stop-1 como {id: data}"""
+        id_field = StorageBackend.ID_FIELDS[entity_type]
+        result = {}
+        for number in range(start, stop):
+            data = self.record(entity_type, number)
+            result[data[id_field]] = data
+        return result
+
+    def _ninos(self, number: int) -> Dict[str, Any]:
+        rng = self._rng('ninos', number)
+        nombre, apellidos = self._person(rng)
+        data = {
+            'id_nino': entity_id('ninos', number),
+            'nombre': f"{nombre} {apellidos}",
+            'edad': rng.randint(3, 15),
+            'genero': rng.choice(['Femenino', 'Masculino']),
+            'descripcion': f"{rng.choice(GUSTOS)}.",
+            'necesidades': rng.sample(NECESIDADES, rng.randint(1, 3)),
+            'estado_apadrinamiento': 'Disponible',
+        }
+        current = self._nino_current.get(number)
+        if current is not None:
+            apadrinamiento, core = current
+            data.update({
+                'estado_apadrinamiento': 'Apadrinado',
+                'id_padrino_actual': entity_id('padrinos', core['padrino']),
+                'fecha_apadrinamiento_actual': core['fecha_inicio'].isoformat(),
+            })
+        return data
+
+    def _padrinos(self, number: int) -> Dict[str, Any]:
+        rng = self._rng('padrinos', number)
+        nombre, apellidos = self._person(rng)
+        usuario = f"{nombre}.{apellidos.split()[0]}".lower().replace(' ', '')
+        return {
+            'id_padrino': entity_id('padrinos', number),
+            'nombre': f"{nombre} {apellidos}",
+            'email': f"{usuario}{number}@correo.smilelink.org",
+            'password_hash': self.password_hash,
+            'fecha_registro': self._days_ago(rng, 4 * 365).isoformat(),
+            'direccion': f"{rng.choice(CALLES)} {rng.randint(1, 999)}",
+            'telefono': f"449-{rng.randint(100, 999)}-{rng.randint(1000, 9999)}",
+            'historial_apadrinamiento_ids': list(self._padrino_history.get(number, [])),
+        }
+
+    def _apadrinamientos(self, number: int) -> Dict[str, Any]:
+        core = self._apadrinamiento_core(number)
+        return {
+            'id_apadrinamiento': entity_id('apadrinamientos', number),
+            'id_padrino': entity_id('padrinos', core['padrino']),
+            'id_nino': entity_id('ninos', core['nino']),
+            'fecha_inicio': core['fecha_inicio'].isoformat(),
+            'fecha_fin': core['fecha_fin'].isoformat() if core['fecha_fin'] else None,
+            'tipo_apadrinamiento': core['tipo'],
+            'estado_apadrinamiento_registro': 'Activo' if core['activo'] else 'Finalizado',
+            'entregas_ids': list(self._apadrinamiento_entregas.get(number, [])),
+        }
+
+    def _entregas(self, number: int) -> Dict[str, Any]:
+        core = self._entrega_core(number)
+        rng = core['rng']
+        entregado = core['estado'] == 'Entregado'
+        return {
+            'id_entrega': entity_id('entregas', number),
+            'id_apadrinamiento': entity_id('apadrinamientos', core['apadrinamiento']),
+            'descripcion_regalo': rng.choice(NECESIDADES),
+            'fecha_programada': core['fecha_programada'].isoformat(),
+            'fecha_entrega_real': (
+                (core['fecha_programada'] + timedelta(days=rng.randint(-3, 10))).isoformat() if entregado else None
+            ),
+            'estado_entrega': core['estado'],
+            'observaciones': '',
+            'id_punto_entrega': entity_id('puntos_entrega', core['punto']) if core['punto'] else '',
+            'evidencia_foto_path': f"evidencias/{entity_id('entregas', number)}.jpg" if entregado else None,
+            'id_evento': entity_id('eventos', core['evento']) if core['evento'] else None,
+        }
+
+    def _solicitudes(self, number: int) -> Dict[str, Any]:
+        rng = self._rng('solicitudes', number)
+        estado = rng.choices(['Abierta', 'En Proceso', 'Cumplida'], weights=[3, 2, 5])[0]
+        fecha = self._days_ago(rng, 2 * 365)
+        cumplida = estado == 'Cumplida' and self.counts['entregas']
+        return {
+            'id_solicitud': entity_id('solicitudes', number),
+            'id_nino': entity_id('ninos', rng.randint(1, max(1, self.counts['ninos']))),
+            'id_padrino_interesado': (
+                entity_id('padrinos', rng.randint(1, self.counts['padrinos']))
+                if self.counts['padrinos'] and rng.random() < 0.4 else None
+            ),
+            'descripcion_solicitud': f"Necesita {rng.choice(NECESIDADES).lower()}",
+            'fecha_solicitud': fecha.isoformat(),
+            'fecha_cierre': (fecha + timedelta(days=rng.randint(5, 120))).isoformat() if estado == 'Cumplida' else None,
+            'estado_solicitud': estado,
+            'id_entrega_asociada': entity_id('entregas', rng.randint(1, self.counts['entregas'])) if cumplida else None,
+        }
+
+    def _puntos_entrega(self, number: int) -> Dict[str, Any]:
+        rng = self._rng('puntos_entrega', number)
+        return {
+            'id_punto_entrega': entity_id('puntos_entrega', number),
+            'nombre_punto': f"Centro Comunitario {rng.choice(APELLIDOS)} {number}",
+            'direccion_fisica': f"{rng.choice(CALLES)} {rng.randint(1, 999)}, Aguascalientes",
+            'latitud': round(21.88 + rng.uniform(-0.08, 0.08), 6),
+            'longitud': round(-102.29 + rng.uniform(-0.08, 0.08), 6),
+            'horario_atencion': rng.choice(['L-V 9:00-17:00', 'L-S 10:00-14:00', 'S-D 9:00-13:00']),
+            'contacto_referencia': f"449-{rng.randint(100, 999)}-{rng.randint(1000, 9999)}",
+            'estado_punto': 'Activo' if rng.random() < 0.9 else 'Inactivo',
+        }
+
+    def _eventos(self, number: int) -> Dict[str, Any]:
+        rng = self._rng('eventos', number)
+        tipo = rng.choices(['Navidad', 'Día del Niño', 'Otro'], weights=[4, 3, 2])[0]
+        inicio = self.today + timedelta(days=rng.randint(-720, 120))
+        fin = inicio + timedelta(days=rng.randint(1, 30))
+        if fin < self.today:
+            estado = 'Cerrado'
+        elif inicio <= self.today:
+            estado = 'Activo'
+        else:
+            estado = 'Planeado'
+        return {
+            'id_evento': entity_id('eventos', number),
+            'nombre_evento': f"{tipo} {inicio.year}" if tipo != 'Otro' else f"Colecta {number}",
+            'tipo_evento': tipo,
+            'fecha_inicio': inicio.isoformat(),
+            'fecha_fin': fin.isoformat(),
+            'estado_evento': estado,
+            'descripcion': '',
+        }
+
+    def _administradores(self, number: int) -> Dict[str, Any]:
+        rng = self._rng('administradores', number)
+        nombre, apellidos = self._person(rng)
+        return {
+            'id_admin': entity_id('administradores', number),
+            'nombre': f"{nombre} {apellidos}",
+            'email': f"admin{number}@smilelink.org",
+            'password_hash': self.password_hash,
+            'fecha_registro': self._days_ago(rng, 4 * 365).isoformat(),
+            'rol': 'Superadmin' if number == 1 else 'Gestor',
+        }
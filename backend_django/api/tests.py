@@ -1,3 +1,432 @@
-from django.test import TestCase
+"""
+Tests de la API
 
-# Create your tests here.
+Cada test corre contra un almacenamiento 'file' en un directorio temporal:
+los singletons del paquete storage se reinician para que apunten a él.
+"""
+import http.client
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
+
+from cryptography.fernet import Fernet
+from django.conf import settings
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django.utils.functional import SimpleLazyObject
+from rest_framework.test import APIClient
+
+import storage.archive
+import storage.encryption
+import storage.file_manager
+import storage.jobs
+import storage.sqlite_backend
+import storage.sync_manager
+import storage.tracing
+from api import campaigns, views
+from api.management.commands.loadtest import LoadClient
+from storage import get_archive_store, get_job_store, get_storage_backend, get_sync_manager
+from api.authentication import issue_tokens
+from api.middleware import TracingMiddleware
+from storage.sqlite_backend import SQLiteStorageManager
+from storage.tracing import TRACE_ID_PATTERN, Tracer, get_current_trace, span
+
+
+_SINGLETONS = (
+    (storage.encryption, '_encryption_manager'),
+    (storage.file_manager, '_storage_manager'),
+    (storage.jobs, '_job_store'),
+    (storage.sync_manager, '_sync_manager'),
+    (storage.archive, '_archive_store'),
+)
+
+
+class IsolatedStorageMixin:
+    """Almacenamiento 'file' nuevo por test, sin NFS, HDFS ni snapshot"""
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp(prefix='smilelink-api-test-')
+        self.addCleanup(shutil.rmtree, self.directory, True)
+
+        env = mock.patch.dict(os.environ, {
+            'ENCRYPTION_KEY': os.getenv('ENCRYPTION_KEY') or Fernet.generate_key().decode(),
+            'STORAGE_BACKEND': 'file',
+            'LOCAL_STORAGE_PATH': self.directory,
+            'USE_NFS': 'False',
+            'USE_HDFS_REPLICATION': 'False',
+            'SNAPSHOT_ENABLED': 'False',
+        })
+        env.start()
+        self.addCleanup(env.stop)
+        for module, name in _SINGLETONS:
+            patcher = mock.patch.object(module, name, None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # Las vistas guardan el motor en objetos lazy a nivel de módulo
+        for name, getter in (('storage', get_storage_backend), ('sync', get_sync_manager),
+                             ('archive', get_archive_store)):
+            patcher = mock.patch.object(views, name, SimpleLazyObject(getter))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.storage = get_storage_backend()
+        self.client = APIClient()
+
+
+def _start_campaign_in_child(evento, barrier, queue):
+    prepare = campaigns.EntregasCampaign.prepare
+
+    def slow_prepare(campaign):
+        # Ensancha la ventana entre revisar el estado y marcarlo 'running'
+        time.sleep(0.2)
+        prepare(campaign)
+
+    barrier.wait()
+    with mock.patch.object(campaigns.EntregasCampaign, 'prepare', slow_prepare):
+        _, started = campaigns.start_campaign(evento)
+    if started:
+        campaigns._running[campaigns.campaign_job_id(evento['id_evento'])].join()
+    queue.put(started)
+
+
+class CampaignTests(IsolatedStorageMixin, SimpleTestCase):
+    """Generación de entregas por evento (api/campaigns.py)"""
+
+    APADRINAMIENTOS = 12
+
+    def setUp(self):
+        super().setUp()
+        self.evento = {
+            'id_evento': 'EV001',
+            'nombre_evento': 'Navidad',
+            'fecha_inicio': '2026-12-01',
+            'fecha_fin': '2026-12-24',
+        }
+        self.storage.save('eventos', 'EV001', self.evento)
+        self.storage.save('puntos_entrega', 'PE001', {'id_punto_entrega': 'PE001', 'estado_punto': 'Activo'})
+        self.storage.save_many('apadrinamientos', {
+            f"A{n:03d}": {'id_apadrinamiento': f"A{n:03d}", 'estado_apadrinamiento_registro': 'Activo'}
+            for n in range(1, self.APADRINAMIENTOS + 1)
+        })
+        self.job_id = campaigns.campaign_job_id('EV001')
+
+    def _wait(self):
+        thread = campaigns._running.pop(self.job_id, None)
+        if thread is not None:
+            thread.join(timeout=60)
+
+    def test_start_twice_creates_entregas_once(self):
+        _, started = campaigns.start_campaign(self.evento, {'chunk_size': 5})
+        _, again = campaigns.start_campaign(self.evento, {'chunk_size': 5})
+        self._wait()
+
+        self.assertTrue(started)
+        self.assertFalse(again)
+        self.assertEqual(campaigns.get_campaign_status('EV001')['status'], 'completed')
+        self.assertEqual(len(self.storage.list_ids('entregas')), self.APADRINAMIENTOS)
+
+        _, restarted = campaigns.start_campaign(self.evento)
+        self.assertFalse(restarted)
+        self.assertEqual(len(self.storage.list_ids('entregas')), self.APADRINAMIENTOS)
+
+    def test_job_locked_by_another_process_is_not_started(self):
+        lock_fd = get_job_store().try_lock(self.job_id)
+        try:
+            status, started = campaigns.start_campaign(self.evento)
+        finally:
+            get_job_store().unlock(lock_fd)
+
+        self.assertFalse(started)
+        self.assertIsNone(status)
+        self.assertEqual(self.storage.list_ids('entregas'), [])
+
+        # Al soltarse el lock (el otro proceso terminó o murió) el job se puede lanzar
+        _, started = campaigns.start_campaign(self.evento)
+        self._wait()
+        self.assertTrue(started)
+        self.assertEqual(len(self.storage.list_ids('entregas')), self.APADRINAMIENTOS)
+
+    def test_concurrent_starts_in_two_processes(self):
+        context = multiprocessing.get_context('fork')
+        barrier = context.Barrier(2)
+        queue = context.Queue()
+        processes = [
+            context.Process(target=_start_campaign_in_child, args=(self.evento, barrier, queue))
+            for _ in range(2)
+        ]
+        for process in processes:
+            process.start()
+        started = [queue.get(timeout=60) for _ in processes]
+        for process in processes:
+            process.join(timeout=60)
+            self.assertEqual(process.exitcode, 0)
+
+        self.assertEqual(started.count(True), 1)
+        entregas = self.storage.list_all('entregas')
+        self.assertEqual(len(entregas), self.APADRINAMIENTOS)
+        self.assertEqual(len({e['id_apadrinamiento'] for e in entregas}), self.APADRINAMIENTOS)
+
+    def test_generar_entregas_rejects_invalid_body(self):
+        url = '/api/eventos/EV001/generar-entregas/'
+        invalid = (['chunk_size', 5], {'chunk_size': 'abc'}, {'workers': 0}, {'workers': 2.5},
+                   {'workers': True}, {'descripcion_regalo': ['x']})
+        for body in invalid:
+            with self.subTest(body=body):
+                response = self.client.post(url, body, format='json')
+                self.assertEqual(response.status_code, 400)
+        self.assertIsNone(get_job_store().load(self.job_id))
+
+    def test_generar_entregas_clamps_options(self):
+        url = '/api/eventos/EV001/generar-entregas/'
+        with mock.patch.object(campaigns, 'start_campaign', return_value=({}, True)) as start:
+            response = self.client.post(url, {'chunk_size': '50', 'workers': 10 ** 6}, format='json')
+
+        self.assertEqual(response.status_code, 202)
+        options = start.call_args.args[1]
+        self.assertEqual(options, {'chunk_size': 50, 'workers': settings.CAMPAIGN_MAX_WORKERS})
+        self.assertEqual(campaigns.EntregasCampaign(self.evento, {'workers': 10 ** 6}).workers,
+                         settings.CAMPAIGN_MAX_WORKERS)
+
+
+class StorageStatusTests(IsolatedStorageMixin, SimpleTestCase):
+    """Estado del almacenamiento (api/storage_views.py)"""
+
+    ENDPOINTS = ('/api/storage/cache/', '/api/storage/snapshot/', '/api/storage/nfs/')
+
+    def test_file_features_report_disabled_on_sqlite(self):
+        sqlite = SQLiteStorageManager(db_path=os.path.join(self.directory, 'smilelink.sqlite3'))
+        with mock.patch.dict(os.environ, {'STORAGE_BACKEND': 'sqlite'}), \
+                mock.patch.object(storage.sqlite_backend, '_sqlite_storage_manager', sqlite), \
+                mock.patch.object(storage.file_manager, '_storage_manager', None), \
+                mock.patch.object(storage.file_manager, 'get_storage_manager') as get_file_storage:
+            for url in self.ENDPOINTS:
+                with self.subTest(url=url):
+                    response = self.client.get(url)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(response.data, {'enabled': False})
+        get_file_storage.assert_not_called()
+
+    def test_cache_status_uses_the_active_file_backend(self):
+        blob_cache = mock.Mock()
+        blob_cache.stats.return_value = {'hits': 3}
+        with mock.patch.object(self.storage, 'blob_cache', blob_cache):
+            response = self.client.get('/api/storage/cache/')
+        self.assertEqual(response.data, {'enabled': True, 'hits': 3})
+
+
+class AuthTests(IsolatedStorageMixin, SimpleTestCase):
+    """Registro, login y tokens JWT (api/auth_views.py, api/authentication.py)"""
+
+    def setUp(self):
+        super().setUp()
+        response = self.client.post('/api/auth/register/', {
+            'nombre': 'Juan Damián Ortega',
+            'email': 'juan@smilelink.org',
+            'password': 'password123',
+            'direccion': 'Av. Universidad 100',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.padrino = response.data['padrino']
+
+    def _login(self):
+        response = self.client.post('/api/auth/login/', {
+            'email': 'juan@smilelink.org', 'password': 'password123',
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_padrino_ids_come_from_the_allocator(self):
+        self.assertEqual(self.padrino['id_padrino'], 'P001')
+        # Un ID borrado no se reutiliza
+        self.storage.delete('padrinos', 'P001')
+        response = self.client.post('/api/auth/register/', {
+            'nombre': 'Ana López', 'email': 'ana@smilelink.org',
+            'password': 'password123', 'direccion': 'Calle 5',
+        }, format='json')
+        self.assertEqual(response.data['padrino']['id_padrino'], 'P002')
+
+    def test_login_returns_tokens_for_me(self):
+        tokens = self._login()
+        self.assertEqual(tokens['token_type'], 'Bearer')
+        self.assertNotIn('password_hash', tokens['padrino'])
+
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+        with mock.patch.object(self.storage, 'load', side_effect=AssertionError('storage read')):
+            response = self.client.get('/api/auth/me/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['id_padrino'], 'P001')
+        self.assertEqual(response.data['email'], 'juan@smilelink.org')
+
+    def test_wrong_password_and_unknown_email(self):
+        response = self.client.post('/api/auth/login/', {
+            'email': 'juan@smilelink.org', 'password': 'otra-clave',
+        }, format='json')
+        self.assertEqual(response.status_code, 401)
+        response = self.client.post('/api/auth/login/', {
+            'email': 'nadie@smilelink.org', 'password': 'password123',
+        }, format='json')
+        self.assertEqual(response.status_code, 404)
+
+    def test_refresh_renews_the_profile(self):
+        tokens = self._login()
+        self.storage.save('padrinos', 'P001', {
+            **self.storage.load('padrinos', 'P001'), 'telefono': '449-000-0000',
+        })
+
+        response = self.client.post('/api/auth/token/refresh/', {'refresh': tokens['refresh']}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        self.assertEqual(self.client.get('/api/auth/me/').data['telefono'], '449-000-0000')
+
+    def test_refresh_rejects_invalid_bodies_and_tokens(self):
+        tokens = self._login()
+        for body in ([tokens['refresh']], 'texto', {}):
+            with self.subTest(body=body):
+                response = self.client.post('/api/auth/token/refresh/', body, format='json')
+                self.assertEqual(response.status_code, 400)
+        # Un access token no sirve como refresh
+        response = self.client.post('/api/auth/token/refresh/', {'refresh': tokens['access']}, format='json')
+        self.assertEqual(response.status_code, 401)
+
+    def test_expired_and_tampered_tokens_are_rejected(self):
+        padrino = self.storage.load('padrinos', 'P001')
+        issued_at = time.time() - 31 * 86400
+        with mock.patch('api.authentication.time.time', return_value=issued_at):
+            expired = issue_tokens(padrino)
+        header, payload, signature = self._login()['access'].split('.')
+        tampered = '.'.join((header, payload, signature[::-1]))
+
+        for token in (expired['access'], tampered, 'no-es-un-jwt'):
+            with self.subTest(token=token[:20]):
+                self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+                self.assertEqual(self.client.get('/api/auth/me/').status_code, 401)
+        self.client.credentials()
+        response = self.client.post('/api/auth/token/refresh/', {'refresh': expired['refresh']}, format='json')
+        self.assertEqual(response.status_code, 401)
+
+
+class TracingTests(IsolatedStorageMixin, SimpleTestCase):
+    """X-Trace-Id y propagación de la Trace por middleware y contextvar (storage/tracing.py)"""
+
+    def setUp(self):
+        super().setUp()
+        # Umbral 0: todo request trazado queda en el log y se puede inspeccionar
+        self.tracer = Tracer(log_path=os.path.join(self.directory, 'slow.jsonl'), slow_ms=0, sample_rate=1)
+        self.tracer.enabled = True
+        patcher = mock.patch.object(storage.tracing, '_tracer', self.tracer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _root_of(self, spans, index):
+        while spans[index]['parent'] is not None:
+            index = spans[index]['parent']
+        return index
+
+    def test_response_carries_the_trace_id_of_the_logged_waterfall(self):
+        response = self.client.get('/api/ninos/')
+
+        trace_id = response['X-Trace-Id']
+        self.assertRegex(trace_id, TRACE_ID_PATTERN)
+        self.assertIsNone(get_current_trace())
+        record = self.tracer.find(trace_id)
+        self.assertEqual((record['status'], record['route']), (200, response.wsgi_request.resolver_match.view_name))
+        spans = record['spans']
+        self.assertEqual((spans[0]['name'], spans[0]['parent']), ('request', None))
+        storage_spans = [i for i, s in enumerate(spans) if s['name'].startswith('storage.')]
+        self.assertTrue(storage_spans)
+        self.assertTrue(all(self._root_of(spans, i) == 0 for i in storage_spans))
+
+    def test_incoming_trace_id_is_kept_only_for_trusted_observers(self):
+        incoming = 'ab' * 16
+        with override_settings(OBSERVABILITY_TOKEN='', OBSERVABILITY_ALLOWED_IPS=['10.0.0.0/8']):
+            untrusted = self.client.get('/api/ninos/', HTTP_X_TRACE_ID=incoming)
+            trusted = self.client.get('/api/ninos/', HTTP_X_TRACE_ID=incoming, REMOTE_ADDR='10.1.2.3')
+            invalid = self.client.get('/api/ninos/', HTTP_X_TRACE_ID='not-hex', REMOTE_ADDR='10.1.2.3')
+            found = self.client.get(f'/api/traces/{incoming}/', REMOTE_ADDR='10.1.2.3')
+
+        self.assertNotEqual(untrusted['X-Trace-Id'], incoming)
+        self.assertEqual(trusted['X-Trace-Id'], incoming)
+        self.assertRegex(invalid['X-Trace-Id'], TRACE_ID_PATTERN)
+        self.assertEqual(found.status_code, 200)
+        self.assertEqual(found.json()['trace_id'], incoming)
+
+    def test_parallel_batch_threads_join_the_request_trace(self):
+        response = self.client.post('/api/batch/', {
+            'parallel': True,
+            'requests': [{'method': 'GET', 'path': '/api/ninos/'}, {'method': 'GET', 'path': '/api/padrinos/'}],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        spans = self.tracer.find(response['X-Trace-Id'])['spans']
+        entity_types = {s['attrs']['entity_type'] for s in spans if s['name'] == 'storage.list_all'}
+        self.assertEqual(entity_types, {'ninos', 'padrinos'})
+        self.assertTrue(all(self._root_of(spans, i) == 0 for i in range(len(spans))))
+
+    def test_failed_request_still_resets_the_context(self):
+        def broken_view(request):
+            with span('storage.load'):
+                raise RuntimeError('boom')
+
+        middleware = TracingMiddleware(broken_view)
+        with self.assertRaises(RuntimeError):
+            middleware(RequestFactory().get('/api/ninos/'))
+
+        self.assertIsNone(get_current_trace())
+        with open(self.tracer.log_path, encoding='utf-8') as f:
+            record = json.loads(f.readline())
+        self.assertEqual(record['status'], 500)
+        self.assertEqual(record['spans'][1]['attrs'], {'error': 'RuntimeError'})
+        # Sin Trace activa, span() no registra nada
+        with span('storage.load'):
+            pass
+        self.assertIsNone(get_current_trace())
+
+
+class LoadClientTests(SimpleTestCase):
+    """Reintentos del cliente de loadtest: sólo conexiones keep-alive vencidas, nunca un POST"""
+
+    def setUp(self):
+        self.client = LoadClient('http://127.0.0.1:8000/api', timeout=5)
+        self.fresh = []
+
+        def connect():
+            conn = mock.Mock()
+            conn.getresponse.return_value.status = 200
+            conn.getresponse.return_value.read.return_value = b'{}'
+            self.fresh.append(conn)
+            self.client.conn = conn
+
+        self.client._connect = connect
+
+    def _stale(self, error):
+        self.client.conn = mock.Mock()
+        self.client.conn.request.side_effect = error
+
+    def test_get_on_a_stale_connection_is_retried(self):
+        for error in (BrokenPipeError(), http.client.RemoteDisconnected('closed')):
+            with self.subTest(error=type(error).__name__):
+                self._stale(error)
+                self.assertEqual(self.client.request('GET', '/ninos/'), (200, b'{}'))
+        self.assertEqual(len(self.fresh), 2)
+
+    def test_post_is_never_retried(self):
+        self._stale(BrokenPipeError())
+        with self.assertRaises(BrokenPipeError):
+            self.client.request('POST', '/apadrinamientos/', {'id_nino': 'N001'})
+        self.assertEqual(self.fresh, [])
+
+    def test_other_errors_are_not_retried(self):
+        self._stale(TimeoutError())
+        with self.assertRaises(TimeoutError):
+            self.client.request('GET', '/ninos/')
+
+        # Una conexión recién abierta que falla no es una keep-alive vencida
+        self.client.conn = None
+        self.client._connect = lambda: self._stale(http.client.RemoteDisconnected('closed'))
+        with self.assertRaises(http.client.RemoteDisconnected):
+            self.client.request('GET', '/ninos/')
+        self.assertEqual(self.fresh, [])
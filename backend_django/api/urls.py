@@ -8,7 +8,10 @@ from .views import (
     EntregasViewSet, SolicitudesViewSet, PuntosEntregaViewSet,
     EventosViewSet, AdministradoresViewSet, DashboardViewSet
 )
-from .auth_views import register, login, logout, get_current_user
+from .auth_views import register, login, logout, refresh_token, get_current_user
+from .batch_views import batch
+from .storage_views import replication_status, cache_status, snapshot_status, nfs_health
+from .metrics_views import metrics, trace_detail
 
 router = DefaultRouter()
 router.register(r'ninos', NinosViewSet, basename='nino')
@@ -27,5 +30,16 @@ urlpatterns = [
     path('auth/register/', register, name='auth-register'),
     path('auth/login/', login, name='auth-login'),
     path('auth/logout/', logout, name='auth-logout'),
+    path('auth/token/refresh/', refresh_token, name='auth-token-refresh'),
     path('auth/me/', get_current_user, name='auth-me'),
+    # Batch endpoint
+    path('batch/', batch, name='batch'),
+    # Storage status
+    path('storage/replication/', replication_status, name='storage-replication'),
+    path('storage/cache/', cache_status, name='storage-cache'),
+    path('storage/snapshot/', snapshot_status, name='storage-snapshot'),
+    path('storage/nfs/', nfs_health, name='storage-nfs'),
+    # Prometheus
+    path('metrics/', metrics, name='metrics'),
+    path('traces/<str:trace_id>/', trace_detail, name='trace-detail'),
 ]
@@ -2,10 +2,13 @@
 SmileLink API - Views
 ViewSets para todas las entidades del sistema
 """
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from storage import get_storage_manager, get_sync_manager
+from storage import get_storage_backend, get_sync_manager, get_archive_store
+from . import campaigns
 from .serializers import (
     NinoSerializer, PadrinoSerializer, ApadrinamientoSerializer,
     EntregaSerializer, SolicitudRegaloSerializer, PuntoEntregaSerializer,
@@ -13,8 +16,91 @@ from .serializers import (
 )
 
 
-storage = get_storage_manager()
-sync = get_sync_manager()
+# Se crean en el primer uso: importar las vistas (arranque del worker, comandos) no toca storage ni HDFS
+storage = SimpleLazyObject(get_storage_backend)
+sync = SimpleLazyObject(get_sync_manager)
+archive = SimpleLazyObject(get_archive_store)
+
+
+def _json_ready(data):
+    """Convert date objects from validated_data to ISO strings"""
+    return {
+        key: value.isoformat() if hasattr(value, 'isoformat') else value
+        for key, value in data.items()
+    }
+
+
+def _positive_int(value):
+    """Entero > 0 desde JSON (número o texto), o None si no lo es"""
+    if isinstance(value, bool):
+        return None
+    try:
+        number = int(str(value).strip())
+    except ValueError:
+        return None
+    return number if number > 0 else None
+
+
+def _include_archived(request):
+    """?include_archived=1 agrega los registros del archivo frío al listado"""
+    return request.query_params.get('include_archived', '').lower() in ('1', 'true', 'yes')
+
+
+def bulk_create(request, entity_type, serializer_class, prefix, id_field):
+    """
+    Validate and create many entities of one type in a single storage commit
+    
+    Body: a list of objects, or {"items": [...]}
+    Invalid rows are reported by position and do not block the valid ones.
+    """
+    items = request.data.get('items') if isinstance(request.data, dict) else request.data
+    
+    if not isinstance(items, list) or not items:
+        return Response({'error': 'Se requiere una lista de elementos'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(items) > settings.BULK_MAX_ITEMS:
+        return Response(
+            {'error': f'Máximo {settings.BULK_MAX_ITEMS} elementos por solicitud'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    valid_rows = []
+    valid_positions = []
+    errors = []
+    for position, item in enumerate(items):
+        serializer = serializer_class(data=item)
+        if serializer.is_valid():
+            valid_rows.append(_json_ready(serializer.validated_data))
+            valid_positions.append(position)
+        else:
+            errors.append({'index': position, 'errors': serializer.errors})
+    
+    created = []
+    if valid_rows:
+        new_ids = storage.allocate_ids(entity_type, prefix, len(valid_rows))
+        records = {}
+        for new_id, data in zip(new_ids, valid_rows):
+            data[id_field] = new_id
+            records[new_id] = data
+        
+        saved_ids = storage.save_many(entity_type, records)
+        sync.sync_entities(entity_type, saved_ids)
+        created = [records[saved_id] for saved_id in saved_ids]
+        
+        saved = set(saved_ids)
+        errors.extend(
+            {'index': position, 'errors': {'non_field_errors': ['No se pudo guardar el registro']}}
+            for position, new_id in zip(valid_positions, new_ids)
+            if new_id not in saved
+        )
+        errors.sort(key=lambda error: error['index'])
+    
+    if not created:
+        response_status = status.HTTP_400_BAD_REQUEST
+    elif errors:
+        response_status = status.HTTP_207_MULTI_STATUS
+    else:
+        response_status = status.HTTP_201_CREATED
+    return Response({'created': created, 'errors': errors}, status=response_status)
 
 
 class NinosViewSet(viewsets.ViewSet):
@@ -46,6 +132,11 @@ class NinosViewSet(viewsets.ViewSet):
             return Response(data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """POST /api/ninos/bulk/"""
+        return bulk_create(request, 'ninos', NinoSerializer, 'N', 'id_nino')
+    
     def update(self, request, pk=None):
         """PUT /api/ninos/{id}/"""
         nino = storage.load('ninos', pk)
@@ -77,6 +168,7 @@ class NinosViewSet(viewsets.ViewSet):
     def destroy(self, request, pk=None):
         """DELETE /api/ninos/{id}/"""
         if storage.delete('ninos', pk):
+            sync.sync_delete('ninos', pk)
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response({'error': 'Niño no encontrado'}, status=status.HTTP_404_NOT_FOUND)
 
@@ -119,6 +211,7 @@ class PadrinosViewSet(viewsets.ViewSet):
     
     def destroy(self, request, pk=None):
         if storage.delete('padrinos', pk):
+            sync.sync_delete('padrinos', pk)
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response({'error': 'Padrino no encontrado'}, status=status.HTTP_404_NOT_FOUND)
 
@@ -128,11 +221,13 @@ class ApadrinamientosViewSet(viewsets.ViewSet):
     
     def list(self, request):
         apadrinamientos = storage.list_all('apadrinamientos')
+        if _include_archived(request):
+            apadrinamientos += archive.list_all('apadrinamientos', exclude=storage.list_ids('apadrinamientos'))
         serializer = ApadrinamientoSerializer(apadrinamientos, many=True)
         return Response(serializer.data)
     
     def retrieve(self, request, pk=None):
-        apadrinamiento = storage.load('apadrinamientos', pk)
+        apadrinamiento = storage.load('apadrinamientos', pk) or archive.load('apadrinamientos', pk)
         if not apadrinamiento:
             return Response({'error': 'Apadrinamiento no encontrado'}, status=status.HTTP_404_NOT_FOUND)
         serializer = ApadrinamientoSerializer(apadrinamiento)
@@ -171,34 +266,33 @@ class ApadrinamientosViewSet(viewsets.ViewSet):
         
         print(f"[DEBUG] Final data to save: {data}")
         
-        # Save apadrinamiento
-        save_result = storage.save('apadrinamientos', new_id, data)
-        print(f"[DEBUG] Save result: {save_result}")
-        sync.sync_entity('apadrinamientos', new_id)
+        # Apadrinamiento, niño y padrino se confirman juntos (todo-o-nada)
+        with storage.write_batch() as batch:
+            batch.save('apadrinamientos', new_id, data)
+            
+            # Update child status to "Apadrinado"
+            nino = storage.load('ninos', data['id_nino'])
+            if nino:
+                print(f"[DEBUG] Updating child {data['id_nino']} status")
+                nino['estado_apadrinamiento'] = 'Apadrinado'
+                nino['id_padrino_actual'] = data['id_padrino']
+                batch.save('ninos', data['id_nino'], nino)
+            else:
+                print(f"[WARNING] Child {data['id_nino']} not found")
+            
+            # Update padrino's history
+            padrino = storage.load('padrinos', data['id_padrino'])
+            if padrino:
+                print(f"[DEBUG] Updating padrino {data['id_padrino']} history")
+                if 'historial_apadrinamiento_ids' not in padrino:
+                    padrino['historial_apadrinamiento_ids'] = []
+                if new_id not in padrino['historial_apadrinamiento_ids']:
+                    padrino['historial_apadrinamiento_ids'].append(new_id)
+                batch.save('padrinos', data['id_padrino'], padrino)
+            else:
+                print(f"[WARNING] Padrino {data['id_padrino']} not found")
         
-        # Update child status to "Apadrinado"
-        nino = storage.load('ninos', data['id_nino'])
-        if nino:
-            print(f"[DEBUG] Updating child {data['id_nino']} status")
-            nino['estado_apadrinamiento'] = 'Apadrinado'
-            nino['id_padrino_actual'] = data['id_padrino']
-            storage.update('ninos', data['id_nino'], nino)
-            sync.sync_entity('ninos', data['id_nino'])
-        else:
-            print(f"[WARNING] Child {data['id_nino']} not found")
-        
-        # Update padrino's history
-        padrino = storage.load('padrinos', data['id_padrino'])
-        if padrino:
-            print(f"[DEBUG] Updating padrino {data['id_padrino']} history")
-            if 'historial_apadrinamiento_ids' not in padrino:
-                padrino['historial_apadrinamiento_ids'] = []
-            if new_id not in padrino['historial_apadrinamiento_ids']:
-                padrino['historial_apadrinamiento_ids'].append(new_id)
-            storage.update('padrinos', data['id_padrino'], padrino)
-            sync.sync_entity('padrinos', data['id_padrino'])
-        else:
-            print(f"[WARNING] Padrino {data['id_padrino']} not found")
+        sync.sync_changes(batch.changes)
         
         print(f"[SUCCESS] Apadrinamiento {new_id} created successfully")
         return Response(data, status=status.HTTP_201_CREATED)
@@ -215,6 +309,7 @@ class ApadrinamientosViewSet(viewsets.ViewSet):
     
     def destroy(self, request, pk=None):
         if storage.delete('apadrinamientos', pk):
+            sync.sync_delete('apadrinamientos', pk)
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response({'error': 'Apadrinamiento no encontrado'}, status=status.HTTP_404_NOT_FOUND)
 
@@ -224,11 +319,13 @@ class EntregasViewSet(viewsets.ViewSet):
     
     def list(self, request):
         entregas = storage.list_all('entregas')
+        if _include_archived(request):
+            entregas += archive.list_all('entregas', exclude=storage.list_ids('entregas'))
         serializer = EntregaSerializer(entregas, many=True)
         return Response(serializer.data)
     
     def retrieve(self, request, pk=None):
-        entrega = storage.load('entregas', pk)
+        entrega = storage.load('entregas', pk) or archive.load('entregas', pk)
         if not entrega:
             return Response({'error': 'Entrega no encontrada'}, status=status.HTTP_404_NOT_FOUND)
         serializer = EntregaSerializer(entrega)
@@ -238,13 +335,18 @@ class EntregasViewSet(viewsets.ViewSet):
         serializer = EntregaSerializer(data=request.data)
         if serializer.is_valid():
             new_id = storage.get_next_id('entregas', 'E')
-            data = serializer.validated_data
+            data = _json_ready(serializer.validated_data)
             data['id_entrega'] = new_id
             storage.save('entregas', new_id, data)
             sync.sync_entity('entregas', new_id)
             return Response(data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """POST /api/entregas/bulk/"""
+        return bulk_create(request, 'entregas', EntregaSerializer, 'E', 'id_entrega')
+    
     def partial_update(self, request, pk=None):
         entrega = storage.load('entregas', pk)
         if not entrega:
@@ -257,6 +359,7 @@ class EntregasViewSet(viewsets.ViewSet):
     
     def destroy(self, request, pk=None):
         if storage.delete('entregas', pk):
+            sync.sync_delete('entregas', pk)
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response({'error': 'Entrega no encontrada'}, status=status.HTTP_404_NOT_FOUND)
 
@@ -287,6 +390,11 @@ class SolicitudesViewSet(viewsets.ViewSet):
             return Response(data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """POST /api/solicitudes/bulk/"""
+        return bulk_create(request, 'solicitudes', SolicitudRegaloSerializer, 'SR', 'id_solicitud')
+    
     def partial_update(self, request, pk=None):
         solicitud = storage.load('solicitudes', pk)
         if not solicitud:
@@ -299,6 +407,7 @@ class SolicitudesViewSet(viewsets.ViewSet):
     
     def destroy(self, request, pk=None):
         if storage.delete('solicitudes', pk):
+            sync.sync_delete('solicitudes', pk)
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response({'error': 'Solicitud no encontrada'}, status=status.HTTP_404_NOT_FOUND)
 
@@ -341,6 +450,7 @@ class PuntosEntregaViewSet(viewsets.ViewSet):
     
     def destroy(self, request, pk=None):
         if storage.delete('puntos_entrega', pk):
+            sync.sync_delete('puntos_entrega', pk)
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response({'error': 'Punto de entrega no encontrado'}, status=status.HTTP_404_NOT_FOUND)
 
@@ -364,13 +474,50 @@ class EventosViewSet(viewsets.ViewSet):
         serializer = EventoSerializer(data=request.data)
         if serializer.is_valid():
             new_id = storage.get_next_id('eventos', 'EV')
-            data = serializer.validated_data
+            data = _json_ready(serializer.validated_data)
             data['id_evento'] = new_id
             storage.save('eventos', new_id, data)
             sync.sync_entity('eventos', new_id)
             return Response(data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
+    @action(detail=True, methods=['get', 'post'], url_path='generar-entregas')
+    def generar_entregas(self, request, pk=None):
+        """
+        POST /api/eventos/{id}/generar-entregas/ - Lanza o reanuda el job
+        GET  /api/eventos/{id}/generar-entregas/ - Progreso del job
+        """
+        evento = storage.load('eventos', pk)
+        if not evento:
+            return Response({'error': 'Evento no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+        
+        if request.method == 'GET':
+            job_status = campaigns.get_campaign_status(pk)
+            if job_status is None:
+                return Response({'error': 'No hay generación de entregas para este evento'}, status=status.HTTP_404_NOT_FOUND)
+            return Response(job_status)
+        
+        if not isinstance(request.data, dict):
+            return Response({'error': 'El body debe ser un objeto'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        options = {}
+        descripcion_regalo = request.data.get('descripcion_regalo')
+        if descripcion_regalo is not None:
+            if not isinstance(descripcion_regalo, str):
+                return Response({'error': 'descripcion_regalo debe ser texto'}, status=status.HTTP_400_BAD_REQUEST)
+            options['descripcion_regalo'] = descripcion_regalo
+        limits = {'chunk_size': settings.CAMPAIGN_MAX_CHUNK_SIZE, 'workers': settings.CAMPAIGN_MAX_WORKERS}
+        for key, maximum in limits.items():
+            if request.data.get(key) is None:
+                continue
+            value = _positive_int(request.data[key])
+            if value is None:
+                return Response({'error': f'{key} debe ser un entero positivo'}, status=status.HTTP_400_BAD_REQUEST)
+            options[key] = min(value, maximum)
+        
+        job_status, started = campaigns.start_campaign(evento, options)
+        return Response(job_status, status=status.HTTP_202_ACCEPTED if started else status.HTTP_200_OK)
+    
     def partial_update(self, request, pk=None):
         evento = storage.load('eventos', pk)
         if not evento:
@@ -383,6 +530,7 @@ class EventosViewSet(viewsets.ViewSet):
     
     def destroy(self, request, pk=None):
         if storage.delete('eventos', pk):
+            sync.sync_delete('eventos', pk)
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response({'error': 'Evento no encontrado'}, status=status.HTTP_404_NOT_FOUND)
 
@@ -425,6 +573,7 @@ class AdministradoresViewSet(viewsets.ViewSet):
     
     def destroy(self, request, pk=None):
         if storage.delete('administradores', pk):
+            sync.sync_delete('administradores', pk)
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response({'error': 'Administrador no encontrado'}, status=status.HTTP_404_NOT_FOUND)
 
@@ -435,23 +584,25 @@ class DashboardViewSet(viewsets.ViewSet):
     @action(detail=False, methods=['get'])
     def kpis(self, request):
         """GET /api/dashboard/kpis/"""
-        ninos = storage.list_all('ninos')
-        padrinos = storage.list_all('padrinos')
-        apadrinamientos = storage.list_all('apadrinamientos')
-        entregas = storage.list_all('entregas')
-        
-        kpis = {
-            'total_ninos': len(ninos),
-            'ninos_disponibles': len([n for n in ninos if n.get('estado_apadrinamiento') == 'Disponible']),
-            'ninos_apadrinados': len([n for n in ninos if n.get('estado_apadrinamiento') == 'Apadrinado']),
-            'total_padrinos': len(padrinos),
-            'padrinos_activos': len([p for p in padrinos if p.get('historial_apadrinamiento_ids')]),
-            'total_apadrinamientos': len(apadrinamientos),
-            'apadrinamientos_activos': len([a for a in apadrinamientos if a.get('estado_apadrinamiento_registro') == 'Activo']),
-            'total_entregas': len(entregas),
-            'entregas_completadas': len([e for e in entregas if e.get('estado_entrega') == 'Entregado']),
-            'entregas_pendientes': len([e for e in entregas if e.get('estado_entrega') == 'Pendiente']),
-        }
+        # count() lo resuelve el motor: el de SQLite sin desencriptar entidades
+        with storage.read_cache():
+            # Los registros archivados cuentan vía agregados, sin desencriptarlos
+            apadrinamientos_archivados = archive.aggregates('apadrinamientos')
+            entregas_archivadas = archive.aggregates('entregas')
+            padrinos = storage.list_all('padrinos')
+            kpis = {
+                'total_ninos': storage.count('ninos'),
+                'ninos_disponibles': storage.count('ninos', estado_apadrinamiento='Disponible'),
+                'ninos_apadrinados': storage.count('ninos', estado_apadrinamiento='Apadrinado'),
+                'total_padrinos': len(padrinos),
+                'padrinos_activos': len([p for p in padrinos if p.get('historial_apadrinamiento_ids')]),
+                'total_apadrinamientos': storage.count('apadrinamientos') + apadrinamientos_archivados['count'],
+                'apadrinamientos_activos': storage.count('apadrinamientos', estado_apadrinamiento_registro='Activo'),
+                'total_entregas': storage.count('entregas') + entregas_archivadas['count'],
+                'entregas_completadas': storage.count('entregas', estado_entrega='Entregado')
+                    + entregas_archivadas['by_estado'].get('Entregado', 0),
+                'entregas_pendientes': storage.count('entregas', estado_entrega='Pendiente'),
+            }
         
         serializer = DashboardKPIsSerializer(kpis)
         return Response(serializer.data)
@@ -0,0 +1,29 @@
+"""
+Gunicorn config for SmileLink
+
+    gunicorn -c gunicorn.conf.py smilelink.wsgi:application
+
+Con SNAPSHOT_ENABLED=True el master construye el snapshot compartido antes
+de crear los workers, así ninguno arranca desencriptando las colecciones.
+"""
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+BASE_DIR = Path(__file__).resolve().parent
+load_dotenv(BASE_DIR / '.env')
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('GUNICORN_WORKERS', '4'))
+
+
+def on_starting(server):
+    """Warm-up del snapshot en un proceso aparte: el master no hereda hilos ni locks al hacer fork"""
+    if os.getenv('SNAPSHOT_ENABLED', 'False').lower() != 'true':
+        return
+    result = subprocess.run([sys.executable, str(BASE_DIR / 'manage.py'), 'warm_snapshot'], cwd=BASE_DIR)
+    if result.returncode != 0:
+        server.log.warning('Snapshot warm-up failed; workers will build it on first read')
@@ -48,6 +48,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.TracingMiddleware',  # Primero: la trace cubre todo el request
+    'api.middleware.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',  # CORS debe ir antes de CommonMiddleware
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -56,6 +58,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.middleware.MetricsMiddleware',
 ]
 
 ROOT_URLCONF = 'smilelink.urls'
@@ -136,6 +139,9 @@ REST_FRAMEWORK = {
     'DEFAULT_PARSER_CLASSES': [
         'rest_framework.parsers.JSONParser',
     ],
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'api.authentication.JWTAuthentication',  # Sólo verifica la firma, sin leer storage
+    ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',  # Cambiar en producción
     ],
@@ -143,9 +149,33 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 100,
     'DATETIME_FORMAT': '%Y-%m-%d %H:%M:%S',
     'DATE_FORMAT': '%Y-%m-%d',
+    'EXCEPTION_HANDLER': 'api.exceptions.exception_handler',
 }
 
 
+# ==============================================================================
+# BATCH API SETTINGS
+# ==============================================================================
+
+BATCH_MAX_REQUESTS = int(os.getenv('BATCH_MAX_REQUESTS', '20'))
+BATCH_MAX_WORKERS = int(os.getenv('BATCH_MAX_WORKERS', '4'))
+
+# Bulk create endpoints (/api/<entity>/bulk/)
+BULK_MAX_ITEMS = int(os.getenv('BULK_MAX_ITEMS', '1000'))
+
+
+# ==============================================================================
+# CAMPAIGN SETTINGS
+# ==============================================================================
+
+# Generación de entregas por evento (/api/eventos/{id}/generar-entregas/)
+CAMPAIGN_CHUNK_SIZE = int(os.getenv('CAMPAIGN_CHUNK_SIZE', '500'))
+CAMPAIGN_WORKERS = int(os.getenv('CAMPAIGN_WORKERS', '4'))
+# Topes para chunk_size/workers pedidos en el body o por comando
+CAMPAIGN_MAX_CHUNK_SIZE = int(os.getenv('CAMPAIGN_MAX_CHUNK_SIZE', '5000'))
+CAMPAIGN_MAX_WORKERS = int(os.getenv('CAMPAIGN_MAX_WORKERS', '16'))
+
+
 # ==============================================================================
 # CORS SETTINGS
 # ==============================================================================
@@ -190,7 +220,8 @@ CORS_ALLOW_HEADERS = [
 
 JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY', SECRET_KEY)
 JWT_ALGORITHM = os.getenv('JWT_ALGORITHM', 'HS256')
-JWT_EXPIRATION_HOURS = int(os.getenv('JWT_EXPIRATION_HOURS', '24'))
+JWT_EXPIRATION_HOURS = int(os.getenv('JWT_EXPIRATION_HOURS', '24'))  # Access token
+JWT_REFRESH_EXPIRATION_DAYS = int(os.getenv('JWT_REFRESH_EXPIRATION_DAYS', '30'))
 
 
 # ==============================================================================
@@ -214,18 +245,108 @@ NFS_MOUNT_POINT = os.getenv('NFS_MOUNT_POINT', '/mnt/nfs')
 NFS_SHARE_PATH = os.getenv('NFS_SHARE_PATH', '/eData')
 NFS_DATA_PATH = os.getenv('NFS_DATA_PATH', '/mnt/nfs/smilelink/data')
 
+# Cache local del ciphertext de NFS (read-through, write-through, LRU)
+NFS_CACHE_ENABLED = os.getenv('NFS_CACHE_ENABLED', 'True').lower() == 'true'
+NFS_CACHE_PATH = os.getenv('NFS_CACHE_PATH', str(BASE_DIR / 'nfs_cache'))
+NFS_CACHE_MAX_BYTES = int(os.getenv('NFS_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+NFS_CACHE_REVALIDATE_SECONDS = float(os.getenv('NFS_CACHE_REVALIDATE_SECONDS', '0'))
+
+# Monitor de salud de NFS (modo degradado sólo lectura)
+NFS_HEALTH_ENABLED = os.getenv('NFS_HEALTH_ENABLED', 'True').lower() == 'true'
+NFS_HEALTH_INTERVAL_SECONDS = float(os.getenv('NFS_HEALTH_INTERVAL_SECONDS', '5'))
+NFS_PROBE_TIMEOUT_SECONDS = float(os.getenv('NFS_PROBE_TIMEOUT_SECONDS', '2'))
+NFS_HEALTH_FAILURE_THRESHOLD = int(os.getenv('NFS_HEALTH_FAILURE_THRESHOLD', '2'))
+NFS_HEALTH_SLOW_MS = float(os.getenv('NFS_HEALTH_SLOW_MS', '500'))
+
 # HDFS Configuration
 HDFS_NAMENODE_URL = os.getenv('HDFS_NAMENODE_URL', 'http://192.168.1.73:9870')
 HDFS_USER = os.getenv('HDFS_USER', 'hadoop')
 HDFS_REPLICATION_PATH = os.getenv('HDFS_REPLICATION_PATH', '/smilelink/data')
 HDFS_REPLICATION_FACTOR = int(os.getenv('HDFS_REPLICATION_FACTOR', '2'))
 
+# Cola de replicación (fuera del request)
+USE_HDFS_QUEUE = os.getenv('USE_HDFS_QUEUE', 'True').lower() == 'true'
+HDFS_QUEUE_PATH = os.getenv('HDFS_QUEUE_PATH', str(BASE_DIR / 'replication_queue'))
+HDFS_QUEUE_WORKERS = int(os.getenv('HDFS_QUEUE_WORKERS', '2'))
+HDFS_RETRY_BASE_SECONDS = float(os.getenv('HDFS_RETRY_BASE_SECONDS', '2'))
+HDFS_RETRY_MAX_SECONDS = float(os.getenv('HDFS_RETRY_MAX_SECONDS', '300'))
+
+# 'files' (un archivo HDFS por entidad) o 'segments' (empaquetado)
+HDFS_REPLICATION_MODE = os.getenv('HDFS_REPLICATION_MODE', 'files')
+HDFS_SEGMENT_MAX_FILES = int(os.getenv('HDFS_SEGMENT_MAX_FILES', '5000'))
+HDFS_SEGMENT_MAX_BYTES = int(os.getenv('HDFS_SEGMENT_MAX_BYTES', str(64 * 1024 * 1024)))
+HDFS_SEGMENT_LINGER_SECONDS = float(os.getenv('HDFS_SEGMENT_LINGER_SECONDS', '5'))
+# Fusión periódica de corridas de segmentos chicos en HDFS (0 la desactiva)
+HDFS_SEGMENT_MERGE_INTERVAL_SECONDS = float(os.getenv('HDFS_SEGMENT_MERGE_INTERVAL_SECONDS', '300'))
+HDFS_SEGMENT_MERGE_MIN_SEGMENTS = int(os.getenv('HDFS_SEGMENT_MERGE_MIN_SEGMENTS', '8'))
+HDFS_SEGMENT_MERGE_SMALL_BYTES = int(os.getenv('HDFS_SEGMENT_MERGE_SMALL_BYTES', str(HDFS_SEGMENT_MAX_BYTES // 4)))
+
+# sync_all incremental (manifest de lo ya replicado + pool de subidas)
+HDFS_SYNC_CONCURRENCY = int(os.getenv('HDFS_SYNC_CONCURRENCY', '8'))
+HDFS_SYNC_MANIFEST_PATH = os.getenv('HDFS_SYNC_MANIFEST_PATH', '')
+
+# Archivo frío de apadrinamientos finalizados y entregas entregadas
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', '365'))
+ARCHIVE_TIER = os.getenv('ARCHIVE_TIER', 'storage')  # 'storage' (NFS) o 'hdfs'
+ARCHIVE_SEGMENT_MAX_BYTES = int(os.getenv('ARCHIVE_SEGMENT_MAX_BYTES', str(64 * 1024 * 1024)))
+
+# Motor de almacenamiento: 'file' (un archivo por entidad), 'sqlite', 'log' o 'migrating'
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'file')
+# Debe estar en disco local (no NFS); por defecto LOCAL_STORAGE_PATH/smilelink.sqlite3
+SQLITE_STORAGE_PATH = os.getenv('SQLITE_STORAGE_PATH', '')
+
+# Write batches del motor 'file': checkpoint en grupo de los archivos aplicados sin fsync
+JOURNAL_CHECKPOINT_SECONDS = float(os.getenv('JOURNAL_CHECKPOINT_SECONDS', '1'))
+JOURNAL_CHECKPOINT_RECORDS = int(os.getenv('JOURNAL_CHECKPOINT_RECORDS', '256'))
+
+# STORAGE_BACKEND=migrating: escribe en origen y destino durante migrate_storage
+MIGRATION_SOURCE = os.getenv('MIGRATION_SOURCE', 'file')
+MIGRATION_TARGET = os.getenv('MIGRATION_TARGET', '')
+MIGRATION_READ_PREFERENCE = os.getenv('MIGRATION_READ_PREFERENCE', 'source')
+
+# Motor 'log': segmentos append-only por tipo (por defecto <datos>/_log)
+LOG_STORAGE_PATH = os.getenv('LOG_STORAGE_PATH', '')
+LOG_SEGMENT_MAX_BYTES = int(os.getenv('LOG_SEGMENT_MAX_BYTES', str(64 * 1024 * 1024)))
+LOG_FSYNC = os.getenv('LOG_FSYNC', 'False').lower() == 'true'
+LOG_COMPACT_INTERVAL_SECONDS = float(os.getenv('LOG_COMPACT_INTERVAL_SECONDS', '60'))
+LOG_COMPACT_MIN_RATIO = float(os.getenv('LOG_COMPACT_MIN_RATIO', '0.5'))
+LOG_COMPACT_MIN_BYTES = int(os.getenv('LOG_COMPACT_MIN_BYTES', str(1024 * 1024)))
+
 # Local Storage (for development)
 LOCAL_STORAGE_PATH = os.getenv('LOCAL_STORAGE_PATH', str(BASE_DIR / 'local_data'))
 
 # Encryption
 ENCRYPTION_KEY = os.getenv('ENCRYPTION_KEY', '')
 
+# Métricas Prometheus en /api/metrics/: cada proceso deja su foto en METRICS_DIR
+# (disco local compartido por los workers de la máquina; 'none' = sólo el proceso)
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True').lower() == 'true'
+METRICS_DIR = os.getenv('METRICS_DIR', str(BASE_DIR / 'metrics_data'))
+METRICS_FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', '5'))
+
+# Tracing por request: los que superan TRACE_SLOW_MS se guardan en TRACE_LOG_PATH (JSONL)
+TRACE_ENABLED = os.getenv('TRACE_ENABLED', 'True').lower() == 'true'
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '1'))
+TRACE_SLOW_MS = float(os.getenv('TRACE_SLOW_MS', '1000'))
+TRACE_LOG_PATH = os.getenv('TRACE_LOG_PATH', str(BASE_DIR / 'traces' / 'slow_requests.jsonl'))
+TRACE_LOG_MAX_BYTES = int(os.getenv('TRACE_LOG_MAX_BYTES', str(50 * 1024 * 1024)))
+TRACE_MAX_SPANS = int(os.getenv('TRACE_MAX_SPANS', '2000'))
+
+# /api/metrics/ y /api/traces/ sólo para IPs/redes de OBSERVABILITY_ALLOWED_IPS o con
+# Authorization: Bearer <OBSERVABILITY_TOKEN>; sin ninguno de los dos quedan cerrados.
+# Un X-Trace-Id entrante sólo se respeta de esos mismos clientes
+OBSERVABILITY_TOKEN = os.getenv('OBSERVABILITY_TOKEN', '')
+OBSERVABILITY_ALLOWED_IPS = [
+    ip.strip() for ip in os.getenv('OBSERVABILITY_ALLOWED_IPS', '').split(',') if ip.strip()
+]
+
+# Perfiles cProfile: fracción muestreada o header X-Profile: <PROFILE_TOKEN> (vacío = sin header)
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN', '')
+PROFILE_DIR = os.getenv('PROFILE_DIR', str(BASE_DIR / 'profiles'))
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', '500'))
+PROFILE_MAX_BYTES = int(os.getenv('PROFILE_MAX_BYTES', str(200 * 1024 * 1024)))
+
 
 # ==============================================================================
 # LOGGING
@@ -1,19 +1,51 @@
 # Storage package initialization
-from .encryption import get_encryption_manager, EncryptionManager
-from .file_manager import get_storage_manager, FileStorageManager
-from .nfs_client import get_nfs_client, NFSClient
-from .hdfs_client import get_hdfs_client, HDFSClient
-from .sync_manager import get_sync_manager, SyncManager
-
-__all__ = [
-    'get_encryption_manager',
-    'EncryptionManager',
-    'get_storage_manager',
-    'FileStorageManager',
-    'get_nfs_client',
-    'NFSClient',
-    'get_hdfs_client',
-    'HDFSClient',
-    'get_sync_manager',
-    'SyncManager',
-]
+import importlib
+
+from dotenv import load_dotenv
+
+# .env se carga una sola vez para todo el paquete (settings.py también lo hace al arrancar Django)
+load_dotenv()
+
+# Los submódulos se importan en el primer acceso a uno de sus nombres: importar
+# el paquete no arrastra SQLite, el log store, HDFS, etc. si no se usan
+_EXPORTS = {
+    '.encryption': ('get_encryption_manager', 'EncryptionManager'),
+    '.backend': ('get_storage_backend', 'open_storage_backend', 'StorageBackend'),
+    '.file_manager': ('get_storage_manager', 'FileStorageManager'),
+    '.sqlite_backend': ('get_sqlite_storage_manager', 'SQLiteStorageManager'),
+    '.log_store': ('get_log_storage_manager', 'LogStorageManager'),
+    '.nfs_client': ('get_nfs_client', 'NFSClient'),
+    '.hdfs_client': ('get_hdfs_client', 'HDFSClient'),
+    '.sync_manager': ('get_sync_manager', 'SyncManager'),
+    '.jobs': ('get_job_store', 'JobStore'),
+    '.write_batch': ('WriteBatch',),
+    '.replication_queue': ('get_replication_queue', 'ReplicationQueue'),
+    '.segments': ('SegmentReader', 'SegmentWriter'),
+    '.restore': ('HDFSRestorer',),
+    '.blob_cache': ('BlobCache',),
+    '.snapshot': ('SnapshotStore',),
+    '.nfs_health': ('get_nfs_health_monitor', 'NFSHealthMonitor', 'StorageUnavailable'),
+    '.archive': ('get_archive_store', 'ArchiveStore'),
+    '.migration': ('MigratingStorageBackend', 'StorageMigration'),
+    '.fsck': ('StorageChecker',),
+    '.metrics': ('MetricsRegistry', 'render_prometheus'),
+    '.tracing': ('get_tracer', 'Tracer', 'span'),
+    '.profiling': ('get_profile_store', 'ProfileStore'),
+}
+
+_MODULE_OF = {name: module for module, names in _EXPORTS.items() for name in names}
+
+__all__ = [name for names in _EXPORTS.values() for name in names]
+
+
+def __getattr__(name):
+    module = _MODULE_OF.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,483 @@
+"""
+SmileLink Storage - Archive
+Capa fría para registros terminados: apadrinamientos 'Finalizado' y entregas
+'Entregado' con más de ARCHIVE_AFTER_DAYS salen del índice caliente y se
+compactan en segmentos (mismo formato que storage/segments.py)
+
+El ciphertext se mueve tal cual, sin desencriptar-reencriptar. Cada tipo
+tiene un catálogo encriptado con {id: [segment_id, offset, length]} y los
+agregados que necesitan los KPIs, escritos juntos de forma atómica. Los
+segmentos viven bajo <base_path del motor>/_archive o en HDFS (ARCHIVE_TIER=hdfs).
+
+Funciona sobre cualquier motor (load_raw / delete_if_unchanged). Con
+STORAGE_BACKEND=migrating el archivo es el del origen; migrate_storage lo
+copia al destino y lo compara en la verificación.
+"""
+import json
+import os
+import shutil
+import threading
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .backend import get_storage_backend
+from .hdfs_client import get_hdfs_client
+from .segments import MANIFEST_SUFFIX, SEGMENT_SUFFIX, SegmentWriter
+
+
+ARCHIVE_DIR = '_archive'
+CATALOG_NAME = 'catalog.json.enc'
+
+# Qué se archiva: estado terminal y fechas a considerar (la primera presente)
+ARCHIVE_RULES = {
+    'apadrinamientos': {
+        'status_field': 'estado_apadrinamiento_registro',
+        'status': 'Finalizado',
+        'date_fields': ('fecha_fin', 'fecha_inicio'),
+    },
+    'entregas': {
+        'status_field': 'estado_entrega',
+        'status': 'Entregado',
+        'date_fields': ('fecha_entrega_real', 'fecha_programada'),
+    },
+}
+
+
+class _StorageTier:
+    """Segmentos en el mismo filesystem del storage (NFS o local)"""
+
+    name = 'storage'
+
+    def __init__(self, base_path: Path):
+        self.base_path = base_path
+
+    def put(self, relative_path: str, segment_path: Path, manifest_bytes: bytes) -> bool:
+        target = self.base_path / relative_path
+        target.parent.mkdir(parents=True, exist_ok=True)
+        with open(segment_path, 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(segment_path, target)
+        manifest_path = target.with_name(target.name[:-len(SEGMENT_SUFFIX)] + MANIFEST_SUFFIX)
+        with open(manifest_path, 'wb') as f:
+            f.write(manifest_bytes)
+        return True
+
+    def read(self, relative_path: str, offset: int = 0, length: Optional[int] = None) -> Optional[bytes]:
+        try:
+            with open(self.base_path / relative_path, 'rb') as f:
+                f.seek(offset)
+                return f.read() if length is None else f.read(length)
+        except FileNotFoundError:
+            return None
+
+    def delete(self, relative_path: str):
+        target = self.base_path / relative_path
+        target.unlink(missing_ok=True)
+        target.with_name(target.name[:-len(SEGMENT_SUFFIX)] + MANIFEST_SUFFIX).unlink(missing_ok=True)
+
+
+class _HDFSTier:
+    """Segmentos directamente en HDFS, leídos con lecturas por rango"""
+
+    name = 'hdfs'
+
+    def __init__(self, hdfs):
+        self.hdfs = hdfs
+
+    def put(self, relative_path: str, segment_path: Path, manifest_bytes: bytes) -> bool:
+        if not self.hdfs.replicate_file(str(segment_path), relative_path):
+            return False
+        manifest_path = relative_path[:-len(SEGMENT_SUFFIX)] + MANIFEST_SUFFIX
+        if not self.hdfs.write_bytes(manifest_path, manifest_bytes):
+            return False
+        segment_path.unlink(missing_ok=True)
+        return True
+
+    def read(self, relative_path: str, offset: int = 0, length: Optional[int] = None) -> Optional[bytes]:
+        return self.hdfs.read_bytes(relative_path, offset=offset, length=length)
+
+    def delete(self, relative_path: str):
+        self.hdfs.delete_file(relative_path)
+        self.hdfs.delete_file(relative_path[:-len(SEGMENT_SUFFIX)] + MANIFEST_SUFFIX)
+
+
+def _record_date(record: Dict[str, Any], date_fields: Iterable[str]) -> Optional[date]:
+    for field in date_fields:
+        value = record.get(field)
+        if value:
+            try:
+                return date.fromisoformat(str(value)[:10])
+            except ValueError:
+                return None
+    return None
+
+
+class ArchiveStore:
+    """Archivo frío de registros terminados, consultable por ID y con agregados"""
+
+    def __init__(self, storage=None, tier: Optional[str] = None, segment_max_bytes: Optional[int] = None):
+        """
+        Args:
+            storage: StorageBackend con los registros calientes (por defecto el de STORAGE_BACKEND)
+            tier: 'storage' (junto a los datos, p.ej. NFS) o 'hdfs'. Si es None, usa ARCHIVE_TIER
+            segment_max_bytes: Tamaño máximo de un segmento. Si es None, usa ARCHIVE_SEGMENT_MAX_BYTES
+        """
+        self.storage = storage or get_storage_backend()
+        self.encryption = self.storage.encryption
+        self.root = self.storage.base_path / ARCHIVE_DIR
+        self.after_days = int(os.getenv('ARCHIVE_AFTER_DAYS', '365'))
+        self.segment_max_bytes = segment_max_bytes or int(
+            os.getenv('ARCHIVE_SEGMENT_MAX_BYTES', str(64 * 1024 * 1024))
+        )
+
+        tier = (tier or os.getenv('ARCHIVE_TIER', 'storage')).lower()
+        self.tier = _HDFSTier(get_hdfs_client()) if tier == 'hdfs' else _StorageTier(self.storage.base_path)
+
+        self._lock = threading.RLock()
+        self._catalogs: Dict[str, Tuple[int, Dict[str, Any]]] = {}
+
+    # ------------------------------------------------------------------
+    # Catálogo
+    # ------------------------------------------------------------------
+
+    def _catalog_path(self, entity_type: str) -> Path:
+        return self.root / entity_type / CATALOG_NAME
+
+    def _segment_relative(self, entity_type: str, segment_id: str) -> str:
+        return f"{ARCHIVE_DIR}/{entity_type}/{segment_id}{SEGMENT_SUFFIX}"
+
+    def _load_catalog(self, entity_type: str) -> Dict[str, Any]:
+        """Catálogo del tipo, re-leído sólo si cambió en disco"""
+        path = self._catalog_path(entity_type)
+        empty = {'entries': {}, 'aggregates': {'count': 0, 'by_estado': {}}}
+        try:
+            mtime_ns = path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return empty
+        with self._lock:
+            cached = self._catalogs.get(entity_type)
+            if cached and cached[0] == mtime_ns:
+                return cached[1]
+            with open(path, 'rb') as f:
+                catalog = self.encryption.decrypt_data(f.read())
+            self._catalogs[entity_type] = (mtime_ns, catalog)
+            return catalog
+
+    def _save_catalog(self, entity_type: str, catalog: Dict[str, Any]):
+        """Guarda el catálogo de forma atómica y durable"""
+        path = self._catalog_path(entity_type)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(self.encryption.encrypt_data(catalog))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._catalogs.pop(entity_type, None)
+
+    # ------------------------------------------------------------------
+    # Consulta
+    # ------------------------------------------------------------------
+
+    def aggregates(self, entity_type: str) -> Dict[str, Any]:
+        """
+        Totales precomputados del archivo: {'count': n, 'by_estado': {estado: n}}
+
+        Sin contar los IDs que todavía están en el índice caliente (archivado
+        interrumpido antes del borrado): esos ya los cuenta el storage.
+        """
+        catalog = self._load_catalog(entity_type)
+        aggregates = catalog['aggregates']
+        entries = catalog['entries']
+        if not entries:
+            return aggregates
+        overlap = sum(1 for entity_id in self.storage.list_ids(entity_type) if entity_id in entries)
+        if not overlap:
+            return aggregates
+        # Todo lo archivado tiene el estado terminal de la regla
+        status = ARCHIVE_RULES[entity_type]['status']
+        by_estado = dict(aggregates.get('by_estado', {}))
+        by_estado[status] = max(by_estado.get(status, 0) - overlap, 0)
+        return {'count': max(aggregates.get('count', 0) - overlap, 0), 'by_estado': by_estado}
+
+    def list_ids(self, entity_type: str) -> List[str]:
+        """IDs archivados de un tipo"""
+        return list(self._load_catalog(entity_type)['entries'])
+
+    def load(self, entity_type: str, entity_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Carga un registro archivado
+
+        Returns:
+            dict: Datos desencriptados o None si no está archivado
+        """
+        if entity_type not in ARCHIVE_RULES:
+            return None
+        entry = self._load_catalog(entity_type)['entries'].get(entity_id)
+        if entry is None:
+            return None
+        segment_id, offset, length = entry
+        try:
+            raw = self.tier.read(self._segment_relative(entity_type, segment_id), offset, length)
+            return self.encryption.decrypt_data(raw) if raw is not None else None
+        except Exception as e:
+            print(f"Error loading archived {entity_type}/{entity_id}: {e}")
+            return None
+
+    def list_all(self, entity_type: str, exclude: Iterable[str] = ()) -> List[Dict[str, Any]]:
+        """
+        Todos los registros archivados de un tipo (una lectura por segmento)
+
+        Args:
+            exclude: IDs a omitir (p.ej. los del índice caliente, que tienen precedencia)
+        """
+        if entity_type not in ARCHIVE_RULES:
+            return []
+        exclude = set(exclude)
+        by_segment: Dict[str, List[Tuple[str, int, int]]] = {}
+        for entity_id, (segment_id, offset, length) in self._load_catalog(entity_type)['entries'].items():
+            if entity_id in exclude:
+                continue
+            by_segment.setdefault(segment_id, []).append((entity_id, offset, length))
+
+        records = []
+        for segment_id in sorted(by_segment):
+            blob = self.tier.read(self._segment_relative(entity_type, segment_id))
+            if blob is None:
+                print(f"Error reading archive segment {segment_id}")
+                continue
+            for entity_id, offset, length in by_segment[segment_id]:
+                try:
+                    records.append(self.encryption.decrypt_data(blob[offset:offset + length]))
+                except Exception as e:
+                    print(f"Error loading archived {entity_type}/{entity_id}: {e}")
+        return records
+
+    # ------------------------------------------------------------------
+    # Archivado
+    # ------------------------------------------------------------------
+
+    def is_candidate(self, entity_type: str, record: Dict[str, Any], cutoff: date) -> bool:
+        """True si el registro está terminado y su fecha es anterior al corte"""
+        rule = ARCHIVE_RULES[entity_type]
+        if record.get(rule['status_field']) != rule['status']:
+            return False
+        record_date = _record_date(record, rule['date_fields'])
+        return record_date is not None and record_date < cutoff
+
+    def _write_segments(self, entity_type: str, blobs: List[Tuple[str, bytes]]) -> Dict[str, List]:
+        """
+        Empaqueta blobs en segmentos y los publica en la capa fría
+
+        Returns:
+            dict: {entity_id: [segment_id, offset, length]} de lo publicado
+        """
+        tmp_dir = self.root / entity_type / '.tmp'
+        placed: Dict[str, List] = {}
+        writer = SegmentWriter(tmp_dir)
+
+        def publish(writer: SegmentWriter):
+            manifest = writer.close()
+            relative_path = self._segment_relative(entity_type, manifest['segment_id'])
+            if not self.tier.put(relative_path, writer.path, json.dumps(manifest).encode('utf-8')):
+                writer.discard()
+                raise IOError(f"could not store archive segment {manifest['segment_id']}")
+            for entity_id, entry in manifest['entries'].items():
+                placed[entity_id] = [manifest['segment_id'], entry['offset'], entry['length']]
+            if self.tier.name == 'storage':
+                self._sync_file(relative_path)
+                self._sync_file(relative_path[:-len(SEGMENT_SUFFIX)] + MANIFEST_SUFFIX)
+
+        for entity_id, blob in blobs:
+            writer.add(entity_id, blob)
+            if writer.size >= self.segment_max_bytes:
+                publish(writer)
+                writer = SegmentWriter(tmp_dir)
+        if writer.entries:
+            publish(writer)
+        else:
+            writer.discard()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return placed
+
+    def _sync_file(self, relative_path: str):
+        from .sync_manager import get_sync_manager
+        get_sync_manager().sync_file(relative_path)
+
+    def archive(self, entity_type: str, older_than_days: Optional[int] = None,
+                dry_run: bool = False, limit: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Mueve al archivo los registros terminados más viejos que el corte
+
+        El catálogo se confirma antes de borrar del índice caliente: un corte
+        a mitad deja el registro en ambos lados (gana el caliente, y
+        aggregates() no lo cuenta dos veces) y la siguiente corrida termina
+        el trabajo. Un registro modificado mientras se archivaba no se borra
+        y sale del catálogo.
+
+        Returns:
+            dict: candidates, archived, bytes y cutoff
+        """
+        if entity_type not in ARCHIVE_RULES:
+            raise ValueError(f"Entity type not archivable: {entity_type}")
+
+        days = self.after_days if older_than_days is None else older_than_days
+        cutoff = date.today() - timedelta(days=days)
+        rule = ARCHIVE_RULES[entity_type]
+
+        blobs: List[Tuple[str, bytes]] = []
+        estados: Dict[str, str] = {}
+        for entity_id in self.storage.list_ids(entity_type):
+            raw = self.storage.load_raw(entity_type, entity_id)
+            if raw is None:
+                continue
+            try:
+                record = self.encryption.decrypt_data(raw)
+            except Exception as e:
+                print(f"Error loading {entity_type}/{entity_id}: {e}")
+                continue
+            if self.is_candidate(entity_type, record, cutoff):
+                blobs.append((entity_id, raw))
+                estados[entity_id] = record.get(rule['status_field'])
+                if limit and len(blobs) >= limit:
+                    break
+
+        report = {
+            'candidates': len(blobs),
+            'archived': 0,
+            'bytes': sum(len(blob) for _, blob in blobs),
+            'cutoff': cutoff.isoformat(),
+        }
+        if dry_run or not blobs:
+            return report
+
+        with self._lock:
+            placed = self._write_segments(entity_type, blobs)
+
+            catalog = self._load_catalog(entity_type)
+            catalog = {'entries': dict(catalog['entries']), 'aggregates': dict(catalog['aggregates'])}
+            by_estado = dict(catalog['aggregates'].get('by_estado', {}))
+            for entity_id, location in placed.items():
+                if entity_id not in catalog['entries']:
+                    catalog['aggregates']['count'] = catalog['aggregates'].get('count', 0) + 1
+                    by_estado[estados[entity_id]] = by_estado.get(estados[entity_id], 0) + 1
+                catalog['entries'][entity_id] = location
+            catalog['aggregates']['by_estado'] = by_estado
+            self._save_catalog(entity_type, catalog)
+            self._sync_file(f"{ARCHIVE_DIR}/{entity_type}/{CATALOG_NAME}")
+
+        archived_blobs = dict(blobs)
+        deleted = self.storage.delete_if_unchanged(
+            entity_type, {entity_id: archived_blobs[entity_id] for entity_id in placed}
+        )
+
+        deleted_ids = set(deleted)
+        changed = [entity_id for entity_id in placed if entity_id not in deleted_ids]
+        if changed:
+            self._drop_entries(entity_type, changed)
+
+        if deleted:
+            from .sync_manager import get_sync_manager
+            get_sync_manager().sync_deletes(entity_type, deleted)
+
+        report['archived'] = len(deleted)
+        report['skipped_changed'] = len(changed)
+        return report
+
+    def _drop_entries(self, entity_type: str, entity_ids: List[str]):
+        """Saca del catálogo registros que siguen en el storage caliente con otra versión"""
+        status = ARCHIVE_RULES[entity_type]['status']
+        with self._lock:
+            catalog = self._load_catalog(entity_type)
+            entries = dict(catalog['entries'])
+            aggregates = {'count': catalog['aggregates'].get('count', 0),
+                          'by_estado': dict(catalog['aggregates'].get('by_estado', {}))}
+            for entity_id in entity_ids:
+                if entries.pop(entity_id, None) is not None:
+                    aggregates['count'] -= 1
+                    aggregates['by_estado'][status] = aggregates['by_estado'].get(status, 0) - 1
+            self._save_catalog(entity_type, {'entries': entries, 'aggregates': aggregates})
+            self._sync_file(f"{ARCHIVE_DIR}/{entity_type}/{CATALOG_NAME}")
+
+    def rebuild_aggregates(self, entity_type: str) -> Dict[str, Any]:
+        """
+        Recalcula los agregados del catálogo desencriptando los registros archivados
+
+        Returns:
+            dict: Agregados anteriores y nuevos
+        """
+        if entity_type not in ARCHIVE_RULES:
+            raise ValueError(f"Entity type not archivable: {entity_type}")
+        status_field = ARCHIVE_RULES[entity_type]['status_field']
+
+        with self._lock:
+            catalog = self._load_catalog(entity_type)
+            before = catalog['aggregates']
+            if not catalog['entries']:
+                return {'before': before, 'after': before}
+
+            by_estado: Dict[str, int] = {}
+            records = self.list_all(entity_type)
+            for record in records:
+                estado = record.get(status_field)
+                by_estado[estado] = by_estado.get(estado, 0) + 1
+            after = {'count': len(records), 'by_estado': by_estado}
+
+            if after != before:
+                self._save_catalog(entity_type, {'entries': catalog['entries'], 'aggregates': after})
+                self._sync_file(f"{ARCHIVE_DIR}/{entity_type}/{CATALOG_NAME}")
+            return {'before': before, 'after': after}
+
+    def compact(self, entity_type: str) -> Dict[str, Any]:
+        """
+        Reescribe todos los segmentos de un tipo en segmentos llenos
+
+        Returns:
+            dict: segments_before, segments_after y records
+        """
+        with self._lock:
+            catalog = self._load_catalog(entity_type)
+            old_segments = sorted({segment_id for segment_id, _, _ in catalog['entries'].values()})
+            if len(old_segments) <= 1:
+                return {'segments_before': len(old_segments), 'segments_after': len(old_segments),
+                        'records': len(catalog['entries'])}
+
+            blobs: List[Tuple[str, bytes]] = []
+            for segment_id in old_segments:
+                blob = self.tier.read(self._segment_relative(entity_type, segment_id))
+                if blob is None:
+                    raise IOError(f"could not read archive segment {segment_id}")
+                for entity_id, (seg, offset, length) in catalog['entries'].items():
+                    if seg == segment_id:
+                        blobs.append((entity_id, blob[offset:offset + length]))
+
+            placed = self._write_segments(entity_type, blobs)
+            new_catalog = {'entries': placed, 'aggregates': catalog['aggregates']}
+            self._save_catalog(entity_type, new_catalog)
+            self._sync_file(f"{ARCHIVE_DIR}/{entity_type}/{CATALOG_NAME}")
+
+            for segment_id in old_segments:
+                relative_path = self._segment_relative(entity_type, segment_id)
+                self.tier.delete(relative_path)
+                if self.tier.name == 'storage':
+                    self._sync_file(relative_path)
+                    self._sync_file(relative_path[:-len(SEGMENT_SUFFIX)] + MANIFEST_SUFFIX)
+
+            return {
+                'segments_before': len(old_segments),
+                'segments_after': len({seg for seg, _, _ in placed.values()}),
+                'records': len(placed),
+            }
+
+
+# Singleton instance
+_archive_store = None
+
+def get_archive_store() -> ArchiveStore:
+    """Retorna el ArchiveStore singleton sobre el motor de STORAGE_BACKEND"""
+    global _archive_store
+    if _archive_store is None:
+        _archive_store = ArchiveStore()
+    return _archive_store
@@ -0,0 +1,339 @@
+"""
+SmileLink Storage - Backend
+Interfaz común de los motores de almacenamiento. La API (api/views.py,
+api/auth_views.py) trabaja contra StorageBackend y el motor concreto se
+elige con STORAGE_BACKEND:
+
+    file    FileStorageManager: un archivo encriptado por entidad (NFS/local)
+    sqlite  SQLiteStorageManager: blobs encriptados en SQLite (WAL)
+    log     LogStorageManager: segmentos append-only por tipo
+    migrating   MigratingStorageBackend: durante una migración entre motores
+                escribe en ambos y lee de los dos (ver storage/migration.py)
+"""
+import copy
+import os
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+from .read_cache import ReadCache, _current_cache, get_current_read_cache
+from .metrics import STORAGE_INDEX_LOADS, timed_storage_operation
+from .tracing import span
+
+
+class StorageBackend(ABC):
+    """Operaciones de almacenamiento que usan las vistas"""
+
+    name = 'base'
+
+    # Tipos de entidades soportadas
+    ENTITY_TYPES = [
+        'ninos', 'padrinos', 'apadrinamientos', 'entregas',
+        'solicitudes', 'puntos_entrega', 'eventos', 'administradores'
+    ]
+
+    # Campo que guarda el ID dentro de cada entidad
+    ID_FIELDS = {
+        'ninos': 'id_nino',
+        'padrinos': 'id_padrino',
+        'apadrinamientos': 'id_apadrinamiento',
+        'entregas': 'id_entrega',
+        'solicitudes': 'id_solicitud',
+        'puntos_entrega': 'id_punto_entrega',
+        'eventos': 'id_evento',
+        'administradores': 'id_admin',
+    }
+
+    # Campos que find/count comparan sin distinguir mayúsculas ni espacios
+    CASE_INSENSITIVE_FIELDS = ('email',)
+
+    # Prefijo de los IDs generados con get_next_id
+    ID_PREFIXES = {
+        'ninos': 'N',
+        'padrinos': 'P',
+        'apadrinamientos': 'AP',
+        'entregas': 'E',
+        'solicitudes': 'SR',
+        'puntos_entrega': 'PE',
+        'eventos': 'EV',
+        'administradores': 'A',
+    }
+
+    # ------------------------------------------------------------------
+    # A implementar por cada motor
+    # ------------------------------------------------------------------
+
+    @abstractmethod
+    def _read_index(self, entity_type: str) -> List[str]:
+        """Lee los IDs de un tipo en orden de inserción"""
+
+    @abstractmethod
+    def _read_entity(self, entity_type: str, entity_id: str) -> Optional[Dict[str, Any]]:
+        """Lee y desencripta una entidad; None si no existe"""
+
+    @abstractmethod
+    def save(self, entity_type: str, entity_id: str, data: Dict[str, Any]) -> bool:
+        """Guarda una entidad encriptada"""
+
+    @abstractmethod
+    def save_many(self, entity_type: str, records: Dict[str, Dict[str, Any]]) -> List[str]:
+        """Guarda varias entidades; retorna los IDs guardados"""
+
+    @abstractmethod
+    def delete(self, entity_type: str, entity_id: str) -> bool:
+        """Elimina una entidad; False si no existía"""
+
+    @abstractmethod
+    def write_batch(self):
+        """Batch de escrituras todo-o-nada (context manager con save/delete/changes)"""
+
+    @abstractmethod
+    def rebuild_index(self, entity_type: str) -> List[str]:
+        """Reconstruye el índice de un tipo a partir de los datos"""
+
+    @abstractmethod
+    def load_raw(self, entity_type: str, entity_id: str) -> Optional[bytes]:
+        """Ciphertext tal como está guardado (lo usa el archivo frío); None si no existe"""
+
+    @abstractmethod
+    def delete_if_unchanged(self, entity_type: str, expected: Dict[str, bytes]) -> List[str]:
+        """Borra, de forma atómica por entidad, sólo las que siguen con el ciphertext esperado"""
+
+    # ------------------------------------------------------------------
+    # Cache de lecturas por request
+    # ------------------------------------------------------------------
+
+    @contextmanager
+    def read_cache(self):
+        """
+        Activa un cache de lecturas para el contexto actual
+
+        Dentro del bloque, cargas repetidas de la misma entidad o índice se
+        desencriptan una sola vez. Las escrituras invalidan lo afectado.
+        Si ya hay un cache activo se reutiliza.
+        """
+        if get_current_read_cache() is not None:
+            yield
+            return
+
+        token = _current_cache.set(ReadCache())
+        try:
+            yield
+        finally:
+            _current_cache.reset(token)
+
+    def _invalidate_cache(self, entity_type: str, entity_id: Optional[str] = None):
+        """Invalida el cache de lecturas activo tras una escritura"""
+        cache = get_current_read_cache()
+        if cache is not None:
+            cache.invalidate(entity_type, entity_id)
+
+    def _load_index(self, entity_type: str) -> List[str]:
+        """Carga lista de IDs del índice"""
+        cache = get_current_read_cache()
+        if cache is not None:
+            index = cache.get_or_load(
+                ('index', entity_type),
+                lambda: self._read_index_counted(entity_type)
+            )
+            return list(index)
+        return self._read_index_counted(entity_type)
+
+    def _read_index_counted(self, entity_type: str) -> List[str]:
+        STORAGE_INDEX_LOADS.inc(backend=self.name, entity_type=entity_type)
+        with span('index.read', entity_type=entity_type):
+            return self._read_index(entity_type)
+
+    # ------------------------------------------------------------------
+    # Operaciones comunes
+    # ------------------------------------------------------------------
+
+    @timed_storage_operation('load')
+    def load(self, entity_type: str, entity_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Carga una entidad desencriptada
+
+        Args:
+            entity_type: Tipo de entidad
+            entity_id: ID de la entidad
+
+        Returns:
+            dict: Datos desencriptados o None si no existe
+        """
+        if entity_type not in self.ENTITY_TYPES:
+            raise ValueError(f"Invalid entity type: {entity_type}")
+
+        cache = get_current_read_cache()
+        if cache is not None:
+            data = cache.get_or_load(
+                ('entity', entity_type, entity_id),
+                lambda: self._read_entity(entity_type, entity_id)
+            )
+            return copy.deepcopy(data)
+        return self._read_entity(entity_type, entity_id)
+
+    def list_ids(self, entity_type: str) -> List[str]:
+        """
+        Lista los IDs de un tipo sin desencriptar las entidades
+
+        Args:
+            entity_type: Tipo de entidad
+
+        Returns:
+            list: IDs en el orden del índice
+        """
+        if entity_type not in self.ENTITY_TYPES:
+            raise ValueError(f"Invalid entity type: {entity_type}")
+
+        return self._load_index(entity_type)
+
+    @timed_storage_operation('list_all')
+    def list_all(self, entity_type: str) -> List[Dict[str, Any]]:
+        """
+        Lista todas las entidades de un tipo
+
+        Args:
+            entity_type: Tipo de entidad
+
+        Returns:
+            list: Lista de todas las entidades
+        """
+        if entity_type not in self.ENTITY_TYPES:
+            raise ValueError(f"Invalid entity type: {entity_type}")
+
+        index = self._load_index(entity_type)
+        entities = []
+
+        for entity_id in index:
+            data = self.load(entity_type, entity_id)
+            if data:
+                entities.append(data)
+
+        return entities
+
+    @timed_storage_operation('find')
+    def find(self, entity_type: str, **filters) -> List[Dict[str, Any]]:
+        """
+        Entidades cuyos campos son iguales a los filtros dados
+
+        Ej: storage.find('padrinos', email='ana@mail.com')
+
+        Los campos de CASE_INSENSITIVE_FIELDS se comparan normalizados: un
+        padrino guardado como 'Ana@Mail.com' se encuentra con 'ana@mail.com'.
+        Los motores con columnas indexadas lo resuelven sin desencriptar
+        todo el tipo; este default filtra list_all.
+        """
+        return [entity for entity in self.list_all(entity_type) if self._matches(entity, filters)]
+
+    def _normalize_filter_value(self, field: str, value: Any) -> Any:
+        if field in self.CASE_INSENSITIVE_FIELDS and isinstance(value, str):
+            return value.strip().lower()
+        return value
+
+    def _matches(self, entity: Dict[str, Any], filters: Dict[str, Any]) -> bool:
+        """True si la entidad cumple todos los filtros de find"""
+        return all(
+            self._normalize_filter_value(field, entity.get(field)) == self._normalize_filter_value(field, value)
+            for field, value in filters.items()
+        )
+
+    @timed_storage_operation('count')
+    def count(self, entity_type: str, **filters) -> int:
+        """Número de entidades que cumplen los filtros (todas si no hay filtros)"""
+        if not filters:
+            return len(self.list_ids(entity_type))
+        return len(self.find(entity_type, **filters))
+
+    def exists(self, entity_type: str, entity_id: str) -> bool:
+        """Verifica si una entidad existe"""
+        return self.load(entity_type, entity_id) is not None
+
+    def update(self, entity_type: str, entity_id: str, data: Dict[str, Any]) -> bool:
+        """Actualiza una entidad (alias de save)"""
+        return self.save(entity_type, entity_id, data)
+
+    def _max_id_number(self, index: List[str], prefix: str) -> int:
+        """Retorna el mayor número usado en los IDs con el prefijo dado"""
+        max_num = 0
+        for entity_id in index:
+            try:
+                max_num = max(max_num, int(entity_id.replace(prefix, '')))
+            except ValueError:
+                continue
+        return max_num
+
+    def get_next_id(self, entity_type: str, prefix: str) -> str:
+        """
+        Genera el siguiente ID disponible para una entidad
+
+        Args:
+            entity_type: Tipo de entidad
+            prefix: Prefijo del ID (ej: 'N' para niños, 'P' para padrinos)
+
+        Returns:
+            str: Siguiente ID disponible (ej: 'N005')
+        """
+        return self.allocate_ids(entity_type, prefix, 1)[0]
+
+    def allocate_ids(self, entity_type: str, prefix: str, count: int) -> List[str]:
+        """
+        Reserva un bloque de IDs consecutivos leyendo el índice una sola vez
+
+        Sin lock entre procesos: cada motor lo redefine con su propio
+        allocator atómico (high-water mark bajo lock o transacción).
+
+        Args:
+            entity_type: Tipo de entidad
+            prefix: Prefijo del ID
+            count: Número de IDs a generar
+
+        Returns:
+            list: IDs consecutivos (ej: ['E010', 'E011', 'E012'])
+        """
+        index = self._load_index(entity_type)
+        start = self._max_id_number(index, prefix) + 1
+        return [f"{prefix}{str(num).zfill(3)}" for num in range(start, start + count)]
+
+
+def _backend_singleton(name: str) -> StorageBackend:
+    if name == 'file':
+        from .file_manager import get_storage_manager
+        return get_storage_manager()
+    if name == 'sqlite':
+        from .sqlite_backend import get_sqlite_storage_manager
+        return get_sqlite_storage_manager()
+    if name == 'log':
+        from .log_store import get_log_storage_manager
+        return get_log_storage_manager()
+    if name == 'migrating':
+        from .migration import get_migrating_storage_manager
+        return get_migrating_storage_manager()
+    raise ValueError(f"Unknown STORAGE_BACKEND: {name}")
+
+
+def get_storage_backend() -> StorageBackend:
+    """Retorna el motor de almacenamiento configurado en STORAGE_BACKEND"""
+    return _backend_singleton(os.getenv('STORAGE_BACKEND', 'file').lower())
+
+
+def open_storage_backend(spec: str) -> StorageBackend:
+    """
+    Abre un motor a partir de una especificación 'motor[:ruta]'
+
+    Sin ruta retorna el motor configurado en .env; con ruta, una instancia
+    nueva sobre ese directorio/archivo.
+    Ej: 'file', 'file:/srv/data', 'sqlite:/srv/smilelink.sqlite3', 'log:/srv/log'
+    """
+    name, _, path = spec.partition(':')
+    name = name.strip().lower()
+    if name not in ('file', 'sqlite', 'log'):
+        raise ValueError(f"Unknown storage backend in '{spec}' (choose from file, sqlite, log)")
+    if not path:
+        return _backend_singleton(name)
+    if name == 'file':
+        from .file_manager import FileStorageManager
+        return FileStorageManager(base_path=path)
+    if name == 'sqlite':
+        from .sqlite_backend import SQLiteStorageManager
+        return SQLiteStorageManager(db_path=path)
+    from .log_store import LogStorageManager
+    return LogStorageManager(base_path=path)
@@ -0,0 +1,347 @@
+"""
+SmileLink Storage - Blob Cache
+Cache en disco local del ciphertext de NFS (read-through, write-through)
+
+Sólo se cachean los archivos *.json.enc tal como están en NFS: los datos
+desencriptados nunca tocan el disco. Cada copia local empieza con el sello
+del archivo de NFS del que salió (inode, tamaño y mtime) y es válida sólo si
+coincide con el stat actual. Toda escritura es temporal + rename, así que
+una versión nueva siempre trae otro inode aunque tenga el mismo tamaño y
+caiga en el mismo tick de mtime. Varios procesos del host comparten el
+cache sin más metadata. Un stat sobre NFS lo resuelve el cache de atributos
+del cliente, mucho más barato que abrir y leer el archivo.
+
+Con NFS_CACHE_REVALIDATE_SECONDS > 0 una entrada validada se sirve sin tocar
+NFS durante esa ventana (escrituras de otros hosts se ven con ese retraso).
+
+NFS_CACHE_MAX_BYTES limita el directorio completo, no cada proceso: los
+workers llevan la ocupación en un contador compartido (.usage, bajo flock) y
+el que lo ve pasar del máximo recalcula la ocupación real recorriendo el
+directorio y desaloja lo menos usado (mtime, que se renueva en cada acierto)
+hasta LOW_WATERMARK del máximo.
+"""
+import fcntl
+import os
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+
+# Cabecera de cada copia local: magic, inode, tamaño y mtime (ns) del archivo en NFS
+_STAMP = struct.Struct('<4sQQq')
+_STAMP_MAGIC = b'SLB1'
+
+
+# Contador compartido de ocupación: bytes y entradas
+_USAGE = struct.Struct('<qq')
+USAGE_FILE = '.usage'
+
+# El desalojo baja hasta esta fracción del máximo, para no recorrer el directorio en cada llenado
+LOW_WATERMARK = 0.9
+
+# Un acierto renueva el mtime de la copia local a lo sumo cada tantos segundos por proceso
+TOUCH_INTERVAL_SECONDS = 60
+
+
+def _stamp_of(stat: os.stat_result) -> bytes:
+    return _STAMP.pack(_STAMP_MAGIC, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def _strip_stamp(raw: bytes) -> Optional[bytes]:
+    """Ciphertext de una copia local; None si no tiene cabecera (formato anterior)"""
+    if raw[:len(_STAMP_MAGIC)] != _STAMP_MAGIC or len(raw) < _STAMP.size:
+        return None
+    return raw[_STAMP.size:]
+
+
+class BlobCache:
+    """Cache LRU de ciphertext en disco local frente a un directorio NFS"""
+
+    def __init__(self, source_root: Path, cache_dir: Path, max_bytes: int, revalidate_seconds: float = 0):
+        """
+        Args:
+            source_root: Directorio base en NFS
+            cache_dir: Directorio local del cache
+            max_bytes: Tamaño máximo del directorio de cache, para todos los procesos que lo comparten
+            revalidate_seconds: Ventana en que una entrada validada no se vuelve a comparar con NFS
+        """
+        self.source_root = Path(source_root)
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.revalidate_seconds = revalidate_seconds
+
+        self._lock = threading.Lock()
+        self._touched: Dict[str, float] = {}
+        self._validated: Dict[str, float] = {}
+        self._stats = {'hits': 0, 'misses': 0, 'stale_hits': 0, 'evictions': 0, 'writes': 0}
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._usage_fd = os.open(self.cache_dir / USAGE_FILE, os.O_RDWR | os.O_CREAT, 0o644)
+        self._scan()
+
+    def _relative(self, source: Path) -> str:
+        return str(Path(source).relative_to(self.source_root))
+
+    # ------------------------------------------------------------------
+    # Ocupación compartida entre procesos
+    # ------------------------------------------------------------------
+
+    def _read_usage(self) -> tuple:
+        raw = os.pread(self._usage_fd, _USAGE.size, 0)
+        return _USAGE.unpack(raw) if len(raw) == _USAGE.size else (0, 0)
+
+    def _add_usage(self, delta_bytes: int, delta_entries: int) -> int:
+        """Suma al contador compartido; retorna los bytes totales"""
+        fcntl.flock(self._usage_fd, fcntl.LOCK_EX)
+        try:
+            total_bytes, entries = self._read_usage()
+            total_bytes, entries = max(0, total_bytes + delta_bytes), max(0, entries + delta_entries)
+            os.pwrite(self._usage_fd, _USAGE.pack(total_bytes, entries), 0)
+        finally:
+            fcntl.flock(self._usage_fd, fcntl.LOCK_UN)
+        return total_bytes
+
+    def _scan(self, target_bytes: Optional[int] = None):
+        """
+        Recalcula la ocupación real del directorio y, con target_bytes,
+        desaloja lo menos usado hasta quedar debajo
+
+        Bajo el flock del contador: un solo proceso recorre y desaloja a la vez.
+        """
+        fcntl.flock(self._usage_fd, fcntl.LOCK_EX)
+        try:
+            found = []
+            for path in self.cache_dir.rglob('*.json.enc'):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                found.append((stat.st_mtime_ns, path, stat.st_size))
+            found.sort(key=lambda entry: entry[0])
+            total_bytes = sum(size for _, _, size in found)
+
+            evicted = []
+            if target_bytes is not None:
+                while total_bytes > target_bytes and len(found) > 1:
+                    _, path, size = found.pop(0)
+                    try:
+                        path.unlink()
+                    except FileNotFoundError:
+                        pass
+                    total_bytes -= size
+                    evicted.append(str(path.relative_to(self.cache_dir)))
+
+            os.pwrite(self._usage_fd, _USAGE.pack(total_bytes, len(found)), 0)
+        finally:
+            fcntl.flock(self._usage_fd, fcntl.LOCK_UN)
+
+        if evicted:
+            with self._lock:
+                self._stats['evictions'] += len(evicted)
+                for relative_path in evicted:
+                    self._validated.pop(relative_path, None)
+                    self._touched.pop(relative_path, None)
+
+    # ------------------------------------------------------------------
+    # LRU
+    # ------------------------------------------------------------------
+
+    def _touch(self, relative_path: str):
+        """Marca un acierto en el mtime de la copia local, que ordena el desalojo de todos los procesos"""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._touched.get(relative_path, float('-inf')) < TOUCH_INTERVAL_SECONDS:
+                return
+            self._touched[relative_path] = now
+        try:
+            os.utime(self.cache_dir / relative_path)
+        except FileNotFoundError:
+            pass
+
+    def _forget(self, relative_path: str):
+        with self._lock:
+            self._validated.pop(relative_path, None)
+            self._touched.pop(relative_path, None)
+        local_path = self.cache_dir / relative_path
+        try:
+            size = local_path.stat().st_size
+            local_path.unlink()
+        except FileNotFoundError:
+            return
+        self._add_usage(-size, -1)
+
+    def _evict_if_full(self, total_bytes: int):
+        if total_bytes > self.max_bytes:
+            self._scan(target_bytes=int(self.max_bytes * LOW_WATERMARK))
+
+    # ------------------------------------------------------------------
+    # Lectura / escritura
+    # ------------------------------------------------------------------
+
+    def _fill(self, relative_path: str, data: bytes, stamp: os.stat_result):
+        """Guarda una copia local precedida del sello del archivo en NFS"""
+        local_path = self.cache_dir / relative_path
+        try:
+            local_path.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                previous = local_path.stat().st_size
+            except FileNotFoundError:
+                previous = None
+            tmp_path = local_path.with_name(f".{local_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            with open(tmp_path, 'wb') as f:
+                f.write(_stamp_of(stamp))
+                f.write(data)
+            os.replace(tmp_path, local_path)
+        except OSError as e:
+            print(f"Error filling blob cache for {relative_path}: {e}")
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._validated[relative_path] = now
+            self._touched[relative_path] = now
+        size = _STAMP.size + len(data)
+        total_bytes = self._add_usage(size - (previous or 0), 0 if previous is not None else 1)
+        self._evict_if_full(total_bytes)
+
+    def _trusted(self, relative_path: str) -> bool:
+        if self.revalidate_seconds <= 0:
+            return False
+        with self._lock:
+            validated_at = self._validated.get(relative_path)
+        return validated_at is not None and time.monotonic() - validated_at < self.revalidate_seconds
+
+    def read(self, source: Path) -> Optional[bytes]:
+        """
+        Lee el ciphertext de un archivo NFS pasando por el cache
+
+        Args:
+            source: Ruta del archivo en NFS
+
+        Returns:
+            bytes: Contenido, o None si el archivo no existe en NFS
+        """
+        relative_path = self._relative(source)
+        local_path = self.cache_dir / relative_path
+
+        if self._trusted(relative_path):
+            try:
+                with open(local_path, 'rb') as f:
+                    raw = f.read()
+                data = _strip_stamp(raw)
+                if data is not None:
+                    with self._lock:
+                        self._stats['hits'] += 1
+                    self._touch(relative_path)
+                    return data
+            except FileNotFoundError:
+                pass
+
+        try:
+            stamp = os.stat(source)
+        except FileNotFoundError:
+            self._forget(relative_path)
+            return None
+
+        try:
+            with open(local_path, 'rb') as f:
+                header = f.read(_STAMP.size)
+                data = f.read() if header == _stamp_of(stamp) else None
+            if data is not None and len(data) == stamp.st_size:
+                with self._lock:
+                    self._stats['hits'] += 1
+                    self._validated[relative_path] = time.monotonic()
+                self._touch(relative_path)
+                return data
+        except FileNotFoundError:
+            pass
+
+        # Miss: el sello se tomó antes de leer, así que nunca es más nuevo que el dato
+        try:
+            with open(source, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            self._forget(relative_path)
+            return None
+        with self._lock:
+            self._stats['misses'] += 1
+        self._fill(relative_path, data, stamp)
+        return data
+
+    def read_cached(self, source: Path) -> Optional[bytes]:
+        """Copia local sin validar contra NFS (modo degradado); None si no está en cache"""
+        relative_path = self._relative(source)
+        try:
+            with open(self.cache_dir / relative_path, 'rb') as f:
+                raw = f.read()
+        except FileNotFoundError:
+            return None
+        data = _strip_stamp(raw)
+        if data is None:
+            return None
+        with self._lock:
+            self._stats['stale_hits'] += 1
+        self._touch(relative_path)
+        return data
+
+    def exists(self, source: Path) -> bool:
+        """Verifica existencia, sin tocar NFS si la entrada está en su ventana de confianza"""
+        relative_path = self._relative(source)
+        if self._trusted(relative_path) and (self.cache_dir / relative_path).exists():
+            return True
+        return Path(source).exists()
+
+    def write(self, source: Path, data: bytes):
+        """Escribe en NFS (temporal + rename) y deja la misma versión en el cache (write-through)"""
+        tmp_path = Path(source).with_name(f".{Path(source).name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            # Sello del temporal ya cerrado (el rename conserva inode y mtime), no de lo
+            # que haya en la ruta después: otro host puede reemplazarlo entretanto
+            stamp = os.stat(tmp_path)
+            os.replace(tmp_path, source)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        with self._lock:
+            self._stats['writes'] += 1
+        self._fill(self._relative(source), data, stamp)
+
+    def invalidate(self, source: Path):
+        """Descarta la copia local de un archivo escrito o borrado por otra vía"""
+        self._forget(self._relative(source))
+
+    def stats(self) -> Dict[str, Any]:
+        """Contadores de este proceso y ocupación del directorio (compartida por todos los workers)"""
+        total_bytes, entries = self._read_usage()
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            return {
+                **self._stats,
+                'hit_ratio': round(self._stats['hits'] / lookups, 4) if lookups else None,
+                'entries': entries,
+                'bytes': total_bytes,
+                'max_bytes': self.max_bytes,
+                'cache_dir': str(self.cache_dir),
+            }
+
+    def close(self):
+        """Cierra el contador compartido"""
+        if self._usage_fd is not None:
+            os.close(self._usage_fd)
+            self._usage_fd = None
+
+
+def blob_cache_from_env(source_root: Path) -> Optional[BlobCache]:
+    """BlobCache según la configuración, o None si está desactivado"""
+    if os.getenv('NFS_CACHE_ENABLED', 'True').lower() != 'true':
+        return None
+    cache_dir = os.getenv('NFS_CACHE_PATH', '') or str(Path(__file__).resolve().parent.parent / 'nfs_cache')
+    return BlobCache(
+        source_root,
+        Path(cache_dir),
+        max_bytes=int(os.getenv('NFS_CACHE_MAX_BYTES', str(512 * 1024 * 1024))),
+        revalidate_seconds=float(os.getenv('NFS_CACHE_REVALIDATE_SECONDS', '0')),
+    )
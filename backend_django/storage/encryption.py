@@ -2,13 +2,15 @@
 SmileLink Storage - Encryption Manager
 Maneja encriptación/desencriptación AES-256 de archivos JSON
 """
+import hashlib
+import hmac
 import json
 import os
+import time
 from cryptography.fernet import Fernet
 from typing import Dict, Any
-from dotenv import load_dotenv
-
-load_dotenv()
+from .metrics import ENCRYPTION_BYTES, ENCRYPTION_SECONDS
+from .tracing import add_span
 
 
 class EncryptionManager:
@@ -23,7 +25,22 @@ class EncryptionManager:
             print(f"⚠️  WARNING: Using temporary encryption key: {encryption_key}")
             print("   Set ENCRYPTION_KEY in .env for production!")
         
-        self.cipher = Fernet(encryption_key.encode() if isinstance(encryption_key, str) else encryption_key)
+        key_bytes = encryption_key.encode() if isinstance(encryption_key, str) else encryption_key
+        self.cipher = Fernet(key_bytes)
+        # Llave separada para índices HMAC (nunca se usa la de encriptación directamente)
+        self._hmac_key = hashlib.sha256(b'smilelink-index:' + key_bytes).digest()
+    
+    def hmac_digest(self, value: str) -> str:
+        """
+        HMAC-SHA256 de un valor, para indexar campos sensibles sin guardarlos en claro
+        
+        Args:
+            value: Valor a indexar (ej: un email)
+            
+        Returns:
+            str: Digest hexadecimal
+        """
+        return hmac.new(self._hmac_key, value.encode('utf-8'), hashlib.sha256).hexdigest()
     
     def encrypt_data(self, data: Dict[str, Any]) -> bytes:
         """
@@ -35,10 +52,14 @@ class EncryptionManager:
         Returns:
             bytes: Datos encriptados
         """
+        started = time.perf_counter()
         try:
             json_str = json.dumps(data, ensure_ascii=False, indent=2)
             json_bytes = json_str.encode('utf-8')
             encrypted = self.cipher.encrypt(json_bytes)
+            ENCRYPTION_SECONDS.observe(time.perf_counter() - started, operation='encrypt')
+            ENCRYPTION_BYTES.inc(len(encrypted), operation='encrypt')
+            add_span('encrypt', started, bytes=len(encrypted))
             return encrypted
         except Exception as e:
             raise Exception(f"Error al encriptar datos: {str(e)}")
@@ -53,10 +74,14 @@ class EncryptionManager:
         Returns:
             dict: Datos desencriptados
         """
+        started = time.perf_counter()
         try:
             decrypted_bytes = self.cipher.decrypt(encrypted_data)
             json_str = decrypted_bytes.decode('utf-8')
             data = json.loads(json_str)
+            ENCRYPTION_SECONDS.observe(time.perf_counter() - started, operation='decrypt')
+            ENCRYPTION_BYTES.inc(len(encrypted_data), operation='decrypt')
+            add_span('decrypt', started, bytes=len(encrypted_data))
             return data
         except Exception as e:
             raise Exception(f"Error al desencriptar datos: {str(e)}")
@@ -5,22 +5,76 @@ Soporta almacenamiento local y NFS
 """
 import os
 import json
+import fcntl
+import threading
+import time
 from typing import Dict, List, Any, Optional
 from pathlib import Path
-from dotenv import load_dotenv
 from .encryption import get_encryption_manager
+from .backend import StorageBackend
+from .metrics import STORAGE_READ_BYTES, STORAGE_WRITTEN_BYTES, timed_storage_operation
+from .tracing import add_span, span
+from .write_batch import WriteBatch, atomic_write, recover_journal
+from .blob_cache import blob_cache_from_env
+from .nfs_health import StorageUnavailable, get_nfs_health_monitor
+from .snapshot import snapshot_store_from_env
 
-load_dotenv()
+# Mayor número de ID entregado por prefijo; con punto inicial para que fsck y rebuild_index lo ignoren
+ID_HIGH_WATER_NAME = '.id_high_water.json'
 
 
-class FileStorageManager:
+def natural_id_key(entity_id: str):
+    """Llave de orden natural para IDs: ('N', 2) < ('N', 10)"""
+    prefix = entity_id.rstrip('0123456789')
+    number = entity_id[len(prefix):]
+    return (prefix, int(number) if number else -1, entity_id)
+
+
+class IndexLock:
+    """
+    Lock reentrante entre hilos y entre procesos (flock sobre un archivo)
+    
+    Varios workers (o varios hosts sobre NFS) escriben el mismo directorio:
+    el RLock ordena los hilos de este proceso y el flock a los procesos.
+    El archivo se abre en cada adquisición externa para que procesos hijos
+    de un fork no compartan el mismo lock.
+    """
+    
+    def __init__(self, path: Path):
+        self.path = path
+        self._rlock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+    
+    def __enter__(self):
+        self._rlock.acquire()
+        if self._depth == 0:
+            try:
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            except BaseException:
+                self._rlock.release()
+                raise
+            self._fd = fd
+        self._depth += 1
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self._depth -= 1
+        if self._depth == 0:
+            fd, self._fd = self._fd, None
+            try:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            finally:
+                os.close(fd)
+        self._rlock.release()
+        return False
+
+
+class FileStorageManager(StorageBackend):
     """Maneja almacenamiento y recuperación de archivos JSON encriptados"""
     
-    # Tipos de entidades soportadas
-    ENTITY_TYPES = [
-        'ninos', 'padrinos', 'apadrinamientos', 'entregas',
-        'solicitudes', 'puntos_entrega', 'eventos', 'administradores'
-    ]
+    name = 'file'
     
     def __init__(self, base_path: Optional[str] = None):
         """
@@ -43,8 +97,28 @@ class FileStorageManager:
             local_path = os.getenv('LOCAL_STORAGE_PATH', './local_data')
             self.base_path = Path(local_path)
         
+        # Serializa lectura-modificación-escritura de índices entre hilos y procesos
+        self.base_path.mkdir(parents=True, exist_ok=True)
+        self._index_lock = IndexLock(self.base_path / '.index.lock')
+        
+        # Cache local del ciphertext: sólo tiene sentido frente a NFS
+        self.blob_cache = blob_cache_from_env(self.base_path) if use_nfs and not base_path else None
+        
         # Crear directorios si no existen
+        self.health = None
+        self.snapshot = None
         self._initialize_storage()
+        
+        # Snapshot desencriptado compartido entre los workers del host (SNAPSHOT_ENABLED)
+        if not base_path:
+            self.snapshot = snapshot_store_from_env(self)
+            if self.snapshot is not None and self._recovered_batches:
+                for entity_type in self.ENTITY_TYPES:
+                    self.snapshot.bump(entity_type)
+        
+        # Con NFS no saludable: lecturas desde el cache local y escrituras rechazadas
+        if use_nfs and not base_path:
+            self.health = get_nfs_health_monitor()
     
     def _initialize_storage(self):
         """Crea estructura de directorios para todas las entidades"""
@@ -58,6 +132,13 @@ class FileStorageManager:
             index_path = entity_dir / 'index.json.enc'
             if not index_path.exists():
                 self._save_index(entity_type, [])
+        
+        # Re-aplicar write batches confirmados que no alcanzaron a aplicarse
+        # (bajo el lock de índices: otros workers pueden estar escribiendo)
+        with self._index_lock:
+            recovered = self._recovered_batches = recover_journal(self.base_path, self.encryption)
+        if recovered:
+            print(f"Recovered {recovered} pending write batch(es)")
     
     def _get_entity_path(self, entity_type: str, entity_id: str) -> Path:
         """Retorna ruta completa para un archivo de entidad"""
@@ -67,43 +148,169 @@ class FileStorageManager:
         """Retorna ruta del archivo índice"""
         return self.base_path / entity_type / 'index.json.enc'
     
-    def _load_index(self, entity_type: str) -> List[str]:
-        """Carga lista de IDs del índice"""
-        index_path = self._get_index_path(entity_type)
-        
-        if not index_path.exists():
-            return []
+    def write_batch(self) -> WriteBatch:
+        """
+        Crea un batch de escrituras todo-o-nada entre varias entidades
         
+        Returns:
+            WriteBatch: Usar como context manager; confirma al salir sin error
+        """
+        return WriteBatch(self)
+    
+    def _degraded(self) -> bool:
+        """True si NFS está marcado como no saludable por el monitor"""
+        return self.health is not None and not self.health.healthy
+    
+    def _check_writable(self):
+        """Falla rápido en vez de bloquear el worker escribiendo a un NFS caído"""
+        if self._degraded():
+            raise StorageUnavailable('NFS unhealthy: storage is read-only')
+    
+    def _read_blob(self, path: Path) -> Optional[bytes]:
+        """Lee el ciphertext de un archivo (vía cache local si está activo); None si no existe"""
+        started = time.perf_counter()
+        if self._degraded():
+            data = self.blob_cache.read_cached(path) if self.blob_cache is not None else None
+            if data is None:
+                raise StorageUnavailable(f'NFS unhealthy and {path.name} is not cached locally')
+        elif self.blob_cache is not None:
+            data = self.blob_cache.read(path)
+        else:
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                data = None
+        if data is not None:
+            STORAGE_READ_BYTES.inc(len(data), backend=self.name, entity_type=path.parent.name)
+        add_span('blob.read', started, file=f"{path.parent.name}/{path.name}", bytes=len(data or b''))
+        return data
+    
+    def _write_blob(self, path: Path, encrypted: bytes):
+        """Escribe el ciphertext de un archivo (write-through al cache local si está activo)"""
+        self._check_writable()
+        started = time.perf_counter()
+        if self.blob_cache is not None:
+            self.blob_cache.write(path, encrypted)
+        else:
+            atomic_write(path, encrypted)
+        STORAGE_WRITTEN_BYTES.inc(len(encrypted), backend=self.name, entity_type=path.parent.name)
+        add_span('blob.write', started, file=f"{path.parent.name}/{path.name}", bytes=len(encrypted))
+    
+    def _snapshot_view(self, entity_type: str):
+        return self.snapshot.view(entity_type) if self.snapshot is not None else None
+    
+    def _invalidate_cache(self, entity_type: str, entity_id: Optional[str] = None):
+        """Invalida el cache de lecturas y los snapshots del tipo"""
+        super()._invalidate_cache(entity_type, entity_id)
+        if self.snapshot is not None:
+            self.snapshot.bump(entity_type)
+    
+    def _read_index(self, entity_type: str) -> List[str]:
+        """Lee el índice desde el snapshot o desde disco"""
+        view = self._snapshot_view(entity_type)
+        if view is not None:
+            return list(view.ids)
+        return self._read_index_file(entity_type)
+    
+    def _read_index_file(self, entity_type: str) -> List[str]:
+        """Lee y desencripta el índice desde disco"""
         try:
-            with open(index_path, 'rb') as f:
-                encrypted = f.read()
+            encrypted = self._read_blob(self._get_index_path(entity_type))
+            if encrypted is None:
+                return []
             return self.encryption.decrypt_data(encrypted)
+        except StorageUnavailable:
+            raise
         except Exception as e:
             print(f"Error loading index for {entity_type}: {e}")
             return []
     
+    def _read_index_for_update(self, entity_type: str) -> List[str]:
+        """
+        Lee el índice directo del disco para modificarlo (llamar con _index_lock)
+        
+        Sin pasar por el cache de lecturas ni el cache local de NFS, que pueden
+        tener una versión anterior a la escritura de otro proceso. Si el índice
+        existe pero no se puede leer, falla en vez de retornar una lista vacía
+        que después se guardaría encima del índice bueno.
+        """
+        try:
+            with open(self._get_index_path(entity_type), 'rb') as f:
+                encrypted = f.read()
+        except FileNotFoundError:
+            return []
+        index = self.encryption.decrypt_data(encrypted)
+        if not isinstance(index, list):
+            raise ValueError(f"Index for {entity_type} is not a list")
+        return index
+    
+    def _read_high_water(self, entity_type: str) -> Dict[str, int]:
+        """Mayor número de ID entregado por prefijo (llamar con _index_lock)"""
+        try:
+            with open(self.base_path / entity_type / ID_HIGH_WATER_NAME, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+    
+    def allocate_ids(self, entity_type: str, prefix: str, count: int) -> List[str]:
+        """
+        Reserva un bloque de IDs consecutivos, únicos entre procesos
+        
+        Además del índice se guarda el mayor número entregado: dos workers no
+        reciben el mismo ID aunque ninguno haya guardado todavía, y un ID
+        borrado no se vuelve a entregar.
+        
+        Args:
+            entity_type: Tipo de entidad
+            prefix: Prefijo del ID
+            count: Número de IDs a generar
+            
+        Returns:
+            list: IDs consecutivos (ej: ['E010', 'E011', 'E012'])
+        """
+        if entity_type not in self.ENTITY_TYPES:
+            raise ValueError(f"Invalid entity type: {entity_type}")
+        
+        self._check_writable()
+        with self._index_lock:
+            index = self._read_index_for_update(entity_type)
+            high_water = self._read_high_water(entity_type)
+            start = max(self._max_id_number(index, prefix), high_water.get(prefix, 0)) + 1
+            high_water[prefix] = start + count - 1
+            atomic_write(
+                self.base_path / entity_type / ID_HIGH_WATER_NAME,
+                json.dumps(high_water).encode('utf-8')
+            )
+        return [f"{prefix}{str(num).zfill(3)}" for num in range(start, start + count)]
+    
     def _save_index(self, entity_type: str, index: List[str]):
         """Guarda lista de IDs en el índice"""
-        index_path = self._get_index_path(entity_type)
-        encrypted = self.encryption.encrypt_data(index)
+        with span('index.write', entity_type=entity_type, entries=len(index)):
+            index_path = self._get_index_path(entity_type)
+            encrypted = self.encryption.encrypt_data(index)
+            
+            self._write_blob(index_path, encrypted)
         
-        with open(index_path, 'wb') as f:
-            f.write(encrypted)
+        self._invalidate_cache(entity_type)
     
     def _add_to_index(self, entity_type: str, entity_id: str):
         """Agrega un ID al índice si no existe"""
-        index = self._load_index(entity_type)
-        if entity_id not in index:
-            index.append(entity_id)
-            self._save_index(entity_type, index)
+        with self._index_lock:
+            index = self._read_index_for_update(entity_type)
+            if entity_id not in index:
+                index.append(entity_id)
+                self._save_index(entity_type, index)
     
     def _remove_from_index(self, entity_type: str, entity_id: str):
         """Remueve un ID del índice"""
-        index = self._load_index(entity_type)
-        if entity_id in index:
-            index.remove(entity_id)
-            self._save_index(entity_type, index)
+        with self._index_lock:
+            index = self._read_index_for_update(entity_type)
+            if entity_id in index:
+                index.remove(entity_id)
+                self._save_index(entity_type, index)
     
+    @timed_storage_operation('save')
     def save(self, entity_type: str, entity_id: str, data: Dict[str, Any]) -> bool:
         """
         Guarda una entidad encriptada
@@ -125,141 +332,256 @@ class FileStorageManager:
             
             # Guardar archivo
             file_path = self._get_entity_path(entity_type, entity_id)
-            with open(file_path, 'wb') as f:
-                f.write(encrypted)
+            self._write_blob(file_path, encrypted)
+            self._invalidate_cache(entity_type, entity_id)
             
             # Actualizar índice
             self._add_to_index(entity_type, entity_id)
             
             return True
+        except StorageUnavailable:
+            raise
         except Exception as e:
             print(f"Error saving {entity_type}/{entity_id}: {e}")
             return False
     
-    def load(self, entity_type: str, entity_id: str) -> Optional[Dict[str, Any]]:
+    def _read_entity(self, entity_type: str, entity_id: str) -> Optional[Dict[str, Any]]:
+        """Lee una entidad desde el snapshot o desde disco"""
+        view = self._snapshot_view(entity_type)
+        if view is not None:
+            return view.load(entity_id)
+        return self._read_entity_file(entity_type, entity_id)
+    
+    def _read_entity_file(self, entity_type: str, entity_id: str) -> Optional[Dict[str, Any]]:
+        """Lee y desencripta una entidad desde disco"""
+        try:
+            encrypted = self._read_blob(self._get_entity_path(entity_type, entity_id))
+            if encrypted is None:
+                return None
+            return self.encryption.decrypt_data(encrypted)
+        except StorageUnavailable:
+            raise
+        except Exception as e:
+            print(f"Error loading {entity_type}/{entity_id}: {e}")
+            return None
+    
+    @timed_storage_operation('delete')
+    def delete(self, entity_type: str, entity_id: str) -> bool:
         """
-        Carga una entidad desencriptada
+        Elimina una entidad
         
         Args:
             entity_type: Tipo de entidad
             entity_id: ID de la entidad
             
         Returns:
-            dict: Datos desencriptados o None si no existe
+            bool: True si se eliminó exitosamente
         """
         if entity_type not in self.ENTITY_TYPES:
             raise ValueError(f"Invalid entity type: {entity_type}")
         
+        self._check_writable()
         file_path = self._get_entity_path(entity_type, entity_id)
         
         if not file_path.exists():
-            return None
+            return False
         
         try:
-            with open(file_path, 'rb') as f:
-                encrypted = f.read()
-            return self.encryption.decrypt_data(encrypted)
+            file_path.unlink()
+            if self.blob_cache is not None:
+                self.blob_cache.invalidate(file_path)
+            self._invalidate_cache(entity_type, entity_id)
+            self._remove_from_index(entity_type, entity_id)
+            return True
         except Exception as e:
-            print(f"Error loading {entity_type}/{entity_id}: {e}")
-            return None
+            print(f"Error deleting {entity_type}/{entity_id}: {e}")
+            return False
     
-    def list_all(self, entity_type: str) -> List[Dict[str, Any]]:
+    def load_raw(self, entity_type: str, entity_id: str) -> Optional[bytes]:
+        """Ciphertext del archivo de una entidad, o None si no existe"""
+        if entity_type not in self.ENTITY_TYPES:
+            raise ValueError(f"Invalid entity type: {entity_type}")
+        return self._read_blob(self._get_entity_path(entity_type, entity_id))
+    
+    def delete_if_unchanged(self, entity_type: str, expected: Dict[str, bytes]) -> List[str]:
         """
-        Lista todas las entidades de un tipo
+        Borra entidades sólo si su ciphertext sigue siendo el esperado
+
+        Cada archivo se renombra a un temporal (atómico: captura exactamente
+        la versión vigente) y se compara; si otro request lo reescribió, esa
+        versión vuelve a su lugar salvo que ya exista una aún más nueva.
         
         Args:
             entity_type: Tipo de entidad
+            expected: {entity_id: ciphertext leído antes}
             
         Returns:
-            list: Lista de todas las entidades
+            list: IDs borrados
         """
         if entity_type not in self.ENTITY_TYPES:
             raise ValueError(f"Invalid entity type: {entity_type}")
         
-        index = self._load_index(entity_type)
-        entities = []
-        
-        for entity_id in index:
-            data = self.load(entity_type, entity_id)
-            if data:
-                entities.append(data)
+        self._check_writable()
+        deleted, claimed = [], []
+        with self._index_lock:
+            for entity_id, blob in expected.items():
+                path = self._get_entity_path(entity_type, entity_id)
+                tmp_path = path.with_name(f".{path.name}.{os.getpid()}.delete.tmp")
+                try:
+                    os.rename(path, tmp_path)
+                except FileNotFoundError:
+                    continue
+                with open(tmp_path, 'rb') as f:
+                    unchanged = f.read() == blob
+                if unchanged:
+                    deleted.append(entity_id)
+                    claimed.append(tmp_path)
+                    continue
+                try:
+                    os.link(tmp_path, path)
+                except FileExistsError:
+                    pass  # ya hay una versión más nueva
+                tmp_path.unlink()
+            
+            if deleted:
+                index = self._read_index_for_update(entity_type)
+                gone = set(deleted)
+                self._save_index(entity_type, [i for i in index if i not in gone])
         
-        return entities
+        for tmp_path in claimed:
+            tmp_path.unlink(missing_ok=True)
+        for entity_id in deleted:
+            if self.blob_cache is not None:
+                self.blob_cache.invalidate(self._get_entity_path(entity_type, entity_id))
+            self._invalidate_cache(entity_type, entity_id)
+        return deleted
     
-    def delete(self, entity_type: str, entity_id: str) -> bool:
+    @timed_storage_operation('save_many')
+    def save_many(self, entity_type: str, records: Dict[str, Dict[str, Any]]) -> List[str]:
         """
-        Elimina una entidad
+        Guarda varias entidades con una sola actualización del índice
         
         Args:
             entity_type: Tipo de entidad
-            entity_id: ID de la entidad
+            records: Diccionario {entity_id: data}
             
         Returns:
-            bool: True si se eliminó exitosamente
+            list: IDs guardados exitosamente, en el orden recibido. Si falla
+            la actualización del índice se borran los archivos recién creados
+            y sólo se retornan las entidades que ya existían.
         """
         if entity_type not in self.ENTITY_TYPES:
             raise ValueError(f"Invalid entity type: {entity_type}")
+        # Antes del primer stat: con NFS caído no se bloquea el worker
+        self._check_writable()
         
-        file_path = self._get_entity_path(entity_type, entity_id)
+        saved_ids = []
+        created_paths = []
         
-        if not file_path.exists():
-            return False
+        for entity_id, data in records.items():
+            try:
+                encrypted = self.encryption.encrypt_data(data)
+                file_path = self._get_entity_path(entity_type, entity_id)
+                existed = file_path.exists()
+                self._write_blob(file_path, encrypted)
+                self._invalidate_cache(entity_type, entity_id)
+                saved_ids.append(entity_id)
+                if not existed:
+                    created_paths.append((entity_id, file_path))
+            except StorageUnavailable:
+                raise
+            except Exception as e:
+                print(f"Error saving {entity_type}/{entity_id}: {e}")
         
-        try:
-            file_path.unlink()
-            self._remove_from_index(entity_type, entity_id)
-            return True
-        except Exception as e:
-            print(f"Error deleting {entity_type}/{entity_id}: {e}")
-            return False
+        if saved_ids:
+            try:
+                with self._index_lock:
+                    index = self._read_index_for_update(entity_type)
+                    known = set(index)
+                    new_ids = [entity_id for entity_id in saved_ids if entity_id not in known]
+                    if new_ids:
+                        index.extend(new_ids)
+                        self._save_index(entity_type, index)
+            except StorageUnavailable:
+                raise
+            except Exception as e:
+                print(f"Error updating index for {entity_type}: {e}")
+                # Sin índice los archivos nuevos quedarían huérfanos: se deshacen.
+                # Los que ya existían quedan actualizados y siguen en el índice.
+                rolled_back = set()
+                for entity_id, file_path in created_paths:
+                    try:
+                        file_path.unlink()
+                        self._invalidate_cache(entity_type, entity_id)
+                        rolled_back.add(entity_id)
+                    except FileNotFoundError:
+                        rolled_back.add(entity_id)
+                    except OSError as unlink_error:
+                        # Lo reporta fsck_storage como huérfano; --repair lo indexa
+                        print(f"Error rolling back {entity_type}/{entity_id}: {unlink_error}")
+                return [entity_id for entity_id in saved_ids if entity_id not in rolled_back]
+        
+        return saved_ids
     
-    def exists(self, entity_type: str, entity_id: str) -> bool:
-        """Verifica si una entidad existe"""
-        file_path = self._get_entity_path(entity_type, entity_id)
-        return file_path.exists()
+    def list_all(self, entity_type: str) -> List[Dict[str, Any]]:
+        """Lista todas las entidades de un tipo; con snapshot vigente, sin desencriptar"""
+        view = self._snapshot_view(entity_type)
+        if view is None:
+            return super().list_all(entity_type)
+        return self._list_snapshot(entity_type, view)
     
-    def update(self, entity_type: str, entity_id: str, data: Dict[str, Any]) -> bool:
-        """Actualiza una entidad (alias de save)"""
-        return self.save(entity_type, entity_id, data)
+    @timed_storage_operation('list_all')
+    def _list_snapshot(self, entity_type: str, view) -> List[Dict[str, Any]]:
+        with span('snapshot.read', entity_type=entity_type, bytes=view.size):
+            return view.list_all()
     
-    def get_next_id(self, entity_type: str, prefix: str) -> str:
+    def rebuild_index(self, entity_type: str) -> List[str]:
         """
-        Genera el siguiente ID disponible para una entidad
+        Reconstruye el índice a partir de los archivos del directorio
         
         Args:
             entity_type: Tipo de entidad
-            prefix: Prefijo del ID (ej: 'N' para niños, 'P' para padrinos)
             
         Returns:
-            str: Siguiente ID disponible (ej: 'N005')
+            list: IDs del nuevo índice, en orden natural (N002 antes que N010)
         """
-        index = self._load_index(entity_type)
-        
-        if not index:
-            return f"{prefix}001"
+        if entity_type not in self.ENTITY_TYPES:
+            raise ValueError(f"Invalid entity type: {entity_type}")
         
-        # Extraer números de los IDs existentes
-        numbers = []
-        for entity_id in index:
-            try:
-                num = int(entity_id.replace(prefix, ''))
-                numbers.append(num)
-            except ValueError:
-                continue
+        entity_dir = self.base_path / entity_type
+        suffix = '.json.enc'
+        entity_ids = [
+            path.name[:-len(suffix)]
+            for path in entity_dir.glob(f'*{suffix}')
+            if path.name != 'index.json.enc' and not path.name.startswith('.')
+        ]
+        entity_ids.sort(key=natural_id_key)
         
-        if not numbers:
-            return f"{prefix}001"
+        with self._index_lock:
+            self._save_index(entity_type, entity_ids)
         
-        next_num = max(numbers) + 1
-        return f"{prefix}{str(next_num).zfill(3)}"
+        return entity_ids
+    
+    def exists(self, entity_type: str, entity_id: str) -> bool:
+        """Verifica si una entidad existe"""
+        file_path = self._get_entity_path(entity_type, entity_id)
+        if self._degraded():
+            return self._read_blob(file_path) is not None
+        if self.blob_cache is not None:
+            return self.blob_cache.exists(file_path)
+        return file_path.exists()
 
 
 # Singleton instance
 _storage_manager = None
+_storage_manager_lock = threading.Lock()
 
 def get_storage_manager() -> FileStorageManager:
     """Retorna instancia singleton del FileStorageManager"""
     global _storage_manager
     if _storage_manager is None:
-        _storage_manager = FileStorageManager()
+        # Double-checked: las primeras peticiones concurrentes no construyen dos instancias
+        with _storage_manager_lock:
+            if _storage_manager is None:
+                _storage_manager = FileStorageManager()
     return _storage_manager
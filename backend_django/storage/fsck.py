@@ -0,0 +1,232 @@
+"""
+SmileLink Storage - Fsck
+Verificación en paralelo del almacenamiento de archivos y reparación de índices
+
+Por cada tipo se lista el directorio (os.scandir, sin stat por archivo) y
+un pool de hilos lee y desencripta cada entidad en lotes, comprobando que
+el campo ID coincida con el nombre del archivo. Se reporta:
+
+    orphans     archivos válidos que no están en el índice (invisibles en list_all)
+    dangling    entradas del índice sin archivo
+    duplicates  IDs repetidos en el índice
+    corrupt     archivos que no desencriptan o no son un objeto
+    mismatched  archivos cuyo campo ID no coincide con el nombre
+    stale_tmp   temporales de escrituras interrumpidas
+
+La reparación reescribe el índice conservando el orden existente y agrega
+los huérfanos en orden natural. Los archivos corruptos no se borran (la
+réplica HDFS puede tener la versión buena): quedan fuera del índice y con
+quarantine se mueven a _quarantine/.
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from .file_manager import FileStorageManager, get_storage_manager, natural_id_key
+
+ENTITY_SUFFIX = '.json.enc'
+INDEX_NAME = 'index.json.enc'
+QUARANTINE_DIR = '_quarantine'
+STALE_TMP_SECONDS = 3600
+
+
+class StorageChecker:
+    """Revisa y repara los índices de un FileStorageManager"""
+
+    def __init__(self, storage: Optional[FileStorageManager] = None, workers: int = 16, batch_size: int = 256):
+        """
+        Args:
+            storage: FileStorageManager a revisar (por defecto el singleton)
+            workers: Hilos que leen y desencriptan
+            batch_size: Archivos por tarea del pool
+        """
+        self.storage = storage or get_storage_manager()
+        self.encryption = self.storage.encryption
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+
+    # ------------------------------------------------------------------
+    # Revisión
+    # ------------------------------------------------------------------
+
+    def _scan_dir(self, entity_type: str):
+        """IDs de entidades y temporales del directorio del tipo"""
+        entity_ids, tmp_files = [], []
+        entity_dir = self.storage.base_path / entity_type
+        if not entity_dir.exists():
+            return entity_ids, tmp_files
+        with os.scandir(entity_dir) as entries:
+            for entry in entries:
+                name = entry.name
+                if name.startswith('.'):
+                    if name.endswith('.tmp'):
+                        tmp_files.append(name)
+                    continue
+                if name.endswith(ENTITY_SUFFIX) and name != INDEX_NAME:
+                    entity_ids.append(name[:-len(ENTITY_SUFFIX)])
+        return entity_ids, tmp_files
+
+    def _read_index_raw(self, entity_type: str) -> Optional[List[str]]:
+        """Índice en disco (sin cache); None si no se puede leer"""
+        try:
+            with open(self.storage._get_index_path(entity_type), 'rb') as f:
+                index = self.encryption.decrypt_data(f.read())
+            return index if isinstance(index, list) else None
+        except Exception:
+            return None
+
+    def _check_batch(self, entity_type: str, entity_ids: List[str]) -> Dict[str, List]:
+        id_field = self.storage.ID_FIELDS.get(entity_type)
+        entity_dir = self.storage.base_path / entity_type
+        result = {'valid': [], 'corrupt': [], 'mismatched': []}
+        for entity_id in entity_ids:
+            try:
+                with open(entity_dir / f"{entity_id}{ENTITY_SUFFIX}", 'rb') as f:
+                    entity = self.encryption.decrypt_data(f.read())
+            except FileNotFoundError:
+                # Borrado entre el listado y la lectura
+                continue
+            except Exception as e:
+                result['corrupt'].append([entity_id, str(e) or type(e).__name__])
+                continue
+            if not isinstance(entity, dict):
+                result['corrupt'].append([entity_id, 'decrypted payload is not an object'])
+            elif id_field and entity.get(id_field) != entity_id:
+                result['mismatched'].append([entity_id, f"{id_field}={entity.get(id_field)}"])
+            else:
+                result['valid'].append(entity_id)
+        return result
+
+    def check_type(self, entity_type: str, executor: ThreadPoolExecutor) -> Dict[str, Any]:
+        """Revisa un tipo; ver check()"""
+        started = time.time()
+        entity_ids, tmp_files = self._scan_dir(entity_type)
+        index = self._read_index_raw(entity_type)
+
+        futures = [
+            executor.submit(self._check_batch, entity_type, entity_ids[start:start + self.batch_size])
+            for start in range(0, len(entity_ids), self.batch_size)
+        ]
+        valid, corrupt, mismatched = [], [], []
+        for future in futures:
+            result = future.result()
+            valid.extend(result['valid'])
+            corrupt.extend(result['corrupt'])
+            mismatched.extend(result['mismatched'])
+
+        on_disk = set(entity_ids)
+        indexed = set(index or [])
+        seen, duplicates = set(), []
+        for entity_id in index or []:
+            if entity_id in seen:
+                duplicates.append(entity_id)
+            seen.add(entity_id)
+
+        now = time.time()
+        entity_dir = self.storage.base_path / entity_type
+        stale_tmp = []
+        for name in tmp_files:
+            try:
+                if now - (entity_dir / name).stat().st_mtime > STALE_TMP_SECONDS:
+                    stale_tmp.append(name)
+            except FileNotFoundError:
+                continue
+
+        return {
+            'files': len(entity_ids),
+            'indexed': len(index or []),
+            'index_readable': index is not None,
+            'valid': valid,
+            'orphans': sorted((i for i in valid if i not in indexed), key=natural_id_key),
+            'dangling': [i for i in (index or []) if i not in on_disk],
+            'duplicates': duplicates,
+            'corrupt': corrupt,
+            'mismatched': mismatched,
+            'stale_tmp': stale_tmp,
+            'seconds': round(time.time() - started, 3),
+        }
+
+    def check(self, entity_types: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        Revisa los tipos indicados
+
+        Returns:
+            dict: {entity_type: reporte} con las listas de IDs afectados
+        """
+        entity_types = entity_types or list(self.storage.ENTITY_TYPES)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return {entity_type: self.check_type(entity_type, executor) for entity_type in entity_types}
+
+    @staticmethod
+    def has_problems(report: Dict[str, Any]) -> bool:
+        """True si el reporte de un tipo requiere reparación"""
+        return bool(
+            not report['index_readable'] or report['orphans'] or report['dangling'] or report['duplicates']
+            or report['corrupt'] or report['mismatched'] or report['stale_tmp']
+        )
+
+    # ------------------------------------------------------------------
+    # Reparación
+    # ------------------------------------------------------------------
+
+    def _quarantine(self, entity_type: str, entity_ids: List[str]) -> int:
+        target_dir = self.storage.base_path / QUARANTINE_DIR / entity_type
+        target_dir.mkdir(parents=True, exist_ok=True)
+        stamp = time.strftime('%Y%m%d%H%M%S')
+        moved = 0
+        for entity_id in entity_ids:
+            source = self.storage._get_entity_path(entity_type, entity_id)
+            try:
+                os.replace(source, target_dir / f"{entity_id}{ENTITY_SUFFIX}.{stamp}")
+                moved += 1
+            except FileNotFoundError:
+                continue
+            if self.storage.blob_cache is not None:
+                self.storage.blob_cache.invalidate(source)
+        return moved
+
+    def repair(self, entity_type: str, report: Dict[str, Any], quarantine: bool = False) -> Dict[str, Any]:
+        """
+        Reescribe el índice de un tipo a partir de un reporte de check()
+
+        Conserva el orden del índice actual (re-leído bajo el lock, así las
+        altas hechas después de la revisión no se pierden), quita entradas
+        sin archivo o inválidas y agrega los huérfanos en orden natural.
+
+        Returns:
+            dict: Tamaño del índice antes/después, temporales borrados y archivos en cuarentena
+        """
+        storage = self.storage
+        storage._check_writable()
+        invalid = {entity_id for entity_id, _ in report['corrupt'] + report['mismatched']}
+        entity_dir = storage.base_path / entity_type
+
+        with storage._index_lock:
+            current = self._read_index_raw(entity_type) or []
+            new_index, seen = [], set()
+            for entity_id in current + report['orphans']:
+                if entity_id in seen or entity_id in invalid:
+                    continue
+                if not storage._get_entity_path(entity_type, entity_id).exists():
+                    continue
+                seen.add(entity_id)
+                new_index.append(entity_id)
+            if new_index != current:
+                storage._save_index(entity_type, new_index)
+            storage._invalidate_cache(entity_type)
+
+        removed_tmp = 0
+        for name in report['stale_tmp']:
+            try:
+                (entity_dir / name).unlink()
+                removed_tmp += 1
+            except FileNotFoundError:
+                continue
+
+        return {
+            'index_before': len(current),
+            'index_after': len(new_index),
+            'stale_tmp_removed': removed_tmp,
+            'quarantined': self._quarantine(entity_type, sorted(invalid)) if quarantine else 0,
+        }
@@ -5,31 +5,53 @@ Maneja replicación de archivos a HDFS
 import os
 from pathlib import Path
 from typing import Optional
-from dotenv import load_dotenv
+from .metrics import HDFS_FAILURES, HDFS_SECONDS
+from .tracing import span
 
-load_dotenv()
 
-try:
-    from hdfs import InsecureClient
-    HDFS_AVAILABLE = True
-except ImportError:
-    HDFS_AVAILABLE = False
-    print("⚠️  hdfs library not available. Install with: pip install hdfs")
+def _import_hdfs():
+    """requests + hdfs se importan al crear el primer cliente, no al importar el paquete"""
+    try:
+        import requests
+        from requests.adapters import HTTPAdapter
+        from hdfs import InsecureClient
+    except ImportError:
+        print("⚠️  hdfs library not available. Install with: pip install hdfs")
+        return None
+    return requests, HTTPAdapter, InsecureClient
 
 
 class HDFSClient:
     """Cliente para replicar archivos a HDFS"""
     
-    def __init__(self):
-        self.namenode_url = os.getenv('HDFS_NAMENODE_URL', 'http://192.168.1.73:9870')
+    def __init__(self, namenode_url: Optional[str] = None, replication_path: Optional[str] = None,
+                 pool_size: Optional[int] = None):
+        """
+        Args:
+            namenode_url: URL WebHDFS. Si es None, usa HDFS_NAMENODE_URL
+            replication_path: Ruta base en HDFS. Si es None, usa HDFS_REPLICATION_PATH
+            pool_size: Conexiones HTTP reutilizables. Si es None, usa HDFS_SYNC_CONCURRENCY
+        """
+        self.namenode_url = namenode_url or os.getenv('HDFS_NAMENODE_URL', 'http://192.168.1.73:9870')
         self.user = os.getenv('HDFS_USER', 'hadoop')
-        self.replication_path = os.getenv('HDFS_REPLICATION_PATH', '/smilelink/data')
+        self.replication_path = replication_path or os.getenv('HDFS_REPLICATION_PATH', '/smilelink/data')
         self.replication_factor = int(os.getenv('HDFS_REPLICATION_FACTOR', '2'))
         
+        # Directorios ya creados en HDFS, evita un makedirs por cada subida
+        self._known_dirs = set()
+        
         self.client = None
-        if HDFS_AVAILABLE:
+        modules = _import_hdfs()
+        if modules is not None:
+            requests, HTTPAdapter, InsecureClient = modules
             try:
-                self.client = InsecureClient(self.namenode_url, user=self.user)
+                # Una sesión compartida con pool suficiente para las subidas en paralelo
+                pool_size = pool_size or int(os.getenv('HDFS_SYNC_CONCURRENCY', '8'))
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self.client = InsecureClient(self.namenode_url, user=self.user, session=session)
             except Exception as e:
                 print(f"⚠️  Could not connect to HDFS: {e}")
     
@@ -37,6 +59,16 @@ class HDFSClient:
         """Verifica si HDFS está disponible"""
         return self.client is not None
     
+    def _ensure_parent(self, hdfs_full_path: str):
+        """Crea el directorio padre en HDFS una sola vez por proceso"""
+        parent_dir = str(Path(hdfs_full_path).parent)
+        if parent_dir not in self._known_dirs:
+            try:
+                self.client.makedirs(parent_dir)
+            except Exception:
+                pass  # Directorio ya existe
+            self._known_dirs.add(parent_dir)
+    
     def replicate_file(self, local_path: str, hdfs_relative_path: str) -> bool:
         """
         Replica un archivo local a HDFS
@@ -54,27 +86,72 @@ class HDFSClient:
         hdfs_full_path = f"{self.replication_path}/{hdfs_relative_path}"
         
         try:
-            # Crear directorio padre si no existe
-            parent_dir = str(Path(hdfs_full_path).parent)
-            try:
-                self.client.makedirs(parent_dir)
-            except Exception:
-                pass  # Directorio ya existe
+            with HDFS_SECONDS.time(operation='replicate_file'), span('hdfs.replicate_file', file=hdfs_relative_path):
+                self._ensure_parent(hdfs_full_path)
+                
+                # Subir archivo
+                with open(local_path, 'rb') as f:
+                    self.client.write(
+                        hdfs_full_path,
+                        f,
+                        overwrite=True,
+                        replication=self.replication_factor
+                    )
             
-            # Subir archivo
-            with open(local_path, 'rb') as f:
+            return True
+        except Exception as e:
+            HDFS_FAILURES.inc(operation='replicate_file')
+            print(f"Error replicating {local_path} to HDFS: {e}")
+            return False
+    
+    def write_bytes(self, hdfs_relative_path: str, data: bytes) -> bool:
+        """Escribe un contenido en memoria a HDFS (ej: manifests)"""
+        if not self.is_available():
+            return False
+        
+        hdfs_full_path = f"{self.replication_path}/{hdfs_relative_path}"
+        
+        try:
+            with HDFS_SECONDS.time(operation='write_bytes'), span('hdfs.write_bytes', file=hdfs_relative_path):
+                self._ensure_parent(hdfs_full_path)
                 self.client.write(
                     hdfs_full_path,
-                    f,
+                    data,
                     overwrite=True,
                     replication=self.replication_factor
                 )
-            
             return True
         except Exception as e:
-            print(f"Error replicating {local_path} to HDFS: {e}")
+            HDFS_FAILURES.inc(operation='write_bytes')
+            print(f"Error writing {hdfs_relative_path} to HDFS: {e}")
             return False
     
+    def read_bytes(self, hdfs_relative_path: str, offset: int = 0,
+                   length: Optional[int] = None) -> Optional[bytes]:
+        """
+        Lee un archivo (o un rango) de HDFS
+        
+        Args:
+            hdfs_relative_path: Ruta relativa en HDFS
+            offset: Byte inicial
+            length: Número de bytes; None lee hasta el final
+            
+        Returns:
+            bytes: Contenido leído o None si falló
+        """
+        if not self.is_available():
+            return None
+        
+        hdfs_full_path = f"{self.replication_path}/{hdfs_relative_path}"
+        
+        try:
+            with self.client.read(hdfs_full_path, offset=offset, length=length) as reader:
+                return reader.read()
+        except Exception as e:
+            HDFS_FAILURES.inc(operation='read_bytes')
+            print(f"Error reading {hdfs_relative_path} from HDFS: {e}")
+            return None
+    
     def sync_directory(self, local_dir: str, hdfs_relative_dir: str) -> int:
         """
         Sincroniza un directorio completo a HDFS
@@ -102,16 +179,23 @@ class HDFSClient:
         
         return synced_count
     
-    def list_files(self, hdfs_relative_path: str = '') -> list:
-        """Lista archivos en HDFS"""
+    def list_files(self, hdfs_relative_path: str = '', status: bool = False) -> list:
+        """
+        Lista archivos en HDFS
+        
+        Args:
+            hdfs_relative_path: Directorio relativo en HDFS
+            status: Si es True retorna tuplas (nombre, FileStatus) con length y modificationTime
+        """
         if not self.is_available():
             return []
         
         hdfs_full_path = f"{self.replication_path}/{hdfs_relative_path}"
         
         try:
-            return self.client.list(hdfs_full_path)
+            return self.client.list(hdfs_full_path, status=status)
         except Exception as e:
+            HDFS_FAILURES.inc(operation='list_files')
             print(f"Error listing HDFS files: {e}")
             return []
     
@@ -126,6 +210,7 @@ class HDFSClient:
             self.client.delete(hdfs_full_path)
             return True
         except Exception as e:
+            HDFS_FAILURES.inc(operation='delete_file')
             print(f"Error deleting HDFS file: {e}")
             return False
 
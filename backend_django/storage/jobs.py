@@ -0,0 +1,116 @@
+"""
+SmileLink Storage - Job Store
+Persiste estado y checkpoints de jobs de larga duración para poder reanudarlos
+"""
+import fcntl
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from .encryption import get_encryption_manager
+from .file_manager import get_storage_manager
+
+
+class JobStore:
+    """Guarda el estado de cada job como un archivo encriptado"""
+
+    def __init__(self, base_path: Optional[str] = None):
+        """
+        Args:
+            base_path: Directorio de jobs. Si es None, usa <storage>/_jobs
+        """
+        self.encryption = get_encryption_manager()
+
+        if base_path:
+            self.base_path = Path(base_path)
+        else:
+            self.base_path = get_storage_manager().base_path / '_jobs'
+
+        self.base_path.mkdir(parents=True, exist_ok=True)
+
+    def _get_job_path(self, job_id: str) -> Path:
+        """Retorna ruta del archivo de estado de un job"""
+        return self.base_path / f"{job_id}.json.enc"
+
+    def load(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Carga el estado de un job o None si no existe"""
+        job_path = self._get_job_path(job_id)
+
+        if not job_path.exists():
+            return None
+
+        try:
+            with open(job_path, 'rb') as f:
+                return self.encryption.decrypt_data(f.read())
+        except Exception as e:
+            print(f"Error loading job {job_id}: {e}")
+            return None
+
+    def save(self, job_id: str, state: Dict[str, Any]) -> bool:
+        """
+        Guarda el estado de un job de forma atómica
+
+        Escribe a un archivo temporal y lo renombra, así un crash nunca
+        deja un checkpoint a medias.
+        """
+        job_path = self._get_job_path(job_id)
+        tmp_path = job_path.with_name(f".{job_path.name}.{os.getpid()}.tmp")
+
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(self.encryption.encrypt_data(state))
+            os.replace(tmp_path, job_path)
+            return True
+        except Exception as e:
+            print(f"Error saving job {job_id}: {e}")
+            return False
+
+    def delete(self, job_id: str) -> bool:
+        """Elimina el estado de un job"""
+        try:
+            self._get_job_path(job_id).unlink()
+            return True
+        except FileNotFoundError:
+            return False
+
+    def try_lock(self, job_id: str) -> Optional[int]:
+        """
+        Toma sin esperar el lock exclusivo de un job (flock entre procesos)
+
+        El lock se suelta con unlock() o cuando muere el proceso que lo tiene,
+        así un job abandonado se puede reanudar sin esperar a que expire.
+
+        Returns:
+            int: Descriptor a pasar a unlock(), o None si otro lo tiene
+        """
+        fd = os.open(self.base_path / f"{job_id}.lock", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        return fd
+
+    def unlock(self, fd: int):
+        """Suelta un lock tomado con try_lock()"""
+        try:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+    def list_jobs(self, prefix: str = '') -> List[str]:
+        """Lista IDs de jobs guardados, opcionalmente filtrados por prefijo"""
+        return sorted(
+            path.name[:-len('.json.enc')]
+            for path in self.base_path.glob(f"{prefix}*.json.enc")
+        )
+
+
+# Singleton instance
+_job_store = None
+
+def get_job_store() -> JobStore:
+    """Retorna instancia singleton del JobStore"""
+    global _job_store
+    if _job_store is None:
+        _job_store = JobStore()
+    return _job_store
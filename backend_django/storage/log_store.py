@@ -0,0 +1,729 @@
+"""
+SmileLink Storage - Log Store
+Motor de almacenamiento log-structured: segmentos append-only por tipo
+
+En vez de un archivo por entidad más la reescritura del índice en cada
+alta, cada tipo tiene un directorio con segmentos (00000001.seg, ...) a los
+que se agregan registros encriptados:
+
+    crc32 (4) | op (1) | len(id) (2) | len(data) (4) | id | data
+
+op es PUT (data = token Fernet de la entidad) o DEL (tombstone, sin data).
+El índice de offsets {id: (segmento, offset, largo)} vive en memoria y se
+reconstruye al arrancar re-leyendo los segmentos; las lecturas son un slice
+de un mmap del segmento. Un registro incompleto o con CRC inválido al final
+del último segmento es una escritura que no terminó: se trunca.
+
+Varios procesos comparten el directorio: las escrituras toman un flock por
+tipo y cada lectura se pone al día con lo que otros agregaron al final del
+segmento activo. La compactación en segundo plano reescribe los registros
+vivos en un segmento nuevo y borra los anteriores del más viejo al más
+nuevo, así un crash a mitad nunca revive entidades borradas.
+"""
+import fcntl
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from .backend import StorageBackend
+from .encryption import get_encryption_manager
+from .metrics import timed_storage_operation
+from .write_batch import JOURNAL_DIR, WriteBatch, atomic_write, claim_journals, release_journal, unclaim_journal, write_journal_record, _fsync_dir
+
+
+OP_PUT = 1
+OP_DEL = 2
+
+RECORD_HEADER = struct.Struct('>IBHI')
+SEGMENT_SUFFIX = '.seg'
+LOCK_NAME = '.lock'
+# Mayor número de ID entregado por prefijo, junto a los segmentos del tipo
+ID_HIGH_WATER_NAME = '.id_high_water.json'
+
+
+def encode_record(op: int, entity_id: str, data: bytes = b'') -> bytes:
+    """Serializa un registro con su CRC"""
+    id_bytes = entity_id.encode('utf-8')
+    body = struct.pack('>BHI', op, len(id_bytes), len(data)) + id_bytes + data
+    return struct.pack('>I', zlib.crc32(body)) + body
+
+
+class _TypeLog:
+    """Segmentos, índice de offsets y locks de un tipo de entidad"""
+
+    def __init__(self, directory: Path, max_segment_bytes: int, fsync: bool):
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self.fsync = fsync
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        self.lock = threading.RLock()
+        self._lock_file = open(self.directory / LOCK_NAME, 'a+b')
+        self._maps: Dict[int, mmap.mmap] = {}
+        self._write_fd = None
+        self._write_segment = None
+        self._reset()
+
+    def _reset(self):
+        self.index: 'OrderedDict[str, Tuple[int, int, int]]' = OrderedDict()
+        self.segments: List[int] = []
+        self.position = 0           # bytes ya leídos del último segmento
+        self.total_bytes = 0
+        self.live_bytes = 0
+        self._sizes: Dict[str, int] = {}
+        self._dir_mtime = None
+        for mapped in self._maps.values():
+            mapped.close()
+        self._maps = {}
+
+    # ------------------------------------------------------------------
+    # Locks
+    # ------------------------------------------------------------------
+
+    def _flock(self):
+        fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+
+    def _funlock(self):
+        fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    # ------------------------------------------------------------------
+    # Segmentos
+    # ------------------------------------------------------------------
+
+    def segment_path(self, segment: int) -> Path:
+        return self.directory / f"{segment:08d}{SEGMENT_SUFFIX}"
+
+    def _list_segments(self) -> List[int]:
+        segments = []
+        for path in self.directory.glob(f"*{SEGMENT_SUFFIX}"):
+            try:
+                segments.append(int(path.name[:-len(SEGMENT_SUFFIX)]))
+            except ValueError:
+                continue
+        return sorted(segments)
+
+    def _map(self, segment: int, needed: int) -> Optional[mmap.mmap]:
+        """mmap del segmento que cubra al menos `needed` bytes (re-mapea si creció)"""
+        mapped = self._maps.get(segment)
+        if mapped is not None and len(mapped) >= needed:
+            return mapped
+        with open(self.segment_path(segment), 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0 or size < needed:
+                return None
+            new_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if mapped is not None:
+            mapped.close()
+        self._maps[segment] = new_map
+        return new_map
+
+    def _apply(self, op: int, entity_id: str, segment: int, offset: int, length: int, record_size: int):
+        self.total_bytes += record_size
+        previous = self._sizes.pop(entity_id, None)
+        if previous is not None:
+            self.live_bytes -= previous
+        if op == OP_PUT:
+            # Una actualización conserva la posición original en el índice
+            self.index[entity_id] = (segment, offset, length)
+            self._sizes[entity_id] = record_size
+            self.live_bytes += record_size
+        else:
+            self.index.pop(entity_id, None)
+
+    def _replay(self, segment: int, start: int, truncate_torn: bool) -> int:
+        """
+        Aplica los registros de un segmento desde `start`
+
+        Returns:
+            int: Offset del primer byte no aplicado
+        """
+        path = self.segment_path(segment)
+        size = path.stat().st_size
+        if size <= start:
+            return start
+        mapped = self._map(segment, size)
+        if mapped is None:
+            return start
+        offset = start
+        while offset + RECORD_HEADER.size <= size:
+            crc, op, id_len, data_len = RECORD_HEADER.unpack_from(mapped, offset)
+            end = offset + RECORD_HEADER.size + id_len + data_len
+            if end > size or zlib.crc32(mapped[offset + 4:end]) != crc or op not in (OP_PUT, OP_DEL):
+                break
+            id_start = offset + RECORD_HEADER.size
+            entity_id = mapped[id_start:id_start + id_len].decode('utf-8')
+            self._apply(op, entity_id, segment, id_start + id_len, data_len, end - offset)
+            offset = end
+
+        if offset < size and truncate_torn:
+            print(f"Truncating torn tail of {path} at {offset} ({size - offset} bytes)")
+            self._maps.pop(segment).close()
+            os.truncate(path, offset)
+        return offset
+
+    def refresh(self, locked: bool = False):
+        """
+        Se pone al día con lo escrito por otros procesos
+
+        Sin cambios en el directorio (segmentos nuevos o compactados) basta
+        un stat del segmento activo.
+
+        Args:
+            locked: True si se tiene el flock; sólo entonces una cola
+                incompleta se trata como escritura fallida y se trunca
+        """
+        dir_mtime = os.stat(self.directory).st_mtime_ns
+        # La resolución del mtime puede ser de milisegundos: cerca de un cambio, listar siempre
+        recent = time.time_ns() - dir_mtime < 1_000_000_000
+        if self.segments and dir_mtime == self._dir_mtime and not recent:
+            last = self.segments[-1]
+            if os.stat(self.segment_path(last)).st_size > self.position:
+                self.position = self._replay(last, self.position, truncate_torn=locked)
+            return
+
+        segments = self._list_segments()
+        if any(segment not in segments for segment in self.segments):
+            # Otro proceso compactó: volver a leer todo
+            self._reset()
+        self._dir_mtime = dir_mtime
+        for segment in segments:
+            if self.segments and segment < self.segments[-1]:
+                continue
+            if self.segments and segment == self.segments[-1]:
+                start = self.position
+            else:
+                self.segments.append(segment)
+                start = 0
+            is_last = segment == segments[-1]
+            self.position = self._replay(segment, start, truncate_torn=locked and is_last)
+
+    def reload(self):
+        """Descarta el índice en memoria y re-lee todos los segmentos"""
+        self._reset()
+        self.refresh()
+
+    # ------------------------------------------------------------------
+    # Lectura / escritura
+    # ------------------------------------------------------------------
+
+    def read(self, entity_id: str) -> Optional[bytes]:
+        """Ciphertext de una entidad o None si no existe"""
+        for attempt in range(2):
+            try:
+                self.refresh()
+                location = self.index.get(entity_id)
+                if location is None:
+                    return None
+                segment, offset, length = location
+                mapped = self._map(segment, offset + length)
+                if mapped is not None:
+                    return mapped[offset:offset + length]
+            except FileNotFoundError:
+                pass
+            # El segmento desapareció entre refresh y lectura (compactación)
+            self._reset()
+        return None
+
+    def _writer(self, needed: int) -> int:
+        """fd de escritura del segmento activo, abriendo uno nuevo si se llenó"""
+        last = self.segments[-1] if self.segments else 0
+        if not self.segments or (self.position and self.position + needed > self.max_segment_bytes):
+            last += 1
+            self.segments.append(last)
+            self.position = 0
+        if self._write_segment != last:
+            if self._write_fd is not None:
+                os.close(self._write_fd)
+            self._write_fd = os.open(self.segment_path(last), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            self._write_segment = last
+        return self._write_fd
+
+    def append(self, records: List[Tuple[int, str, bytes]], durable: bool = False):
+        """
+        Agrega registros (op, id, data) al segmento activo en una sola escritura
+
+        Con durable=True se sincroniza a disco aunque LOG_FSYNC esté apagado
+        (antes de borrar el journal de un batch).
+        """
+        if not records:
+            return
+        self._flock()
+        try:
+            self.refresh(locked=True)
+            self._append_locked(records, durable)
+        finally:
+            self._funlock()
+
+    def delete_if_unchanged(self, expected: Dict[str, bytes]) -> List[str]:
+        """Agrega tombstones sólo para las entidades cuyo ciphertext sigue igual (bajo el flock)"""
+        self._flock()
+        try:
+            self.refresh(locked=True)
+            deleted = [entity_id for entity_id, blob in expected.items() if self.read(entity_id) == blob]
+            self._append_locked([(OP_DEL, entity_id, b'') for entity_id in deleted], durable=False)
+            return deleted
+        finally:
+            self._funlock()
+
+    def _append_locked(self, records: List[Tuple[int, str, bytes]], durable: bool):
+        """Escribe los registros; llamar con el flock tomado y el índice al día"""
+        if not records:
+            return
+        encoded = [encode_record(op, entity_id, data) for op, entity_id, data in records]
+        buffer = b''.join(encoded)
+
+        previous_segment = self._write_segment
+        fd = self._writer(len(buffer))
+        segment = self._write_segment
+        offset = os.fstat(fd).st_size
+        view = memoryview(buffer)
+        while view:
+            written = os.write(fd, view)
+            view = view[written:]
+        if self.fsync or durable:
+            os.fsync(fd)
+            if segment != previous_segment:
+                _fsync_dir(self.directory)
+
+        for (op, entity_id, data), record in zip(records, encoded):
+            data_offset = offset + RECORD_HEADER.size + len(entity_id.encode('utf-8'))
+            self._apply(op, entity_id, segment, data_offset, len(data), len(record))
+            offset += len(record)
+        self.position = offset
+
+    # ------------------------------------------------------------------
+    # Compactación
+    # ------------------------------------------------------------------
+
+    def garbage_ratio(self) -> float:
+        return 1 - self.live_bytes / self.total_bytes if self.total_bytes else 0.0
+
+    def compact(self) -> Dict[str, Any]:
+        """
+        Reescribe los registros vivos en un segmento nuevo y borra los anteriores
+
+        Returns:
+            dict: Bytes antes y después
+        """
+        self._flock()
+        try:
+            self.refresh(locked=True)
+            old_segments = list(self.segments)
+            before = self.total_bytes
+            if not old_segments:
+                return {'before_bytes': 0, 'after_bytes': 0, 'segments_removed': 0}
+
+            new_segment = old_segments[-1] + 1
+            tmp_path = self.directory / f".{new_segment:08d}.compact"
+            new_index: 'OrderedDict[str, Tuple[int, int, int]]' = OrderedDict()
+            sizes: Dict[str, int] = {}
+            offset = 0
+            with open(tmp_path, 'wb') as f:
+                for entity_id, (segment, data_offset, length) in self.index.items():
+                    data = self._map(segment, data_offset + length)[data_offset:data_offset + length]
+                    record = encode_record(OP_PUT, entity_id, data)
+                    f.write(record)
+                    new_index[entity_id] = (
+                        new_segment, offset + RECORD_HEADER.size + len(entity_id.encode('utf-8')), length
+                    )
+                    sizes[entity_id] = len(record)
+                    offset += len(record)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.segment_path(new_segment))
+            _fsync_dir(self.directory)
+
+            # Del más viejo al más nuevo: lo que quede tras un crash es un sufijo válido
+            for segment in old_segments:
+                mapped = self._maps.pop(segment, None)
+                if mapped is not None:
+                    mapped.close()
+                self.segment_path(segment).unlink(missing_ok=True)
+            _fsync_dir(self.directory)
+
+            if self._write_fd is not None:
+                os.close(self._write_fd)
+                self._write_fd = None
+                self._write_segment = None
+
+            self.index = new_index
+            self._sizes = sizes
+            self.segments = [new_segment]
+            self.position = offset
+            self.total_bytes = offset
+            self.live_bytes = offset
+            return {'before_bytes': before, 'after_bytes': offset, 'segments_removed': len(old_segments)}
+        finally:
+            self._funlock()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'records': len(self.index),
+            'segments': len(self.segments),
+            'total_bytes': self.total_bytes,
+            'live_bytes': self.live_bytes,
+            'garbage_ratio': round(self.garbage_ratio(), 4),
+        }
+
+
+class LogStorageManager(StorageBackend):
+    """Almacena entidades encriptadas en segmentos append-only por tipo"""
+
+    name = 'log'
+
+    def __init__(self, base_path: Optional[str] = None, compact_interval: Optional[float] = None):
+        """
+        Args:
+            base_path: Directorio de segmentos. Si es None, usa LOG_STORAGE_PATH
+                o <directorio de datos>/_log
+            compact_interval: Segundos entre revisiones del compactador (0 lo desactiva)
+        """
+        self.encryption = get_encryption_manager()
+
+        if base_path:
+            self.base_path = Path(base_path)
+        elif os.getenv('LOG_STORAGE_PATH'):
+            self.base_path = Path(os.getenv('LOG_STORAGE_PATH'))
+        elif os.getenv('USE_NFS', 'False').lower() == 'true':
+            self.base_path = Path(os.getenv('NFS_DATA_PATH', '/mnt/nfs/smilelink/data')) / '_log'
+        else:
+            self.base_path = Path(os.getenv('LOCAL_STORAGE_PATH', './local_data')) / '_log'
+
+        max_segment_bytes = int(os.getenv('LOG_SEGMENT_MAX_BYTES', str(64 * 1024 * 1024)))
+        fsync = os.getenv('LOG_FSYNC', 'False').lower() == 'true'
+        self.compact_min_ratio = float(os.getenv('LOG_COMPACT_MIN_RATIO', '0.5'))
+        self.compact_min_bytes = int(os.getenv('LOG_COMPACT_MIN_BYTES', str(1024 * 1024)))
+        if compact_interval is None:
+            compact_interval = float(os.getenv('LOG_COMPACT_INTERVAL_SECONDS', '60'))
+
+        self.base_path.mkdir(parents=True, exist_ok=True)
+        self._index_lock = threading.RLock()
+        self._logs = {
+            entity_type: _TypeLog(self.base_path / entity_type, max_segment_bytes, fsync)
+            for entity_type in self.ENTITY_TYPES
+        }
+        for entity_type, log in self._logs.items():
+            with log.lock:
+                log._flock()
+                try:
+                    log.refresh(locked=True)
+                finally:
+                    log._funlock()
+
+        recovered = self._recover_journal()
+        if recovered:
+            print(f"Recovered {recovered} pending write batch(es)")
+
+        self._stop = threading.Event()
+        self._compactor = None
+        if compact_interval > 0:
+            self._compactor = threading.Thread(
+                target=self._compact_loop, args=(compact_interval,), name='log-compactor', daemon=True
+            )
+            self._compactor.start()
+
+    def _log(self, entity_type: str) -> _TypeLog:
+        if entity_type not in self.ENTITY_TYPES:
+            raise ValueError(f"Invalid entity type: {entity_type}")
+        return self._logs[entity_type]
+
+    # ------------------------------------------------------------------
+    # Journal de write batches
+    # ------------------------------------------------------------------
+
+    def _apply_ops(self, ops: List[List[Any]]):
+        """Agrega las operaciones de un batch agrupadas por tipo, sincronizadas a disco"""
+        by_type: Dict[str, List[Tuple[int, str, bytes]]] = {}
+        for entity_type, op, entity_id, token in ops:
+            data = token.encode('ascii') if token else b''
+            by_type.setdefault(entity_type, []).append((op, entity_id, data))
+        for entity_type, records in by_type.items():
+            log = self._log(entity_type)
+            with log.lock:
+                log.append(records, durable=True)
+
+    def _recover_journal(self) -> int:
+        """
+        Re-aplica batches confirmados cuyo append no terminó
+
+        Re-agregar es idempotente; los registros que un writer vivo todavía
+        tiene tomados (batch en curso en otro worker) se dejan en paz.
+        """
+        recovered = 0
+        for journal_path, record in claim_journals(self.base_path / JOURNAL_DIR):
+            try:
+                self._apply_ops(record.get('ops', []))
+            except Exception as e:
+                print(f"Error recovering journal {journal_path.name}: {e}")
+                unclaim_journal(journal_path)
+                continue
+            release_journal(journal_path)
+            recovered += 1
+        return recovered
+
+    # ------------------------------------------------------------------
+    # StorageBackend
+    # ------------------------------------------------------------------
+
+    def _read_index(self, entity_type: str) -> List[str]:
+        log = self._log(entity_type)
+        with log.lock:
+            log.refresh()
+            return list(log.index)
+
+    def _read_entity(self, entity_type: str, entity_id: str) -> Optional[Dict[str, Any]]:
+        log = self._log(entity_type)
+        with log.lock:
+            token = log.read(entity_id)
+        if token is None:
+            return None
+        try:
+            return self.encryption.decrypt_data(token)
+        except Exception as e:
+            print(f"Error loading {entity_type}/{entity_id}: {e}")
+            return None
+
+    @timed_storage_operation('save')
+    def save(self, entity_type: str, entity_id: str, data: Dict[str, Any]) -> bool:
+        """
+        Guarda una entidad encriptada agregándola al segmento activo
+
+        Args:
+            entity_type: Tipo de entidad (ninos, padrinos, etc.)
+            entity_id: ID único de la entidad
+            data: Datos a guardar
+
+        Returns:
+            bool: True si se guardó exitosamente
+        """
+        return bool(self._save_many(entity_type, {entity_id: data}))
+
+    @timed_storage_operation('save_many')
+    def save_many(self, entity_type: str, records: Dict[str, Dict[str, Any]]) -> List[str]:
+        """
+        Guarda varias entidades con un solo append
+
+        Returns:
+            list: IDs guardados, en el orden recibido
+        """
+        return self._save_many(entity_type, records)
+
+    def _save_many(self, entity_type: str, records: Dict[str, Dict[str, Any]]) -> List[str]:
+        """save_many sin métrica: save la usa sin contarse dos veces"""
+        log = self._log(entity_type)
+        try:
+            encoded = [
+                (OP_PUT, entity_id, self.encryption.encrypt_data(data))
+                for entity_id, data in records.items()
+            ]
+            with log.lock:
+                log.append(encoded)
+        except Exception as e:
+            print(f"Error saving {entity_type}: {e}")
+            return []
+
+        for entity_id in records:
+            self._invalidate_cache(entity_type, entity_id)
+        return list(records)
+
+    @timed_storage_operation('delete')
+    def delete(self, entity_type: str, entity_id: str) -> bool:
+        """
+        Elimina una entidad agregando un tombstone
+
+        Returns:
+            bool: True si se eliminó exitosamente
+        """
+        log = self._log(entity_type)
+        try:
+            with log.lock:
+                log.refresh()
+                if entity_id not in log.index:
+                    return False
+                log.append([(OP_DEL, entity_id, b'')])
+        except Exception as e:
+            print(f"Error deleting {entity_type}/{entity_id}: {e}")
+            return False
+
+        self._invalidate_cache(entity_type, entity_id)
+        return True
+
+    def exists(self, entity_type: str, entity_id: str) -> bool:
+        """Verifica si una entidad existe sin desencriptarla"""
+        log = self._log(entity_type)
+        with log.lock:
+            log.refresh()
+            return entity_id in log.index
+
+    def load_raw(self, entity_type: str, entity_id: str) -> Optional[bytes]:
+        """Ciphertext del último registro de una entidad, o None si no existe"""
+        log = self._log(entity_type)
+        with log.lock:
+            token = log.read(entity_id)
+        return bytes(token) if token is not None else None
+
+    def delete_if_unchanged(self, entity_type: str, expected: Dict[str, bytes]) -> List[str]:
+        """
+        Agrega tombstones sólo para entidades cuyo ciphertext sigue siendo el esperado
+
+        Returns:
+            list: IDs borrados
+        """
+        log = self._log(entity_type)
+        with log.lock:
+            deleted = log.delete_if_unchanged(expected)
+        for entity_id in deleted:
+            self._invalidate_cache(entity_type, entity_id)
+        return deleted
+
+    def allocate_ids(self, entity_type: str, prefix: str, count: int) -> List[str]:
+        """
+        Reserva un bloque de IDs consecutivos, únicos entre hilos y procesos
+
+        Bajo el flock del tipo se lee el índice al día y el mayor número ya
+        entregado (persistido junto a los segmentos): dos workers nunca reciben
+        el mismo ID y un ID borrado no se vuelve a entregar.
+
+        Returns:
+            list: IDs consecutivos (ej: ['E010', 'E011', 'E012'])
+        """
+        log = self._log(entity_type)
+        high_water_path = log.directory / ID_HIGH_WATER_NAME
+        with log.lock:
+            log._flock()
+            try:
+                log.refresh(locked=True)
+                try:
+                    with open(high_water_path, 'r', encoding='utf-8') as f:
+                        high_water = json.load(f)
+                except (FileNotFoundError, ValueError):
+                    high_water = {}
+                start = max(self._max_id_number(log.index, prefix), high_water.get(prefix, 0)) + 1
+                high_water[prefix] = start + count - 1
+                atomic_write(high_water_path, json.dumps(high_water).encode('utf-8'))
+            finally:
+                log._funlock()
+        return [f"{prefix}{str(num).zfill(3)}" for num in range(start, start + count)]
+
+    def write_batch(self) -> 'LogWriteBatch':
+        """Batch todo-o-nada: journal con los registros y luego append por tipo"""
+        return LogWriteBatch(self)
+
+    def rebuild_index(self, entity_type: str) -> List[str]:
+        """Reconstruye el índice de offsets re-leyendo los segmentos del tipo"""
+        log = self._log(entity_type)
+        with log.lock:
+            log.reload()
+            ids = list(log.index)
+        self._invalidate_cache(entity_type)
+        return ids
+
+    # ------------------------------------------------------------------
+    # Compactación
+    # ------------------------------------------------------------------
+
+    def compact(self, entity_type: Optional[str] = None, force: bool = False) -> Dict[str, Dict[str, Any]]:
+        """
+        Compacta los tipos con suficiente espacio recuperable
+
+        Args:
+            entity_type: Sólo este tipo (None = todos)
+            force: Compactar aunque no se alcancen los umbrales
+
+        Returns:
+            dict: {entity_type: resultado} de los tipos compactados
+        """
+        results = {}
+        for name in ([entity_type] if entity_type else self.ENTITY_TYPES):
+            log = self._log(name)
+            with log.lock:
+                log.refresh()
+                garbage = log.total_bytes - log.live_bytes
+                if not force and (
+                    log.garbage_ratio() < self.compact_min_ratio or garbage < self.compact_min_bytes
+                ):
+                    continue
+                if garbage == 0 and len(log.segments) <= 1:
+                    continue
+                started = time.time()
+                result = log.compact()
+            result['seconds'] = round(time.time() - started, 3)
+            results[name] = result
+        return results
+
+    def _compact_loop(self, interval: float):
+        while not self._stop.wait(interval):
+            try:
+                for entity_type, result in self.compact().items():
+                    print(f"Compacted {entity_type}: {result['before_bytes']} -> {result['after_bytes']} bytes")
+            except Exception as e:
+                print(f"Error compacting log store: {e}")
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Registros, segmentos y espacio recuperable por tipo"""
+        stats = {}
+        for entity_type, log in self._logs.items():
+            with log.lock:
+                log.refresh()
+                stats[entity_type] = log.stats()
+        return stats
+
+
+class LogWriteBatch(WriteBatch):
+    """WriteBatch que confirma un journal con los registros y luego los agrega"""
+
+    def commit(self) -> bool:
+        if self.committed:
+            raise RuntimeError('WriteBatch already committed')
+        if not self._saves and not self._deletes:
+            self.committed = True
+            return True
+
+        storage = self.storage
+        # Mismo orden que el WriteBatch de archivos: primero escrituras, luego borrados
+        ops = [
+            [entity_type, OP_PUT, entity_id, storage.encryption.encrypt_data(data).decode('ascii')]
+            for (entity_type, entity_id), data in self._saves.items()
+        ]
+        ops.extend([entity_type, OP_DEL, entity_id, None] for entity_type, entity_id in self._deletes)
+
+        with storage._index_lock:
+            record = {'txid': f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}", 'ops': ops}
+            journal_path = write_journal_record(storage.base_path / JOURNAL_DIR, record)
+            try:
+                storage._apply_ops(ops)
+            except Exception:
+                # Confirmado pero sin agregar: lo rehace la recuperación del próximo worker
+                unclaim_journal(journal_path)
+                raise
+            release_journal(journal_path)
+
+        for entity_type, entity_ids in self.changes.items():
+            for entity_id in entity_ids:
+                storage._invalidate_cache(entity_type, entity_id)
+
+        self.committed = True
+        return True
+
+
+# Singleton instance
+_log_storage_manager = None
+_log_storage_manager_lock = threading.Lock()
+
+def get_log_storage_manager() -> LogStorageManager:
+    """Retorna instancia singleton del LogStorageManager"""
+    global _log_storage_manager
+    if _log_storage_manager is None:
+        # Dos instancias abrirían dos veces los segmentos y lanzarían dos compactadores
+        with _log_storage_manager_lock:
+            if _log_storage_manager is None:
+                _log_storage_manager = LogStorageManager()
+    return _log_storage_manager
@@ -0,0 +1,56 @@
+"""
+Management command to move finished records to the cold archive tier
+"""
+from django.core.management.base import BaseCommand, CommandError
+from storage import get_archive_store
+from storage.archive import ARCHIVE_RULES
+
+
+class Command(BaseCommand):
+    help = 'Archive finished apadrinamientos and delivered entregas older than ARCHIVE_AFTER_DAYS'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Archive records older than this (default: ARCHIVE_AFTER_DAYS)')
+        parser.add_argument('--type', action='append', dest='types', help='Entity type to archive (repeatable)')
+        parser.add_argument('--limit', type=int, help='Maximum records per type in this run')
+        parser.add_argument('--dry-run', action='store_true', help='Only count candidates')
+        parser.add_argument('--compact', action='store_true', help='Merge archive segments after archiving')
+    
+    def handle(self, *args, **options):
+        entity_types = options['types'] or list(ARCHIVE_RULES)
+        invalid = [t for t in entity_types if t not in ARCHIVE_RULES]
+        if invalid:
+            raise CommandError(f"Not archivable: {', '.join(invalid)} (choose from {', '.join(ARCHIVE_RULES)})")
+        
+        store = get_archive_store()
+        self.stdout.write(f"Archive tier: {store.tier.name}")
+        
+        for entity_type in entity_types:
+            report = store.archive(
+                entity_type,
+                older_than_days=options['days'],
+                dry_run=options['dry_run'],
+                limit=options['limit'],
+            )
+            verb = 'would archive' if options['dry_run'] else 'archived'
+            count = report['candidates'] if options['dry_run'] else report['archived']
+            self.stdout.write(
+                f"  {entity_type}: {verb} {count} record(s) before {report['cutoff']} "
+                f"({report['bytes'] / 1024:.1f} KB)"
+            )
+            if report.get('skipped_changed'):
+                self.stdout.write(self.style.WARNING(
+                    f"  {entity_type}: {report['skipped_changed']} record(s) changed while archiving, left in place"
+                ))
+            
+            if options['compact'] and not options['dry_run']:
+                compacted = store.compact(entity_type)
+                self.stdout.write(
+                    f"  {entity_type}: compacted {compacted['segments_before']} -> "
+                    f"{compacted['segments_after']} segment(s), {compacted['records']} record(s)"
+                )
+            
+            aggregates = store.aggregates(entity_type)
+            self.stdout.write(f"  {entity_type}: {aggregates['count']} record(s) in archive")
+        
+        self.stdout.write(self.style.SUCCESS('\n✅ Archive run complete'))
@@ -0,0 +1,95 @@
+"""
+Management command to compare the storage backends on the same workload
+"""
+import random
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+from storage import FileStorageManager, LogStorageManager, SQLiteStorageManager
+
+
+ESTADOS_NINO = ['Disponible', 'Apadrinado']
+ESTADOS_ENTREGA = ['Pendiente', 'Entregado', 'En tránsito']
+
+
+class Command(BaseCommand):
+    help = 'Time create, point reads, list_all, dashboard counts and email lookup on every backend'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=5000, help='Entities per type (default: 5000)')
+        parser.add_argument('--reads', type=int, default=2000, help='Random point reads (default: 2000)')
+        parser.add_argument('--keep', action='store_true', help='Keep the temp directories')
+
+    def _workload(self, storage, count: int, reads: int):
+        timings = {}
+
+        started = time.perf_counter()
+        storage.save_many('ninos', {
+            f"N{i:06d}": {
+                'id_nino': f"N{i:06d}", 'nombre': f"Nino {i}", 'edad': 5 + i % 10,
+                'estado_apadrinamiento': ESTADOS_NINO[i % 2],
+            }
+            for i in range(1, count + 1)
+        })
+        storage.save_many('padrinos', {
+            f"P{i:06d}": {'id_padrino': f"P{i:06d}", 'nombre': f"Padrino {i}", 'email': f"padrino{i}@smilelink.org"}
+            for i in range(1, count + 1)
+        })
+        storage.save_many('entregas', {
+            f"E{i:06d}": {'id_entrega': f"E{i:06d}", 'estado_entrega': ESTADOS_ENTREGA[i % 3]}
+            for i in range(1, count + 1)
+        })
+        timings['create (3 types)'] = time.perf_counter() - started
+
+        rng = random.Random(7)
+        started = time.perf_counter()
+        for _ in range(reads):
+            storage.load('ninos', f"N{rng.randint(1, count):06d}")
+        timings[f'{reads} point reads'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        storage.list_all('ninos')
+        timings['list_all ninos'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        with storage.read_cache():
+            storage.count('ninos')
+            storage.count('ninos', estado_apadrinamiento='Disponible')
+            storage.count('ninos', estado_apadrinamiento='Apadrinado')
+            storage.count('entregas', estado_entrega='Entregado')
+            storage.count('entregas', estado_entrega='Pendiente')
+        timings['dashboard counts'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        found = storage.find('padrinos', email=f"padrino{count // 2}@smilelink.org")
+        timings['find padrino by email'] = time.perf_counter() - started
+        assert len(found) == 1
+
+        return timings
+
+    def handle(self, *args, **options):
+        workdir = Path(tempfile.mkdtemp(prefix='smilelink-backend-bench-'))
+        results = {}
+        try:
+            backends = {
+                'file': lambda: FileStorageManager(base_path=str(workdir / 'file')),
+                'sqlite': lambda: SQLiteStorageManager(db_path=str(workdir / 'sqlite' / 'smilelink.sqlite3')),
+                'log': lambda: LogStorageManager(base_path=str(workdir / 'log'), compact_interval=0),
+            }
+            for name, factory in backends.items():
+                self.stdout.write(f"Running {options['count']} entities/type on {name}...")
+                results[name] = self._workload(factory(), options['count'], options['reads'])
+        finally:
+            if not options['keep']:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+        names = list(results)
+        self.stdout.write('\n' + f"{'operation':<26}" + ''.join(f"{name + ' (s)':>14}" for name in names))
+        for operation in results['file']:
+            row = ''.join(f"{results[name][operation]:>14.3f}" for name in names)
+            self.stdout.write(f"{operation:<26}{row}")
+
+        self.stdout.write(self.style.SUCCESS('\n✅ Benchmark finished'))
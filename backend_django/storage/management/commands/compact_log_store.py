@@ -0,0 +1,41 @@
+"""
+Management command to compact the segments of the log storage backend
+"""
+from django.core.management.base import BaseCommand, CommandError
+from storage import LogStorageManager
+
+
+class Command(BaseCommand):
+    help = 'Rewrite live records of the log backend into fresh segments and drop superseded versions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--type', dest='entity_type', help='Only compact this entity type')
+        parser.add_argument('--force', action='store_true',
+                            help='Compact even below LOG_COMPACT_MIN_RATIO / LOG_COMPACT_MIN_BYTES')
+        parser.add_argument('--path', help='Log store directory (default: LOG_STORAGE_PATH)')
+
+    def handle(self, *args, **options):
+        storage = LogStorageManager(base_path=options['path'], compact_interval=0)
+        entity_type = options['entity_type']
+        if entity_type and entity_type not in storage.ENTITY_TYPES:
+            raise CommandError(f"Invalid entity type: {entity_type}")
+
+        self.stdout.write(f"Log store: {storage.base_path}")
+        for name, stats in storage.stats().items():
+            if entity_type and name != entity_type:
+                continue
+            self.stdout.write(
+                f"  {name}: {stats['records']} records, {stats['segments']} segment(s), "
+                f"{stats['total_bytes'] / 1024:.1f} KB ({stats['garbage_ratio']:.0%} reclaimable)"
+            )
+
+        results = storage.compact(entity_type, force=options['force'])
+        for name, result in results.items():
+            self.stdout.write(
+                f"  compacted {name}: {result['before_bytes'] / 1024:.1f} KB -> "
+                f"{result['after_bytes'] / 1024:.1f} KB in {result['seconds']}s"
+            )
+
+        if not results:
+            self.stdout.write('Nothing to compact')
+        self.stdout.write(self.style.SUCCESS('\n✅ Compaction finished'))
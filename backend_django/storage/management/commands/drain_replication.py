@@ -0,0 +1,41 @@
+"""
+Management command to drain the HDFS replication queue
+"""
+import time
+from django.core.management.base import BaseCommand
+from storage import get_replication_queue
+
+
+class Command(BaseCommand):
+    help = 'Upload pending files from the local replication queue to HDFS'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--forever', action='store_true', help='Keep draining as a standalone worker')
+        parser.add_argument('--timeout', type=float, default=None, help='Stop after this many seconds')
+    
+    def handle(self, *args, **options):
+        queue = get_replication_queue()
+        
+        if not queue.hdfs.is_available():
+            self.stdout.write(self.style.WARNING('HDFS client not available, nothing uploaded'))
+            return
+        
+        if options['forever']:
+            self.stdout.write(f'Draining {queue.queue_path} with {queue.workers} workers (Ctrl+C to stop)...')
+            queue.start()
+            try:
+                while True:
+                    time.sleep(60)
+                    self.stdout.write(str(queue.stats()))
+            except KeyboardInterrupt:
+                queue.stop()
+            return
+        
+        self.stdout.write(f'Draining {queue.depth()} pending files...')
+        empty = queue.drain(timeout=options['timeout'])
+        
+        stats = queue.stats()
+        if empty:
+            self.stdout.write(self.style.SUCCESS(f"\n✅ Queue drained ({stats['replicated']} files replicated)"))
+        else:
+            self.stdout.write(self.style.WARNING(f"\n⚠️  {stats['depth']} files still pending ({stats['last_error']})"))
@@ -0,0 +1,90 @@
+"""
+Management command to verify every entity file and rebuild drifted indexes
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from storage import StorageChecker, get_archive_store, get_storage_manager, get_sync_manager
+from storage.archive import ARCHIVE_RULES
+
+
+class Command(BaseCommand):
+    help = 'Decrypt and check every entity file in parallel, report index drift and optionally repair it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--type', action='append', dest='types', help='Entity type to check (repeatable)')
+        parser.add_argument('--workers', type=int, default=16, help='Reader/decrypt threads (default: 16)')
+        parser.add_argument('--repair', action='store_true',
+                            help='Rewrite indexes, remove stale temp files and rebuild archive aggregates')
+        parser.add_argument('--quarantine', action='store_true',
+                            help='With --repair, move corrupt/mismatched files to _quarantine/')
+        parser.add_argument('--verbose-ids', action='store_true', help='List every affected ID')
+
+    def _ids(self, values, verbose):
+        ids = [v[0] if isinstance(v, list) else v for v in values]
+        if verbose or len(ids) <= 5:
+            return ', '.join(ids)
+        return f"{', '.join(ids[:5])}, ... (+{len(ids) - 5})"
+
+    def handle(self, *args, **options):
+        storage = get_storage_manager()
+        entity_types = options['types'] or list(storage.ENTITY_TYPES)
+        invalid = [t for t in entity_types if t not in storage.ENTITY_TYPES]
+        if invalid:
+            raise CommandError(f"Invalid entity type(s): {', '.join(invalid)}")
+        if options['quarantine'] and not options['repair']:
+            raise CommandError('--quarantine requires --repair')
+
+        checker = StorageChecker(storage, workers=options['workers'])
+        self.stdout.write(f"Checking {storage.base_path} with {checker.workers} workers...")
+        started = time.time()
+        reports = checker.check(entity_types)
+        elapsed = time.time() - started
+        total_files = sum(report['files'] for report in reports.values())
+
+        problems = 0
+        for entity_type, report in reports.items():
+            self.stdout.write(
+                f"  {entity_type}: {report['files']} files, {report['indexed']} indexed, "
+                f"{len(report['valid'])} ok ({report['seconds']}s)"
+            )
+            if not report['index_readable']:
+                self.stdout.write(self.style.WARNING('    index unreadable'))
+            for key in ('orphans', 'dangling', 'duplicates', 'corrupt', 'mismatched', 'stale_tmp'):
+                if report[key]:
+                    self.stdout.write(self.style.WARNING(
+                        f"    {key}: {len(report[key])} ({self._ids(report[key], options['verbose_ids'])})"
+                    ))
+            if checker.has_problems(report):
+                problems += 1
+
+        rate = total_files / elapsed if elapsed else 0
+        self.stdout.write(f"\nChecked {total_files} files in {elapsed:.1f}s ({rate:.0f} files/s)")
+
+        if not options['repair']:
+            if problems:
+                raise CommandError(f"{problems} entity type(s) need repair; re-run with --repair")
+            self.stdout.write(self.style.SUCCESS('\n✅ Storage is consistent'))
+            return
+
+        sync = get_sync_manager()
+        for entity_type, report in reports.items():
+            if not checker.has_problems(report):
+                continue
+            result = checker.repair(entity_type, report, quarantine=options['quarantine'])
+            sync.sync_index(entity_type)
+            self.stdout.write(
+                f"  repaired {entity_type}: index {result['index_before']} -> {result['index_after']}, "
+                f"{result['stale_tmp_removed']} temp file(s) removed, {result['quarantined']} quarantined"
+            )
+
+        # Índices derivados: agregados del archivo frío que usan los KPIs
+        archive = get_archive_store()
+        for entity_type in entity_types:
+            if entity_type not in ARCHIVE_RULES:
+                continue
+            result = archive.rebuild_aggregates(entity_type)
+            if result['before'] != result['after']:
+                self.stdout.write(f"  archive aggregates {entity_type}: {result['before']} -> {result['after']}")
+
+        self.stdout.write(self.style.SUCCESS('\n✅ Repair finished'))
@@ -0,0 +1,33 @@
+"""
+Management command to merge small HDFS segments
+"""
+import logging
+from django.core.management.base import BaseCommand, CommandError
+from storage import get_replication_queue
+
+
+class Command(BaseCommand):
+    help = 'Merge runs of small consecutive segments in the HDFS replica into larger ones'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--min-segments', type=int, default=None,
+                            help='Shortest run worth merging (default: HDFS_SEGMENT_MERGE_MIN_SEGMENTS)')
+    
+    def handle(self, *args, **options):
+        # La librería hdfs registra cada lectura en INFO
+        logging.getLogger('hdfs').setLevel(logging.WARNING)
+        queue = get_replication_queue()
+        if not queue.hdfs.is_available():
+            raise CommandError('HDFS client not available')
+        if options['min_segments'] is not None:
+            queue.merge_min_segments = max(2, options['min_segments'])
+        
+        merged = queue.merge_segments()
+        for result in merged:
+            self.stdout.write(
+                f"  {result['segment_id']}: {len(result['merged'])} segments merged ({result['size']} bytes)"
+            )
+        if merged:
+            self.stdout.write(self.style.SUCCESS(f"\n✅ {len(merged)} merged segment(s) written"))
+        else:
+            self.stdout.write('No runs of small segments to merge')
@@ -0,0 +1,97 @@
+"""
+Management command to aggregate stored request profiles into a hot functions report
+"""
+import json
+import os
+import pstats
+import sys
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from storage import get_profile_store
+
+SORT_KEYS = {'tottime': 2, 'cumulative': 3, 'calls': 1}
+
+
+def _short_path(filename):
+    """Ruta legible: relativa al proyecto o a site-packages"""
+    base = str(settings.BASE_DIR) + os.sep
+    if filename.startswith(base):
+        return filename[len(base):]
+    marker = f"site-packages{os.sep}"
+    if marker in filename:
+        return filename.split(marker, 1)[1]
+    for prefix in sys.path:
+        if prefix and filename.startswith(prefix + os.sep):
+            return filename[len(prefix) + 1:]
+    return filename
+
+
+class Command(BaseCommand):
+    help = 'Merge stored cProfile profiles by endpoint and print the top-N hot functions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--route', help="Only routes matching this regex (e.g. 'nino-.*')")
+        parser.add_argument('--top', type=int, default=20, help='Functions per route (default: 20)')
+        parser.add_argument('--sort', choices=sorted(SORT_KEYS), default='tottime',
+                            help='Rank by own time, cumulative time or call count (default: tottime)')
+        parser.add_argument('--since-hours', type=float, help='Only profiles from the last N hours')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        store = get_profile_store()
+        since = time.time() - options['since_hours'] * 3600 if options['since_hours'] else None
+        profiles = store.list_profiles(route=options['route'], since=since)
+        if not profiles:
+            raise CommandError(f"No stored profiles in {store.directory}")
+
+        by_route = defaultdict(list)
+        for profile in profiles:
+            by_route[(profile['method'], profile['route'])].append(profile)
+
+        sort_index = SORT_KEYS[options['sort']]
+        report = []
+        for (method, route), items in sorted(by_route.items(), key=lambda kv: -len(kv[1])):
+            try:
+                stats = pstats.Stats(*[item['path'] for item in items])
+            except (OSError, TypeError, EOFError) as e:
+                self.stderr.write(f"Skipping {method} {route}: {e}")
+                continue
+            rows = sorted(stats.stats.items(), key=lambda kv: kv[1][sort_index], reverse=True)[:options['top']]
+            durations = [item['duration_ms'] for item in items]
+            report.append({
+                'method': method,
+                'route': route,
+                'profiles': len(items),
+                'avg_ms': round(sum(durations) / len(durations), 3),
+                'max_ms': max(durations),
+                'functions': [
+                    {
+                        'function': f"{_short_path(filename)}:{line}({name})",
+                        'calls': nc,
+                        'tottime_ms': round(tt * 1000, 3),
+                        'cumtime_ms': round(ct * 1000, 3),
+                        'per_request_ms': round(tt * 1000 / len(items), 3),
+                    }
+                    for (filename, line, name), (cc, nc, tt, ct, callers) in rows
+                ],
+            })
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2, ensure_ascii=False))
+            return
+
+        for entry in report:
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f"\n{entry['method']} {entry['route']}: {entry['profiles']} profile(s), "
+                f"avg {entry['avg_ms']:.1f} ms, max {entry['max_ms']:.1f} ms"
+            ))
+            self.stdout.write(f"  {'calls':>9} {'own ms':>10} {'cum ms':>10} {'own/req':>9}  function")
+            for row in entry['functions']:
+                self.stdout.write(
+                    f"  {row['calls']:>9} {row['tottime_ms']:>10.1f} {row['cumtime_ms']:>10.1f} "
+                    f"{row['per_request_ms']:>9.2f}  {row['function']}"
+                )
+        self.stdout.write(self.style.SUCCESS(f"\n✅ {len(profiles)} profile(s) from {store.directory}"))
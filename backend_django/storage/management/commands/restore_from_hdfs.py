@@ -0,0 +1,62 @@
+"""
+Management command to rebuild local storage from the HDFS replica
+"""
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+from storage import HDFSClient, HDFSRestorer, FileStorageManager
+
+
+class Command(BaseCommand):
+    help = 'Download entity files from HDFS in parallel, verify them and rebuild the indexes (resumable)'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=16, help='Concurrent downloads (default: 16)')
+        parser.add_argument('--type', action='append', dest='types', help='Entity type to restore (repeatable)')
+        parser.add_argument('--target', help='Target directory (default: configured storage path)')
+        parser.add_argument('--namenode-url', help='WebHDFS URL (default: HDFS_NAMENODE_URL)')
+        parser.add_argument('--prune', action='store_true',
+                            help='Delete local entity files that are no longer in the replica (default: only report them)')
+    
+    def handle(self, *args, **options):
+        # La librería hdfs registra cada lectura en INFO
+        logging.getLogger('hdfs').setLevel(logging.WARNING)
+        entity_types = options['types'] or FileStorageManager.ENTITY_TYPES
+        invalid = [t for t in entity_types if t not in FileStorageManager.ENTITY_TYPES]
+        if invalid:
+            raise CommandError(f"Invalid entity type(s): {', '.join(invalid)}")
+        
+        hdfs = HDFSClient(namenode_url=options['namenode_url'], pool_size=options['workers'])
+        if not hdfs.is_available():
+            raise CommandError('HDFS client not available')
+        
+        restorer = HDFSRestorer(hdfs, target_path=options['target'], workers=options['workers'])
+        self.stdout.write(f"Restoring {', '.join(entity_types)} from {hdfs.namenode_url} into {restorer.base_path}...")
+        report = restorer.restore(entity_types, prune=options['prune'])
+        
+        for entity_type, counts in report['by_type'].items():
+            line = (
+                f"  {entity_type}: {counts['restored']} restored, {counts['skipped']} already present, "
+                f"{counts['failed']} failed"
+            )
+            if counts['extra']:
+                line += f", {counts['extra']} not in replica ({counts['removed']} removed)"
+            self.stdout.write(line)
+        for failure in report['failures'][:20]:
+            self.stdout.write(self.style.ERROR(f"  {failure['type']}/{failure['id']}: {failure['error']}"))
+        kept = report['extra'] - report['removed']
+        if kept:
+            sample = ', '.join(f"{e['type']}/{e['id']}" for e in report['extras'][:10])
+            hint = '' if options['prune'] else '; re-run with --prune to delete them'
+            self.stdout.write(self.style.WARNING(f"  {kept} local file(s) not in the replica kept ({sample}){hint}"))
+        
+        mb = report['bytes'] / (1024 * 1024)
+        rate = report['restored'] / report['seconds'] if report['seconds'] else 0
+        summary = (
+            f"\n{report['restored']} restored ({mb:.2f} MB, {rate:.0f} files/s), {report['skipped']} skipped, "
+            f"{report['failed']} failed in {report['seconds']}s"
+        )
+        if report['failed']:
+            self.stdout.write(self.style.WARNING(summary + '\nRe-run the command to retry the failed files'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"\n✅ {summary.strip()}"))
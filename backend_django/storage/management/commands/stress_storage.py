@@ -0,0 +1,342 @@
+"""
+Management command to stress one FileStorageManager directory from several processes
+"""
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from storage import FileStorageManager, StorageChecker
+
+
+ENTITY_TYPE = 'ninos'
+DEFAULT_MIX = 'create=40,update=30,delete=15,read=15'
+SEED_RECORDS = 50
+
+
+def _parse_mix(value):
+    mix = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        name, _, weight = item.partition('=')
+        if name not in ('create', 'update', 'delete', 'read'):
+            raise CommandError(f"Unknown operation '{name}' in --mix")
+        try:
+            mix[name] = float(weight)
+        except ValueError:
+            raise CommandError(f"Invalid weight for {name}: {weight}")
+    if not any(weight > 0 for weight in mix.values()):
+        raise CommandError('--mix needs at least one positive weight')
+    return mix
+
+
+class Command(BaseCommand):
+    help = ('Spawn N processes doing mixed creates/updates/deletes on one storage directory, '
+            'verify no lost index entries, duplicate IDs or torn files, and report ops/sec per process count')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', default='1,2,4,8', help='Process counts to run (default: 1,2,4,8)')
+        parser.add_argument('--ops', type=int, default=200, help='Operations per process (default: 200)')
+        parser.add_argument('--mix', default=DEFAULT_MIX, help=f"Operation weights (default: {DEFAULT_MIX})")
+        parser.add_argument('--payload-bytes', type=int, default=512, help='Padding per record (default: 512)')
+        parser.add_argument('--targets', default='local,nfs',
+                            help="local (plain directory), nfs (NFS code path: blob cache per process) or both")
+        parser.add_argument('--local-path', help='Parent directory for the local runs (default: a temp dir)')
+        parser.add_argument('--nfs-path', help='Parent directory for the nfs runs, e.g. a real NFS mount '
+                                               '(default: a local stand-in directory)')
+        parser.add_argument('--seed', type=int, default=7, help='Random seed (default: 7)')
+        parser.add_argument('--output', help='Write the report as JSON to this file')
+        parser.add_argument('--keep', action='store_true', help='Keep the run directories')
+        # Interno: un proceso de carga
+        parser.add_argument('--worker-id', type=int, help='(internal)')
+        parser.add_argument('--worker-dir', help='(internal)')
+
+    # ------------------------------------------------------------------
+    # Proceso de carga
+    # ------------------------------------------------------------------
+
+    def _record(self, entity_id, owner, version, padding):
+        return {
+            'id_nino': entity_id,
+            'nombre': f"Stress {owner}",
+            'estado_apadrinamiento': 'Disponible',
+            'owner': owner,
+            'version': version,
+            'padding': padding,
+        }
+
+    def _worker(self, worker_id, run_dir, options):
+        """Ejecuta --ops operaciones y deja un log de lo que hizo en worker-<id>.json"""
+        run_dir = Path(run_dir)
+        storage = FileStorageManager()
+        rng = random.Random(f"{options['seed']}:{worker_id}")
+        mix = _parse_mix(options['mix'])
+        names, weights = list(mix), list(mix.values())
+        padding = 'x' * options['payload_bytes']
+        seeds = [f"N{n:03d}" for n in range(1, SEED_RECORDS + 1)]
+
+        owned = {}        # id -> última versión escrita por este proceso
+        creates, deletes = [], []
+        ops = Counter()
+        failures = Counter()
+
+        (run_dir / f"ready-{worker_id}").touch()
+        go = run_dir / 'go'
+        while not go.exists():
+            time.sleep(0.01)
+
+        started = time.perf_counter()
+        for seq in range(options['ops']):
+            op = rng.choices(names, weights=weights)[0]
+            if op == 'delete' and not owned:
+                op = 'create'
+            try:
+                if op == 'create':
+                    entity_id = storage.get_next_id(ENTITY_TYPE, 'N')
+                    if storage.save(ENTITY_TYPE, entity_id, self._record(entity_id, worker_id, seq, padding)):
+                        owned[entity_id] = seq
+                        creates.append(entity_id)
+                    else:
+                        failures['create'] += 1
+                elif op == 'update':
+                    # Mitad sobre registros propios, mitad sobre registros compartidos por todos
+                    if owned and rng.random() < 0.5:
+                        entity_id = rng.choice(list(owned))
+                        ok = storage.save(ENTITY_TYPE, entity_id, self._record(entity_id, worker_id, seq, padding))
+                        if ok:
+                            owned[entity_id] = seq
+                    else:
+                        entity_id = rng.choice(seeds)
+                        ok = storage.save(ENTITY_TYPE, entity_id, self._record(entity_id, 'seed', f"{worker_id}-{seq}", padding))
+                    if not ok:
+                        failures['update'] += 1
+                elif op == 'delete':
+                    entity_id = rng.choice(list(owned))
+                    if storage.delete(ENTITY_TYPE, entity_id):
+                        del owned[entity_id]
+                        deletes.append(entity_id)
+                    else:
+                        failures['delete'] += 1
+                else:
+                    # Los registros semilla nunca se borran: una lectura vacía es una lectura rota
+                    entity_id = rng.choice(seeds)
+                    data = storage.load(ENTITY_TYPE, entity_id)
+                    if not data or data.get('id_nino') != entity_id:
+                        failures['read'] += 1
+            except Exception as e:
+                print(f"Error in worker {worker_id} ({op}): {e}")
+                failures[op] += 1
+            ops[op] += 1
+        elapsed = time.perf_counter() - started
+
+        with open(run_dir / f"worker-{worker_id}.json", 'w', encoding='utf-8') as f:
+            json.dump({
+                'elapsed': elapsed, 'ops': ops, 'failures': failures,
+                'creates': creates, 'deletes': deletes, 'owned': owned,
+            }, f)
+
+    # ------------------------------------------------------------------
+    # Proceso padre
+    # ------------------------------------------------------------------
+
+    def _worker_env(self, target, data_dir, run_dir, worker_id):
+        env = {
+            **os.environ,
+            'STORAGE_BACKEND': 'file',
+            'METRICS_DIR': 'none',
+            'PROFILE_SAMPLE_RATE': '0',
+        }
+        if target == 'local':
+            env.update({'USE_NFS': 'False', 'LOCAL_STORAGE_PATH': str(data_dir)})
+        else:
+            # Ruta de NFS de producción: cache local propio por proceso, como si cada uno fuera otro host.
+            # El stand-in no es un montaje real, así que el monitor de salud queda apagado.
+            env.update({
+                'USE_NFS': 'True',
+                'NFS_DATA_PATH': str(data_dir),
+                'NFS_CACHE_ENABLED': 'True',
+                'NFS_CACHE_PATH': str(run_dir / f"cache-{worker_id}"),
+                'NFS_CACHE_REVALIDATE_SECONDS': '0',
+                'NFS_HEALTH_ENABLED': 'False',
+            })
+        return env
+
+    def _run(self, target, parent, processes, options):
+        run_dir = Path(tempfile.mkdtemp(prefix=f"stress-{target}-{processes}p-", dir=parent))
+        data_dir = run_dir / 'data'
+        storage = FileStorageManager(base_path=str(data_dir))
+        padding = 'x' * options['payload_bytes']
+        storage.save_many(ENTITY_TYPE, {
+            f"N{n:03d}": self._record(f"N{n:03d}", 'seed', 0, padding) for n in range(1, SEED_RECORDS + 1)
+        })
+
+        command = [sys.executable, str(Path(settings.BASE_DIR) / 'manage.py'), 'stress_storage',
+                   '--worker-dir', str(run_dir), '--ops', str(options['ops']), '--mix', options['mix'],
+                   '--payload-bytes', str(options['payload_bytes']), '--seed', str(options['seed'])]
+        workers = [
+            subprocess.Popen(command + ['--worker-id', str(i)], env=self._worker_env(target, data_dir, run_dir, i),
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+            for i in range(processes)
+        ]
+        try:
+            # Todos arrancan a la vez cuando el último terminó de inicializar Django
+            deadline = time.monotonic() + 120
+            while sum((run_dir / f"ready-{i}").exists() for i in range(processes)) < processes:
+                if any(worker.poll() is not None for worker in workers) or time.monotonic() > deadline:
+                    raise CommandError(f"Workers failed to start:\n{workers[0].communicate()[0][-2000:]}")
+                time.sleep(0.02)
+            started = time.perf_counter()
+            (run_dir / 'go').touch()
+            outputs = [worker.communicate()[0] for worker in workers]
+            wall = time.perf_counter() - started
+        finally:
+            for worker in workers:
+                if worker.poll() is None:
+                    worker.kill()
+
+        logs = []
+        for i in range(processes):
+            try:
+                with open(run_dir / f"worker-{i}.json", 'r', encoding='utf-8') as f:
+                    logs.append(json.load(f))
+            except (OSError, ValueError):
+                raise CommandError(f"Worker {i} left no log:\n{outputs[i][-2000:]}")
+
+        result = self._verify(data_dir, logs)
+        total_ops = sum(sum(log['ops'].values()) for log in logs)
+        result.update({
+            'target': target,
+            'processes': processes,
+            'ops': total_ops,
+            'seconds': round(wall, 3),
+            'ops_per_sec': round(total_ops / wall, 1),
+            'ops_by_type': dict(sum((Counter(log['ops']) for log in logs), Counter())),
+        })
+        if not options['keep']:
+            shutil.rmtree(run_dir, ignore_errors=True)
+        else:
+            result['directory'] = str(run_dir)
+        return result
+
+    def _verify(self, data_dir, logs):
+        """Compara el estado final del directorio con lo que cada proceso dice haber hecho"""
+        storage = FileStorageManager(base_path=str(data_dir))
+        checker = StorageChecker(storage, workers=4)
+        report = checker.check([ENTITY_TYPE])[ENTITY_TYPE]
+        index = checker._read_index_raw(ENTITY_TYPE) or []
+        _, tmp_files = checker._scan_dir(ENTITY_TYPE)
+
+        # Dos creates que recibieron el mismo ID: uno de los dos registros se perdió
+        claims = Counter(entity_id for log in logs for entity_id in log['creates'])
+        duplicate_ids = sorted(entity_id for entity_id, count in claims.items() if count > 1)
+        duplicated = set(duplicate_ids)
+
+        seeds = {f"N{n:03d}" for n in range(1, SEED_RECORDS + 1)}
+        live = set(seeds)
+        deleted = set()
+        for log in logs:
+            live.update(entity_id for entity_id in log['creates'] if entity_id not in duplicated)
+            deleted.update(entity_id for entity_id in log['deletes'] if entity_id not in duplicated)
+        live -= deleted
+
+        indexed = set(index)
+        lost_writes = []
+        for worker_id, log in enumerate(logs):
+            for entity_id, version in log['owned'].items():
+                if entity_id in duplicated:
+                    continue
+                data = storage.load(ENTITY_TYPE, entity_id)
+                if not data or data.get('owner') != worker_id or data.get('version') != version:
+                    lost_writes.append(entity_id)
+
+        problems = {
+            'lost_index_entries': sorted(live - indexed),
+            'deleted_still_indexed': sorted(deleted & indexed),
+            'duplicate_ids': duplicate_ids,
+            'duplicate_index_entries': report['duplicates'],
+            'torn_files': [entity_id for entity_id, _ in report['corrupt']],
+            'mismatched_files': [entity_id for entity_id, _ in report['mismatched']],
+            'orphan_files': report['orphans'],
+            'dangling_index_entries': [i for i in report['dangling'] if i not in deleted],
+            'leftover_tmp_files': tmp_files,
+            'lost_writes': sorted(lost_writes),
+            'failed_reads': sum(log['failures'].get('read', 0) for log in logs),
+            'failed_writes': sum(
+                count for log in logs for op, count in log['failures'].items() if op != 'read'
+            ),
+        }
+        return {
+            'records': len(index),
+            'problems': {name: value for name, value in problems.items() if value},
+        }
+
+    def handle(self, *args, **options):
+        if options['worker_id'] is not None:
+            self._worker(options['worker_id'], options['worker_dir'], options)
+            return
+
+        _parse_mix(options['mix'])
+        try:
+            counts = [int(value) for value in options['processes'].split(',') if value.strip()]
+        except ValueError:
+            raise CommandError('--processes must be comma-separated integers')
+        if not counts or min(counts) < 1:
+            raise CommandError('--processes must be positive')
+        targets = [target.strip() for target in options['targets'].split(',') if target.strip()]
+        if not targets or any(target not in ('local', 'nfs') for target in targets):
+            raise CommandError("--targets must be 'local', 'nfs' or 'local,nfs'")
+
+        created_dirs = []
+        parents = {}
+        for target in targets:
+            given = options['local_path'] if target == 'local' else options['nfs_path']
+            if given:
+                Path(given).mkdir(parents=True, exist_ok=True)
+                parents[target] = given
+            else:
+                parents[target] = tempfile.mkdtemp(prefix=f"smilelink-stress-{target}-")
+                created_dirs.append(parents[target])
+
+        results = []
+        try:
+            for target in targets:
+                for processes in counts:
+                    self.stdout.write(f"Running {target} with {processes} process(es) x {options['ops']} ops...")
+                    results.append(self._run(target, parents[target], processes, options))
+        finally:
+            if not options['keep']:
+                for directory in created_dirs:
+                    shutil.rmtree(directory, ignore_errors=True)
+
+        self.stdout.write(
+            f"\n{'target':<8}{'procs':>6}{'ops':>8}{'seconds':>10}{'ops/s':>10}{'ops/s/proc':>12}{'records':>9}  problems"
+        )
+        for result in results:
+            problems = ', '.join(
+                f"{name}={len(value) if isinstance(value, list) else value}"
+                for name, value in result['problems'].items()
+            ) or 'none'
+            line = (
+                f"{result['target']:<8}{result['processes']:>6}{result['ops']:>8}{result['seconds']:>10.2f}"
+                f"{result['ops_per_sec']:>10.1f}{result['ops_per_sec'] / result['processes']:>12.1f}"
+                f"{result['records']:>9}  {problems}"
+            )
+            self.stdout.write(self.style.ERROR(line) if result['problems'] else line)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump({'options': {k: options[k] for k in ('processes', 'ops', 'mix', 'payload_bytes', 'seed')},
+                           'cpus': os.cpu_count(), 'results': results}, f, indent=2)
+            self.stdout.write(f"\nReport written to {options['output']}")
+
+        failed = [result for result in results if result['problems']]
+        if failed:
+            raise CommandError(f"{len(failed)} run(s) left the store inconsistent")
+        self.stdout.write(self.style.SUCCESS('\n✅ Store consistent after every run'))
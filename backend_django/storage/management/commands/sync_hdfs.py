@@ -0,0 +1,34 @@
+"""
+Management command to run an incremental full sync to HDFS
+"""
+from django.core.management.base import BaseCommand
+from storage import get_sync_manager
+
+
+class Command(BaseCommand):
+    help = 'Upload new or changed entity files to HDFS and propagate local deletions'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--type', action='append', dest='types', help='Entity type to sync (repeatable)')
+    
+    def handle(self, *args, **options):
+        sync = get_sync_manager()
+        
+        if not sync.auto_sync or not sync.hdfs.is_available():
+            self.stdout.write(self.style.WARNING('HDFS replication disabled or client not available'))
+            return
+        
+        entity_types = options['types'] or sync.storage.ENTITY_TYPES
+        self.stdout.write(f"Syncing {', '.join(entity_types)} to HDFS...")
+        report = sync.sync_incremental(entity_types)
+        
+        for entity_type, counts in report['by_type'].items():
+            self.stdout.write(f"  {entity_type}: {counts['uploaded']} uploaded, {counts['deleted']} deleted")
+        
+        mb = report['bytes_uploaded'] / (1024 * 1024)
+        summary = (
+            f"\n{report['files_uploaded']} uploaded ({mb:.2f} MB), {report['files_skipped']} unchanged, "
+            f"{report['files_deleted']} deleted, {report['errors']} errors in {report['seconds']}s"
+        )
+        style = self.style.SUCCESS if not report['errors'] else self.style.WARNING
+        self.stdout.write(style(summary))
@@ -0,0 +1,40 @@
+"""
+Management command to build the shared read-only snapshot before the workers start
+"""
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from storage import get_storage_manager
+
+
+class Command(BaseCommand):
+    help = 'Decrypt the hot collections into the shared snapshot (SNAPSHOT_ENABLED) read by every gunicorn worker'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--type', action='append', dest='types',
+                            help='Entity type to build (repeatable, default: SNAPSHOT_TYPES)')
+
+    def handle(self, *args, **options):
+        if os.getenv('STORAGE_BACKEND', 'file').lower() != 'file':
+            raise CommandError('Snapshots are only available with STORAGE_BACKEND=file')
+        snapshot = get_storage_manager().snapshot
+        if snapshot is None or not snapshot.reads_enabled:
+            raise CommandError('Snapshot disabled: set SNAPSHOT_ENABLED=True')
+
+        entity_types = options['types'] or snapshot.entity_types
+        invalid = [t for t in entity_types if t not in snapshot.entity_types]
+        if invalid:
+            raise CommandError(
+                f"Not snapshot type(s): {', '.join(invalid)} (SNAPSHOT_TYPES={','.join(snapshot.entity_types)})"
+            )
+
+        self.stdout.write(f"Building snapshot in {snapshot.directory}...")
+        started = time.time()
+        for entity_type in entity_types:
+            result = snapshot.build(entity_type)
+            self.stdout.write(
+                f"  {entity_type}: {result['records']} records, {result['bytes'] / 1024:.0f} KiB, "
+                f"{result['decrypted']} decrypted, {result['reused']} reused ({result['seconds']}s)"
+            )
+        self.stdout.write(self.style.SUCCESS(f"\n✅ Snapshot ready in {time.time() - started:.2f}s"))
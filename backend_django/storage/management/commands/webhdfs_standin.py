@@ -0,0 +1,25 @@
+"""
+Management command to serve a directory through a local WebHDFS stand-in
+"""
+from django.core.management.base import BaseCommand
+from storage.webhdfs_standin import WebHDFSStandIn
+
+
+class Command(BaseCommand):
+    help = 'Run a local WebHDFS server backed by a directory (for testing replication and restore)'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--root', default='./hdfs_standin', help='Directory used as the HDFS filesystem')
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=9870)
+    
+    def handle(self, *args, **options):
+        server = WebHDFSStandIn(options['root'], host=options['host'], port=options['port'])
+        self.stdout.write(self.style.SUCCESS(f"WebHDFS stand-in on {server.url} serving {server.root}"))
+        self.stdout.write(f"Use HDFS_NAMENODE_URL={server.url}  (Ctrl+C to stop)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.stop()
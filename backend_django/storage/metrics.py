@@ -0,0 +1,376 @@
+"""
+SmileLink Storage - Metrics
+Contadores e histogramas en memoria expuestos en formato de texto de Prometheus
+
+Cada proceso (worker de gunicorn, comando) acumula sus métricas en memoria
+y cada METRICS_FLUSH_SECONDS deja una foto en METRICS_DIR/<pid>.json. El
+endpoint /api/metrics/ suma las fotos de todos los procesos; las de procesos
+que ya terminaron se acumulan en _archived.json para que los contadores no
+retrocedan. Registrar una observación es un lock y una suma: nunca toca disco.
+"""
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from .tracing import get_current_trace, span
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - sólo POSIX
+    fcntl = None
+
+
+ENABLED = os.getenv('METRICS_ENABLED', 'True').lower() == 'true'
+
+# Segundos: de 0.5 ms (lectura cacheada) a 10 s (subida a HDFS lenta)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+ARCHIVED_NAME = '_archived.json'
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], Any] = {}
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def reset(self):
+        with self._lock:
+            self._values = {}
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            values = [[list(key), value if not isinstance(value, list) else list(value)]
+                      for key, value in self._values.items()]
+        return {'type': self.kind, 'help': self.documentation, 'labels': list(self.labelnames), 'values': values}
+
+
+class Counter(_Metric):
+    """Valor que sólo crece (ej: bytes escritos, fallos)"""
+
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Histogram(_Metric):
+    """Distribución de duraciones en buckets fijos"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        position = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                position = i
+                break
+        with self._lock:
+            # [conteo por bucket (no acumulado) ..., +Inf, suma, total]
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            entry[position] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Mide la duración del bloque"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def snapshot(self) -> Dict[str, Any]:
+        snapshot = super().snapshot()
+        snapshot['buckets'] = list(self.buckets)
+        return snapshot
+
+
+class MetricsRegistry:
+    """Métricas del proceso y agregación entre procesos vía un directorio local"""
+
+    def __init__(self, directory: Optional[str] = None, flush_seconds: float = 5):
+        self.directory = Path(directory) if directory else None
+        self.flush_seconds = flush_seconds
+        self._metrics: Dict[str, _Metric] = {}
+        self._flusher = None
+        self._flusher_pid = None
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Métricas de este proceso"""
+        return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+    def reset(self):
+        """Descarta lo acumulado (p.ej. en el hijo tras un fork)"""
+        for metric in self._metrics.values():
+            metric.reset()
+
+    # ------------------------------------------------------------------
+    # Fotos por proceso
+    # ------------------------------------------------------------------
+
+    def _process_file(self) -> Path:
+        return self.directory / f"{os.getpid()}.json"
+
+    def flush(self):
+        """Escribe la foto de este proceso en el directorio compartido"""
+        if self.directory is None or not ENABLED:
+            return
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            path = self._process_file()
+            tmp_path = path.with_name(f".{path.name}.tmp")
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Error flushing metrics: {e}")
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            self.flush()
+
+    def start(self):
+        """Arranca el hilo que escribe la foto periódicamente (una vez por proceso)"""
+        if self.directory is None or not ENABLED or self._flusher_pid == os.getpid():
+            return
+        self._flusher_pid = os.getpid()
+        self._flusher = threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True)
+        self._flusher.start()
+
+    # ------------------------------------------------------------------
+    # Agregación
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def merge(into: Dict[str, Any], snapshot: Dict[str, Any]):
+        """Suma una foto sobre otra (contadores e histogramas son aditivos)"""
+        for name, metric in snapshot.items():
+            target = into.setdefault(name, {**metric, 'values': []})
+            if target.get('buckets') != metric.get('buckets'):
+                continue
+            values = {tuple(labels): value for labels, value in target['values']}
+            for labels, value in metric['values']:
+                key = tuple(labels)
+                if key not in values:
+                    values[key] = value if not isinstance(value, list) else list(value)
+                elif isinstance(value, list):
+                    values[key] = [a + b for a, b in zip(values[key], value)]
+                else:
+                    values[key] += value
+            target['values'] = [[list(key), value] for key, value in values.items()]
+
+    @staticmethod
+    def _alive(pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def _read(self, path: Path) -> Dict[str, Any]:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def collect(self) -> Dict[str, Any]:
+        """Métricas sumadas de todos los procesos (o sólo de este si no hay directorio)"""
+        if self.directory is None:
+            return self.snapshot()
+
+        self.flush()
+        lock_file = None
+        if fcntl is not None:
+            lock_file = open(self.directory / '.lock', 'a')
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            archived_path = self.directory / ARCHIVED_NAME
+            archived = self._read(archived_path)
+            archived_changed = False
+            # La definición de este proceso manda: fotos con otros buckets (de
+            # antes de un deploy) se descartan, sin importar el orden del glob
+            merged: Dict[str, Any] = {}
+            self.merge(merged, self.snapshot())
+
+            for path in self.directory.glob('*.json'):
+                if path.name in (ARCHIVED_NAME, self._process_file().name):
+                    continue
+                snapshot = self._read(path)
+                try:
+                    pid = int(path.stem)
+                except ValueError:
+                    continue
+                if pid != os.getpid() and not self._alive(pid):
+                    # Proceso terminado: su último valor pasa al acumulado
+                    self.merge(archived, snapshot)
+                    archived_changed = True
+                    path.unlink(missing_ok=True)
+                    continue
+                self.merge(merged, snapshot)
+
+            if archived_changed:
+                tmp_path = archived_path.with_name(f".{archived_path.name}.tmp")
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(archived, f)
+                os.replace(tmp_path, archived_path)
+            self.merge(merged, archived)
+            return merged
+        finally:
+            if lock_file is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+                lock_file.close()
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: List[str], values: List[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus(metrics: Dict[str, Any]) -> str:
+    """Formato de exposición de texto de Prometheus (version 0.0.4)"""
+    lines = []
+    for name in sorted(metrics):
+        metric = metrics[name]
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        labelnames = metric['labels']
+        for labels, value in sorted(metric['values']):
+            if metric['type'] == 'histogram':
+                cumulative = 0
+                for bound, count in zip(metric['buckets'] + ['+Inf'], value[:-2]):
+                    cumulative += count
+                    le = bound if bound == '+Inf' else _number(float(bound))
+                    lines.append(f"{name}_bucket{_labels(labelnames, labels, ('le', le))} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labelnames, labels)} {_number(float(value[-2]))}")
+                lines.append(f"{name}_count{_labels(labelnames, labels)} {value[-1]}")
+            else:
+                lines.append(f"{name}{_labels(labelnames, labels)} {_number(value)}")
+    return '\n'.join(lines) + '\n'
+
+
+def _default_directory() -> Optional[str]:
+    directory = os.getenv('METRICS_DIR', '')
+    if directory.lower() == 'none':
+        return None
+    return directory or str(Path(__file__).resolve().parent.parent / 'metrics_data')
+
+
+REGISTRY = MetricsRegistry(_default_directory(), float(os.getenv('METRICS_FLUSH_SECONDS', '5')))
+
+if hasattr(os, 'register_at_fork'):
+    # Un worker hereda lo acumulado por el master antes del fork: empezar de cero
+    os.register_at_fork(after_in_child=REGISTRY.reset)
+atexit.register(REGISTRY.flush)
+
+
+# ----------------------------------------------------------------------
+# Métricas de SmileLink
+# ----------------------------------------------------------------------
+
+STORAGE_OPERATION_SECONDS = REGISTRY.histogram(
+    'smilelink_storage_operation_seconds', 'Latency of storage backend operations',
+    ('backend', 'operation', 'entity_type'),
+)
+STORAGE_READ_BYTES = REGISTRY.counter(
+    'smilelink_storage_read_bytes_total', 'Ciphertext bytes read from the entity store', ('backend', 'entity_type'),
+)
+STORAGE_WRITTEN_BYTES = REGISTRY.counter(
+    'smilelink_storage_written_bytes_total', 'Ciphertext bytes written to the entity store', ('backend', 'entity_type'),
+)
+STORAGE_INDEX_LOADS = REGISTRY.counter(
+    'smilelink_storage_index_loads_total', 'Index reads that reached the backend (read cache misses)',
+    ('backend', 'entity_type'),
+)
+ENCRYPTION_SECONDS = REGISTRY.histogram(
+    'smilelink_encryption_seconds', 'Time spent in Fernet encrypt/decrypt including JSON', ('operation',),
+)
+ENCRYPTION_BYTES = REGISTRY.counter(
+    'smilelink_encryption_bytes_total', 'Ciphertext bytes produced or consumed', ('operation',),
+)
+HDFS_SECONDS = REGISTRY.histogram(
+    'smilelink_hdfs_operation_seconds', 'Latency of HDFS operations', ('operation',),
+)
+HDFS_FAILURES = REGISTRY.counter(
+    'smilelink_hdfs_failures_total', 'Failed HDFS operations', ('operation',),
+)
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    'smilelink_http_request_seconds', 'API request latency by route', ('method', 'route', 'status'),
+)
+
+
+def timed_storage_operation(operation: str):
+    """
+    Decorador para métodos de StorageBackend con firma (self, entity_type, ...)
+
+    Registra la latencia en el histograma y, si el request se está trazando,
+    un span storage.<operation>.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, entity_type, *args, **kwargs):
+            if not ENABLED and get_current_trace() is None:
+                return func(self, entity_type, *args, **kwargs)
+            started = time.perf_counter()
+            try:
+                with span(f'storage.{operation}', backend=self.name, entity_type=entity_type):
+                    return func(self, entity_type, *args, **kwargs)
+            finally:
+                STORAGE_OPERATION_SECONDS.observe(
+                    time.perf_counter() - started,
+                    backend=self.name, operation=operation, entity_type=entity_type,
+                )
+        return wrapper
+    return decorator
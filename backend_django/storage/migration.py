@@ -0,0 +1,581 @@
+"""
+SmileLink Storage - Migration
+Migración en línea entre motores/layouts de almacenamiento
+
+Despliegue sin downtime:
+
+1. Los workers de la API arrancan con STORAGE_BACKEND=migrating,
+   MIGRATION_SOURCE=<origen> y MIGRATION_TARGET=<destino>: cada escritura
+   va a ambos layouts y las lecturas salen del preferido
+   (MIGRATION_READ_PREFERENCE) con respaldo en el otro.
+2. `python manage.py migrate_storage --source ... --target ...` copia en
+   chunks paralelos lo que falte en el destino, con checkpoints en el
+   JobStore: si se interrumpe, al relanzarlo continúa donde quedó.
+3. La verificación compara el contenido desencriptado de ambos lados
+   (--fix corrige diferencias) y entonces se cambia STORAGE_BACKEND al destino.
+
+El archivo frío (storage/archive.py) vive en <base_path>/_archive de cada
+motor: copy_archive lo lleva al destino y verify_archive lo compara.
+
+La copia, la corrección de --fix y el write-through de un mismo tipo se
+serializan con un flock por tipo junto al origen (`.migration.<tipo>.lock`),
+así un chunk nunca pisa en el destino una escritura más nueva de la API.
+
+Un write-through que falla no falla el request (el origen es autoritativo):
+el ID se anota en `.migration.<tipo>.failed` junto al origen. migrate_storage
+vuelve a copiar esos IDs después de la copia, y la verificación falla
+mientras queden anotados (--fix los copia).
+
+Las especificaciones de layout son las de open_storage_backend:
+'file', 'file:/ruta', 'sqlite:/ruta/db.sqlite3', 'log:/ruta'.
+"""
+import os
+import re
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+from .archive import ARCHIVE_DIR, CATALOG_NAME
+from .backend import StorageBackend, open_storage_backend
+from .file_manager import IndexLock
+from .jobs import get_job_store
+from .write_batch import WriteBatch
+
+
+_type_locks: Dict[Path, IndexLock] = {}
+_type_locks_guard = threading.Lock()
+
+
+def migration_type_lock(source: StorageBackend, entity_type: str) -> IndexLock:
+    """Lock entre procesos que ordena copia y write-through de un tipo"""
+    path = Path(source.base_path) / f".migration.{entity_type}.lock"
+    with _type_locks_guard:
+        lock = _type_locks.get(path)
+        if lock is None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            lock = _type_locks[path] = IndexLock(path)
+        return lock
+
+
+def _failures_path(source: StorageBackend, entity_type: str) -> Path:
+    return Path(source.base_path) / f".migration.{entity_type}.failed"
+
+
+def record_write_through_failures(source: StorageBackend, entity_type: str, entity_ids: Iterable[str]):
+    """Anota IDs que no llegaron al destino; llamar con el lock del tipo tomado"""
+    entity_ids = list(entity_ids)
+    if not entity_ids:
+        return
+    try:
+        with open(_failures_path(source, entity_type), 'a', encoding='utf-8') as f:
+            f.write(''.join(f"{entity_id}\n" for entity_id in entity_ids))
+    except OSError as e:
+        print(f"Error recording write-through failures for {entity_type}: {e}")
+
+
+def read_write_through_failures(source: StorageBackend, entity_type: str) -> List[str]:
+    """IDs anotados por write-through fallidos, sin repetir"""
+    try:
+        with open(_failures_path(source, entity_type), 'r', encoding='utf-8') as f:
+            return list(dict.fromkeys(line.strip() for line in f if line.strip()))
+    except FileNotFoundError:
+        return []
+
+
+class MigratingStorageBackend(StorageBackend):
+    """Escribe en el layout de origen y en el de destino; lee de ambos"""
+
+    name = 'migrating'
+
+    def __init__(self, source: StorageBackend, target: StorageBackend, read_preference: str = 'source'):
+        """
+        Args:
+            source: Layout actual (autoritativo hasta el cambio)
+            target: Layout nuevo
+            read_preference: 'source' o 'target'; el otro se usa si no encuentra la entidad
+        """
+        if read_preference not in ('source', 'target'):
+            raise ValueError(f"Invalid read preference: {read_preference}")
+        self.source = source
+        self.target = target
+        self.read_preference = read_preference
+        self.primary, self.secondary = (source, target) if read_preference == 'source' else (target, source)
+        self.encryption = source.encryption
+        self.base_path = source.base_path
+        self._index_lock = threading.RLock()
+
+    def _type_lock(self, entity_type: str) -> IndexLock:
+        return migration_type_lock(self.source, entity_type)
+
+    # ------------------------------------------------------------------
+    # Lecturas
+    # ------------------------------------------------------------------
+
+    def _read_index(self, entity_type: str) -> List[str]:
+        # Todas las escrituras llegan al origen: su índice está completo
+        return self.source._read_index(entity_type)
+
+    def _read_entity(self, entity_type: str, entity_id: str) -> Optional[Dict[str, Any]]:
+        data = self.primary._read_entity(entity_type, entity_id)
+        if data is None:
+            data = self.secondary._read_entity(entity_type, entity_id)
+        return data
+
+    def exists(self, entity_type: str, entity_id: str) -> bool:
+        """Verifica si una entidad existe en alguno de los layouts"""
+        return self.primary.exists(entity_type, entity_id) or self.secondary.exists(entity_type, entity_id)
+
+    def find(self, entity_type: str, **filters) -> List[Dict[str, Any]]:
+        return self.source.find(entity_type, **filters)
+
+    def count(self, entity_type: str, **filters) -> int:
+        return self.source.count(entity_type, **filters)
+
+    def allocate_ids(self, entity_type: str, prefix: str, count: int) -> List[str]:
+        """IDs del allocator atómico del origen, que recibe todas las escrituras"""
+        return self.source.allocate_ids(entity_type, prefix, count)
+
+    # ------------------------------------------------------------------
+    # Escrituras (origen primero; lo que falle en el destino queda anotado)
+    # ------------------------------------------------------------------
+
+    def _write_through_failed(self, entity_type: str, entity_ids: List[str], error: Any):
+        print(f"Error writing through {entity_type} {', '.join(entity_ids[:5])} to migration target: {error}")
+        record_write_through_failures(self.source, entity_type, entity_ids)
+
+    def save(self, entity_type: str, entity_id: str, data: Dict[str, Any]) -> bool:
+        """Guarda la entidad en ambos layouts"""
+        with self._type_lock(entity_type):
+            saved = self.source.save(entity_type, entity_id, data)
+            if saved:
+                try:
+                    if not self.target.save(entity_type, entity_id, data):
+                        self._write_through_failed(entity_type, [entity_id], 'save returned False')
+                except Exception as e:
+                    self._write_through_failed(entity_type, [entity_id], e)
+        return saved
+
+    def save_many(self, entity_type: str, records: Dict[str, Dict[str, Any]]) -> List[str]:
+        """Guarda varias entidades en ambos layouts"""
+        with self._type_lock(entity_type):
+            saved = self.source.save_many(entity_type, records)
+            if saved:
+                try:
+                    written = set(self.target.save_many(entity_type, {entity_id: records[entity_id] for entity_id in saved}))
+                    error = 'not saved'
+                except Exception as e:
+                    written, error = set(), e
+                failed = [entity_id for entity_id in saved if entity_id not in written]
+                if failed:
+                    self._write_through_failed(entity_type, failed, error)
+        return saved
+
+    def delete(self, entity_type: str, entity_id: str) -> bool:
+        """Elimina la entidad de ambos layouts"""
+        with self._type_lock(entity_type):
+            deleted = self.source.delete(entity_type, entity_id)
+            try:
+                deleted_target = self.target.delete(entity_type, entity_id)
+            except Exception as e:
+                self._write_through_failed(entity_type, [entity_id], e)
+                deleted_target = False
+        return deleted or deleted_target
+
+    def load_raw(self, entity_type: str, entity_id: str) -> Optional[bytes]:
+        """Ciphertext del origen, que recibe todas las escrituras"""
+        return self.source.load_raw(entity_type, entity_id)
+
+    def delete_if_unchanged(self, entity_type: str, expected: Dict[str, bytes]) -> List[str]:
+        """Compara contra el origen y borra lo que coincidió también del destino"""
+        with self._type_lock(entity_type):
+            deleted = self.source.delete_if_unchanged(entity_type, expected)
+            for entity_id in deleted:
+                try:
+                    self.target.delete(entity_type, entity_id)
+                except Exception as e:
+                    self._write_through_failed(entity_type, [entity_id], e)
+        return deleted
+
+    def write_batch(self) -> 'MigratingWriteBatch':
+        """Batch confirmado en el origen y después en el destino"""
+        return MigratingWriteBatch(self)
+
+    def rebuild_index(self, entity_type: str) -> List[str]:
+        """Reconstruye el índice en ambos layouts; retorna el del origen"""
+        self.target.rebuild_index(entity_type)
+        return self.source.rebuild_index(entity_type)
+
+
+class MigratingWriteBatch(WriteBatch):
+    """WriteBatch re-ejecutado sobre cada layout"""
+
+    def _replay(self, storage: StorageBackend):
+        batch = storage.write_batch()
+        batch._saves = dict(self._saves)
+        batch._deletes = list(self._deletes)
+        return batch.commit()
+
+    def commit(self) -> bool:
+        if self.committed:
+            raise RuntimeError('WriteBatch already committed')
+
+        # Locks en orden fijo: dos batches con tipos cruzados no se bloquean entre sí
+        entity_types = sorted({entity_type for entity_type, _ in list(self._saves) + self._deletes})
+        with ExitStack() as stack:
+            for entity_type in entity_types:
+                stack.enter_context(self.storage._type_lock(entity_type))
+            self._replay(self.storage.source)
+            try:
+                self._replay(self.storage.target)
+            except Exception as e:
+                for entity_type, entity_ids in self.changes.items():
+                    self.storage._write_through_failed(entity_type, entity_ids, e)
+
+        self.committed = True
+        return True
+
+
+def migration_job_id(source_spec: str, target_spec: str) -> str:
+    """ID estable del job para un par origen/destino"""
+    slug = re.sub(r'[^a-zA-Z0-9]+', '-', f"{source_spec}-to-{target_spec}").strip('-').lower()
+    return f"migrate-{slug}"
+
+
+class StorageMigration:
+    """
+    Copia todas las entidades de un layout a otro en chunks paralelos
+
+    Los IDs de cada tipo se congelan al inicio del job; cada chunk copia las
+    entidades que falten en el destino y se marca hecho en el checkpoint.
+    La lectura del origen y la escritura en el destino se hacen bajo el lock
+    del tipo (migration_type_lock), el mismo que toma el write-through: una
+    entidad que ya está en el destino la escribió la API y no se toca.
+    Re-aplicar un chunk a medias es seguro.
+    """
+
+    def __init__(self, source: StorageBackend, target: StorageBackend, job_id: str,
+                 chunk_size: int = 500, workers: int = 8, jobs=None):
+        self.source = source
+        self.target = target
+        self.job_id = job_id
+        self.chunk_size = max(1, chunk_size)
+        self.workers = max(1, workers)
+        self.jobs = jobs or get_job_store()
+
+        self._lock = threading.Lock()
+        self.state: Dict[str, Any] = {}
+
+    # ------------------------------------------------------------------
+    # Estado
+    # ------------------------------------------------------------------
+
+    def _checkpoint(self):
+        """Persiste el estado actual; llamar con self._lock tomado"""
+        self.state['updated_at'] = time.time()
+        self.jobs.save(self.job_id, self.state)
+
+    def _load_or_init_state(self, entity_types: List[str], restart: bool):
+        state = None if restart else self.jobs.load(self.job_id)
+        if state is None:
+            state = {
+                'job_id': self.job_id,
+                'status': 'running',
+                'chunk_size': self.chunk_size,
+                'types': {},
+                'started_at': time.time(),
+                'updated_at': time.time(),
+                'error': None,
+            }
+        else:
+            # Un job reanudado conserva su partición original en chunks
+            self.chunk_size = state['chunk_size']
+            state['status'] = 'running'
+            state['error'] = None
+        self.state = state
+
+        for entity_type in entity_types:
+            ids_job = f"{self.job_id}-ids-{entity_type}"
+            if entity_type in state['types'] and self.jobs.load(ids_job) is not None:
+                continue
+            ids = self.source.list_ids(entity_type)
+            self.jobs.save(ids_job, {'ids': ids})
+            state['types'][entity_type] = {
+                'total': len(ids),
+                'chunks_total': (len(ids) + self.chunk_size - 1) // self.chunk_size,
+                'chunks_done': [],
+                'copied': 0,
+                'skipped': 0,
+            }
+        with self._lock:
+            self._checkpoint()
+
+    # ------------------------------------------------------------------
+    # Copia
+    # ------------------------------------------------------------------
+
+    def _copy_chunk(self, entity_type: str, chunk_no: int, ids: List[str]):
+        records = {}
+        # Pre-filtro sin lock; la comprobación que cuenta se repite bajo el lock
+        pending = [entity_id for entity_id in ids if not self.target.exists(entity_type, entity_id)]
+        skipped = len(ids) - len(pending)
+
+        with migration_type_lock(self.source, entity_type):
+            for entity_id in pending:
+                if self.target.exists(entity_type, entity_id):
+                    skipped += 1
+                    continue
+                data = self.source.load(entity_type, entity_id)
+                if data is None:
+                    # Borrado después de congelar los IDs
+                    skipped += 1
+                    continue
+                records[entity_id] = data
+
+            if records and len(self.target.save_many(entity_type, records)) != len(records):
+                raise IOError(f"Target rejected chunk {chunk_no} of {entity_type}")
+
+        with self._lock:
+            progress = self.state['types'][entity_type]
+            progress['chunks_done'].append(chunk_no)
+            progress['copied'] += len(records)
+            progress['skipped'] += skipped
+            self._checkpoint()
+
+    def run(self, entity_types: Optional[List[str]] = None, restart: bool = False,
+            progress_callback=None) -> Dict[str, Any]:
+        """
+        Ejecuta (o reanuda) la copia
+
+        Args:
+            entity_types: Tipos a migrar (None = todos)
+            restart: Ignorar el checkpoint y empezar de cero
+            progress_callback: Función (entity_type, progress) llamada al terminar cada tipo
+
+        Returns:
+            dict: Estado final del job
+        """
+        entity_types = entity_types or list(self.source.ENTITY_TYPES)
+        self._load_or_init_state(entity_types, restart)
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for entity_type in entity_types:
+                    ids = self.jobs.load(f"{self.job_id}-ids-{entity_type}")['ids']
+                    done = set(self.state['types'][entity_type]['chunks_done'])
+                    futures = [
+                        executor.submit(self._copy_chunk, entity_type, chunk_no, ids[start:start + self.chunk_size])
+                        for chunk_no, start in enumerate(range(0, len(ids), self.chunk_size))
+                        if chunk_no not in done
+                    ]
+                    for future in futures:
+                        future.result()
+                    # Chunks en paralelo llegan en desorden: dejar el índice del destino consistente
+                    with migration_type_lock(self.source, entity_type):
+                        self.recopy_write_through_failures([entity_type])
+                        self.target.rebuild_index(entity_type)
+                    if progress_callback:
+                        progress_callback(entity_type, self.state['types'][entity_type])
+        except Exception as e:
+            with self._lock:
+                self.state['status'] = 'failed'
+                self.state['error'] = str(e)
+                self._checkpoint()
+            raise
+
+        with self._lock:
+            self.state['status'] = 'completed'
+            self._checkpoint()
+        return self.state
+
+    # ------------------------------------------------------------------
+    # Verificación
+    # ------------------------------------------------------------------
+
+    def _verify_chunk(self, entity_type: str, ids: List[str], fix: bool) -> Dict[str, List[str]]:
+        result = {'missing': [], 'extra': [], 'mismatched': []}
+        for entity_id in ids:
+            expected = self.source.load(entity_type, entity_id)
+            actual = self.target.load(entity_type, entity_id)
+            if expected == actual:
+                continue
+            if actual is None:
+                result['missing'].append(entity_id)
+            elif expected is None:
+                result['extra'].append(entity_id)
+            else:
+                result['mismatched'].append(entity_id)
+            if fix:
+                self._fix_entity(entity_type, entity_id)
+        return result
+
+    def _fix_entity(self, entity_type: str, entity_id: str):
+        """Iguala el destino al origen releyendo ambos bajo el lock del tipo"""
+        with migration_type_lock(self.source, entity_type):
+            expected = self.source.load(entity_type, entity_id)
+            if expected == self.target.load(entity_type, entity_id):
+                # El write-through ya lo dejó al día
+                return
+            if expected is None:
+                self.target.delete(entity_type, entity_id)
+            else:
+                self.target.save(entity_type, entity_id, expected)
+
+    def recopy_write_through_failures(self, entity_types: Optional[List[str]] = None) -> Dict[str, List[str]]:
+        """
+        Iguala en el destino los IDs cuyo write-through falló y borra la anotación
+
+        Returns:
+            dict: {entity_type: [IDs re-copiados]}
+        """
+        entity_types = entity_types or list(self.source.ENTITY_TYPES)
+        recopied = {}
+        for entity_type in entity_types:
+            # Bajo el lock del tipo: un fallo anotado mientras tanto no se pierde al vaciar
+            with migration_type_lock(self.source, entity_type):
+                entity_ids = read_write_through_failures(self.source, entity_type)
+                if not entity_ids:
+                    continue
+                for entity_id in entity_ids:
+                    self._fix_entity(entity_type, entity_id)
+                _failures_path(self.source, entity_type).unlink(missing_ok=True)
+            recopied[entity_type] = entity_ids
+        return recopied
+
+    def verify(self, entity_types: Optional[List[str]] = None, fix: bool = False) -> Dict[str, Dict[str, Any]]:
+        """
+        Compara el contenido desencriptado de origen y destino
+
+        Args:
+            entity_types: Tipos a verificar (None = todos)
+            fix: Copiar/borrar en el destino lo que difiera del origen
+
+        Returns:
+            dict: {entity_type: {checked, missing, extra, mismatched, write_through_failed}}
+            con los IDs afectados. write_through_failed son los IDs anotados por
+            write-through fallidos (con fix se re-copian y la lista queda vacía)
+        """
+        entity_types = entity_types or list(self.source.ENTITY_TYPES)
+        if fix:
+            self.recopy_write_through_failures(entity_types)
+        report = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for entity_type in entity_types:
+                source_ids = self.source.list_ids(entity_type)
+                known = set(source_ids)
+                ids = source_ids + [i for i in self.target.list_ids(entity_type) if i not in known]
+                futures = [
+                    executor.submit(self._verify_chunk, entity_type, ids[start:start + self.chunk_size], fix)
+                    for start in range(0, len(ids), self.chunk_size)
+                ]
+                result = {'checked': len(ids), 'missing': [], 'extra': [], 'mismatched': []}
+                for future in futures:
+                    for key, affected in future.result().items():
+                        result[key].extend(affected)
+                result['write_through_failed'] = read_write_through_failures(self.source, entity_type)
+                report[entity_type] = result
+        return report
+
+
+    # ------------------------------------------------------------------
+    # Archivo frío
+    # ------------------------------------------------------------------
+
+    def _archive_roots(self):
+        return Path(self.source.base_path) / ARCHIVE_DIR, Path(self.target.base_path) / ARCHIVE_DIR
+
+    def _archive_files(self, root: Path) -> Dict[str, Path]:
+        """{'tipo/archivo': ruta} de catálogos, segmentos y manifests (sin temporales)"""
+        if not root.exists():
+            return {}
+        return {
+            f"{path.parent.name}/{path.name}": path
+            for path in root.glob('*/*')
+            if path.is_file() and not path.name.startswith('.')
+        }
+
+    def copy_archive(self) -> Dict[str, int]:
+        """
+        Copia catálogos y segmentos del archivo frío a la carpeta del destino
+
+        Los segmentos son inmutables: sólo se copian los que faltan o cambiaron
+        de tamaño, y se borran los que el origen ya compactó. Los catálogos se
+        copian al final, así nunca apuntan a un segmento que no llegó.
+
+        Returns:
+            dict: copied y removed
+        """
+        source_root, target_root = self._archive_roots()
+        if source_root.resolve() == target_root.resolve():
+            return {'copied': 0, 'removed': 0}
+
+        source_files = self._archive_files(source_root)
+        target_files = self._archive_files(target_root)
+        ordered = sorted(source_files, key=lambda name: (name.endswith(CATALOG_NAME), name))
+        copied = 0
+        for name in ordered:
+            source_path = source_files[name]
+            target_path = target_root / name
+            if (not name.endswith(CATALOG_NAME) and name in target_files
+                    and target_path.stat().st_size == source_path.stat().st_size):
+                continue
+            target_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = target_path.with_name(f".{target_path.name}.{os.getpid()}.tmp")
+            shutil.copyfile(source_path, tmp_path)
+            os.replace(tmp_path, target_path)
+            copied += 1
+
+        removed = 0
+        for name, path in target_files.items():
+            if name not in source_files:
+                path.unlink(missing_ok=True)
+                removed += 1
+        return {'copied': copied, 'removed': removed}
+
+    def verify_archive(self) -> Dict[str, Any]:
+        """
+        Compara byte a byte el archivo frío de origen y destino
+
+        Returns:
+            dict: checked y la lista de archivos missing / mismatched / extra
+        """
+        source_root, target_root = self._archive_roots()
+        result = {'checked': 0, 'missing': [], 'mismatched': [], 'extra': []}
+        if source_root.resolve() == target_root.resolve():
+            return result
+
+        source_files = self._archive_files(source_root)
+        target_files = self._archive_files(target_root)
+        result['checked'] = len(source_files)
+        for name, source_path in sorted(source_files.items()):
+            target_path = target_files.get(name)
+            if target_path is None:
+                result['missing'].append(name)
+            elif target_path.read_bytes() != source_path.read_bytes():
+                result['mismatched'].append(name)
+        result['extra'] = sorted(name for name in target_files if name not in source_files)
+        return result
+
+
+# Singleton instance
+_migrating_storage_manager = None
+_migrating_storage_manager_lock = threading.Lock()
+
+def get_migrating_storage_manager() -> MigratingStorageBackend:
+    """Retorna el backend de doble escritura configurado con MIGRATION_SOURCE / MIGRATION_TARGET"""
+    global _migrating_storage_manager
+    if _migrating_storage_manager is None:
+        with _migrating_storage_manager_lock:
+            if _migrating_storage_manager is None:
+                target = os.getenv('MIGRATION_TARGET', '')
+                if not target:
+                    raise ValueError('STORAGE_BACKEND=migrating requires MIGRATION_TARGET')
+                _migrating_storage_manager = MigratingStorageBackend(
+                    open_storage_backend(os.getenv('MIGRATION_SOURCE', 'file')),
+                    open_storage_backend(target),
+                    read_preference=os.getenv('MIGRATION_READ_PREFERENCE', 'source').lower(),
+                )
+    return _migrating_storage_manager
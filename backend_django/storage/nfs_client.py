@@ -5,9 +5,7 @@ Maneja montaje y verificación de NFS share
 import os
 import subprocess
 from pathlib import Path
-from dotenv import load_dotenv
-
-load_dotenv()
+from typing import Optional
 
 
 class NFSClient:
@@ -18,8 +16,43 @@ class NFSClient:
         self.share_path = os.getenv('NFS_SHARE_PATH', '/eData')
         self.mount_point = os.getenv('NFS_MOUNT_POINT', '/mnt/nfs')
     
+    def get_mount_entry(self) -> Optional[dict]:
+        """
+        Busca el punto de montaje en /proc/self/mountinfo (sin lanzar procesos)
+        
+        Returns:
+            dict: mount_point, fstype, source y options, o None si no está montado
+            
+        Raises:
+            OSError: Si /proc/self/mountinfo no está disponible (no Linux)
+        """
+        mount_point = os.path.normpath(self.mount_point)
+        with open('/proc/self/mountinfo', 'r', encoding='utf-8') as f:
+            for line in f:
+                # id parent major:minor root mount_point options [opcionales...] - fstype source superoptions
+                fields, _, tail = line.rstrip('\n').partition(' - ')
+                fields = fields.split(' ')
+                if len(fields) < 6:
+                    continue
+                point = fields[4].encode('utf-8').decode('unicode_escape')
+                if point != mount_point:
+                    continue
+                tail = tail.split(' ')
+                return {
+                    'mount_point': point,
+                    'fstype': tail[0] if tail else '',
+                    'source': tail[1] if len(tail) > 1 else '',
+                    'options': fields[5],
+                }
+        return None
+    
     def is_mounted(self) -> bool:
         """Verifica si el NFS share está montado"""
+        try:
+            return self.get_mount_entry() is not None
+        except OSError:
+            pass
+        
         try:
             result = subprocess.run(
                 ['mount'],
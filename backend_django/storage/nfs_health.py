@@ -0,0 +1,187 @@
+"""
+SmileLink Storage - NFS Health
+Monitor en segundo plano del montaje NFS
+
+Cada NFS_HEALTH_INTERVAL_SECONDS revisa el montaje en /proc/self/mountinfo
+(sin lanzar procesos) y mide una prueba de stat + escritura + lectura con
+timeout. La prueba corre en un hilo aparte: si NFS se cuelga, el que queda
+bloqueado es ese hilo y no los workers. Tras NFS_HEALTH_FAILURE_THRESHOLD
+fallos seguidos el storage pasa a modo degradado: lecturas desde el cache
+local (si existe) y escrituras rechazadas con StorageUnavailable.
+"""
+import os
+import socket
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from .nfs_client import get_nfs_client
+
+
+class StorageUnavailable(Exception):
+    """El almacenamiento no puede atender la operación (NFS caído o en modo sólo lectura)"""
+
+
+class NFSHealthMonitor:
+    """Publica el estado de salud de NFS para que el storage falle rápido"""
+
+    def __init__(self, data_path: str, interval: float = 5, probe_timeout: float = 2,
+                 failure_threshold: int = 2, slow_ms: float = 500):
+        """
+        Args:
+            data_path: Directorio de datos en NFS a probar
+            interval: Segundos entre chequeos
+            probe_timeout: Segundos máximos de una prueba antes de darla por fallida
+            failure_threshold: Fallos seguidos para declarar NFS no saludable
+            slow_ms: Latencia sobre la cual el estado se reporta como 'slow'
+        """
+        self.data_path = Path(data_path)
+        self.interval = interval
+        self.probe_timeout = probe_timeout
+        self.failure_threshold = failure_threshold
+        self.slow_ms = slow_ms
+        self.nfs = get_nfs_client()
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._probe_thread = None
+        self._probe_file = self.data_path / f".health-{socket.gethostname()}-{os.getpid()}"
+
+        self._state: Dict[str, Any] = {
+            'state': 'unknown',
+            'healthy': True,
+            'mounted': None,
+            'latency_ms': None,
+            'consecutive_failures': 0,
+            'last_error': None,
+            'checked_at': None,
+            'unhealthy_since': None,
+        }
+
+    @property
+    def healthy(self) -> bool:
+        """False cuando el storage debe operar en modo degradado"""
+        with self._lock:
+            return self._state['healthy']
+
+    def state(self) -> Dict[str, Any]:
+        """Último estado publicado"""
+        with self._lock:
+            return dict(self._state, data_path=str(self.data_path))
+
+    # ------------------------------------------------------------------
+    # Prueba
+    # ------------------------------------------------------------------
+
+    def _probe(self, result: Dict[str, Any]):
+        try:
+            os.stat(self.data_path)
+            payload = str(time.time()).encode('ascii')
+            with open(self._probe_file, 'wb') as f:
+                f.write(payload)
+            with open(self._probe_file, 'rb') as f:
+                if f.read() != payload:
+                    raise IOError('probe read back different content')
+            result['ok'] = True
+        except Exception as e:
+            result['error'] = str(e)
+
+    def check(self) -> Dict[str, Any]:
+        """Ejecuta un chequeo y actualiza el estado publicado"""
+        mounted = self.nfs.is_mounted()
+        error = None
+        latency_ms = None
+
+        if not mounted:
+            error = f"NFS not mounted at {self.nfs.mount_point}"
+        elif self._probe_thread is not None and self._probe_thread.is_alive():
+            # La prueba anterior sigue colgada: no acumular hilos bloqueados
+            error = 'previous probe still blocked'
+        else:
+            result: Dict[str, Any] = {}
+            started = time.monotonic()
+            self._probe_thread = threading.Thread(target=self._probe, args=(result,), name='nfs-probe', daemon=True)
+            self._probe_thread.start()
+            self._probe_thread.join(self.probe_timeout)
+            latency_ms = round((time.monotonic() - started) * 1000, 2)
+            if self._probe_thread.is_alive():
+                error = f"probe timed out after {self.probe_timeout}s"
+            elif not result.get('ok'):
+                error = result.get('error', 'probe failed')
+
+        with self._lock:
+            state = self._state
+            state['mounted'] = mounted
+            state['latency_ms'] = latency_ms
+            state['checked_at'] = time.time()
+            if error:
+                state['consecutive_failures'] += 1
+                state['last_error'] = error
+                if state['consecutive_failures'] >= self.failure_threshold or not mounted:
+                    if state['healthy']:
+                        print(f"⚠️  NFS unhealthy, switching storage to degraded mode: {error}")
+                        state['unhealthy_since'] = state['checked_at']
+                    state['healthy'] = False
+                    state['state'] = 'unhealthy'
+            else:
+                if not state['healthy']:
+                    print("✓ NFS healthy again, leaving degraded mode")
+                state['consecutive_failures'] = 0
+                state['healthy'] = True
+                state['unhealthy_since'] = None
+                state['state'] = 'slow' if latency_ms > self.slow_ms else 'healthy'
+            return dict(state)
+
+    # ------------------------------------------------------------------
+    # Hilo de fondo
+    # ------------------------------------------------------------------
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                print(f"Error checking NFS health: {e}")
+
+    def start(self) -> 'NFSHealthMonitor':
+        """Hace un primer chequeo (acotado por el timeout) y arranca el hilo de fondo"""
+        if self._thread is not None and self._thread.is_alive():
+            return self
+        self.check()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='nfs-health', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Detiene el hilo de fondo"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.interval + self.probe_timeout)
+        try:
+            self._probe_file.unlink()
+        except OSError:
+            pass
+
+
+# Singleton instance
+_nfs_health_monitor = None
+
+def get_nfs_health_monitor() -> Optional[NFSHealthMonitor]:
+    """Retorna el monitor de NFS (iniciado), o None si NFS o el monitor están desactivados"""
+    global _nfs_health_monitor
+    if os.getenv('USE_NFS', 'False').lower() != 'true':
+        return None
+    if os.getenv('NFS_HEALTH_ENABLED', 'True').lower() != 'true':
+        return None
+    if _nfs_health_monitor is None:
+        _nfs_health_monitor = NFSHealthMonitor(
+            os.getenv('NFS_DATA_PATH', '/mnt/nfs/smilelink/data'),
+            interval=float(os.getenv('NFS_HEALTH_INTERVAL_SECONDS', '5')),
+            probe_timeout=float(os.getenv('NFS_PROBE_TIMEOUT_SECONDS', '2')),
+            failure_threshold=int(os.getenv('NFS_HEALTH_FAILURE_THRESHOLD', '2')),
+            slow_ms=float(os.getenv('NFS_HEALTH_SLOW_MS', '500')),
+        ).start()
+    return _nfs_health_monitor
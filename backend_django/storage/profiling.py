@@ -0,0 +1,160 @@
+"""
+SmileLink Storage - Profiling
+Perfiles cProfile de requests muestreados, guardados en un directorio acotado
+
+ProfilingMiddleware perfila una fracción PROFILE_SAMPLE_RATE de los requests
+o los que traen el header X-Profile con el valor de PROFILE_TOKEN. Cada
+perfil queda como <id>.prof (formato pstats) más <id>.json con la ruta,
+método, status y duración; al superar PROFILE_MAX_FILES o PROFILE_MAX_BYTES
+se borran los más viejos. python manage.py profile_report los agrega por ruta.
+
+cProfile mide sólo el hilo del request: los sub-requests de un batch
+paralelo aparecen como espera en el pool.
+"""
+import cProfile
+import hmac
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+PROFILE_SUFFIX = '.prof'
+META_SUFFIX = '.json'
+
+
+class ProfileStore:
+    """Decide qué requests perfilar y guarda los perfiles con rotación"""
+
+    def __init__(self, directory: Optional[str] = None, sample_rate: Optional[float] = None,
+                 token: Optional[str] = None, max_files: Optional[int] = None, max_bytes: Optional[int] = None):
+        """
+        Args:
+            directory: Directorio de perfiles. Si es None, usa PROFILE_DIR
+            sample_rate: Fracción de requests perfilados (0-1). Si es None, usa PROFILE_SAMPLE_RATE
+            token: Valor de X-Profile que fuerza el perfil. Si es None, usa PROFILE_TOKEN
+            max_files: Perfiles a conservar. Si es None, usa PROFILE_MAX_FILES
+            max_bytes: Tamaño total a conservar. Si es None, usa PROFILE_MAX_BYTES
+        """
+        default_dir = Path(__file__).resolve().parent.parent / 'profiles'
+        self.directory = Path(directory or os.getenv('PROFILE_DIR', '') or default_dir)
+        self.sample_rate = sample_rate if sample_rate is not None else float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+        self.token = token if token is not None else os.getenv('PROFILE_TOKEN', '')
+        self.max_files = max_files or int(os.getenv('PROFILE_MAX_FILES', '500'))
+        self.max_bytes = max_bytes or int(os.getenv('PROFILE_MAX_BYTES', str(200 * 1024 * 1024)))
+        self._lock = threading.Lock()
+
+    def should_profile(self, header_value: Optional[str]) -> bool:
+        """True si el request va perfilado (header de admin o muestreo)"""
+        if header_value and self.token and hmac.compare_digest(header_value, self.token):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    # ------------------------------------------------------------------
+    # Escritura
+    # ------------------------------------------------------------------
+
+    def save(self, profiler: cProfile.Profile, meta: Dict[str, Any]) -> Optional[str]:
+        """
+        Guarda un perfil y su metadata, luego aplica la rotación
+
+        Args:
+            profiler: Perfil ya deshabilitado
+            meta: Ruta, método, status, duración...
+
+        Returns:
+            str: ID del perfil o None si falló
+        """
+        profile_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(str(self.directory / f"{profile_id}{PROFILE_SUFFIX}"))
+            tmp_path = self.directory / f".{profile_id}{META_SUFFIX}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'id': profile_id, 'created_at': time.time(), **meta}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.directory / f"{profile_id}{META_SUFFIX}")
+        except OSError as e:
+            print(f"Error saving profile {profile_id}: {e}")
+            return None
+        self.rotate()
+        return profile_id
+
+    def rotate(self) -> int:
+        """
+        Borra los perfiles más viejos por encima de max_files / max_bytes
+
+        Returns:
+            int: Perfiles borrados
+        """
+        with self._lock:
+            try:
+                entries = sorted(
+                    (entry.name, entry.stat().st_size)
+                    for entry in os.scandir(self.directory)
+                    if entry.name.endswith(PROFILE_SUFFIX)
+                )
+            except OSError:
+                return 0
+            total = sum(size for _, size in entries)
+            removed = 0
+            # Los IDs empiezan con la fecha: orden por nombre = orden de creación
+            while entries and (len(entries) > self.max_files or total > self.max_bytes):
+                name, size = entries.pop(0)
+                stem = name[:-len(PROFILE_SUFFIX)]
+                for suffix in (PROFILE_SUFFIX, META_SUFFIX):
+                    try:
+                        (self.directory / f"{stem}{suffix}").unlink()
+                    except FileNotFoundError:
+                        pass
+                total -= size
+                removed += 1
+            return removed
+
+    # ------------------------------------------------------------------
+    # Lectura
+    # ------------------------------------------------------------------
+
+    def list_profiles(self, route: Optional[str] = None, since: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        Metadata de los perfiles guardados, del más viejo al más nuevo
+
+        Args:
+            route: Sólo los de esta ruta (nombre de vista, ej: 'nino-list')
+            since: Sólo los creados después de este timestamp
+
+        Returns:
+            list: Metadata con 'path' al archivo .prof
+        """
+        profiles = []
+        if not self.directory.exists():
+            return profiles
+        for meta_path in sorted(self.directory.glob(f"*{META_SUFFIX}")):
+            try:
+                with open(meta_path, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                continue
+            profile_path = meta_path.with_suffix(PROFILE_SUFFIX)
+            if not profile_path.exists():
+                continue
+            if route is not None and not re.fullmatch(route, meta.get('route', '')):
+                continue
+            if since is not None and meta.get('created_at', 0) < since:
+                continue
+            profiles.append({**meta, 'path': str(profile_path)})
+        return profiles
+
+
+# Singleton instance
+_profile_store = None
+
+def get_profile_store() -> ProfileStore:
+    """Retorna instancia singleton del ProfileStore"""
+    global _profile_store
+    if _profile_store is None:
+        _profile_store = ProfileStore()
+    return _profile_store
@@ -0,0 +1,62 @@
+"""
+SmileLink Storage - Read Cache
+Cache de lecturas con alcance de contexto para deduplicar cargas repetidas
+dentro de una misma petición (p.ej. un batch de sub-requests)
+"""
+import contextvars
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class ReadCache:
+    """Memoriza lecturas desencriptadas; seguro para uso desde varios hilos"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[Hashable, Any] = {}
+        self._key_locks: Dict[Hashable, threading.Lock] = {}
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """
+        Retorna el valor cacheado para key o lo carga una sola vez
+
+        Si dos hilos piden la misma key a la vez, el segundo espera al
+        primero en lugar de repetir la lectura.
+
+        Args:
+            key: Llave de la lectura (ej: ('entity', 'ninos', 'N001'))
+            loader: Función que realiza la lectura real
+
+        Returns:
+            El valor cargado (compartido, el llamador debe copiarlo)
+        """
+        with self._lock:
+            if key in self._entries:
+                return self._entries[key]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                if key in self._entries:
+                    return self._entries[key]
+            value = loader()
+            with self._lock:
+                self._entries[key] = value
+            return value
+
+    def invalidate(self, entity_type: str, entity_id: Optional[str] = None):
+        """Descarta las lecturas afectadas por una escritura"""
+        with self._lock:
+            self._entries.pop(('index', entity_type), None)
+            if entity_id is not None:
+                self._entries.pop(('entity', entity_type, entity_id), None)
+
+
+_current_cache: contextvars.ContextVar = contextvars.ContextVar(
+    'smilelink_read_cache', default=None
+)
+
+
+def get_current_read_cache() -> Optional[ReadCache]:
+    """Retorna el ReadCache activo en el contexto actual, si existe"""
+    return _current_cache.get()
@@ -0,0 +1,414 @@
+"""
+SmileLink Storage - Replication Queue
+Cola durable en disco local para replicar archivos a HDFS fuera del request
+"""
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from .hdfs_client import get_hdfs_client
+from .segments import merge_small_segments, pack_files, upload_segment
+
+
+def _marker_name(relative_path: str) -> str:
+    """'ninos/N001.json.enc' -> 'ninos__N001.json.enc'"""
+    return relative_path.replace('/', '__')
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class ReplicationQueue:
+    """
+    Cola de archivos pendientes de subir a HDFS
+
+    Cada archivo pendiente es un marcador en pending/ nombrado por su ruta,
+    así que escrituras repetidas de la misma entidad antes de subirla se
+    coalescen en una sola subida. Un worker reclama un marcador moviéndolo a
+    inflight/<pid>/ (rename atómico), por lo que varios procesos pueden
+    drenar la misma cola. Los fallos vuelven a pending/ con backoff
+    exponencial.
+    """
+
+    def __init__(self, source_path: Path, queue_path: Optional[str] = None, workers: Optional[int] = None):
+        """
+        Args:
+            source_path: Directorio base de los archivos a replicar
+            queue_path: Directorio de la cola (disco local, no NFS)
+            workers: Número de hilos que suben en paralelo
+        """
+        self.hdfs = get_hdfs_client()
+        self.source_path = Path(source_path)
+        self.queue_path = Path(queue_path or os.getenv('HDFS_QUEUE_PATH', './replication_queue'))
+        self.workers = workers or int(os.getenv('HDFS_QUEUE_WORKERS', '2'))
+        self.retry_base = float(os.getenv('HDFS_RETRY_BASE_SECONDS', '2'))
+        self.retry_max = float(os.getenv('HDFS_RETRY_MAX_SECONDS', '300'))
+        self.poll_interval = float(os.getenv('HDFS_QUEUE_POLL_SECONDS', '1'))
+        
+        # 'files': un archivo HDFS por entidad; 'segments': empaqueta lo pendiente
+        self.mode = os.getenv('HDFS_REPLICATION_MODE', 'files').lower()
+        self.segment_max_files = int(os.getenv('HDFS_SEGMENT_MAX_FILES', '5000'))
+        self.segment_max_bytes = int(os.getenv('HDFS_SEGMENT_MAX_BYTES', str(64 * 1024 * 1024)))
+        self.segment_linger = float(os.getenv('HDFS_SEGMENT_LINGER_SECONDS', '5'))
+        # Fusión periódica de segmentos chicos (0 la desactiva)
+        self.merge_interval = float(os.getenv('HDFS_SEGMENT_MERGE_INTERVAL_SECONDS', '300'))
+        self.merge_min_segments = int(os.getenv('HDFS_SEGMENT_MERGE_MIN_SEGMENTS', '8'))
+        self.merge_small_bytes = int(os.getenv('HDFS_SEGMENT_MERGE_SMALL_BYTES', str(self.segment_max_bytes // 4)))
+
+        self.pending_dir = self.queue_path / 'pending'
+        self.inflight_dir = self.queue_path / 'inflight' / str(os.getpid())
+        self.segments_tmp_dir = self.queue_path / 'segments_tmp'
+        self.pending_dir.mkdir(parents=True, exist_ok=True)
+        self.inflight_dir.mkdir(parents=True, exist_ok=True)
+
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._threads_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._merge_lock = threading.Lock()
+        self._merged_at = time.monotonic()
+        self._stats = {
+            'enqueued': 0,
+            'coalesced': 0,
+            'replicated': 0,
+            'failed_attempts': 0,
+            'last_error': None,
+            'last_lag_seconds': None,
+            'segments_uploaded': 0,
+            'segments_merged': 0,
+        }
+
+        self._recover_inflight()
+
+    # ------------------------------------------------------------------
+    # Marcadores
+    # ------------------------------------------------------------------
+
+    def _read_marker(self, marker: Path) -> Optional[Dict[str, Any]]:
+        try:
+            with open(marker, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_marker(self, marker: Path, item: Dict[str, Any]):
+        tmp_path = marker.with_name(f".{marker.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(item, f)
+        os.replace(tmp_path, marker)
+
+    def _recover_inflight(self):
+        """Devuelve a pending/ lo que reclamaron procesos que ya no existen"""
+        for pid_dir in (self.queue_path / 'inflight').iterdir():
+            if not pid_dir.is_dir() or not pid_dir.name.isdigit():
+                continue
+            if pid_dir.name != str(os.getpid()) and _pid_alive(int(pid_dir.name)):
+                continue
+            for marker in pid_dir.iterdir():
+                target = self.pending_dir / marker.name
+                if target.exists():
+                    marker.unlink(missing_ok=True)
+                else:
+                    os.replace(marker, target)
+            if pid_dir != self.inflight_dir:
+                pid_dir.rmdir()
+
+    # ------------------------------------------------------------------
+    # API
+    # ------------------------------------------------------------------
+
+    def enqueue(self, relative_path: str) -> bool:
+        """
+        Agrega un archivo a la cola (coalesce si ya estaba pendiente)
+
+        Args:
+            relative_path: Ruta relativa al directorio base (ej: 'ninos/N001.json.enc')
+
+        Returns:
+            bool: True si se creó un marcador nuevo, False si se coalesció
+        """
+        marker = self.pending_dir / _marker_name(relative_path)
+
+        if marker.exists():
+            with self._stats_lock:
+                self._stats['coalesced'] += 1
+            self._wake.set()
+            return False
+
+        self._write_marker(marker, {
+            'path': relative_path,
+            'enqueued_at': time.time(),
+            'attempts': 0,
+            'next_attempt': 0,
+        })
+        with self._stats_lock:
+            self._stats['enqueued'] += 1
+
+        self.start()
+        self._wake.set()
+        return True
+
+    def _claim_batch(self, limit: int) -> List[Dict[str, Any]]:
+        """Reclama hasta limit marcadores listos para subir, los más viejos primero"""
+        now = time.time()
+
+        def mtime(path: Path) -> float:
+            try:
+                return path.stat().st_mtime
+            except FileNotFoundError:
+                return now
+
+        markers = sorted(self.pending_dir.glob('[!.]*'), key=mtime)
+        claimed_items = []
+
+        for marker in markers:
+            item = self._read_marker(marker)
+            if item is None or item.get('next_attempt', 0) > now:
+                continue
+
+            claimed = self.inflight_dir / marker.name
+            try:
+                os.rename(marker, claimed)
+            except FileNotFoundError:
+                continue  # Otro worker lo reclamó primero
+            item['_marker'] = claimed
+            claimed_items.append(item)
+            if len(claimed_items) >= limit:
+                break
+
+        return claimed_items
+
+    def _claim(self) -> Optional[Dict[str, Any]]:
+        """Reclama el siguiente marcador listo para subir"""
+        items = self._claim_batch(1)
+        return items[0] if items else None
+
+    def _backoff(self, attempts: int) -> float:
+        return min(self.retry_base * (2 ** (attempts - 1)), self.retry_max)
+
+    def _process(self, item: Dict[str, Any]) -> bool:
+        """Sube (o borra en HDFS) un archivo reclamado"""
+        claimed: Path = item.pop('_marker')
+        relative_path = item['path']
+        local_path = self.source_path / relative_path
+
+        try:
+            if local_path.exists():
+                ok = self.hdfs.replicate_file(str(local_path), relative_path)
+            else:
+                ok = self.hdfs.delete_file(relative_path)
+        except Exception as e:
+            print(f"Error replicating {relative_path}: {e}")
+            ok = False
+
+        if ok:
+            claimed.unlink(missing_ok=True)
+            with self._stats_lock:
+                self._stats['replicated'] += 1
+                self._stats['last_lag_seconds'] = round(time.time() - item['enqueued_at'], 3)
+            return True
+
+        self._requeue(item, claimed, relative_path)
+        return False
+
+    def _requeue(self, item: Dict[str, Any], claimed: Path, error: str):
+        """Regresa un elemento fallido a pending/ con backoff"""
+        item['attempts'] += 1
+        item['next_attempt'] = time.time() + self._backoff(item['attempts'])
+        with self._stats_lock:
+            self._stats['failed_attempts'] += 1
+            self._stats['last_error'] = f"{error} (attempt {item['attempts']})"
+
+        pending = self.pending_dir / claimed.name
+        if pending.exists():
+            # Llegó una escritura nueva mientras subíamos: conservar la más antigua para el lag
+            newer = self._read_marker(pending) or {}
+            item['enqueued_at'] = min(item['enqueued_at'], newer.get('enqueued_at', item['enqueued_at']))
+        self._write_marker(pending, item)
+        claimed.unlink(missing_ok=True)
+
+    def _process_segment(self, items: List[Dict[str, Any]]) -> bool:
+        """Empaqueta varios archivos reclamados en segmentos y los sube"""
+        by_path = {item['path']: item for item in items}
+        claimed = {item['path']: item.pop('_marker') for item in items}
+        ok = True
+
+        try:
+            for segment_path, manifest in pack_files(self.source_path, list(by_path), self.segments_tmp_dir, self.segment_max_bytes):
+                paths = list(manifest['entries']) + manifest['deleted']
+                try:
+                    uploaded = upload_segment(self.hdfs, segment_path, manifest)
+                except Exception as e:
+                    print(f"Error uploading segment {manifest['segment_id']}: {e}")
+                    uploaded = False
+                finally:
+                    segment_path.unlink(missing_ok=True)
+
+                now = time.time()
+                for relative_path in paths:
+                    item = by_path[relative_path]
+                    marker = claimed.pop(relative_path)
+                    if uploaded:
+                        marker.unlink(missing_ok=True)
+                    else:
+                        self._requeue(item, marker, f"segment {manifest['segment_id']}")
+
+                if uploaded:
+                    with self._stats_lock:
+                        self._stats['segments_uploaded'] += 1
+                        self._stats['replicated'] += len(paths)
+                        oldest = min(by_path[p]['enqueued_at'] for p in paths)
+                        self._stats['last_lag_seconds'] = round(now - oldest, 3)
+                ok = ok and uploaded
+        except Exception as e:
+            print(f"Error packing segment: {e}")
+            ok = False
+        finally:
+            # Lo que no llegó a un segmento subido o reencolado vuelve a pending/
+            for relative_path, marker in claimed.items():
+                self._requeue(by_path[relative_path], marker, 'segment not packed')
+
+        return ok
+
+    def process_once(self) -> bool:
+        """Procesa un elemento si hay alguno listo. Retorna False si no había"""
+        if self.mode == 'segments':
+            items = self._claim_batch(self.segment_max_files)
+            if not items:
+                return False
+            self._process_segment(items)
+            return True
+
+        item = self._claim()
+        if item is None:
+            return False
+        self._process(item)
+        return True
+
+    def merge_segments(self) -> List[Dict[str, Any]]:
+        """Fusiona los segmentos chicos ya subidos (ver segments.merge_small_segments)"""
+        with self._merge_lock:
+            self._merged_at = time.monotonic()
+            merged = merge_small_segments(
+                self.hdfs, self.segments_tmp_dir / 'merge', self.merge_small_bytes,
+                self.segment_max_bytes, self.merge_min_segments,
+            )
+        with self._stats_lock:
+            self._stats['segments_merged'] += sum(len(result['merged']) for result in merged)
+        return merged
+
+    def _maybe_merge(self):
+        """Un solo hilo fusiona, a lo sumo cada merge_interval segundos"""
+        if self.merge_interval <= 0 or time.monotonic() - self._merged_at < self.merge_interval:
+            return
+        if self._merge_lock.locked():
+            return
+        try:
+            self.merge_segments()
+        except Exception as e:
+            print(f"Error merging segments: {e}")
+
+    def _worker(self):
+        while not self._stop.is_set():
+            if not self.hdfs.is_available() or not self.process_once():
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+            elif self.mode == 'segments':
+                # Dejar que se acumulen escrituras para el siguiente segmento
+                self._stop.wait(self.segment_linger)
+            if self.mode == 'segments' and self.hdfs.is_available():
+                self._maybe_merge()
+
+    def start(self):
+        """Arranca los hilos de drenado si no están corriendo"""
+        with self._threads_lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            for n in range(len(self._threads), self.workers):
+                thread = threading.Thread(target=self._worker, name=f"hdfs-replication-{n}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self):
+        """Detiene los hilos de drenado"""
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+        self._stop.clear()
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """
+        Procesa la cola en el hilo actual hasta vaciarla
+
+        Args:
+            timeout: Segundos máximos; None espera indefinidamente
+
+        Returns:
+            bool: True si la cola quedó vacía
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while deadline is None or time.time() < deadline:
+            if self.depth() == 0:
+                return True
+            if not self.process_once():
+                time.sleep(min(self.poll_interval, 0.1))
+        return self.depth() == 0
+
+    def depth(self) -> int:
+        """Número de archivos pendientes (incluye los que esperan reintento)"""
+        return sum(1 for _ in self.pending_dir.glob('[!.]*'))
+
+    def stats(self) -> Dict[str, Any]:
+        """Profundidad de la cola, lag de replicación y contadores"""
+        now = time.time()
+        oldest = None
+        retrying = 0
+        for marker in self.pending_dir.glob('[!.]*'):
+            item = self._read_marker(marker)
+            if item is None:
+                continue
+            oldest = item['enqueued_at'] if oldest is None else min(oldest, item['enqueued_at'])
+            if item.get('attempts'):
+                retrying += 1
+
+        inflight = sum(
+            1 for pid_dir in (self.queue_path / 'inflight').iterdir() if pid_dir.is_dir()
+            for _ in pid_dir.iterdir()
+        )
+
+        with self._stats_lock:
+            counters = dict(self._stats)
+
+        return {
+            'depth': self.depth(),
+            'inflight': inflight,
+            'retrying': retrying,
+            'oldest_pending_age_seconds': round(now - oldest, 3) if oldest else 0,
+            'workers': len([t for t in self._threads if t.is_alive()]),
+            'mode': self.mode,
+            'hdfs_available': self.hdfs.is_available(),
+            **counters,
+        }
+
+
+# Singleton instance
+_replication_queue = None
+
+def get_replication_queue() -> ReplicationQueue:
+    """Retorna instancia singleton del ReplicationQueue"""
+    global _replication_queue
+    if _replication_queue is None:
+        from .file_manager import get_storage_manager
+        _replication_queue = ReplicationQueue(get_storage_manager().base_path)
+    return _replication_queue
@@ -0,0 +1,309 @@
+"""
+SmileLink Storage - Restore
+Reconstruye el almacenamiento local a partir de la réplica en HDFS, descargando
+en paralelo, verificando cada entidad y reconstruyendo los índices al final
+
+La réplica puede tener archivos sueltos (modo files), segmentos (modo
+segments) o ambos si se cambió de modo; para cada archivo gana la versión más
+nueva. El restore es reanudable: un archivo local se da por restaurado si su
+sha256 coincide con el del manifest del segmento. Para archivos sueltos (y
+segmentos viejos sin sha256) cada archivo restaurado lleva como mtime la
+versión remota, y se salta sólo si tamaño y ese sello coinciden.
+
+Los archivos locales que la réplica ya no tiene se reportan como 'extra'; con
+prune=True se borran antes de reconstruir los índices.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .file_manager import FileStorageManager, get_storage_manager
+from .segments import SEGMENT_DIR, SegmentReader
+from .sync_manifest import file_sha256
+
+
+ENTITY_SUFFIX = '.json.enc'
+INDEX_NAME = 'index.json.enc'
+
+
+def _segment_time_ms(segment_id: str) -> int:
+    """Los IDs de segmento empiezan con time_ns"""
+    try:
+        return int(segment_id.split('-', 1)[0]) // 1_000_000
+    except ValueError:
+        return 0
+
+
+class HDFSRestorer:
+    """Restaura entidades desde HDFS a un directorio local"""
+
+    def __init__(self, hdfs, target_path: Optional[str] = None, workers: int = 16):
+        """
+        Args:
+            hdfs: HDFSClient conectado a la réplica
+            target_path: Directorio destino. Si es None, usa el storage configurado
+            workers: Descargas concurrentes
+        """
+        self.hdfs = hdfs
+        self.storage = FileStorageManager(target_path) if target_path else get_storage_manager()
+        self.base_path = self.storage.base_path
+        self.encryption = self.storage.encryption
+        self.workers = max(1, workers)
+        self._lock = threading.Lock()
+        self._remote_dirs = set()
+
+    # ------------------------------------------------------------------
+    # Plan
+    # ------------------------------------------------------------------
+
+    def _segment_sources(self) -> Tuple[Dict[str, Tuple[int, str, int, int]], Dict[str, int]]:
+        """
+        Versión vigente de cada archivo en los segmentos
+
+        Returns:
+            tuple: ({ruta: (time_ms, segment_id, offset, length, sha256)}, {ruta borrada: time_ms})
+        """
+        reader = SegmentReader(self.hdfs)
+        entries: Dict[str, Tuple[int, str, int, int, Optional[str]]] = {}
+        deleted: Dict[str, int] = {}
+        if SEGMENT_DIR not in self._remote_dirs:
+            return entries, deleted
+        for segment_id in reader.list_segments():
+            manifest = reader.load_manifest(segment_id)
+            if manifest is None:
+                continue
+            seg_time = _segment_time_ms(segment_id)
+            for relative_path in manifest.get('deleted', []):
+                entries.pop(relative_path, None)
+                deleted[relative_path] = seg_time
+            for relative_path, entry in manifest['entries'].items():
+                entries[relative_path] = (
+                    seg_time, segment_id, entry['offset'], entry['length'], entry.get('sha256')
+                )
+                deleted.pop(relative_path, None)
+        return entries, deleted
+
+    def plan(self, entity_types: Iterable[str]) -> Dict[str, Dict[str, Tuple]]:
+        """
+        Decide de dónde sale cada entidad
+
+        Returns:
+            dict: {entity_type: {entity_id: ('file', time_ms, length) |
+                                            ('segment', segment_id, offset, length, sha256, time_ms)}}
+        """
+        entity_types = list(entity_types)
+        self._remote_dirs = set(self.hdfs.list_files(''))
+        seg_entries, seg_deleted = self._segment_sources()
+        plan: Dict[str, Dict[str, Tuple]] = {}
+
+        for entity_type in entity_types:
+            sources: Dict[str, Tuple] = {}
+            newest: Dict[str, int] = {}
+
+            listing = self.hdfs.list_files(entity_type, status=True) if entity_type in self._remote_dirs else []
+            for name, status in listing:
+                if name == INDEX_NAME or not name.endswith(ENTITY_SUFFIX) or status.get('type') != 'FILE':
+                    continue
+                relative_path = f"{entity_type}/{name}"
+                mtime = int(status.get('modificationTime', 0))
+                if seg_deleted.get(relative_path, -1) >= mtime:
+                    continue
+                entity_id = name[:-len(ENTITY_SUFFIX)]
+                sources[entity_id] = ('file', mtime, int(status.get('length', 0)))
+                newest[entity_id] = mtime
+
+            prefix = f"{entity_type}/"
+            for relative_path, (seg_time, segment_id, offset, length, sha256) in seg_entries.items():
+                name = relative_path[len(prefix):]
+                if not relative_path.startswith(prefix) or name == INDEX_NAME or '/' in name:
+                    continue
+                entity_id = name[:-len(ENTITY_SUFFIX)]
+                if seg_time >= newest.get(entity_id, -1):
+                    sources[entity_id] = ('segment', segment_id, offset, length, sha256, seg_time)
+                    newest[entity_id] = seg_time
+
+            plan[entity_type] = sources
+        return plan
+
+    # ------------------------------------------------------------------
+    # Restore
+    # ------------------------------------------------------------------
+
+    def _verify(self, entity_type: str, entity_id: str, data: bytes):
+        """Falla si el blob no desencripta a la entidad que dice ser"""
+        entity = self.encryption.decrypt_data(data)
+        id_field = FileStorageManager.ID_FIELDS.get(entity_type)
+        if not isinstance(entity, dict):
+            raise ValueError('decrypted payload is not an object')
+        if id_field and entity.get(id_field) not in (None, entity_id):
+            raise ValueError(f"{id_field}={entity.get(id_field)} does not match file name")
+
+    def _write(self, entity_type: str, entity_id: str, data: bytes, version_ms: int):
+        path = self.storage._get_entity_path(entity_type, entity_id)
+        tmp_path = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        # La versión remota queda como mtime: un restore reanudado reconoce lo ya bajado
+        os.utime(tmp_path, ns=(time.time_ns(), version_ms * 1_000_000))
+        os.replace(tmp_path, path)
+
+    def _is_restored(self, entity_type: str, entity_id: str, source: Tuple) -> bool:
+        """True si el archivo local ya es la versión remota elegida en el plan"""
+        path = self.storage._get_entity_path(entity_type, entity_id)
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return False
+        if source[0] == 'file':
+            _, version_ms, length = source
+            sha256 = None
+        else:
+            _, _, _, length, sha256, version_ms = source
+        if stat.st_size != length:
+            return False
+        if sha256:
+            return file_sha256(path) == sha256
+        return stat.st_mtime_ns == version_ms * 1_000_000
+
+    def _restore_one(self, entity_type: str, entity_id: str, data: Optional[bytes], version_ms: int) -> int:
+        if data is None:
+            raise IOError('download failed')
+        self._verify(entity_type, entity_id, data)
+        self._write(entity_type, entity_id, data, version_ms)
+        return len(data)
+
+    def _restore_file(self, entity_type: str, entity_id: str, version_ms: int) -> int:
+        data = self.hdfs.read_bytes(f"{entity_type}/{entity_id}{ENTITY_SUFFIX}")
+        return self._restore_one(entity_type, entity_id, data, version_ms)
+
+    def _restore_segment(self, segment_id: str, items: List[Tuple[str, str, int, int, int]]) -> List[Tuple]:
+        """Descarga un segmento una vez y restaura todas sus entidades"""
+        blob = SegmentReader(self.hdfs).read_entry(segment_id, 0, None)
+        results = []
+        for entity_type, entity_id, offset, length, version_ms in items:
+            try:
+                if blob is None:
+                    raise IOError(f"segment {segment_id} download failed")
+                size = self._restore_one(entity_type, entity_id, blob[offset:offset + length], version_ms)
+                results.append((entity_type, entity_id, size, None))
+            except Exception as e:
+                results.append((entity_type, entity_id, 0, str(e)))
+        return results
+
+    def _local_extras(self, plan: Dict[str, Dict[str, Tuple]]) -> Dict[str, List[str]]:
+        """IDs con archivo local que no están en la réplica, por tipo"""
+        extras: Dict[str, List[str]] = {}
+        for entity_type, sources in plan.items():
+            type_dir = self.base_path / entity_type
+            if not type_dir.is_dir():
+                continue
+            ids = sorted(
+                path.name[:-len(ENTITY_SUFFIX)] for path in type_dir.iterdir()
+                if path.name.endswith(ENTITY_SUFFIX) and path.name != INDEX_NAME and not path.name.startswith('.')
+            )
+            missing = [entity_id for entity_id in ids if entity_id not in sources]
+            if missing:
+                extras[entity_type] = missing
+        return extras
+
+    def _prune(self, entity_type: str, entity_ids: List[str]) -> int:
+        removed = 0
+        for entity_id in entity_ids:
+            try:
+                self.storage._get_entity_path(entity_type, entity_id).unlink()
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def restore(self, entity_types: Optional[Iterable[str]] = None, prune: bool = False) -> Dict[str, Any]:
+        """
+        Restaura los tipos indicados y reconstruye sus índices
+
+        Args:
+            entity_types: Tipos a restaurar (default: todos)
+            prune: Borrar los archivos locales que la réplica ya no tiene. Un
+                tipo sin ninguna entidad en la réplica no se poda (podría ser
+                un listado remoto fallido): sólo se reporta.
+
+        Returns:
+            dict: Reporte con restored, skipped, failed, extra, removed, bytes,
+            seconds, by_type, failures y extras
+        """
+        started = time.time()
+        entity_types = list(entity_types or FileStorageManager.ENTITY_TYPES)
+        plan = self.plan(entity_types)
+
+        report: Dict[str, Any] = {
+            'restored': 0, 'skipped': 0, 'failed': 0, 'extra': 0, 'removed': 0, 'bytes': 0,
+            'by_type': {t: {'restored': 0, 'skipped': 0, 'failed': 0, 'extra': 0, 'removed': 0} for t in entity_types},
+            'failures': [],
+            'extras': [],
+        }
+
+        def record(entity_type: str, entity_id: str, size: int, error: Optional[str]):
+            with self._lock:
+                counts = report['by_type'][entity_type]
+                if error:
+                    report['failed'] += 1
+                    counts['failed'] += 1
+                    if len(report['failures']) < 100:
+                        report['failures'].append({'type': entity_type, 'id': entity_id, 'error': error})
+                else:
+                    report['restored'] += 1
+                    report['bytes'] += size
+                    counts['restored'] += 1
+
+        file_jobs: List[Tuple[str, str, int]] = []
+        segment_jobs: Dict[str, List[Tuple[str, str, int, int, int]]] = {}
+        for entity_type, sources in plan.items():
+            for entity_id, source in sources.items():
+                if self._is_restored(entity_type, entity_id, source):
+                    report['skipped'] += 1
+                    report['by_type'][entity_type]['skipped'] += 1
+                elif source[0] == 'file':
+                    file_jobs.append((entity_type, entity_id, source[1]))
+                else:
+                    _, segment_id, offset, length, _, version_ms = source
+                    segment_jobs.setdefault(segment_id, []).append(
+                        (entity_type, entity_id, offset, length, version_ms)
+                    )
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {
+                executor.submit(self._restore_file, entity_type, entity_id, version_ms): (entity_type, entity_id)
+                for entity_type, entity_id, version_ms in file_jobs
+            }
+            segment_futures = [
+                executor.submit(self._restore_segment, segment_id, items)
+                for segment_id, items in segment_jobs.items()
+            ]
+
+            for future in as_completed(futures):
+                entity_type, entity_id = futures[future]
+                try:
+                    record(entity_type, entity_id, future.result(), None)
+                except Exception as e:
+                    record(entity_type, entity_id, 0, str(e))
+
+            for future in as_completed(segment_futures):
+                for result in future.result():
+                    record(*result)
+
+        for entity_type, entity_ids in self._local_extras(plan).items():
+            counts = report['by_type'][entity_type]
+            counts['extra'] = len(entity_ids)
+            report['extra'] += len(entity_ids)
+            report['extras'].extend({'type': entity_type, 'id': entity_id} for entity_id in entity_ids[:100])
+            if prune and plan[entity_type]:
+                counts['removed'] = self._prune(entity_type, entity_ids)
+                report['removed'] += counts['removed']
+        report['extras'] = report['extras'][:100]
+
+        for entity_type in entity_types:
+            self.storage.rebuild_index(entity_type)
+
+        report['seconds'] = round(time.time() - started, 3)
+        return report
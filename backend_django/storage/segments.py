@@ -0,0 +1,379 @@
+"""
+SmileLink Storage - Segments
+Empaqueta muchos archivos pequeños *.json.enc en segmentos append-only para
+subirlos a HDFS como un solo archivo (evita el problema de small files)
+
+Formato de un segmento (.seg), una secuencia de registros:
+    [4 bytes big-endian: largo de la ruta][ruta utf-8]
+    [8 bytes big-endian: largo del dato][dato]
+
+Cada segmento lleva un manifest JSON con el offset, largo y sha256 de cada
+dato para lectura aleatoria y verificación. Un registro con largo 0 y la ruta en 'deleted' es un
+tombstone. El segmento es auto-descriptivo: scan_segment reconstruye el
+manifest si éste se pierde.
+
+Cada subida deja un segmento más en HDFS: merge_small_segments fusiona
+periódicamente las corridas de segmentos chicos consecutivos en uno solo que
+toma su lugar en el orden (ID del más nuevo de la corrida con sufijo -mNNNN),
+así la versión vigente de cada archivo no cambia. SegmentReader mantiene un
+índice en memoria ruta -> segmento que sólo carga los manifests nuevos.
+"""
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+SEGMENT_DIR = '_segments'
+SEGMENT_SUFFIX = '.seg'
+MANIFEST_SUFFIX = '.manifest.json'
+MERGED_MARK = '-m'
+
+_PATH_HEADER = struct.Struct('>I')
+_DATA_HEADER = struct.Struct('>Q')
+
+_counter_lock = threading.Lock()
+_counter = 0
+
+
+def new_segment_id() -> str:
+    """IDs ordenables por tiempo: el segmento más nuevo gana"""
+    global _counter
+    with _counter_lock:
+        _counter += 1
+        counter = _counter
+    return f"{time.time_ns():020d}-{os.getpid()}-{counter:06d}"
+
+
+def merged_segment_id(newest_segment_id: str) -> str:
+    """
+    ID del segmento que reemplaza a una corrida: ordena justo después del más
+    nuevo de ella y antes de cualquier segmento posterior
+
+    Es determinista: dos procesos que fusionan la misma corrida escriben el
+    mismo segmento en vez de dos que se pisen.
+    """
+    base, _, generation = newest_segment_id.partition(MERGED_MARK)
+    number = int(generation) + 1 if generation.isdigit() else 1
+    return f"{base}{MERGED_MARK}{number:04d}"
+
+
+class SegmentWriter:
+    """Construye un segmento en un archivo local y su manifest"""
+
+    def __init__(self, tmp_dir: Path, segment_id: Optional[str] = None):
+        self.segment_id = segment_id or new_segment_id()
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        self.path = tmp_dir / f"{self.segment_id}{SEGMENT_SUFFIX}"
+        self._file = open(self.path, 'wb')
+        self._offset = 0
+        self.entries: Dict[str, Dict[str, int]] = {}
+        self.deleted: List[str] = []
+
+    @property
+    def size(self) -> int:
+        return self._offset
+
+    def _write_record(self, relative_path: str, data: bytes) -> int:
+        path_bytes = relative_path.encode('utf-8')
+        header = _PATH_HEADER.pack(len(path_bytes)) + path_bytes + _DATA_HEADER.pack(len(data))
+        self._file.write(header)
+        self._file.write(data)
+        data_offset = self._offset + len(header)
+        self._offset = data_offset + len(data)
+        return data_offset
+
+    def add(self, relative_path: str, data: bytes):
+        """Agrega el contenido (ciphertext) de un archivo"""
+        offset = self._write_record(relative_path, data)
+        self.entries[relative_path] = {
+            'offset': offset,
+            'length': len(data),
+            'sha256': hashlib.sha256(data).hexdigest(),
+        }
+        if relative_path in self.deleted:
+            self.deleted.remove(relative_path)
+
+    def add_tombstone(self, relative_path: str):
+        """Marca un archivo como borrado"""
+        self._write_record(relative_path, b'')
+        self.entries.pop(relative_path, None)
+        if relative_path not in self.deleted:
+            self.deleted.append(relative_path)
+
+    def close(self) -> Dict[str, Any]:
+        """Cierra el segmento y retorna su manifest"""
+        self._file.close()
+        return {
+            'segment_id': self.segment_id,
+            'created_at': time.time(),
+            'size': self._offset,
+            'entries': self.entries,
+            'deleted': self.deleted,
+        }
+
+    def discard(self):
+        """Cierra y borra el archivo local"""
+        if not self._file.closed:
+            self._file.close()
+        self.path.unlink(missing_ok=True)
+
+
+def scan_segment(f: BinaryIO) -> Iterator[Tuple[str, int, int]]:
+    """
+    Recorre los registros de un segmento
+
+    Yields:
+        tuple: (ruta relativa, offset del dato, largo del dato)
+    """
+    offset = 0
+    while True:
+        raw = f.read(_PATH_HEADER.size)
+        if len(raw) < _PATH_HEADER.size:
+            return
+        (path_len,) = _PATH_HEADER.unpack(raw)
+        relative_path = f.read(path_len).decode('utf-8')
+        raw = f.read(_DATA_HEADER.size)
+        if len(raw) < _DATA_HEADER.size:
+            return
+        (data_len,) = _DATA_HEADER.unpack(raw)
+        data_offset = offset + _PATH_HEADER.size + path_len + _DATA_HEADER.size
+        f.seek(data_len, os.SEEK_CUR)
+        offset = data_offset + data_len
+        yield relative_path, data_offset, data_len
+
+
+def pack_files(base_path: Path, relative_paths: Iterable[str], tmp_dir: Path,
+               max_bytes: int) -> Iterator[Tuple[Path, Dict[str, Any]]]:
+    """
+    Empaqueta archivos locales en uno o más segmentos de hasta max_bytes
+
+    Los archivos que ya no existen localmente se registran como tombstones.
+
+    Yields:
+        tuple: (ruta local del segmento, manifest)
+    """
+    writer = SegmentWriter(tmp_dir)
+    for relative_path in relative_paths:
+        local_path = base_path / relative_path
+        try:
+            with open(local_path, 'rb') as f:
+                writer.add(relative_path, f.read())
+        except FileNotFoundError:
+            writer.add_tombstone(relative_path)
+
+        if writer.size >= max_bytes:
+            yield writer.path, writer.close()
+            writer = SegmentWriter(tmp_dir)
+
+    if writer.entries or writer.deleted:
+        yield writer.path, writer.close()
+    else:
+        writer.discard()
+
+
+def upload_segment(hdfs, segment_path: Path, manifest: Dict[str, Any]) -> bool:
+    """
+    Sube un segmento y después su manifest (el manifest lo hace visible)
+
+    Returns:
+        bool: True si ambos se subieron
+    """
+    segment_id = manifest['segment_id']
+    if not hdfs.replicate_file(str(segment_path), f"{SEGMENT_DIR}/{segment_id}{SEGMENT_SUFFIX}"):
+        return False
+    return hdfs.write_bytes(
+        f"{SEGMENT_DIR}/{segment_id}{MANIFEST_SUFFIX}",
+        json.dumps(manifest).encode('utf-8')
+    )
+
+
+class SegmentReader:
+    """Extrae entidades individuales de los segmentos replicados en HDFS"""
+
+    def __init__(self, hdfs, refresh_seconds: float = 0):
+        """
+        Args:
+            hdfs: HDFSClient
+            refresh_seconds: Ventana en que el índice se usa sin volver a listar los segmentos
+        """
+        self.hdfs = hdfs
+        self.refresh_seconds = refresh_seconds
+        self._manifests: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        # Índice de los manifests ya aplicados: ruta -> (segment_id, offset, length) o None si borrada
+        self._indexed: List[str] = []
+        self._index: Dict[str, Optional[Tuple[str, int, int]]] = {}
+        self._refreshed_at: Optional[float] = None
+
+    def list_segments(self) -> List[str]:
+        """IDs de segmentos con manifest, del más viejo al más nuevo"""
+        names = self.hdfs.list_files(SEGMENT_DIR)
+        return sorted(name[:-len(MANIFEST_SUFFIX)] for name in names if name.endswith(MANIFEST_SUFFIX))
+
+    def _apply_manifest(self, segment_id: str, manifest: Dict[str, Any]):
+        for relative_path in manifest.get('deleted', []):
+            self._index[relative_path] = None
+        for relative_path, entry in manifest['entries'].items():
+            self._index[relative_path] = (segment_id, entry['offset'], entry['length'])
+
+    def refresh(self, force: bool = False):
+        """
+        Pone el índice al día con un solo listado
+
+        Si sólo aparecieron segmentos más nuevos se cargan sus manifests y se
+        aplican encima; si una fusión quitó segmentos (o apareció uno fuera
+        de orden) se reconstruye con los manifests ya cacheados.
+        """
+        with self._lock:
+            if (not force and self._refreshed_at is not None
+                    and time.monotonic() - self._refreshed_at < self.refresh_seconds):
+                return
+            segments = self.list_segments()
+            if segments[:len(self._indexed)] != self._indexed:
+                current = set(segments)
+                self._manifests = {k: v for k, v in self._manifests.items() if k in current}
+                self._indexed = []
+                self._index = {}
+            for segment_id in segments[len(self._indexed):]:
+                manifest = self.load_manifest(segment_id)
+                if manifest is None:
+                    # Se reintenta en el próximo refresh (reconstruyendo, por el hueco)
+                    continue
+                self._apply_manifest(segment_id, manifest)
+                self._indexed.append(segment_id)
+            self._refreshed_at = time.monotonic()
+
+    def load_manifest(self, segment_id: str) -> Optional[Dict[str, Any]]:
+        """Carga (y cachea) el manifest de un segmento"""
+        if segment_id not in self._manifests:
+            raw = self.hdfs.read_bytes(f"{SEGMENT_DIR}/{segment_id}{MANIFEST_SUFFIX}")
+            if raw is None:
+                return None
+            self._manifests[segment_id] = json.loads(raw)
+        return self._manifests[segment_id]
+
+    def latest_entries(self) -> Dict[str, Tuple[str, int, int]]:
+        """
+        Versión vigente de cada archivo a través de todos los segmentos
+
+        Returns:
+            dict: {ruta relativa: (segment_id, offset, length)}; los borrados no aparecen
+        """
+        self.refresh()
+        with self._lock:
+            return {relative_path: entry for relative_path, entry in self._index.items() if entry is not None}
+
+    def read_entry(self, segment_id: str, offset: int, length: int) -> Optional[bytes]:
+        """Lee un dato de un segmento con una lectura por rango"""
+        return self.hdfs.read_bytes(f"{SEGMENT_DIR}/{segment_id}{SEGMENT_SUFFIX}", offset=offset, length=length)
+
+    def read_file(self, relative_path: str) -> Optional[bytes]:
+        """Ciphertext vigente de un archivo (ej: 'ninos/N001.json.enc') o None"""
+        self.refresh()
+        with self._lock:
+            entry = self._index.get(relative_path)
+        if entry is None:
+            return None
+        segment_id, offset, length = entry
+        return self.read_entry(segment_id, offset, length)
+
+
+def _merge_run(hdfs, tmp_dir: Path, run: List[str]) -> Optional[Dict[str, Any]]:
+    """Fusiona una corrida de segmentos consecutivos, sube el resultado y borra los originales"""
+    reader = SegmentReader(hdfs)
+    latest: Dict[str, Optional[bytes]] = {}
+    for segment_id in run:
+        manifest = reader.load_manifest(segment_id)
+        blob = reader.read_entry(segment_id, 0, None)
+        if manifest is None or blob is None:
+            print(f"Error merging segments: {segment_id} is not readable")
+            return None
+        for relative_path in manifest.get('deleted', []):
+            latest[relative_path] = None
+        for relative_path, entry in manifest['entries'].items():
+            data = blob[entry['offset']:entry['offset'] + entry['length']]
+            if entry.get('sha256') and hashlib.sha256(data).hexdigest() != entry['sha256']:
+                print(f"Error merging segments: {relative_path} in {segment_id} fails its sha256")
+                return None
+            latest[relative_path] = data
+
+    # Los tombstones se conservan: ocultan versiones en segmentos o archivos sueltos anteriores
+    writer = SegmentWriter(tmp_dir, merged_segment_id(run[-1]))
+    try:
+        for relative_path in sorted(latest):
+            data = latest[relative_path]
+            if data is None:
+                writer.add_tombstone(relative_path)
+            else:
+                writer.add(relative_path, data)
+        manifest = writer.close()
+        manifest['merged_from'] = run
+        if not upload_segment(hdfs, writer.path, manifest):
+            return None
+    finally:
+        writer.discard()
+
+    # Primero los manifests: el segmento deja de ser visible antes de perder sus datos
+    for segment_id in run:
+        hdfs.delete_file(f"{SEGMENT_DIR}/{segment_id}{MANIFEST_SUFFIX}")
+        hdfs.delete_file(f"{SEGMENT_DIR}/{segment_id}{SEGMENT_SUFFIX}")
+    return {'segment_id': manifest['segment_id'], 'merged': run, 'size': manifest['size']}
+
+
+def merge_small_segments(hdfs, tmp_dir: Path, small_bytes: int, max_bytes: int,
+                         min_segments: int = 8) -> List[Dict[str, Any]]:
+    """
+    Fusiona las corridas de segmentos chicos consecutivos en HDFS
+
+    Sólo se fusionan segmentos consecutivos en el orden de IDs: el segmento
+    fusionado toma el lugar del más nuevo de la corrida, así que ningún
+    segmento intermedio queda 'debajo' de versiones que antes lo precedían.
+    El resultado se sube antes de borrar los originales; un lector que los
+    ve a ambos obtiene las mismas versiones.
+
+    Args:
+        hdfs: HDFSClient
+        tmp_dir: Directorio local para armar el segmento fusionado
+        small_bytes: Segmentos de menos de este tamaño se consideran chicos
+        max_bytes: Tamaño máximo de un segmento fusionado
+        min_segments: Largo mínimo de una corrida para fusionarla
+
+    Returns:
+        list: Un {'segment_id', 'merged', 'size'} por corrida fusionada
+    """
+    listing = dict(hdfs.list_files(SEGMENT_DIR, status=True))
+    segments = sorted(name[:-len(MANIFEST_SUFFIX)] for name in listing if name.endswith(MANIFEST_SUFFIX))
+
+    runs: List[List[str]] = []
+    run: List[str] = []
+    run_bytes = 0
+    for segment_id in segments:
+        size = int(listing.get(f"{segment_id}{SEGMENT_SUFFIX}", {}).get('length', 0))
+        if size < small_bytes and run_bytes + size <= max_bytes:
+            run.append(segment_id)
+            run_bytes += size
+            continue
+        if len(run) >= min_segments:
+            runs.append(run)
+        run, run_bytes = ([segment_id], size) if size < small_bytes else ([], 0)
+    if len(run) >= min_segments:
+        runs.append(run)
+
+    merged = []
+    for run in runs:
+        result = _merge_run(hdfs, tmp_dir, run)
+        if result is not None:
+            merged.append(result)
+    return merged
+
+
+def read_local_entry(segment_path: Path, offset: int, length: int) -> bytes:
+    """Lee un dato de un segmento local"""
+    with open(segment_path, 'rb') as f:
+        f.seek(offset)
+        return f.read(length)
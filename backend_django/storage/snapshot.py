@@ -0,0 +1,397 @@
+"""
+SmileLink Storage - Snapshot
+Snapshot de solo lectura, ya desencriptado, de las colecciones más leídas,
+compartido por todos los workers de gunicorn del host vía mmap
+
+Cada tipo se guarda en <dir>/<tipo>.snap (tmpfs privado, 0700):
+
+    línea 1   JSON {"entity_type", "epoch", "generation", "built_at", "records", "index"}
+    línea 2   JSON [[id, inicio, largo, ino, size, mtime_ns], ...] en el orden
+              del índice ([id] si el archivo de la entidad no existe)
+    resto     arreglo JSON con las entidades
+
+list_all parsea el arreglo completo con un solo json.loads y load() sólo el
+tramo de la entidad. Las páginas las comparte el page cache: la memoria no
+crece con el número de workers y nadie vuelve a desencriptar lo que ya está
+en el snapshot.
+
+Frescura: <dir>/generations tiene un contador por tipo (mmap compartido) que
+FileStorageManager incrementa después de cada escritura ya en disco. Un
+snapshot se usa sólo si se construyó con la generación actual; si no, las
+lecturas van a disco y un hilo lo reconstruye tras SNAPSHOT_REFRESH_DELAY_SECONDS
+(un proceso a la vez). Al reconstruir sólo se desencriptan las entidades cuyo
+archivo cambió (inode, tamaño y mtime).
+
+Los contadores son locales al host: si otros hosts escriben sobre el mismo
+NFS, SNAPSHOT_MAX_AGE_SECONDS acota cuánto puede atrasarse un snapshot. Con
+USE_NFS=True el default es NFS_DEFAULT_MAX_AGE_SECONDS; sin NFS, sin límite.
+"""
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+GENERATIONS_NAME = 'generations'
+SNAPSHOT_SUFFIX = '.snap'
+DEFAULT_TYPES = ('ninos', 'puntos_entrega', 'eventos')
+NFS_DEFAULT_MAX_AGE_SECONDS = 30
+
+# Epoch aleatorio + un contador por tipo; el epoch cambia si el archivo se recrea
+_SLOT = struct.Struct('<Q')
+
+
+def default_snapshot_dir(base_path: Path) -> Path:
+    """Directorio privado en /dev/shm (o el tmp del sistema) propio de este usuario y base_path"""
+    root = Path('/dev/shm') if os.path.isdir('/dev/shm') else Path(tempfile.gettempdir())
+    digest = hashlib.sha1(str(Path(base_path).resolve()).encode('utf-8')).hexdigest()[:10]
+    return root / f"smilelink-snapshot-{os.getuid()}-{digest}"
+
+
+class SnapshotView:
+    """Un archivo .snap mapeado en memoria"""
+
+    def __init__(self, path: Path):
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.identity = (stat.st_ino, stat.st_mtime_ns)
+        self.size = stat.st_size
+
+        header_end = self._map.find(b'\n')
+        index_end = self._map.find(b'\n', header_end + 1)
+        header = json.loads(self._map[:header_end])
+        self.entity_type = header['entity_type']
+        self.epoch = header['epoch']
+        self.generation = header['generation']
+        self.built_at = header['built_at']
+        self.index_identity = header['index']
+        self.entries = json.loads(self._map[header_end + 1:index_end])
+        self._data_start = index_end + 1
+
+        self.ids = [entry[0] for entry in self.entries]
+        self._offsets = {entry[0]: (entry[1], entry[2]) for entry in self.entries if len(entry) > 1}
+
+    def load(self, entity_id: str) -> Optional[Dict[str, Any]]:
+        """Entidad desencriptada; None si no está en el snapshot"""
+        offset = self._offsets.get(entity_id)
+        if offset is None:
+            return None
+        start = self._data_start + offset[0]
+        return json.loads(self._map[start:start + offset[1]])
+
+    def raw(self, entry: List[Any]) -> bytes:
+        """Bytes JSON de una entrada del índice (para reutilizarlos al reconstruir)"""
+        start = self._data_start + entry[1]
+        return self._map[start:start + entry[2]]
+
+    def list_all(self) -> List[Dict[str, Any]]:
+        """Todas las entidades en el orden del índice"""
+        return json.loads(self._map[self._data_start:])
+
+
+class SnapshotStore:
+    """Snapshots por tipo de un FileStorageManager y sus contadores de generación"""
+
+    def __init__(self, storage, directory: Path, entity_types=DEFAULT_TYPES,
+                 reads_enabled: bool = True, refresh_delay: float = 1.0, max_age: float = 0):
+        """
+        Args:
+            storage: FileStorageManager del que se leen los datos
+            directory: Directorio de los snapshots (se crea con permisos 0700)
+            entity_types: Tipos que se sirven desde el snapshot
+            reads_enabled: False para sólo mantener los contadores (procesos que escriben sin leer del snapshot)
+            refresh_delay: Segundos de espera antes de reconstruir un snapshot desactualizado
+            max_age: Antigüedad máxima en segundos de un snapshot (0 = sin límite)
+        """
+        self.storage = storage
+        self.directory = Path(directory)
+        self.entity_types = [t for t in entity_types if t in storage.ENTITY_TYPES]
+        self.reads_enabled = reads_enabled
+        self.refresh_delay = refresh_delay
+        self.max_age = max_age
+
+        self._slots = {entity_type: i + 1 for i, entity_type in enumerate(storage.ENTITY_TYPES)}
+        self._lock = threading.Lock()
+        self._views: Dict[str, SnapshotView] = {}
+        self._refreshing = set()
+        self._stats = {'hits': 0, 'misses': 0, 'rebuilds': 0}
+        self._pid = None
+        self._fd = None
+        self._map = None
+
+        self._prepare_directory()
+        self._open_generations()
+        self._check_index_identity()
+
+    def _prepare_directory(self):
+        """Crea el directorio; rechaza uno ajeno o accesible por otros usuarios"""
+        self.directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+        stat = os.stat(self.directory)
+        if stat.st_uid != os.getuid() or stat.st_mode & 0o077:
+            raise PermissionError(
+                f"{self.directory} must be owned by uid {os.getuid()} with mode 0700"
+            )
+
+    def _index_identity(self, entity_type: str) -> Optional[List[int]]:
+        try:
+            stat = os.stat(self.storage._get_index_path(entity_type))
+        except FileNotFoundError:
+            return None
+        return [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+
+    def _check_index_identity(self):
+        """
+        Invalida snapshots de datos cambiados por fuera de FileStorageManager
+
+        Ej: el directorio de datos se borró o se restauró con el servidor
+        detenido; el índice en disco ya no es el que se leyó al construir.
+        """
+        for entity_type in self.entity_types:
+            view = self._open_view(entity_type, None)
+            if view is not None and view.index_identity != self._index_identity(entity_type):
+                self.bump(entity_type)
+
+    def _open_generations(self):
+        """Abre (o crea) el archivo de contadores; se reabre en procesos hijos de un fork"""
+        size = _SLOT.size * (len(self._slots) + 1)
+        fd = os.open(self.directory / GENERATIONS_NAME, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(fd).st_size < size:
+                    os.ftruncate(fd, 0)
+                    os.write(fd, os.urandom(_SLOT.size) + bytes(size - _SLOT.size))
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            self._map = mmap.mmap(fd, size)
+        except BaseException:
+            os.close(fd)
+            raise
+        self._fd = fd
+        self._pid = os.getpid()
+
+    def _generations(self):
+        if self._pid != os.getpid():
+            # El fd heredado comparte el flock con el padre
+            self._open_generations()
+        return self._map
+
+    @property
+    def epoch(self) -> int:
+        return _SLOT.unpack_from(self._generations(), 0)[0]
+
+    def generation(self, entity_type: str) -> int:
+        """Generación actual de un tipo"""
+        return _SLOT.unpack_from(self._generations(), self._slots[entity_type] * _SLOT.size)[0]
+
+    def bump(self, entity_type: str):
+        """Marca como desactualizados los snapshots de un tipo (llamar con la escritura ya en disco)"""
+        generations = self._generations()
+        offset = self._slots[entity_type] * _SLOT.size
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            _SLOT.pack_into(generations, offset, _SLOT.unpack_from(generations, offset)[0] + 1)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _path(self, entity_type: str) -> Path:
+        return self.directory / f"{entity_type}{SNAPSHOT_SUFFIX}"
+
+    def _fresh(self, view: Optional[SnapshotView], epoch: int, generation: int) -> bool:
+        if view is None or view.epoch != epoch or view.generation != generation:
+            return False
+        return not self.max_age or time.time() - view.built_at <= self.max_age
+
+    def _open_view(self, entity_type: str, current: Optional[SnapshotView]) -> Optional[SnapshotView]:
+        """Mapea el archivo del snapshot si es distinto del ya mapeado"""
+        try:
+            stat = os.stat(self._path(entity_type))
+        except FileNotFoundError:
+            return None
+        if current is not None and current.identity == (stat.st_ino, stat.st_mtime_ns):
+            return current
+        try:
+            return SnapshotView(self._path(entity_type))
+        except (OSError, ValueError, KeyError, IndexError) as e:
+            print(f"Error opening snapshot for {entity_type}: {e}")
+            return None
+
+    def view(self, entity_type: str) -> Optional[SnapshotView]:
+        """
+        Snapshot vigente de un tipo, o None si hay que leer de disco
+
+        Un snapshot desactualizado programa su reconstrucción en segundo plano.
+        """
+        if not self.reads_enabled or entity_type not in self.entity_types:
+            return None
+        epoch, generation = self.epoch, self.generation(entity_type)
+        view = self._views.get(entity_type)
+        if not self._fresh(view, epoch, generation):
+            view = self._open_view(entity_type, view)
+            if view is not None:
+                self._views[entity_type] = view
+            if not self._fresh(view, epoch, generation):
+                self._stats['misses'] += 1
+                self._schedule_refresh(entity_type)
+                return None
+        self._stats['hits'] += 1
+        return view
+
+    def _schedule_refresh(self, entity_type: str):
+        with self._lock:
+            if entity_type in self._refreshing:
+                return
+            self._refreshing.add(entity_type)
+        thread = threading.Thread(
+            target=self._refresh, args=(entity_type,), name=f"snapshot-{entity_type}", daemon=True
+        )
+        thread.start()
+
+    def _refresh(self, entity_type: str):
+        try:
+            time.sleep(self.refresh_delay)
+            self.build(entity_type, blocking=False)
+        except Exception as e:
+            print(f"Error rebuilding snapshot for {entity_type}: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(entity_type)
+
+    def build(self, entity_type: str, blocking: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        Reconstruye el snapshot de un tipo desde disco
+
+        Sólo un proceso construye a la vez; sin blocking, si otro ya lo está
+        haciendo retorna None. Si el snapshot ya está al día no se reescribe.
+
+        Returns:
+            dict: records, bytes, decrypted (entidades desencriptadas), reused, seconds
+        """
+        if entity_type not in self.entity_types:
+            raise ValueError(f"{entity_type} is not a snapshot type")
+
+        fd = os.open(self.directory / f".{entity_type}.lock", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+
+            started = time.time()
+            # La generación se toma antes de leer: una escritura durante la
+            # lectura deja este snapshot desactualizado desde que se publica
+            epoch, generation = self.epoch, self.generation(entity_type)
+            previous = self._open_view(entity_type, None)
+            if self._fresh(previous, epoch, generation):
+                return {'records': len(previous.ids), 'bytes': previous.size,
+                        'decrypted': 0, 'reused': len(previous.ids), 'seconds': 0.0}
+            reusable = {entry[0]: entry for entry in previous.entries if len(entry) > 1} if previous else {}
+            index_identity = self._index_identity(entity_type)
+
+            entries, records = [], []
+            offset = decrypted = 0
+            for entity_id in self.storage._read_index_file(entity_type):
+                try:
+                    stat = os.stat(self.storage._get_entity_path(entity_type, entity_id))
+                except FileNotFoundError:
+                    entries.append([entity_id])
+                    continue
+                identity = [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+                old = reusable.get(entity_id)
+                if old is not None and old[3:] == identity:
+                    record = previous.raw(old)
+                else:
+                    data = self.storage._read_entity_file(entity_type, entity_id)
+                    if data is None:
+                        entries.append([entity_id])
+                        continue
+                    record = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+                    decrypted += 1
+                if records:
+                    offset += 1  # la coma
+                entries.append([entity_id, offset + 1, len(record), *identity])
+                records.append(record)
+                offset += len(record)
+
+            header = {
+                'entity_type': entity_type,
+                'epoch': epoch,
+                'generation': generation,
+                'built_at': time.time(),
+                'records': len(records),
+                'index': index_identity,
+            }
+            content = b''.join([
+                json.dumps(header).encode('utf-8'), b'\n',
+                json.dumps(entries, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), b'\n',
+                b'[', b','.join(records), b']',
+            ])
+            path = self._path(entity_type)
+            tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+            with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+            self._stats['rebuilds'] += 1
+            return {'records': len(records), 'bytes': len(content), 'decrypted': decrypted,
+                    'reused': len(records) - decrypted, 'seconds': round(time.time() - started, 3)}
+        finally:
+            os.close(fd)
+
+    def stats(self) -> Dict[str, Any]:
+        """Aciertos de este proceso y estado de cada snapshot"""
+        epoch = self.epoch
+        types = {}
+        for entity_type in self.entity_types:
+            view = self._open_view(entity_type, self._views.get(entity_type))
+            generation = self.generation(entity_type)
+            types[entity_type] = {
+                'generation': generation,
+                'fresh': self._fresh(view, epoch, generation),
+                'records': len(view.ids) if view else 0,
+                'bytes': view.size if view else 0,
+                'age_seconds': round(time.time() - view.built_at, 1) if view else None,
+            }
+        lookups = self._stats['hits'] + self._stats['misses']
+        return {
+            'directory': str(self.directory),
+            'reads_enabled': self.reads_enabled,
+            **self._stats,
+            'hit_ratio': round(self._stats['hits'] / lookups, 4) if lookups else None,
+            'types': types,
+        }
+
+
+def snapshot_store_from_env(storage) -> Optional[SnapshotStore]:
+    """
+    SnapshotStore según la configuración, o None
+
+    Con SNAPSHOT_ENABLED=False pero el directorio ya creado (otros procesos
+    del host leen del snapshot) sólo se mantienen los contadores.
+    """
+    enabled = os.getenv('SNAPSHOT_ENABLED', 'False').lower() == 'true'
+    directory = Path(os.getenv('SNAPSHOT_DIR', '') or default_snapshot_dir(storage.base_path))
+    if not enabled and not directory.is_dir():
+        return None
+    entity_types = [t.strip() for t in os.getenv('SNAPSHOT_TYPES', ','.join(DEFAULT_TYPES)).split(',') if t.strip()]
+    # Sobre NFS escriben otros hosts que no ven los contadores: nunca sin límite por defecto
+    use_nfs = os.getenv('USE_NFS', 'False').lower() == 'true'
+    default_max_age = NFS_DEFAULT_MAX_AGE_SECONDS if use_nfs else 0
+    try:
+        return SnapshotStore(
+            storage,
+            directory,
+            entity_types,
+            reads_enabled=enabled,
+            refresh_delay=float(os.getenv('SNAPSHOT_REFRESH_DELAY_SECONDS', '1')),
+            max_age=float(os.getenv('SNAPSHOT_MAX_AGE_SECONDS', str(default_max_age))),
+        )
+    except OSError as e:
+        print(f"Error opening snapshot directory {directory}: {e}")
+        return None
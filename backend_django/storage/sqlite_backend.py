@@ -0,0 +1,445 @@
+"""
+SmileLink Storage - SQLite Backend
+Motor de almacenamiento sobre SQLite (stdlib) en modo WAL
+
+Cada entidad se guarda como un blob encriptado (el mismo token Fernet que
+usa el motor de archivos). Los campos por los que se filtra se copian a una
+tabla de índice: en claro si no son sensibles (estados, IDs de relación) o
+como HMAC-SHA256 si lo son (emails), así find('padrinos', email=...) no
+necesita desencriptar el tipo completo ni deja el email legible en la base.
+
+SQLite en WAL necesita memoria compartida entre procesos: la base debe vivir
+en disco local, no en NFS.
+"""
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .backend import StorageBackend
+from .encryption import get_encryption_manager
+from .metrics import timed_storage_operation
+from .write_batch import WriteBatch
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entities (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    entity_type TEXT NOT NULL,
+    entity_id TEXT NOT NULL,
+    data BLOB NOT NULL,
+    UNIQUE (entity_type, entity_id)
+);
+CREATE TABLE IF NOT EXISTS entity_fields (
+    entity_type TEXT NOT NULL,
+    field TEXT NOT NULL,
+    value TEXT NOT NULL,
+    entity_id TEXT NOT NULL,
+    PRIMARY KEY (entity_type, field, value, entity_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS entity_fields_by_entity ON entity_fields (entity_type, entity_id);
+CREATE TABLE IF NOT EXISTS id_counters (
+    entity_type TEXT NOT NULL,
+    prefix TEXT NOT NULL,
+    last_number INTEGER NOT NULL,
+    PRIMARY KEY (entity_type, prefix)
+) WITHOUT ROWID;
+"""
+
+
+class SQLiteStorageManager(StorageBackend):
+    """Almacena entidades encriptadas en una base SQLite"""
+
+    name = 'sqlite'
+
+    # Campos indexados por tipo: 'plain' guarda el valor, 'hmac' sólo su HMAC
+    INDEXED_FIELDS = {
+        'ninos': {'estado_apadrinamiento': 'plain', 'id_padrino_actual': 'plain'},
+        'padrinos': {'email': 'hmac'},
+        'apadrinamientos': {
+            'id_padrino': 'plain',
+            'id_nino': 'plain',
+            'estado_apadrinamiento_registro': 'plain',
+        },
+        'entregas': {
+            'id_apadrinamiento': 'plain',
+            'estado_entrega': 'plain',
+            'id_punto_entrega': 'plain',
+            'id_evento': 'plain',
+        },
+        'solicitudes': {'id_nino': 'plain', 'estado_solicitud': 'plain'},
+        'puntos_entrega': {'estado_punto': 'plain'},
+        'eventos': {'estado_evento': 'plain'},
+        'administradores': {'email': 'hmac'},
+    }
+
+    def __init__(self, db_path: Optional[str] = None):
+        """
+        Args:
+            db_path: Archivo de la base. Si es None, usa SQLITE_STORAGE_PATH
+        """
+        self.encryption = get_encryption_manager()
+        default_path = Path(os.getenv('LOCAL_STORAGE_PATH', './local_data')) / 'smilelink.sqlite3'
+        self.db_path = Path(db_path or os.getenv('SQLITE_STORAGE_PATH', '') or default_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        # Directorio de trabajo para quien lo necesite (ej: JobStore)
+        self.base_path = self.db_path.parent
+
+        self._local = threading.local()
+        self._index_lock = threading.RLock()
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        """Una conexión por hilo, en autocommit; las escrituras abren su transacción"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA busy_timeout=30000')
+            self._local.conn = conn
+        return conn
+
+    # ------------------------------------------------------------------
+    # Índices de campos
+    # ------------------------------------------------------------------
+
+    def _index_value(self, kind: str, value: Any) -> str:
+        text = str(value)
+        if kind == 'hmac':
+            return self.encryption.hmac_digest(text.strip().lower())
+        return text
+
+    def _field_rows(self, entity_type: str, entity_id: str, data: Dict[str, Any]) -> List[tuple]:
+        rows = []
+        for field, kind in self.INDEXED_FIELDS.get(entity_type, {}).items():
+            value = data.get(field)
+            if value is not None:
+                rows.append((entity_type, field, self._index_value(kind, value), entity_id))
+        return rows
+
+    def _write_rows(self, conn: sqlite3.Connection, entity_type: str, entity_id: str, data: Dict[str, Any]):
+        """Upsert de la entidad y sus campos indexados (dentro de una transacción abierta)"""
+        conn.execute(
+            'INSERT INTO entities (entity_type, entity_id, data) VALUES (?, ?, ?) '
+            'ON CONFLICT (entity_type, entity_id) DO UPDATE SET data = excluded.data',
+            (entity_type, entity_id, self.encryption.encrypt_data(data))
+        )
+        conn.execute('DELETE FROM entity_fields WHERE entity_type = ? AND entity_id = ?', (entity_type, entity_id))
+        conn.executemany(
+            'INSERT OR IGNORE INTO entity_fields (entity_type, field, value, entity_id) VALUES (?, ?, ?, ?)',
+            self._field_rows(entity_type, entity_id, data)
+        )
+
+    def _delete_rows(self, conn: sqlite3.Connection, entity_type: str, entity_id: str) -> bool:
+        cursor = conn.execute('DELETE FROM entities WHERE entity_type = ? AND entity_id = ?', (entity_type, entity_id))
+        conn.execute('DELETE FROM entity_fields WHERE entity_type = ? AND entity_id = ?', (entity_type, entity_id))
+        return cursor.rowcount > 0
+
+    # ------------------------------------------------------------------
+    # StorageBackend
+    # ------------------------------------------------------------------
+
+    def _read_index(self, entity_type: str) -> List[str]:
+        rows = self._connect().execute(
+            'SELECT entity_id FROM entities WHERE entity_type = ? ORDER BY seq', (entity_type,)
+        )
+        return [row[0] for row in rows]
+
+    def _read_entity(self, entity_type: str, entity_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute(
+            'SELECT data FROM entities WHERE entity_type = ? AND entity_id = ?', (entity_type, entity_id)
+        ).fetchone()
+        if row is None:
+            return None
+        try:
+            return self.encryption.decrypt_data(row[0])
+        except Exception as e:
+            print(f"Error loading {entity_type}/{entity_id}: {e}")
+            return None
+
+    @timed_storage_operation('save')
+    def save(self, entity_type: str, entity_id: str, data: Dict[str, Any]) -> bool:
+        """
+        Guarda una entidad encriptada
+
+        Args:
+            entity_type: Tipo de entidad (ninos, padrinos, etc.)
+            entity_id: ID único de la entidad
+            data: Datos a guardar
+
+        Returns:
+            bool: True si se guardó exitosamente
+        """
+        return bool(self._save_many(entity_type, {entity_id: data}))
+
+    @timed_storage_operation('save_many')
+    def save_many(self, entity_type: str, records: Dict[str, Dict[str, Any]]) -> List[str]:
+        """
+        Guarda varias entidades en una sola transacción
+
+        Returns:
+            list: IDs guardados, en el orden recibido ([] si la transacción falló)
+        """
+        return self._save_many(entity_type, records)
+
+    def _save_many(self, entity_type: str, records: Dict[str, Dict[str, Any]]) -> List[str]:
+        """save_many sin métrica: save la usa sin contarse dos veces"""
+        if entity_type not in self.ENTITY_TYPES:
+            raise ValueError(f"Invalid entity type: {entity_type}")
+
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for entity_id, data in records.items():
+                self._write_rows(conn, entity_type, entity_id, data)
+            conn.execute('COMMIT')
+        except Exception as e:
+            conn.execute('ROLLBACK')
+            print(f"Error saving {entity_type}: {e}")
+            return []
+
+        for entity_id in records:
+            self._invalidate_cache(entity_type, entity_id)
+        return list(records)
+
+    @timed_storage_operation('delete')
+    def delete(self, entity_type: str, entity_id: str) -> bool:
+        """
+        Elimina una entidad
+
+        Returns:
+            bool: True si se eliminó exitosamente
+        """
+        if entity_type not in self.ENTITY_TYPES:
+            raise ValueError(f"Invalid entity type: {entity_type}")
+
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            deleted = self._delete_rows(conn, entity_type, entity_id)
+            conn.execute('COMMIT')
+        except Exception as e:
+            conn.execute('ROLLBACK')
+            print(f"Error deleting {entity_type}/{entity_id}: {e}")
+            return False
+
+        self._invalidate_cache(entity_type, entity_id)
+        return deleted
+
+    def load_raw(self, entity_type: str, entity_id: str) -> Optional[bytes]:
+        """Ciphertext de la fila de una entidad, o None si no existe"""
+        if entity_type not in self.ENTITY_TYPES:
+            raise ValueError(f"Invalid entity type: {entity_type}")
+        row = self._connect().execute(
+            'SELECT data FROM entities WHERE entity_type = ? AND entity_id = ?', (entity_type, entity_id)
+        ).fetchone()
+        return bytes(row[0]) if row is not None else None
+
+    def delete_if_unchanged(self, entity_type: str, expected: Dict[str, bytes]) -> List[str]:
+        """
+        Borra entidades sólo si su ciphertext sigue siendo el esperado
+
+        Comparación y borrado van en la misma transacción BEGIN IMMEDIATE:
+        ninguna escritura de otro proceso puede colarse entre ambos.
+
+        Returns:
+            list: IDs borrados
+        """
+        if entity_type not in self.ENTITY_TYPES:
+            raise ValueError(f"Invalid entity type: {entity_type}")
+
+        conn = self._connect()
+        deleted = []
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for entity_id, blob in expected.items():
+                row = conn.execute(
+                    'SELECT data FROM entities WHERE entity_type = ? AND entity_id = ?', (entity_type, entity_id)
+                ).fetchone()
+                if row is not None and bytes(row[0]) == blob:
+                    self._delete_rows(conn, entity_type, entity_id)
+                    deleted.append(entity_id)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        for entity_id in deleted:
+            self._invalidate_cache(entity_type, entity_id)
+        return deleted
+
+    def allocate_ids(self, entity_type: str, prefix: str, count: int) -> List[str]:
+        """
+        Reserva un bloque de IDs consecutivos, únicos entre hilos y procesos
+
+        El último número entregado se guarda en id_counters dentro de la misma
+        transacción BEGIN IMMEDIATE que lo lee: dos workers nunca reciben el
+        mismo ID y un ID borrado no se vuelve a entregar.
+
+        Returns:
+            list: IDs consecutivos (ej: ['E010', 'E011', 'E012'])
+        """
+        if entity_type not in self.ENTITY_TYPES:
+            raise ValueError(f"Invalid entity type: {entity_type}")
+
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT last_number FROM id_counters WHERE entity_type = ? AND prefix = ?', (entity_type, prefix)
+            ).fetchone()
+            ids = [r[0] for r in conn.execute('SELECT entity_id FROM entities WHERE entity_type = ?', (entity_type,))]
+            start = max(self._max_id_number(ids, prefix), row[0] if row else 0) + 1
+            conn.execute(
+                'INSERT INTO id_counters (entity_type, prefix, last_number) VALUES (?, ?, ?) '
+                'ON CONFLICT (entity_type, prefix) DO UPDATE SET last_number = excluded.last_number',
+                (entity_type, prefix, start + count - 1)
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return [f"{prefix}{str(num).zfill(3)}" for num in range(start, start + count)]
+
+    def write_batch(self) -> 'SQLiteWriteBatch':
+        """Batch todo-o-nada confirmado como una transacción SQLite"""
+        return SQLiteWriteBatch(self)
+
+    def rebuild_index(self, entity_type: str) -> List[str]:
+        """Regenera los campos indexados de un tipo (p.ej. tras cambiar INDEXED_FIELDS)"""
+        ids = self._read_index(entity_type)
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM entity_fields WHERE entity_type = ?', (entity_type,))
+            for entity_id in ids:
+                data = self._read_entity(entity_type, entity_id)
+                if data is not None:
+                    conn.executemany(
+                        'INSERT OR IGNORE INTO entity_fields (entity_type, field, value, entity_id) VALUES (?, ?, ?, ?)',
+                        self._field_rows(entity_type, entity_id, data)
+                    )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        self._invalidate_cache(entity_type)
+        return ids
+
+    @timed_storage_operation('list_all')
+    def list_all(self, entity_type: str) -> List[Dict[str, Any]]:
+        """Todas las entidades de un tipo con una sola consulta"""
+        if entity_type not in self.ENTITY_TYPES:
+            raise ValueError(f"Invalid entity type: {entity_type}")
+
+        entities = []
+        rows = self._connect().execute(
+            'SELECT entity_id, data FROM entities WHERE entity_type = ? ORDER BY seq', (entity_type,)
+        )
+        for entity_id, blob in rows:
+            try:
+                entities.append(self.encryption.decrypt_data(blob))
+            except Exception as e:
+                print(f"Error loading {entity_type}/{entity_id}: {e}")
+        return entities
+
+    def exists(self, entity_type: str, entity_id: str) -> bool:
+        """Verifica si una entidad existe"""
+        row = self._connect().execute(
+            'SELECT 1 FROM entities WHERE entity_type = ? AND entity_id = ?', (entity_type, entity_id)
+        ).fetchone()
+        return row is not None
+
+    def _indexed_ids_query(self, entity_type: str, filters: Dict[str, Any]):
+        """SQL con los IDs que cumplen filtros sobre campos indexados, o None si alguno no lo está"""
+        indexed = self.INDEXED_FIELDS.get(entity_type, {})
+        if not filters or any(field not in indexed for field in filters):
+            return None
+        clauses, params = [], []
+        for field, value in filters.items():
+            clauses.append(
+                'entity_id IN (SELECT entity_id FROM entity_fields '
+                'WHERE entity_type = ? AND field = ? AND value = ?)'
+            )
+            params.extend([entity_type, field, self._index_value(indexed[field], value)])
+        return ' AND '.join(clauses), params
+
+    @timed_storage_operation('find')
+    def find(self, entity_type: str, **filters) -> List[Dict[str, Any]]:
+        """Filtra por campos indexados sin desencriptar el resto del tipo"""
+        query = self._indexed_ids_query(entity_type, filters)
+        if query is None:
+            return super().find(entity_type, **filters)
+        where, params = query
+        rows = self._connect().execute(
+            f'SELECT entity_id, data FROM entities WHERE entity_type = ? AND {where} ORDER BY seq',
+            [entity_type] + params
+        )
+        entities = []
+        for entity_id, blob in rows:
+            entity = self.encryption.decrypt_data(blob)
+            # Descarta colisiones del índice con la misma comparación que el default
+            if self._matches(entity, filters):
+                entities.append(entity)
+        return entities
+
+    @timed_storage_operation('count')
+    def count(self, entity_type: str, **filters) -> int:
+        """Cuenta con el índice, sin desencriptar nada"""
+        if not filters:
+            row = self._connect().execute(
+                'SELECT COUNT(*) FROM entities WHERE entity_type = ?', (entity_type,)
+            ).fetchone()
+            return row[0]
+        query = self._indexed_ids_query(entity_type, filters)
+        if query is None or any(self.INDEXED_FIELDS[entity_type][f] == 'hmac' for f in filters):
+            return super().count(entity_type, **filters)
+        where, params = query
+        row = self._connect().execute(
+            f'SELECT COUNT(*) FROM entities WHERE entity_type = ? AND {where}', [entity_type] + params
+        ).fetchone()
+        return row[0]
+
+
+class SQLiteWriteBatch(WriteBatch):
+    """WriteBatch confirmado como una transacción SQLite en vez de un journal"""
+
+    def commit(self) -> bool:
+        if self.committed:
+            raise RuntimeError('WriteBatch already committed')
+
+        storage = self.storage
+        conn = storage._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for (entity_type, entity_id), data in self._saves.items():
+                storage._write_rows(conn, entity_type, entity_id, data)
+            for entity_type, entity_id in self._deletes:
+                storage._delete_rows(conn, entity_type, entity_id)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        for entity_type, entity_ids in self.changes.items():
+            for entity_id in entity_ids:
+                storage._invalidate_cache(entity_type, entity_id)
+
+        self.committed = True
+        return True
+
+
+# Singleton instance
+_sqlite_storage_manager = None
+_sqlite_storage_manager_lock = threading.Lock()
+
+def get_sqlite_storage_manager() -> SQLiteStorageManager:
+    """Retorna instancia singleton del SQLiteStorageManager"""
+    global _sqlite_storage_manager
+    if _sqlite_storage_manager is None:
+        with _sqlite_storage_manager_lock:
+            if _sqlite_storage_manager is None:
+                _sqlite_storage_manager = SQLiteStorageManager()
+    return _sqlite_storage_manager
@@ -3,21 +3,75 @@ SmileLink Storage - Sync Manager
 Maneja sincronización automática entre NFS y HDFS
 """
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from dotenv import load_dotenv
 from .file_manager import get_storage_manager
 from .hdfs_client import get_hdfs_client
-
-load_dotenv()
+from .replication_queue import get_replication_queue
+from .segments import pack_files, upload_segment
+from .sync_manifest import SyncManifest
+from .tracing import span
 
 
 class SyncManager:
     """Maneja sincronización de archivos entre NFS y HDFS"""
     
     def __init__(self):
-        self.storage = get_storage_manager()
-        self.hdfs = get_hdfs_client()
+        self._storage = None
+        self._hdfs = None
         self.auto_sync = os.getenv('USE_HDFS_REPLICATION', 'False').lower() == 'true'
+        # La réplica por archivo sólo aplica al motor 'file' (ver storage/backend.py),
+        # también mientras es el origen de una migración
+        backend = os.getenv('STORAGE_BACKEND', 'file').lower()
+        if backend == 'migrating':
+            backend = os.getenv('MIGRATION_SOURCE', 'file').lower()
+        if backend != 'file':
+            self.auto_sync = False
+        # Con la cola activa, sync_entity/sync_index sólo encolan y regresan
+        self.use_queue = os.getenv('USE_HDFS_QUEUE', 'True').lower() == 'true'
+        # 'segments' empaqueta muchos archivos por subida (ver storage/segments.py)
+        self.replication_mode = os.getenv('HDFS_REPLICATION_MODE', 'files').lower()
+        self.segment_max_bytes = int(os.getenv('HDFS_SEGMENT_MAX_BYTES', str(64 * 1024 * 1024)))
+        self.sync_concurrency = int(os.getenv('HDFS_SYNC_CONCURRENCY', '8'))
+        self._manifest = None
+        self.queue = get_replication_queue() if self.auto_sync and self.use_queue else None
+        if self.queue is not None:
+            self.queue.start()
+    
+    @property
+    def storage(self):
+        """FileStorageManager, creado en el primer uso (con otro motor puede no usarse nunca)"""
+        if self._storage is None:
+            self._storage = get_storage_manager()
+        return self._storage
+    
+    @property
+    def hdfs(self):
+        """Cliente HDFS, creado en el primer uso"""
+        if self._hdfs is None:
+            self._hdfs = get_hdfs_client()
+        return self._hdfs
+    
+    def _replicate(self, local_path: Path, hdfs_relative: str) -> bool:
+        """Encola la subida o, sin cola, replica en línea"""
+        with span('replication', file=hdfs_relative, mode='queue' if self.queue is not None else 'inline'):
+            if self.queue is not None:
+                self.queue.enqueue(hdfs_relative)
+                return True
+            return self.hdfs.replicate_file(str(local_path), hdfs_relative)
+    
+    def replication_status(self) -> dict:
+        """Estado de la replicación: profundidad de la cola y lag"""
+        status = {
+            'auto_sync': self.auto_sync,
+            'queue_enabled': self.queue is not None,
+            'hdfs_available': self.hdfs.is_available(),
+        }
+        if self.queue is not None:
+            status['queue'] = self.queue.stats()
+        return status
     
     def sync_entity(self, entity_type: str, entity_id: str) -> bool:
         """
@@ -30,23 +84,123 @@ class SyncManager:
         Returns:
             bool: True si se sincronizó exitosamente
         """
-        if not self.auto_sync or not self.hdfs.is_available():
+        if not self.auto_sync or (self.queue is None and not self.hdfs.is_available()):
             return False
         
         # Obtener ruta local del archivo
         local_path = self.storage._get_entity_path(entity_type, entity_id)
         
-        if not local_path.exists():
+        # Con cola, un archivo ausente se encola igual: se replica como borrado
+        if self.queue is None and not local_path.exists():
             return False
         
         # Ruta relativa para HDFS
         hdfs_relative = f"{entity_type}/{entity_id}.json.enc"
         
-        return self.hdfs.replicate_file(str(local_path), hdfs_relative)
+        return self._replicate(local_path, hdfs_relative)
+    
+    def sync_delete(self, entity_type: str, entity_id: str) -> bool:
+        """
+        Propaga a HDFS el borrado local de una entidad
+        
+        Returns:
+            bool: True si se encoló o borró exitosamente
+        """
+        if not self.auto_sync or (self.queue is None and not self.hdfs.is_available()):
+            return False
+        
+        hdfs_relative = f"{entity_type}/{entity_id}.json.enc"
+        
+        if self.queue is not None:
+            self.queue.enqueue(hdfs_relative)
+            deleted = True
+        else:
+            deleted = self.hdfs.delete_file(hdfs_relative)
+        
+        self.sync_index(entity_type)
+        return deleted
+    
+    def sync_deletes(self, entity_type: str, entity_ids: list) -> int:
+        """
+        Propaga a HDFS varios borrados locales y sube el índice una sola vez
+        
+        Returns:
+            int: Número de borrados encolados o aplicados
+        """
+        if not self.auto_sync or (self.queue is None and not self.hdfs.is_available()):
+            return 0
+        
+        deleted = 0
+        for entity_id in entity_ids:
+            hdfs_relative = f"{entity_type}/{entity_id}.json.enc"
+            if self.queue is not None:
+                self.queue.enqueue(hdfs_relative)
+                deleted += 1
+            elif self.hdfs.delete_file(hdfs_relative):
+                deleted += 1
+        
+        self.sync_index(entity_type)
+        return deleted
+    
+    def sync_file(self, relative_path: str) -> bool:
+        """
+        Replica un archivo arbitrario del storage (ej: segmentos del archivo frío)
+        
+        Args:
+            relative_path: Ruta relativa al storage y a HDFS
+            
+        Returns:
+            bool: True si se encoló o replicó (o borró, si ya no existe localmente)
+        """
+        if not self.auto_sync or (self.queue is None and not self.hdfs.is_available()):
+            return False
+        
+        local_path = self.storage.base_path / relative_path
+        if self.queue is None and not local_path.exists():
+            return self.hdfs.delete_file(relative_path)
+        
+        return self._replicate(local_path, relative_path)
+    
+    def sync_entities(self, entity_type: str, entity_ids: list) -> int:
+        """
+        Sincroniza un grupo de entidades recién escritas y su índice
+        
+        Args:
+            entity_type: Tipo de entidad
+            entity_ids: IDs a replicar
+            
+        Returns:
+            int: Número de entidades sincronizadas
+        """
+        if not self.auto_sync or (self.queue is None and not self.hdfs.is_available()):
+            return 0
+        
+        synced_count = sum(1 for entity_id in entity_ids if self.sync_entity(entity_type, entity_id))
+        self.sync_index(entity_type)
+        
+        return synced_count
+    
+    def sync_changes(self, changes: dict) -> int:
+        """
+        Replica como una unidad los cambios de un WriteBatch
+        
+        Args:
+            changes: {entity_type: [entity_ids]} (ver WriteBatch.changes)
+            
+        Returns:
+            int: Número de entidades sincronizadas
+        """
+        if not self.auto_sync or (self.queue is None and not self.hdfs.is_available()):
+            return 0
+        
+        return sum(
+            self.sync_entities(entity_type, entity_ids)
+            for entity_type, entity_ids in changes.items()
+        )
     
     def sync_index(self, entity_type: str) -> bool:
         """Sincroniza el archivo índice de una entidad"""
-        if not self.auto_sync or not self.hdfs.is_available():
+        if not self.auto_sync or (self.queue is None and not self.hdfs.is_available()):
             return False
         
         index_path = self.storage._get_index_path(entity_type)
@@ -56,7 +210,7 @@ class SyncManager:
         
         hdfs_relative = f"{entity_type}/index.json.enc"
         
-        return self.hdfs.replicate_file(str(index_path), hdfs_relative)
+        return self._replicate(index_path, hdfs_relative)
     
     def sync_all_entities(self, entity_type: str) -> int:
         """
@@ -68,38 +222,159 @@ class SyncManager:
         if not self.auto_sync or not self.hdfs.is_available():
             return 0
         
-        entity_dir = self.storage.base_path / entity_type
-        
-        if not entity_dir.exists():
+        if not (self.storage.base_path / entity_type).exists():
             return 0
         
-        return self.hdfs.sync_directory(str(entity_dir), entity_type)
+        return self.sync_incremental([entity_type])['files_uploaded']
     
     def sync_all(self) -> dict:
         """
         Sincroniza todos los tipos de entidades
         
         Returns:
-            dict: Resumen de sincronización por tipo
+            dict: Reporte (archivos, bytes, tiempo) con desglose por tipo
         """
         if not self.auto_sync or not self.hdfs.is_available():
             return {}
         
-        results = {}
+        return self.sync_incremental(self.storage.ENTITY_TYPES)
+    
+    def _get_manifest(self) -> SyncManifest:
+        if self._manifest is None:
+            manifest_path = os.getenv('HDFS_SYNC_MANIFEST_PATH') or self.storage.base_path / '_sync_manifest.json'
+            self._manifest = SyncManifest(manifest_path)
+        return self._manifest
+    
+    def sync_incremental(self, entity_types) -> dict:
+        """
+        Sube sólo archivos nuevos o modificados y propaga borrados locales
+        
+        Compara cada archivo contra el manifest persistido (size/mtime y,
+        si cambiaron, hash del contenido). Las subidas corren en un pool de
+        HDFS_SYNC_CONCURRENCY hilos que comparten la sesión HTTP del cliente.
+        
+        Args:
+            entity_types: Tipos de entidad a sincronizar
+            
+        Returns:
+            dict: files_scanned, files_uploaded, files_skipped, files_deleted,
+                  bytes_uploaded, errors, seconds y by_type
+        """
+        started = time.monotonic()
+        base_path = self.storage.base_path
+        manifest = self._get_manifest()
+        entity_types = list(entity_types)
+        
+        local_files = {
+            f"{entity_type}/{file_path.name}": file_path
+            for entity_type in entity_types
+            for file_path in (base_path / entity_type).glob('*.json.enc')
+        }
+        deleted = [
+            relative_path for relative_path in manifest.remote_paths()
+            if relative_path.split('/', 1)[0] in entity_types and relative_path not in local_files
+        ]
+        
+        report = {
+            'files_scanned': len(local_files),
+            'files_uploaded': 0,
+            'files_skipped': 0,
+            'files_deleted': 0,
+            'bytes_uploaded': 0,
+            'errors': 0,
+            'by_type': {t: {'uploaded': 0, 'deleted': 0} for t in entity_types},
+        }
         
-        for entity_type in self.storage.ENTITY_TYPES:
-            count = self.sync_all_entities(entity_type)
-            results[entity_type] = count
+        with ThreadPoolExecutor(max_workers=self.sync_concurrency) as executor:
+            changed = [
+                (relative_path, local_files[relative_path], entry)
+                for relative_path, entry in zip(
+                    local_files,
+                    executor.map(lambda item: self._check_changed(manifest, *item), local_files.items())
+                )
+                if entry is not None
+            ]
+            report['files_skipped'] = len(local_files) - len(changed)
+            
+            if self.replication_mode == 'segments':
+                outcomes = self._upload_packed(manifest, changed, deleted)
+            else:
+                outcomes = list(executor.map(lambda item: self._upload_one(manifest, *item), changed))
+                outcomes += list(executor.map(lambda rel: self._delete_one(manifest, rel), deleted))
+        
+        for relative_path, outcome, size in outcomes:
+            entity_type = relative_path.split('/', 1)[0]
+            if outcome == 'uploaded':
+                report['files_uploaded'] += 1
+                report['bytes_uploaded'] += size
+                report['by_type'][entity_type]['uploaded'] += 1
+            elif outcome == 'deleted':
+                report['files_deleted'] += 1
+                report['by_type'][entity_type]['deleted'] += 1
+            else:
+                report['errors'] += 1
+        
+        manifest.save()
+        report['seconds'] = round(time.monotonic() - started, 3)
+        return report
+    
+    def _check_changed(self, manifest: SyncManifest, relative_path: str, local_path: Path):
+        try:
+            return manifest.needs_upload(relative_path, local_path)
+        except FileNotFoundError:
+            return None  # Borrado durante el escaneo; lo recoge la siguiente pasada
+    
+    def _upload_one(self, manifest: SyncManifest, relative_path: str, local_path: Path, entry: dict):
+        if self.hdfs.replicate_file(str(local_path), relative_path):
+            manifest.mark_present(relative_path, entry, time.time())
+            return relative_path, 'uploaded', entry['size']
+        return relative_path, 'error', 0
+    
+    def _delete_one(self, manifest: SyncManifest, relative_path: str):
+        if self.hdfs.delete_file(relative_path):
+            manifest.mark_deleted(relative_path)
+            return relative_path, 'deleted', 0
+        return relative_path, 'error', 0
+    
+    def _upload_packed(self, manifest: SyncManifest, changed: list, deleted: list) -> list:
+        """Sube cambios y tombstones empaquetados en segmentos grandes"""
+        base_path = self.storage.base_path
+        entries = {relative_path: entry for relative_path, _, entry in changed}
+        relative_paths = list(entries) + deleted
+        tmp_dir = base_path / '_segments_tmp'
+        outcomes = []
+        
+        for segment_path, segment_manifest in pack_files(base_path, relative_paths, tmp_dir, self.segment_max_bytes):
+            try:
+                uploaded = upload_segment(self.hdfs, segment_path, segment_manifest)
+            finally:
+                segment_path.unlink(missing_ok=True)
+            
+            synced_at = time.time()
+            for relative_path in segment_manifest['entries']:
+                if uploaded and relative_path in entries:
+                    manifest.mark_present(relative_path, entries[relative_path], synced_at)
+                    outcomes.append((relative_path, 'uploaded', entries[relative_path]['size']))
+                else:
+                    outcomes.append((relative_path, 'error', 0))
+            for relative_path in segment_manifest['deleted']:
+                if uploaded:
+                    manifest.mark_deleted(relative_path)
+                outcomes.append((relative_path, 'deleted' if uploaded else 'error', 0))
         
-        return results
+        return outcomes
 
 
 # Singleton instance
 _sync_manager = None
+_sync_manager_lock = threading.Lock()
 
 def get_sync_manager() -> SyncManager:
     """Retorna instancia singleton del SyncManager"""
     global _sync_manager
     if _sync_manager is None:
-        _sync_manager = SyncManager()
+        # Double-checked: las primeras peticiones concurrentes no construyen dos instancias
+        with _sync_manager_lock:
+            if _sync_manager is None:
+                _sync_manager = SyncManager()
     return _sync_manager
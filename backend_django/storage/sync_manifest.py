@@ -0,0 +1,93 @@
+"""
+SmileLink Storage - Sync Manifest
+Registro persistente de lo que ya se replicó a HDFS para sincronizar sólo
+archivos nuevos o modificados
+"""
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+
+def file_sha256(path: Path) -> str:
+    """Hash del contenido de un archivo"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class SyncManifest:
+    """
+    Mapa ruta relativa -> {size, mtime_ns, sha256, remote, synced_at}
+
+    Un archivo se considera sin cambios si su size y mtime coinciden con el
+    manifest. Si difieren pero el hash es igual (p.ej. un touch) sólo se
+    actualiza la entrada, sin subir nada.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.load()
+
+    def load(self):
+        """Carga el manifest desde disco (vacío si no existe o está corrupto)"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f).get('entries', {})
+        except FileNotFoundError:
+            self.entries = {}
+        except (OSError, ValueError) as e:
+            print(f"Error loading sync manifest, starting fresh: {e}")
+            self.entries = {}
+
+    def save(self):
+        """Guarda el manifest de forma atómica"""
+        with self._lock:
+            payload = {'version': 1, 'entries': self.entries}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(payload, f)
+        os.replace(tmp_path, self.path)
+
+    def needs_upload(self, relative_path: str, local_path: Path) -> Optional[Dict[str, Any]]:
+        """
+        Decide si un archivo local cambió desde la última sincronización
+
+        Returns:
+            dict: Nueva entrada a registrar tras subirlo, o None si no cambió
+        """
+        stat = local_path.stat()
+        with self._lock:
+            entry = self.entries.get(relative_path)
+
+        if entry and entry.get('remote') == 'present' \
+                and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            return None
+
+        new_entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': file_sha256(local_path)}
+
+        if entry and entry.get('remote') == 'present' and entry.get('sha256') == new_entry['sha256']:
+            self.mark_present(relative_path, new_entry, entry.get('synced_at'))
+            return None
+
+        return new_entry
+
+    def mark_present(self, relative_path: str, entry: Dict[str, Any], synced_at: float):
+        with self._lock:
+            self.entries[relative_path] = {**entry, 'remote': 'present', 'synced_at': synced_at}
+
+    def mark_deleted(self, relative_path: str):
+        with self._lock:
+            self.entries.pop(relative_path, None)
+
+    def remote_paths(self):
+        """Rutas que el manifest registra como presentes en HDFS"""
+        with self._lock:
+            return [p for p, e in self.entries.items() if e.get('remote') == 'present']
@@ -1,3 +1,1343 @@
-from django.test import TestCase
+"""
+Tests del almacenamiento
 
-# Create your tests here.
+El mismo contrato se corre sobre los tres motores (file, sqlite, log), cada
+uno en un directorio temporal. Las pruebas propias de un motor (recuperación
+de batches interrumpidos, compactación del log) van en su subclase.
+"""
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+from cryptography.fernet import Fernet
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase
+
+import storage.encryption
+import storage.log_store
+import storage.migration
+import storage.sqlite_backend
+from storage import metrics, write_batch
+from storage.archive import ArchiveStore
+from storage.blob_cache import BlobCache
+from storage.file_manager import FileStorageManager
+from storage.fsck import StorageChecker
+from storage.hdfs_client import HDFSClient
+from storage.jobs import JobStore
+from storage.log_store import LogStorageManager
+from storage.migration import MigratingStorageBackend, StorageMigration
+from storage.nfs_health import StorageUnavailable
+from storage.replication_queue import ReplicationQueue
+from storage.restore import HDFSRestorer
+from storage.segments import MANIFEST_SUFFIX, SEGMENT_DIR, SegmentReader, merge_small_segments, pack_files, upload_segment
+from storage.snapshot import SnapshotStore
+from storage.sqlite_backend import SQLiteStorageManager
+from storage.sync_manager import SyncManager
+from storage.webhdfs_standin import WebHDFSStandIn
+from storage.write_batch import JOURNAL_DIR
+
+
+_env_patch = None
+
+
+def setUpModule():
+    # Todos los procesos (también los del stress) deben compartir la llave
+    global _env_patch
+    _env_patch = mock.patch.dict(os.environ, {
+        'ENCRYPTION_KEY': os.getenv('ENCRYPTION_KEY') or Fernet.generate_key().decode(),
+        'SNAPSHOT_ENABLED': 'False',
+    })
+    _env_patch.start()
+    storage.encryption._encryption_manager = None
+
+
+def tearDownModule():
+    _env_patch.stop()
+    storage.encryption._encryption_manager = None
+
+
+class SimulatedCrash(Exception):
+    """El proceso 'muere' a mitad de un commit"""
+
+
+def _abandon_held_journals():
+    """Suelta los journals de este proceso como si su writer hubiera muerto"""
+    for journal_path in list(write_batch._held_journals):
+        write_batch.unclaim_journal(journal_path)
+
+
+def _allocate_in_child(open_backend, queue, rounds):
+    backend = open_backend()
+    ids = []
+    for _ in range(rounds):
+        ids.extend(backend.allocate_ids('entregas', 'E', 3))
+    queue.put(ids)
+
+
+class StorageContractMixin:
+    """Comportamiento que la API espera de cualquier StorageBackend"""
+
+    def open_backend(self):
+        """Instancia nueva del motor sobre self.directory"""
+        raise NotImplementedError
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='smilelink-storage-test-')
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        # Checkpoint sincrónico: cada batch queda durable y sin registro al retornar
+        self.checkpointer = write_batch.JournalCheckpointer(interval=0, max_pending=1)
+        patcher = mock.patch.object(write_batch, '_journal_checkpointer', self.checkpointer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.storage = self.open_backend()
+
+    def _entrega(self, entity_id, estado='Pendiente', **extra):
+        return {'id_entrega': entity_id, 'estado_entrega': estado, **extra}
+
+    # ------------------------------------------------------------------
+    # CRUD
+    # ------------------------------------------------------------------
+
+    def test_save_and_load_round_trip(self):
+        data = self._entrega('E001', observaciones='Niño con regalo ñ')
+        self.assertTrue(self.storage.save('entregas', 'E001', data))
+        self.assertEqual(self.storage.load('entregas', 'E001'), data)
+        self.assertTrue(self.storage.exists('entregas', 'E001'))
+
+    def test_load_missing_returns_none(self):
+        self.assertIsNone(self.storage.load('entregas', 'E999'))
+        self.assertFalse(self.storage.exists('entregas', 'E999'))
+
+    def test_list_keeps_insertion_order(self):
+        for entity_id in ('E010', 'E002', 'E001'):
+            self.storage.save('entregas', entity_id, self._entrega(entity_id))
+        # Una actualización no mueve la entidad en el índice
+        self.storage.save('entregas', 'E002', self._entrega('E002', 'Entregado'))
+
+        self.assertEqual(self.storage.list_ids('entregas'), ['E010', 'E002', 'E001'])
+        self.assertEqual(
+            [(e['id_entrega'], e['estado_entrega']) for e in self.storage.list_all('entregas')],
+            [('E010', 'Pendiente'), ('E002', 'Entregado'), ('E001', 'Pendiente')],
+        )
+
+    def test_save_many(self):
+        records = {f"E{n:03d}": self._entrega(f"E{n:03d}") for n in range(1, 21)}
+        self.assertEqual(self.storage.save_many('entregas', records), list(records))
+        self.assertEqual(self.storage.list_ids('entregas'), list(records))
+        self.assertEqual(self.storage.load('entregas', 'E020'), records['E020'])
+
+    def test_delete(self):
+        self.storage.save('entregas', 'E001', self._entrega('E001'))
+        self.storage.save('entregas', 'E002', self._entrega('E002'))
+
+        self.assertTrue(self.storage.delete('entregas', 'E001'))
+        self.assertFalse(self.storage.delete('entregas', 'E001'))
+        self.assertIsNone(self.storage.load('entregas', 'E001'))
+        self.assertEqual(self.storage.list_ids('entregas'), ['E002'])
+
+    def test_invalid_entity_type(self):
+        with self.assertRaises(ValueError):
+            self.storage.save('desconocidos', 'X001', {})
+
+    def test_find_and_count_ignore_email_case(self):
+        self.storage.save('padrinos', 'P001', {'id_padrino': 'P001', 'email': 'ana@example.org'})
+        self.storage.save('padrinos', 'P002', {'id_padrino': 'P002', 'email': 'luis@example.org'})
+
+        found = self.storage.find('padrinos', email=' Ana@Example.ORG ')
+        self.assertEqual([p['id_padrino'] for p in found], ['P001'])
+        self.assertEqual(self.storage.count('padrinos', email='LUIS@example.org'), 1)
+
+    def test_changes_persist_across_instances(self):
+        self.storage.save('ninos', 'N001', {'id_nino': 'N001'})
+        self.storage.save('ninos', 'N002', {'id_nino': 'N002'})
+        self.storage.delete('ninos', 'N001')
+
+        reopened = self.open_backend()
+        self.assertEqual(reopened.list_ids('ninos'), ['N002'])
+        self.assertEqual(reopened.load('ninos', 'N002'), {'id_nino': 'N002'})
+
+    def test_rebuild_index(self):
+        for entity_id in ('E002', 'E010', 'E001'):
+            self.storage.save('entregas', entity_id, self._entrega(entity_id))
+        self.assertEqual(sorted(self.storage.rebuild_index('entregas')), ['E001', 'E002', 'E010'])
+        self.assertEqual(sorted(self.storage.list_ids('entregas')), ['E001', 'E002', 'E010'])
+
+    def test_delete_if_unchanged_keeps_rewritten_entities(self):
+        self.storage.save('entregas', 'E001', self._entrega('E001'))
+        self.storage.save('entregas', 'E002', self._entrega('E002'))
+        expected = {entity_id: self.storage.load_raw('entregas', entity_id) for entity_id in ('E001', 'E002')}
+        self.storage.save('entregas', 'E002', self._entrega('E002', 'Entregado'))
+
+        self.assertEqual(self.storage.delete_if_unchanged('entregas', expected), ['E001'])
+        self.assertEqual(self.storage.list_ids('entregas'), ['E002'])
+        self.assertEqual(self.storage.load('entregas', 'E002')['estado_entrega'], 'Entregado')
+
+    # ------------------------------------------------------------------
+    # Archivo frío
+    # ------------------------------------------------------------------
+
+    def test_archive_moves_finished_records(self):
+        delivered = self._entrega('E001', 'Entregado', fecha_entrega_real='2020-01-15')
+        self.storage.save('entregas', 'E001', delivered)
+        self.storage.save('entregas', 'E002', self._entrega('E002', fecha_programada='2020-01-15'))
+        archive = ArchiveStore(self.storage, tier='storage')
+
+        report = archive.archive('entregas', older_than_days=30)
+
+        self.assertEqual(report['archived'], 1)
+        self.assertEqual(self.storage.list_ids('entregas'), ['E002'])
+        self.assertEqual(archive.load('entregas', 'E001'), delivered)
+        self.assertEqual(archive.aggregates('entregas'), {'count': 1, 'by_estado': {'Entregado': 1}})
+        reopened = ArchiveStore(self.open_backend(), tier='storage')
+        self.assertEqual(reopened.list_all('entregas'), [delivered])
+
+    # ------------------------------------------------------------------
+    # Write batches
+    # ------------------------------------------------------------------
+
+    def test_write_batch_commits_every_change(self):
+        self.storage.save('entregas', 'E001', self._entrega('E001'))
+
+        with self.storage.write_batch() as batch:
+            batch.save('entregas', 'E002', self._entrega('E002'))
+            batch.save('ninos', 'N001', {'id_nino': 'N001'})
+            batch.delete('entregas', 'E001')
+
+        self.assertEqual(batch.changes, {'entregas': ['E002', 'E001'], 'ninos': ['N001']})
+        self.assertEqual(self.storage.list_ids('entregas'), ['E002'])
+        self.assertEqual(self.storage.list_ids('ninos'), ['N001'])
+        self.assertEqual(self.open_backend().list_ids('entregas'), ['E002'])
+
+    def test_write_batch_discarded_on_exception(self):
+        with self.assertRaises(RuntimeError):
+            with self.storage.write_batch() as batch:
+                batch.save('entregas', 'E001', self._entrega('E001'))
+                raise RuntimeError('abort')
+
+        self.assertFalse(batch.committed)
+        self.assertEqual(self.storage.list_ids('entregas'), [])
+
+    def _interrupted_batch(self):
+        """Batch con escrituras en dos tipos y un borrado, para cortar su commit"""
+        batch = self.storage.write_batch()
+        batch.save('entregas', 'E002', self._entrega('E002'))
+        batch.save('ninos', 'N001', {'id_nino': 'N001'})
+        batch.delete('entregas', 'E001')
+        return batch
+
+    # ------------------------------------------------------------------
+    # Métricas
+    # ------------------------------------------------------------------
+
+    def test_each_operation_is_timed_once(self):
+        with mock.patch.object(metrics, 'ENABLED', True), \
+                mock.patch.object(metrics.STORAGE_OPERATION_SECONDS, 'observe') as observe:
+            self.storage.save('entregas', 'E001', self._entrega('E001'))
+            self.storage.save_many('entregas', {'E002': self._entrega('E002')})
+        operations = [call.kwargs['operation'] for call in observe.call_args_list]
+        self.assertEqual(operations, ['save', 'save_many'])
+
+    # ------------------------------------------------------------------
+    # IDs
+    # ------------------------------------------------------------------
+
+    def test_allocate_ids_never_reuses_deleted_ids(self):
+        first = self.storage.allocate_ids('entregas', 'E', 2)
+        for entity_id in first:
+            self.storage.save('entregas', entity_id, self._entrega(entity_id))
+        self.storage.delete('entregas', first[-1])
+
+        second = self.storage.allocate_ids('entregas', 'E', 2)
+        self.assertEqual(first, ['E001', 'E002'])
+        self.assertEqual(second, ['E003', 'E004'])
+
+    def test_allocate_ids_unique_across_threads(self):
+        allocated = []
+        lock = threading.Lock()
+
+        def work():
+            backend = self.open_backend()
+            for _ in range(10):
+                ids = backend.allocate_ids('entregas', 'E', 3)
+                with lock:
+                    allocated.extend(ids)
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(allocated), 240)
+        self.assertEqual(len(set(allocated)), 240)
+
+    def test_allocate_ids_unique_across_processes(self):
+        context = multiprocessing.get_context('fork')
+        queue = context.Queue()
+        processes = [
+            context.Process(target=_allocate_in_child, args=(self.open_backend, queue, 10))
+            for _ in range(4)
+        ]
+        for process in processes:
+            process.start()
+        allocated = [entity_id for _ in processes for entity_id in queue.get(timeout=60)]
+        for process in processes:
+            process.join(timeout=60)
+            self.assertEqual(process.exitcode, 0)
+
+        allocated.extend(self.storage.allocate_ids('entregas', 'E', 3))
+        self.assertEqual(len(allocated), 123)
+        self.assertEqual(len(set(allocated)), 123)
+
+
+class FileStorageTests(StorageContractMixin, SimpleTestCase):
+
+    def open_backend(self):
+        return FileStorageManager(base_path=self.directory)
+
+    def test_save_many_fails_fast_when_nfs_is_unhealthy(self):
+        with mock.patch.object(self.storage, '_degraded', return_value=True), \
+                mock.patch.object(Path, 'exists') as exists:
+            with self.assertRaises(StorageUnavailable):
+                self.storage.save_many('entregas', {'E001': self._entrega('E001')})
+        exists.assert_not_called()
+
+    def _journal_files(self):
+        return sorted(path.suffix for path in (Path(self.directory) / JOURNAL_DIR).iterdir())
+
+    def _defer_checkpoint(self):
+        """Deja los batches aplicados sin fsync hasta un flush explícito"""
+        self.checkpointer.interval = 3600
+        self.checkpointer.max_pending = 10 ** 6
+        self.addCleanup(self.checkpointer.flush)
+
+    def test_interrupted_batch_is_recovered_on_open(self):
+        self.storage.save('entregas', 'E001', self._entrega('E001'))
+        batch = self._interrupted_batch()
+        with mock.patch('storage.write_batch.apply_journal_record', side_effect=SimulatedCrash):
+            with self.assertRaises(SimulatedCrash):
+                batch.commit()
+        # El commit fallido suelta el registro: no queda tomado hasta que muera el proceso
+        self.assertEqual(write_batch._held_journals, {})
+        self.assertTrue(self.storage.exists('entregas', 'E001'))
+
+        reopened = self.open_backend()
+        self.assertEqual(reopened.list_ids('entregas'), ['E002'])
+        self.assertEqual(reopened.list_ids('ninos'), ['N001'])
+        self.assertEqual(list((Path(self.directory) / JOURNAL_DIR).iterdir()), [])
+
+    def test_failed_apply_is_retried_durably(self):
+        self.storage.save('entregas', 'E001', self._entrega('E001'))
+        apply = write_batch.apply_journal_record
+        calls = []
+
+        def flaky_apply(*args, **kwargs):
+            calls.append(kwargs.get('durable', True))
+            if len(calls) == 1:
+                raise OSError('disk full')
+            return apply(*args, **kwargs)
+
+        with mock.patch('storage.write_batch.apply_journal_record', side_effect=flaky_apply):
+            self.assertTrue(self._interrupted_batch().commit())
+
+        self.assertEqual(calls, [False, True])
+        self.assertEqual(self.storage.list_ids('entregas'), ['E002'])
+        self.assertEqual(write_batch._held_journals, {})
+        self.assertEqual(self._journal_files(), [])
+
+    def test_commit_fsyncs_only_the_journal(self):
+        self._defer_checkpoint()
+        batch = self.storage.write_batch()
+        for n in range(1, 21):
+            batch.save('entregas', f"E{n:03d}", self._entrega(f"E{n:03d}"))
+        batch.save('ninos', 'N001', {'id_nino': 'N001'})
+
+        fsync = os.fsync
+        with mock.patch('os.fsync', side_effect=fsync) as patched:
+            batch.commit()
+        # El registro y su directorio; nada por archivo aplicado
+        self.assertEqual(patched.call_count, 2)
+        self.assertEqual(self._journal_files(), ['.applied'])
+
+        with mock.patch('os.fsync', side_effect=fsync) as patched:
+            self.checkpointer.flush()
+        # Una vez cada uno: 21 entidades, 2 índices, 2 directorios de tipo y el del journal
+        self.assertEqual(patched.call_count, 26)
+        self.assertEqual(self._journal_files(), [])
+        self.assertEqual(write_batch._held_journals, {})
+
+    def test_live_batch_is_not_replayed(self):
+        self._defer_checkpoint()
+        self._interrupted_batch().commit()
+        self.storage.save('ninos', 'N001', {'id_nino': 'N001', 'nombre': 'posterior'})
+
+        # El writer sigue vivo (tiene el flock del registro): nadie más lo toca
+        reopened = self.open_backend()
+        self.assertEqual(reopened.load('ninos', 'N001')['nombre'], 'posterior')
+        self.assertEqual(self._journal_files(), ['.applied'])
+
+    def test_applied_batch_of_dead_writer_is_synced_not_replayed(self):
+        self._defer_checkpoint()
+        self._interrupted_batch().commit()
+        self.checkpointer._pending.clear()
+        _abandon_held_journals()
+        self.storage.save('ninos', 'N001', {'id_nino': 'N001', 'nombre': 'posterior'})
+
+        # Sin reinicio lo escrito sigue en el page cache: re-aplicar pisaría la escritura posterior
+        reopened = self.open_backend()
+        self.assertEqual(reopened.load('ninos', 'N001')['nombre'], 'posterior')
+        self.assertEqual(self._journal_files(), [])
+
+    def test_applied_batch_is_redone_after_reboot(self):
+        self._defer_checkpoint()
+        self._interrupted_batch().commit()
+        self.checkpointer._pending.clear()
+        _abandon_held_journals()
+        # El reinicio se llevó lo que no estaba sincronizado
+        (Path(self.directory) / 'ninos' / 'N001.json.enc').unlink()
+
+        with mock.patch.object(write_batch, 'BOOT', write_batch.BOOT + '-rebooted'):
+            reopened = self.open_backend()
+        self.assertEqual(reopened.load('ninos', 'N001'), {'id_nino': 'N001'})
+        self.assertEqual(self._journal_files(), [])
+
+
+class SQLiteStorageTests(StorageContractMixin, SimpleTestCase):
+
+    def open_backend(self):
+        return SQLiteStorageManager(db_path=str(Path(self.directory) / 'smilelink.sqlite3'))
+
+    def test_interrupted_batch_is_rolled_back(self):
+        self.storage.save('entregas', 'E001', self._entrega('E001'))
+        batch = self._interrupted_batch()
+        with mock.patch.object(self.storage, '_delete_rows', side_effect=SimulatedCrash):
+            with self.assertRaises(SimulatedCrash):
+                batch.commit()
+
+        reopened = self.open_backend()
+        self.assertEqual(reopened.list_ids('entregas'), ['E001'])
+        self.assertEqual(reopened.list_ids('ninos'), [])
+
+
+class LogStorageTests(StorageContractMixin, SimpleTestCase):
+
+    def open_backend(self):
+        return LogStorageManager(base_path=self.directory, compact_interval=0)
+
+    def test_interrupted_batch_is_recovered_on_open(self):
+        self.storage.save('entregas', 'E001', self._entrega('E001'))
+        batch = self._interrupted_batch()
+        with mock.patch.object(self.storage, '_apply_ops', side_effect=SimulatedCrash):
+            with self.assertRaises(SimulatedCrash):
+                batch.commit()
+        self.assertEqual(write_batch._held_journals, {})
+
+        reopened = self.open_backend()
+        self.assertEqual(reopened.list_ids('entregas'), ['E002'])
+        self.assertEqual(reopened.list_ids('ninos'), ['N001'])
+        self.assertEqual(list((Path(self.directory) / JOURNAL_DIR).iterdir()), [])
+
+    def test_torn_tail_is_truncated_on_open(self):
+        self.storage.save_many('solicitudes', {
+            f"SR{n:03d}": {'id_solicitud': f"SR{n:03d}"} for n in range(1, 11)
+        })
+        segment = Path(self.directory) / 'solicitudes' / '00000001.seg'
+        size = segment.stat().st_size
+        with open(segment, 'ab') as f:
+            f.write(b'\x00\x01partial record')
+
+        reopened = self.open_backend()
+        self.assertEqual(segment.stat().st_size, size)
+        self.assertEqual(len(reopened.list_ids('solicitudes')), 10)
+        self.assertEqual(reopened.load('solicitudes', 'SR010'), {'id_solicitud': 'SR010'})
+
+    def test_compaction_keeps_live_records(self):
+        for version in range(5):
+            self.storage.save_many('solicitudes', {
+                f"SR{n:03d}": {'id_solicitud': f"SR{n:03d}", 'version': version} for n in range(1, 51)
+            })
+        for n in range(1, 26):
+            self.storage.delete('solicitudes', f"SR{n:03d}")
+        before = self.storage.stats()['solicitudes']
+
+        self.storage.compact('solicitudes', force=True)
+        after = self.storage.stats()['solicitudes']
+
+        self.assertLess(after['total_bytes'], before['total_bytes'])
+        self.assertEqual(after['total_bytes'], after['live_bytes'])
+        expected = [f"SR{n:03d}" for n in range(26, 51)]
+        self.assertEqual(self.storage.list_ids('solicitudes'), expected)
+        self.assertEqual(self.storage.load('solicitudes', 'SR050'), {'id_solicitud': 'SR050', 'version': 4})
+
+        reopened = self.open_backend()
+        self.assertEqual(reopened.list_ids('solicitudes'), expected)
+        self.assertIsNone(reopened.load('solicitudes', 'SR001'))
+
+
+class SingletonTests(SimpleTestCase):
+    """Las primeras peticiones concurrentes comparten una sola instancia del motor"""
+
+    def _assert_built_once(self, getter, factory_target, singleton_target):
+        def slow_factory(*args, **kwargs):
+            time.sleep(0.05)
+            return object()
+
+        with mock.patch(factory_target, side_effect=slow_factory) as factory, \
+                mock.patch(singleton_target, None):
+            results = []
+            threads = [threading.Thread(target=lambda: results.append(getter())) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(factory.call_count, 1)
+        self.assertEqual(len({id(result) for result in results}), 1)
+
+    def test_sqlite_singleton(self):
+        self._assert_built_once(storage.sqlite_backend.get_sqlite_storage_manager,
+                                'storage.sqlite_backend.SQLiteStorageManager',
+                                'storage.sqlite_backend._sqlite_storage_manager')
+
+    def test_log_singleton(self):
+        self._assert_built_once(storage.log_store.get_log_storage_manager,
+                                'storage.log_store.LogStorageManager',
+                                'storage.log_store._log_storage_manager')
+
+    def test_migrating_singleton(self):
+        with mock.patch.dict(os.environ, {'MIGRATION_TARGET': 'sqlite'}), \
+                mock.patch('storage.migration.open_storage_backend'):
+            self._assert_built_once(storage.migration.get_migrating_storage_manager,
+                                    'storage.migration.MigratingStorageBackend',
+                                    'storage.migration._migrating_storage_manager')
+
+
+class ArchiveMigrationTests(SimpleTestCase):
+    """El archivo frío sigue disponible durante y después de migrar de motor"""
+
+    def setUp(self):
+        directory = Path(tempfile.mkdtemp(prefix='smilelink-archive-migration-test-'))
+        self.addCleanup(shutil.rmtree, directory, True)
+        self.source = FileStorageManager(base_path=str(directory / 'file'))
+        self.target = SQLiteStorageManager(db_path=str(directory / 'sqlite' / 'smilelink.sqlite3'))
+        self.migration = StorageMigration(
+            self.source, self.target, job_id='migrate-test', jobs=JobStore(base_path=str(directory / 'jobs'))
+        )
+
+    def _delivered(self, entity_id):
+        return {'id_entrega': entity_id, 'estado_entrega': 'Entregado', 'fecha_entrega_real': '2020-01-15'}
+
+    def test_archive_is_copied_and_verified(self):
+        self.source.save('entregas', 'E001', self._delivered('E001'))
+        ArchiveStore(self.source, tier='storage').archive('entregas', older_than_days=30)
+
+        self.migration.run(['entregas'])
+        self.assertIn('entregas/catalog.json.enc', self.migration.verify_archive()['missing'])
+        self.migration.copy_archive()
+
+        after_cutover = ArchiveStore(self.target, tier='storage')
+        self.assertEqual(after_cutover.load('entregas', 'E001'), self._delivered('E001'))
+        self.assertEqual(after_cutover.aggregates('entregas')['count'], 1)
+        clean = self.migration.verify_archive()
+        self.assertEqual(clean['missing'] + clean['mismatched'] + clean['extra'], [])
+
+    def test_archiving_during_migration_writes_through(self):
+        migrating = MigratingStorageBackend(self.source, self.target)
+        migrating.save('entregas', 'E001', self._delivered('E001'))
+        migrating.save('entregas', 'E002', {'id_entrega': 'E002', 'estado_entrega': 'Pendiente'})
+
+        report = ArchiveStore(migrating, tier='storage').archive('entregas', older_than_days=30)
+
+        self.assertEqual(report['archived'], 1)
+        self.assertEqual(self.source.list_ids('entregas'), ['E002'])
+        self.assertEqual(self.target.list_ids('entregas'), ['E002'])
+        stale = self.migration.verify_archive()
+        self.assertIn('entregas/catalog.json.enc', stale['missing'])
+        self.migration.copy_archive()
+        self.assertEqual(ArchiveStore(self.target, tier='storage').list_ids('entregas'), ['E001'])
+
+    def test_failed_write_through_is_recorded_and_recopied(self):
+        migrating = MigratingStorageBackend(self.source, self.target)
+        with mock.patch.object(self.target, 'save', side_effect=OSError('disk full')):
+            migrating.save('entregas', 'E001', self._delivered('E001'))
+        with mock.patch.object(self.target, 'save_many', return_value=[]):
+            migrating.save_many('entregas', {'E002': self._delivered('E002')})
+
+        self.assertEqual(self.source.list_ids('entregas'), ['E001', 'E002'])
+        self.assertEqual(self.target.list_ids('entregas'), [])
+        self.assertEqual(self.migration.verify(['entregas'])['entregas']['write_through_failed'], ['E001', 'E002'])
+
+        self.assertEqual(self.migration.recopy_write_through_failures(['entregas']), {'entregas': ['E001', 'E002']})
+        self.assertEqual(self.target.load('entregas', 'E002'), self._delivered('E002'))
+        self.assertEqual(self.migration.verify(['entregas'])['entregas']['write_through_failed'], [])
+
+    def test_verify_fails_until_failed_write_through_is_fixed(self):
+        source_spec = f"file:{self.source.base_path}"
+        target_spec = f"sqlite:{self.target.db_path}"
+        migrating = MigratingStorageBackend(self.source, self.target)
+        migrating.save('entregas', 'E001', self._delivered('E001'))
+        with mock.patch.object(self.target, 'delete', side_effect=OSError('locked')):
+            migrating.delete('entregas', 'E001')
+
+        out = StringIO()
+        with self.assertRaisesRegex(CommandError, 'difference'):
+            call_command('migrate_storage', source=source_spec, target=target_spec,
+                         types=['entregas'], verify_only=True, stdout=out)
+        self.assertIn('1 failed write-through(s)', out.getvalue())
+
+        call_command('migrate_storage', source=source_spec, target=target_spec,
+                     types=['entregas'], verify_only=True, fix=True, stdout=StringIO())
+        self.assertEqual(self.target.list_ids('entregas'), [])
+        call_command('migrate_storage', source=source_spec, target=target_spec,
+                     types=['entregas'], verify_only=True, stdout=StringIO())
+
+
+class BlobCacheTests(SimpleTestCase):
+    """Validez de las copias locales frente al archivo en NFS"""
+
+    def setUp(self):
+        directory = Path(tempfile.mkdtemp(prefix='smilelink-blob-cache-test-'))
+        self.addCleanup(shutil.rmtree, directory, True)
+        self.source = directory / 'nfs' / 'ninos' / 'N001.json.enc'
+        self.source.parent.mkdir(parents=True)
+        self.directory = directory
+        self.cache = BlobCache(directory / 'nfs', directory / 'cache', max_bytes=1024 * 1024)
+        self.addCleanup(self.cache.close)
+
+    def _replace_keeping_size_and_mtime(self, data):
+        """Otro host reemplaza el archivo dentro del mismo tick de mtime"""
+        mtime_ns = self.source.stat().st_mtime_ns
+        tmp_path = self.source.with_name('.other-host.tmp')
+        tmp_path.write_bytes(data)
+        os.utime(tmp_path, ns=(mtime_ns, mtime_ns))
+        os.replace(tmp_path, self.source)
+
+    def test_hit_after_write_through(self):
+        self.cache.write(self.source, b'version-1')
+        self.assertEqual(self.cache.read(self.source), b'version-1')
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_same_size_and_mtime_replacement_is_a_miss(self):
+        self.cache.write(self.source, b'version-1')
+        self._replace_keeping_size_and_mtime(b'version-2')
+
+        self.assertEqual(self.cache.read(self.source), b'version-2')
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+    def test_deleted_source_is_forgotten(self):
+        self.cache.write(self.source, b'version-1')
+        self.source.unlink()
+
+        self.assertIsNone(self.cache.read(self.source))
+        self.assertIsNone(self.cache.read_cached(self.source))
+
+    def test_size_cap_is_shared_between_workers(self):
+        # Dos workers del mismo host: cada uno por su cuenta cabría en el máximo
+        workers = [BlobCache(self.directory / 'nfs', self.directory / 'cache', max_bytes=2000) for _ in range(2)]
+        for worker in workers:
+            self.addCleanup(worker.close)
+        for n in range(20):
+            source = self.source.with_name(f"N{n + 100:03d}.json.enc")
+            workers[n % 2].write(source, b'x' * 100)
+
+        on_disk = sum(path.stat().st_size for path in (self.directory / 'cache').rglob('*.json.enc'))
+        self.assertLessEqual(on_disk, 2000)
+        self.assertEqual(workers[0].stats()['bytes'], on_disk)
+        self.assertEqual(workers[1].stats()['bytes'], on_disk)
+        self.assertGreater(sum(worker.stats()['evictions'] for worker in workers), 0)
+
+    def test_least_recently_read_is_evicted_first(self):
+        cache = BlobCache(self.directory / 'nfs', self.directory / 'lru', max_bytes=600)
+        self.addCleanup(cache.close)
+        sources = [self.source.with_name(f"N{n:03d}.json.enc") for n in range(200, 204)]
+        for n, source in enumerate(sources[:3]):
+            cache.write(source, b'x' * 100)
+            os.utime(cache.cache_dir / cache._relative(source), ns=(n * 10 ** 9, n * 10 ** 9))
+        cache._touched.clear()
+        cache.read(sources[0])
+
+        cache.write(sources[3], b'x' * 300)
+        self.assertIsNotNone(cache.read_cached(sources[0]))
+        self.assertIsNone(cache.read_cached(sources[1]))
+
+
+class StressStorageCommandTests(SimpleTestCase):
+    """python manage.py stress_storage como chequeo automático (procesos reales)"""
+
+    def test_store_consistent_under_concurrent_processes(self):
+        directory = tempfile.mkdtemp(prefix='smilelink-stress-test-')
+        self.addCleanup(shutil.rmtree, directory, True)
+        out = StringIO()
+
+        call_command(
+            'stress_storage', processes='1,3', ops=40, targets='local,nfs',
+            local_path=directory, nfs_path=directory, stdout=out,
+        )
+
+        self.assertIn('Store consistent after every run', out.getvalue())
+
+
+class ReplicationQueueTests(SimpleTestCase):
+    """Reclamo de marcadores, reintentos y recuperación de la cola de replicación"""
+
+    def setUp(self):
+        self.workdir = Path(tempfile.mkdtemp(prefix='smilelink-replication-queue-test-'))
+        self.addCleanup(shutil.rmtree, self.workdir, True)
+        (self.workdir / 'data' / 'ninos').mkdir(parents=True)
+        (self.workdir / 'data' / 'ninos' / 'N001.json.enc').write_bytes(b'ciphertext')
+        self.hdfs = mock.Mock()
+        self.hdfs.replicate_file.return_value = True
+        for patcher in (
+            mock.patch('storage.replication_queue.get_hdfs_client', return_value=self.hdfs),
+            # Los tests drenan en el hilo actual
+            mock.patch.object(ReplicationQueue, 'start'),
+            mock.patch.dict(os.environ, {'HDFS_REPLICATION_MODE': 'files', 'HDFS_RETRY_BASE_SECONDS': '60'}),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _queue(self):
+        return ReplicationQueue(self.workdir / 'data', queue_path=str(self.workdir / 'queue'))
+
+    def _pending(self, queue):
+        return queue._read_marker(queue.pending_dir / 'ninos__N001.json.enc')
+
+    def test_repeated_writes_coalesce_into_one_upload(self):
+        queue = self._queue()
+        self.assertTrue(queue.enqueue('ninos/N001.json.enc'))
+        self.assertFalse(queue.enqueue('ninos/N001.json.enc'))
+
+        self.assertTrue(queue.drain(timeout=5))
+        self.hdfs.replicate_file.assert_called_once_with(
+            str(self.workdir / 'data' / 'ninos' / 'N001.json.enc'), 'ninos/N001.json.enc'
+        )
+        self.assertEqual(queue.stats()['coalesced'], 1)
+        self.assertEqual(queue.stats()['inflight'], 0)
+
+    def test_claimed_marker_is_not_claimed_twice(self):
+        first, second = self._queue(), self._queue()
+        first.enqueue('ninos/N001.json.enc')
+
+        item = first._claim()
+        self.assertEqual(item['path'], 'ninos/N001.json.enc')
+        self.assertIsNone(second._claim())
+        self.assertEqual(first.depth(), 0)
+        self.assertEqual(first.stats()['inflight'], 1)
+
+    def test_failed_upload_waits_for_backoff_then_retries(self):
+        queue = self._queue()
+        queue.enqueue('ninos/N001.json.enc')
+        self.hdfs.replicate_file.return_value = False
+
+        self.assertTrue(queue.process_once())
+        item = self._pending(queue)
+        self.assertEqual(item['attempts'], 1)
+        self.assertGreater(item['next_attempt'], time.time() + 50)
+        self.assertEqual(queue.stats()['retrying'], 1)
+        # Dentro del backoff no se reclama
+        self.assertFalse(queue.process_once())
+        self.assertEqual(self.hdfs.replicate_file.call_count, 1)
+
+        item['next_attempt'] = 0
+        queue._write_marker(queue.pending_dir / 'ninos__N001.json.enc', item)
+        self.hdfs.replicate_file.return_value = True
+        self.assertTrue(queue.process_once())
+        self.assertEqual(queue.depth(), 0)
+        self.assertEqual(queue.stats()['failed_attempts'], 1)
+        self.assertEqual(queue.stats()['replicated'], 1)
+
+    def test_write_during_failed_upload_keeps_the_oldest_enqueue_time(self):
+        queue = self._queue()
+        queue.enqueue('ninos/N001.json.enc')
+        enqueued_at = self._pending(queue)['enqueued_at']
+
+        def rewritten_while_uploading(local_path, relative_path):
+            time.sleep(0.01)
+            self.assertTrue(queue.enqueue(relative_path))
+            return False
+
+        self.hdfs.replicate_file.side_effect = rewritten_while_uploading
+        queue.process_once()
+
+        item = self._pending(queue)
+        self.assertEqual(item['enqueued_at'], enqueued_at)
+        self.assertEqual(item['attempts'], 1)
+        self.assertEqual(queue.depth(), 1)
+
+    def test_markers_of_a_dead_worker_return_to_pending(self):
+        queue = self._queue()
+        queue.enqueue('ninos/N001.json.enc')
+        queue.enqueue('ninos/N002.json.enc')
+        dead = multiprocessing.Process(target=int)
+        dead.start()
+        dead.join()
+        dead_dir = queue.queue_path / 'inflight' / str(dead.pid)
+        live_dir = queue.queue_path / 'inflight' / str(os.getppid())
+        for directory in (dead_dir, live_dir):
+            directory.mkdir()
+        os.rename(queue.pending_dir / 'ninos__N001.json.enc', dead_dir / 'ninos__N001.json.enc')
+        # N002 quedó reclamado por el muerto y además se volvió a encolar
+        (dead_dir / 'ninos__N002.json.enc').write_text((queue.pending_dir / 'ninos__N002.json.enc').read_text())
+        (live_dir / 'ninos__N003.json.enc').write_text('{}')
+
+        recovered = self._queue()
+
+        self.assertEqual(sorted(p.name for p in recovered.pending_dir.iterdir()), ['ninos__N001.json.enc', 'ninos__N002.json.enc'])
+        self.assertFalse(dead_dir.exists())
+        self.assertTrue((live_dir / 'ninos__N003.json.enc').exists())
+
+
+class SyncAllTests(SimpleTestCase):
+    """sync_all sube sólo lo que cambió respecto al manifest"""
+
+    def setUp(self):
+        self.workdir = Path(tempfile.mkdtemp(prefix='smilelink-sync-all-test-'))
+        self.addCleanup(shutil.rmtree, self.workdir, True)
+        patcher = mock.patch.dict(os.environ, {
+            'USE_HDFS_REPLICATION': 'True', 'USE_HDFS_QUEUE': 'False', 'STORAGE_BACKEND': 'file',
+            'HDFS_REPLICATION_MODE': 'files', 'HDFS_SYNC_CONCURRENCY': '4', 'HDFS_SYNC_MANIFEST_PATH': '',
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.storage = FileStorageManager(base_path=str(self.workdir / 'data'))
+        # Sólo cuentan los archivos que escribe cada test, no los índices vacíos
+        for index_path in self.storage.base_path.glob('*/index.json.enc'):
+            index_path.unlink()
+        self.hdfs = mock.Mock()
+        self.hdfs.replicate_file.return_value = True
+        self.hdfs.delete_file.return_value = True
+
+    def _sync_manager(self):
+        """Instancia nueva, como tras reiniciar el proceso"""
+        manager = SyncManager()
+        manager._storage = self.storage
+        manager._hdfs = self.hdfs
+        return manager
+
+    def _write(self, relative_path, data):
+        path = self.storage.base_path / relative_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+        return path
+
+    def _uploaded(self):
+        paths = sorted(c.args[1] for c in self.hdfs.replicate_file.call_args_list)
+        self.hdfs.replicate_file.reset_mock()
+        return paths
+
+    def test_second_pass_uploads_nothing(self):
+        self._write('ninos/N001.json.enc', b'uno')
+        self._write('entregas/E001.json.enc', b'dos')
+
+        report = self._sync_manager().sync_all()
+        self.assertEqual((report['files_uploaded'], report['bytes_uploaded']), (2, 6))
+        self.assertEqual(self._uploaded(), ['entregas/E001.json.enc', 'ninos/N001.json.enc'])
+
+        # El manifest persistido sobrevive al reinicio
+        report = self._sync_manager().sync_all()
+        self.assertEqual((report['files_uploaded'], report['files_skipped']), (0, 2))
+        self.assertEqual(self._uploaded(), [])
+
+    def test_only_changed_content_is_uploaded(self):
+        touched = self._write('ninos/N001.json.enc', b'uno')
+        self._write('ninos/N002.json.enc', b'dos')
+        manager = self._sync_manager()
+        manager.sync_all()
+        self._uploaded()
+
+        os.utime(touched, ns=(time.time_ns(), time.time_ns() + 10 ** 9))
+        self._write('ninos/N002.json.enc', b'dos v2')
+        report = manager.sync_all()
+
+        self.assertEqual(self._uploaded(), ['ninos/N002.json.enc'])
+        self.assertEqual(report['by_type']['ninos'], {'uploaded': 1, 'deleted': 0})
+        # El touch sólo refrescó la entrada: la siguiente pasada no vuelve a hashear ni subir
+        self.assertEqual(manager.sync_all()['files_skipped'], 2)
+
+    def test_local_deletes_are_propagated_once(self):
+        self._write('ninos/N001.json.enc', b'uno')
+        gone = self._write('ninos/N002.json.enc', b'dos')
+        manager = self._sync_manager()
+        manager.sync_all()
+        gone.unlink()
+
+        report = manager.sync_all()
+        self.hdfs.delete_file.assert_called_once_with('ninos/N002.json.enc')
+        self.assertEqual(report['files_deleted'], 1)
+        self.assertEqual(manager.sync_all()['files_deleted'], 0)
+        self.hdfs.delete_file.assert_called_once()
+
+    def test_failed_upload_is_retried_next_pass(self):
+        self._write('ninos/N001.json.enc', b'uno')
+        manager = self._sync_manager()
+        self.hdfs.replicate_file.return_value = False
+        self.assertEqual(manager.sync_all()['errors'], 1)
+        self._uploaded()
+
+        self.hdfs.replicate_file.return_value = True
+        report = manager.sync_all()
+        self.assertEqual((report['files_uploaded'], report['errors']), (1, 0))
+        self.assertEqual(self._uploaded(), ['ninos/N001.json.enc'])
+
+    def test_segments_mode_packs_changes_and_tombstones(self):
+        logging.getLogger('hdfs').setLevel(logging.WARNING)
+        (self.workdir / 'hdfs').mkdir()
+        server = WebHDFSStandIn(str(self.workdir / 'hdfs')).start()
+        self.addCleanup(server.stop)
+        self.hdfs = HDFSClient(namenode_url=server.url, replication_path='/smilelink/data', pool_size=2)
+        self._write('ninos/N001.json.enc', b'uno')
+        gone = self._write('ninos/N002.json.enc', b'dos')
+        with mock.patch.dict(os.environ, {'HDFS_REPLICATION_MODE': 'segments'}):
+            manager = self._sync_manager()
+        manager.sync_all()
+        gone.unlink()
+        self._write('ninos/N001.json.enc', b'uno v2')
+
+        report = manager.sync_all()
+
+        self.assertEqual((report['files_uploaded'], report['files_deleted'], report['errors']), (1, 1, 0))
+        reader = SegmentReader(self.hdfs)
+        self.assertEqual(reader.read_file('ninos/N001.json.enc'), b'uno v2')
+        self.assertIsNone(reader.read_file('ninos/N002.json.enc'))
+
+
+class FsckTests(SimpleTestCase):
+    """Huérfanos, entradas sin archivo y archivos corruptos; reparación del índice"""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp(prefix='smilelink-fsck-test-')
+        self.addCleanup(shutil.rmtree, directory, True)
+        patcher = mock.patch.object(write_batch, '_journal_checkpointer', write_batch.JournalCheckpointer(interval=0, max_pending=1))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.storage = FileStorageManager(base_path=directory)
+        for entity_id in ('E001', 'E002', 'E003'):
+            self.storage.save('entregas', entity_id, self._entrega(entity_id))
+        self.checker = StorageChecker(self.storage, workers=4, batch_size=2)
+
+    def _entrega(self, entity_id, **extra):
+        return {'id_entrega': entity_id, 'estado_entrega': 'Pendiente', **extra}
+
+    def _path(self, entity_id):
+        return self.storage._get_entity_path('entregas', entity_id)
+
+    def _write_raw(self, entity_id, data):
+        """Archivo escrito por fuera del manager, sin pasar por el índice"""
+        self._path(entity_id).write_bytes(data if isinstance(data, bytes) else self.storage.encryption.encrypt_data(data))
+
+    def _check(self):
+        return self.checker.check(['entregas'])['entregas']
+
+    def test_consistent_store_has_no_problems(self):
+        report = self._check()
+        self.assertEqual((report['files'], report['indexed'], sorted(report['valid'])), (3, 3, ['E001', 'E002', 'E003']))
+        self.assertFalse(StorageChecker.has_problems(report))
+
+    def test_detects_orphans_dangling_duplicates_and_corrupt_files(self):
+        self._write_raw('E010', self._entrega('E010'))
+        self._write_raw('E004', self._entrega('E004'))
+        self._path('E002').unlink()
+        self._write_raw('E003', b'not a fernet token')
+        self._write_raw('E005', self._entrega('E999'))
+        self.storage._save_index('entregas', ['E001', 'E002', 'E003', 'E001'])
+
+        report = self._check()
+
+        self.assertEqual(report['orphans'], ['E004', 'E010'])
+        self.assertEqual(report['dangling'], ['E002'])
+        self.assertEqual(report['duplicates'], ['E001'])
+        self.assertEqual([entity_id for entity_id, _ in report['corrupt']], ['E003'])
+        self.assertEqual(report['mismatched'], [['E005', 'id_entrega=E999']])
+        self.assertTrue(StorageChecker.has_problems(report))
+
+    def test_unreadable_index_is_a_problem(self):
+        self.storage._get_index_path('entregas').write_bytes(b'garbage')
+
+        report = self._check()
+
+        self.assertFalse(report['index_readable'])
+        self.assertEqual(report['orphans'], ['E001', 'E002', 'E003'])
+        self.assertTrue(StorageChecker.has_problems(report))
+
+    def test_repair_rewrites_the_index_and_quarantines_invalid_files(self):
+        self._write_raw('E010', self._entrega('E010'))
+        self._write_raw('E004', self._entrega('E004'))
+        self._path('E002').unlink()
+        self._write_raw('E003', b'not a fernet token')
+        self.storage._save_index('entregas', ['E003', 'E002', 'E001', 'E001'])
+        stale = self._path('E001').with_name('.E001.json.enc.123.tmp')
+        stale.write_bytes(b'')
+        os.utime(stale, (time.time() - 2 * 3600, time.time() - 2 * 3600))
+
+        report = self._check()
+        self.assertEqual(report['stale_tmp'], [stale.name])
+        result = self.checker.repair('entregas', report, quarantine=True)
+
+        # Conserva el orden existente y agrega los huérfanos en orden natural
+        self.assertEqual(self.storage.list_ids('entregas'), ['E001', 'E004', 'E010'])
+        self.assertEqual(result, {'index_before': 4, 'index_after': 3, 'stale_tmp_removed': 1, 'quarantined': 1})
+        self.assertFalse(stale.exists())
+        self.assertFalse(self._path('E003').exists())
+        self.assertEqual(len(list((self.storage.base_path / '_quarantine' / 'entregas').iterdir())), 1)
+        self.assertFalse(StorageChecker.has_problems(self._check()))
+
+    def test_repair_keeps_entities_saved_after_the_check(self):
+        self._write_raw('E004', self._entrega('E004'))
+        report = self._check()
+        self.storage.save('entregas', 'E005', self._entrega('E005'))
+
+        self.checker.repair('entregas', report)
+
+        self.assertEqual(self.storage.list_ids('entregas'), ['E001', 'E002', 'E003', 'E005', 'E004'])
+
+    def test_command_fails_until_repaired(self):
+        self._write_raw('E004', self._entrega('E004'))
+        with mock.patch('storage.management.commands.fsck_storage.get_storage_manager', return_value=self.storage), \
+                mock.patch('storage.management.commands.fsck_storage.get_sync_manager'), \
+                mock.patch('storage.management.commands.fsck_storage.get_archive_store') as archive:
+            archive.return_value.rebuild_aggregates.return_value = {'before': 0, 'after': 0}
+            with self.assertRaisesRegex(CommandError, 'need repair'):
+                call_command('fsck_storage', types=['entregas'], stdout=StringIO())
+            call_command('fsck_storage', types=['entregas'], repair=True, stdout=StringIO())
+            call_command('fsck_storage', types=['entregas'], stdout=StringIO())
+        self.assertIn('E004', self.storage.list_ids('entregas'))
+
+
+class MetricsTests(SimpleTestCase):
+    """Suma de las fotos por proceso en /api/metrics/"""
+
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp(prefix='smilelink-metrics-test-'))
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        patcher = mock.patch.object(metrics, 'ENABLED', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.registry = metrics.MetricsRegistry(str(self.directory))
+        self.requests = self.registry.counter('requests_total', 'Requests', ('route',))
+        self.latency = self.registry.histogram('latency_seconds', 'Latency', buckets=(0.1, 1.0))
+
+    def _other_process(self, pid, requests, latencies=()):
+        """Foto que dejó otro proceso con sus propias métricas"""
+        other = metrics.MetricsRegistry()
+        counter = other.counter('requests_total', 'Requests', ('route',))
+        histogram = other.histogram('latency_seconds', 'Latency', buckets=(0.1, 1.0))
+        counter.inc(requests, route='/api/ninos/')
+        for value in latencies:
+            histogram.observe(value)
+        (self.directory / f"{pid}.json").write_text(json.dumps(other.snapshot()))
+
+    def _dead_pid(self):
+        process = multiprocessing.Process(target=int)
+        process.start()
+        process.join()
+        return process.pid
+
+    def _values(self, collected, name):
+        return {tuple(labels): value for labels, value in collected[name]['values']}
+
+    def test_merge_adds_counters_and_histogram_buckets(self):
+        self.requests.inc(2, route='/api/ninos/')
+        self.latency.observe(0.05)
+        self._other_process(os.getppid(), 3, latencies=(0.5, 5.0))
+
+        collected = self.registry.collect()
+
+        self.assertEqual(self._values(collected, 'requests_total'), {('/api/ninos/',): 5})
+        # [<=0.1, <=1.0, +Inf, suma, total]
+        self.assertEqual(self._values(collected, 'latency_seconds'), {(): [1, 1, 1, 5.55, 3]})
+
+    def test_dead_process_is_archived_once(self):
+        self.requests.inc(1, route='/api/ninos/')
+        dead_pid = self._dead_pid()
+        self._other_process(dead_pid, 4)
+
+        first = self.registry.collect()
+        second = self.registry.collect()
+
+        self.assertFalse((self.directory / f"{dead_pid}.json").exists())
+        self.assertTrue((self.directory / metrics.ARCHIVED_NAME).exists())
+        self.assertEqual(self._values(first, 'requests_total'), {('/api/ninos/',): 5})
+        self.assertEqual(self._values(second, 'requests_total'), {('/api/ninos/',): 5})
+
+    def test_snapshots_with_other_buckets_are_skipped(self):
+        self.latency.observe(0.05)
+        other = metrics.MetricsRegistry()
+        other.histogram('latency_seconds', 'Latency', buckets=(0.5,)).observe(0.2)
+        (self.directory / f"{os.getppid()}.json").write_text(json.dumps(other.snapshot()))
+
+        self.assertEqual(self._values(self.registry.collect(), 'latency_seconds'), {(): [1, 0, 0, 0.05, 1]})
+
+    def test_render_prometheus_uses_cumulative_buckets(self):
+        self.requests.inc(route='/api/"x"/')
+        self.latency.observe(0.05)
+        self.latency.observe(0.5)
+
+        text = metrics.render_prometheus(self.registry.snapshot())
+
+        self.assertIn('requests_total{route="/api/\\"x\\"/"} 1', text)
+        self.assertIn('latency_seconds_bucket{le="0.1"} 1', text)
+        self.assertIn('latency_seconds_bucket{le="1.0"} 2', text)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 2', text)
+        self.assertIn('latency_seconds_count 2', text)
+
+
+class SnapshotTests(SimpleTestCase):
+    """Frescura del snapshot compartido: bump, reconstrucción y límites de antigüedad"""
+
+    def setUp(self):
+        self.workdir = Path(tempfile.mkdtemp(prefix='smilelink-snapshot-test-'))
+        self.addCleanup(shutil.rmtree, self.workdir, True)
+        patcher = mock.patch.object(write_batch, '_journal_checkpointer', write_batch.JournalCheckpointer(interval=0, max_pending=1))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.storage = FileStorageManager(base_path=str(self.workdir / 'data'))
+        for entity_id in ('N001', 'N002', 'N003'):
+            self.storage.save('ninos', entity_id, self._nino(entity_id))
+        self.storage.snapshot = self._store()
+
+    def _nino(self, entity_id, nombre='Ana'):
+        return {'id_nino': entity_id, 'nombre': nombre}
+
+    def _store(self, **options):
+        """Otro worker del host: mismo directorio, mismos contadores"""
+        options.setdefault('refresh_delay', 0)
+        return SnapshotStore(self.storage, self.workdir / 'snapshot', ['ninos'], **options)
+
+    def test_fresh_snapshot_is_read_without_decrypting(self):
+        self.storage.snapshot.build('ninos')
+
+        with mock.patch.object(self.storage.encryption, 'decrypt_data', side_effect=AssertionError('decrypted')):
+            self.assertEqual([n['id_nino'] for n in self.storage.list_all('ninos')], ['N001', 'N002', 'N003'])
+            self.assertEqual(self.storage.load('ninos', 'N002'), self._nino('N002'))
+        self.assertEqual(self.storage.snapshot.stats()['misses'], 0)
+
+    def test_write_makes_the_snapshot_stale_for_every_worker(self):
+        self.storage.snapshot.build('ninos')
+        other_worker = self._store()
+        self.assertIsNotNone(other_worker.view('ninos'))
+
+        with mock.patch.object(SnapshotStore, '_schedule_refresh'):
+            self.storage.save('ninos', 'N002', self._nino('N002', nombre='Beto'))
+            self.assertIsNone(other_worker.view('ninos'))
+            # Mientras tanto las lecturas van a disco y ven la escritura
+            self.assertEqual(self.storage.load('ninos', 'N002')['nombre'], 'Beto')
+
+        result = other_worker.build('ninos')
+        self.assertEqual((result['decrypted'], result['reused']), (1, 2))
+        self.assertEqual(other_worker.view('ninos').load('N002')['nombre'], 'Beto')
+        # Ya al día: no se reescribe
+        self.assertEqual(self.storage.snapshot.build('ninos')['decrypted'], 0)
+
+    def test_stale_read_schedules_a_background_rebuild(self):
+        self.storage.snapshot.build('ninos')
+        self.storage.save('ninos', 'N004', self._nino('N004'))
+
+        self.assertEqual(len(self.storage.list_all('ninos')), 4)
+
+        deadline = time.time() + 5
+        while self.storage.snapshot.view('ninos') is None and time.time() < deadline:
+            time.sleep(0.02)
+        self.assertEqual(self.storage.snapshot.view('ninos').ids, ['N001', 'N002', 'N003', 'N004'])
+        self.assertEqual(self.storage.snapshot.stats()['rebuilds'], 2)
+
+    def test_max_age_bounds_writes_from_other_hosts(self):
+        store = self._store(max_age=0.05)
+        store.build('ninos')
+        self.assertIsNotNone(store.view('ninos'))
+
+        time.sleep(0.1)
+        with mock.patch.object(SnapshotStore, '_schedule_refresh') as refresh:
+            self.assertIsNone(store.view('ninos'))
+        refresh.assert_called_once_with('ninos')
+
+    def test_index_changed_while_stopped_invalidates_the_snapshot(self):
+        self.storage.snapshot.build('ninos')
+        self.storage.snapshot = None
+        # Restauración con el servidor detenido: nadie incrementó la generación
+        self.storage.save('ninos', 'N004', self._nino('N004'))
+
+        with mock.patch.object(SnapshotStore, '_schedule_refresh'):
+            self.assertIsNone(self._store().view('ninos'))
+
+
+class RestoreTests(SimpleTestCase):
+    """Restore desde una réplica servida por el stand-in de WebHDFS"""
+
+    NINOS = 20
+    ENTREGAS = 10
+
+    def setUp(self):
+        logging.getLogger('hdfs').setLevel(logging.WARNING)
+        workdir = Path(tempfile.mkdtemp(prefix='smilelink-restore-test-'))
+        self.addCleanup(shutil.rmtree, workdir, True)
+
+        # Réplica mixta: ninos como archivos sueltos, entregas en un segmento
+        source = FileStorageManager(base_path=str(workdir / 'source'))
+        self.ninos = {f"N{n:03d}": {'id_nino': f"N{n:03d}", 'nombre': f"Nino {n}"} for n in range(1, self.NINOS + 1)}
+        self.entregas = {f"E{n:03d}": {'id_entrega': f"E{n:03d}"} for n in range(1, self.ENTREGAS + 1)}
+        source.save_many('ninos', self.ninos)
+        source.save_many('entregas', self.entregas)
+
+        replica = workdir / 'hdfs' / 'smilelink' / 'data'
+        shutil.copytree(source.base_path / 'ninos', replica / 'ninos')
+        segment_dir = replica / SEGMENT_DIR
+        segment_dir.mkdir(parents=True)
+        rel_paths = [f"entregas/{entity_id}.json.enc" for entity_id in self.entregas]
+        for segment_path, manifest in pack_files(source.base_path, rel_paths, workdir / 'packing', 1024 * 1024):
+            shutil.move(str(segment_path), str(segment_dir / segment_path.name))
+            (segment_dir / f"{manifest['segment_id']}{MANIFEST_SUFFIX}").write_text(json.dumps(manifest))
+
+        server = WebHDFSStandIn(str(workdir / 'hdfs')).start()
+        self.addCleanup(server.stop)
+        self.hdfs = HDFSClient(namenode_url=server.url, replication_path='/smilelink/data', pool_size=4)
+        self.target = workdir / 'restored'
+
+    def _restorer(self):
+        return HDFSRestorer(self.hdfs, target_path=str(self.target), workers=4)
+
+    def _assert_restored(self):
+        restored = FileStorageManager(base_path=str(self.target))
+        self.assertEqual(sorted(restored.list_ids('ninos')), sorted(self.ninos))
+        self.assertEqual(sorted(restored.list_ids('entregas')), sorted(self.entregas))
+        self.assertEqual(restored.load('ninos', 'N007'), self.ninos['N007'])
+        self.assertEqual(restored.load('entregas', 'E003'), self.entregas['E003'])
+
+    def test_restore_from_files_and_segments(self):
+        report = self._restorer().restore(['ninos', 'entregas'])
+
+        self.assertEqual((report['restored'], report['failed']), (self.NINOS + self.ENTREGAS, 0))
+        self._assert_restored()
+
+    def test_interrupted_restore_resumes(self):
+        restore_file = HDFSRestorer._restore_file
+
+        def cut_off(restorer, entity_type, entity_id, version_ms):
+            # La conexión se corta a mitad: la mitad de los ninos no llega
+            if int(entity_id[1:]) % 2 == 0:
+                raise IOError('connection reset')
+            return restore_file(restorer, entity_type, entity_id, version_ms)
+
+        with mock.patch.object(HDFSRestorer, '_restore_file', cut_off):
+            first = self._restorer().restore(['ninos', 'entregas'])
+        self.assertEqual(first['failed'], self.NINOS // 2)
+
+        resumed = self._restorer().restore(['ninos', 'entregas'])
+        self.assertEqual(resumed['restored'], self.NINOS // 2)
+        self.assertEqual(resumed['skipped'], first['restored'])
+        self.assertEqual(resumed['failed'], 0)
+        self._assert_restored()
+
+        again = self._restorer().restore(['ninos', 'entregas'])
+        self.assertEqual((again['restored'], again['skipped']), (0, self.NINOS + self.ENTREGAS))
+
+    def test_local_files_missing_from_replica_are_reported_then_pruned(self):
+        local = FileStorageManager(base_path=str(self.target))
+        local.save('ninos', 'N999', {'id_nino': 'N999'})
+
+        report = self._restorer().restore(['ninos', 'entregas'])
+        self.assertEqual((report['extra'], report['removed']), (1, 0))
+        self.assertEqual(report['extras'], [{'type': 'ninos', 'id': 'N999'}])
+        self.assertTrue((self.target / 'ninos' / 'N999.json.enc').exists())
+
+        report = self._restorer().restore(['ninos', 'entregas'], prune=True)
+        self.assertEqual((report['extra'], report['removed']), (1, 1))
+        self.assertFalse((self.target / 'ninos' / 'N999.json.enc').exists())
+        self._assert_restored()
+
+    def test_prune_skips_types_missing_from_replica(self):
+        local = FileStorageManager(base_path=str(self.target))
+        local.save('padrinos', 'P001', {'id_padrino': 'P001'})
+
+        report = self._restorer().restore(['padrinos'], prune=True)
+        self.assertEqual((report['extra'], report['removed']), (1, 0))
+        self.assertEqual(FileStorageManager(base_path=str(self.target)).list_ids('padrinos'), ['P001'])
+
+
+class SegmentTests(SimpleTestCase):
+    """Fusión de segmentos chicos e índice de manifests en HDFS (stand-in de WebHDFS)"""
+
+    def setUp(self):
+        logging.getLogger('hdfs').setLevel(logging.WARNING)
+        self.workdir = Path(tempfile.mkdtemp(prefix='smilelink-segments-test-'))
+        self.addCleanup(shutil.rmtree, self.workdir, True)
+        (self.workdir / 'hdfs').mkdir()
+        server = WebHDFSStandIn(str(self.workdir / 'hdfs')).start()
+        self.addCleanup(server.stop)
+        self.hdfs = HDFSClient(namenode_url=server.url, replication_path='/smilelink/data', pool_size=2)
+        self.local = self.workdir / 'local'
+
+    def _upload(self, files):
+        """Sube un segmento con {ruta: contenido}; None es un tombstone"""
+        for relative_path, data in files.items():
+            path = self.local / relative_path
+            path.parent.mkdir(parents=True, exist_ok=True)
+            if data is None:
+                path.unlink(missing_ok=True)
+            else:
+                path.write_bytes(data)
+        for segment_path, manifest in pack_files(self.local, list(files), self.workdir / 'tmp', 1024 * 1024):
+            self.assertTrue(upload_segment(self.hdfs, segment_path, manifest))
+            segment_path.unlink()
+
+    def _versions(self, reader, paths):
+        return {relative_path: reader.read_file(relative_path) for relative_path in paths}
+
+    def test_merge_keeps_the_latest_version_of_every_file(self):
+        paths = [f"ninos/N{n:03d}.json.enc" for n in range(1, 6)]
+        for n in range(10):
+            self._upload({paths[n % 5]: f"v{n}".encode()})
+        self._upload({paths[0]: None})
+        # Un segmento grande corta la corrida: lo posterior no puede quedar debajo de él
+        self._upload({paths[1]: b'big' * 400})
+        for n in range(3):
+            self._upload({paths[2]: f"after-{n}".encode()})
+
+        before = self._versions(SegmentReader(self.hdfs), paths)
+        merged = merge_small_segments(self.hdfs, self.workdir / 'merge', small_bytes=1000,
+                                      max_bytes=1024 * 1024, min_segments=3)
+
+        self.assertEqual([len(result['merged']) for result in merged], [11, 3])
+        reader = SegmentReader(self.hdfs)
+        self.assertEqual(len(reader.list_segments()), 3)
+        self.assertEqual(self._versions(reader, paths), before)
+        self.assertIsNone(before[paths[0]])
+        self.assertEqual(before[paths[1]], b'big' * 400)
+        self.assertEqual(before[paths[2]], b'after-2')
+
+        # Fusionar de nuevo lo ya fusionado no cambia nada
+        self._upload({paths[3]: b'new'})
+        merge_small_segments(self.hdfs, self.workdir / 'merge', small_bytes=1000,
+                             max_bytes=1024 * 1024, min_segments=2)
+        self.assertEqual(SegmentReader(self.hdfs).read_file(paths[3]), b'new')
+        self.assertEqual(SegmentReader(self.hdfs).read_file(paths[2]), b'after-2')
+
+    def test_reader_index_loads_each_manifest_once(self):
+        paths = [f"ninos/N{n:03d}.json.enc" for n in range(1, 4)]
+        for n in range(6):
+            self._upload({paths[n % 3]: f"v{n}".encode()})
+        reader = SegmentReader(self.hdfs)
+
+        with mock.patch.object(self.hdfs, 'read_bytes', wraps=self.hdfs.read_bytes) as read_bytes:
+            for _ in range(5):
+                self._versions(reader, paths)
+            manifest_reads = [c for c in read_bytes.call_args_list if c.args[0].endswith(MANIFEST_SUFFIX)]
+            self.assertEqual(len(manifest_reads), 6)
+
+            self._upload({paths[0]: b'v6'})
+            self.assertEqual(reader.read_file(paths[0]), b'v6')
+            manifest_reads = [c for c in read_bytes.call_args_list if c.args[0].endswith(MANIFEST_SUFFIX)]
+            self.assertEqual(len(manifest_reads), 7)
+
+        # Una fusión quita segmentos: el índice se reconstruye
+        merge_small_segments(self.hdfs, self.workdir / 'merge', small_bytes=1000,
+                             max_bytes=1024 * 1024, min_segments=2)
+        self.assertEqual(self._versions(reader, paths), {paths[0]: b'v6', paths[1]: b'v4', paths[2]: b'v5'})
+        self.assertEqual(len(reader.latest_entries()), 3)
@@ -0,0 +1,258 @@
+"""
+SmileLink Storage - Tracing
+Spans por request con alcance de contexto y log de requests lentos
+
+TracingMiddleware abre una Trace por request muestreado; las capas de abajo
+(storage, índices, encriptación, NFS, replicación) agregan spans con span()
+o add_span(). Si no hay Trace activa, span() retorna un objeto nulo
+compartido: el costo es una lectura de ContextVar.
+
+Los requests que superan TRACE_SLOW_MS se escriben como una línea JSON en
+TRACE_LOG_PATH con la cascada completa; el header X-Trace-Id de la respuesta
+es la llave para encontrarla (GET /api/traces/<trace_id>/).
+"""
+import contextvars
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - sólo POSIX
+    fcntl = None
+
+
+TRACE_ID_PATTERN = re.compile(r'^[0-9a-f]{16,32}$')
+
+
+class Trace:
+    """Spans de un request; seguro para los hilos de un batch paralelo"""
+
+    def __init__(self, name: str, trace_id: Optional[str] = None, max_spans: int = 2000):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.name = name
+        self.max_spans = max_spans
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.duration = None
+        self.dropped = 0
+        # [nombre, inicio (s desde el request), duración (s), índice del padre, atributos]
+        self.spans: List[list] = []
+        self._lock = threading.Lock()
+
+    def _append(self, name: str, start: float, duration: Optional[float], attrs: Dict[str, Any]) -> Optional[int]:
+        with self._lock:
+            if len(self.spans) >= self.max_spans:
+                self.dropped += 1
+                return None
+            self.spans.append([name, start - self.started, duration, _current_span.get(), attrs])
+            return len(self.spans) - 1
+
+    def finish(self) -> float:
+        self.duration = time.perf_counter() - self.started
+        return self.duration
+
+    def to_dict(self, **extra) -> Dict[str, Any]:
+        """Trace serializable; tiempos en milisegundos"""
+        with self._lock:
+            spans = [
+                {
+                    'name': name,
+                    'start_ms': round(start * 1000, 3),
+                    'duration_ms': round(duration * 1000, 3) if duration is not None else None,
+                    'parent': parent,
+                    **({'attrs': attrs} if attrs else {}),
+                }
+                for name, start, duration, parent, attrs in self.spans
+            ]
+        return {
+            'trace_id': self.trace_id,
+            'name': self.name,
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started_at)),
+            'duration_ms': round((self.duration or 0) * 1000, 3),
+            **extra,
+            'dropped_spans': self.dropped,
+            'spans': spans,
+        }
+
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar('smilelink_trace', default=None)
+# Índice del span abierto en este contexto (padre de los nuevos)
+_current_span: contextvars.ContextVar = contextvars.ContextVar('smilelink_trace_span', default=None)
+
+
+def get_current_trace() -> Optional[Trace]:
+    """Retorna la Trace activa en el contexto actual, si existe"""
+    return _current_trace.get()
+
+
+class _Span:
+    __slots__ = ('trace', 'name', 'attrs', 'index', 'token', 'start')
+
+    def __init__(self, trace: Trace, name: str, attrs: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        """Agrega atributos al span (ej: bytes leídos al terminar)"""
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.index = self.trace._append(self.name, self.start, None, self.attrs)
+        self.token = _current_span.set(self.index) if self.index is not None else None
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.index is None:
+            return False
+        _current_span.reset(self.token)
+        self.trace.spans[self.index][2] = time.perf_counter() - self.start
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name: str, **attrs):
+    """
+    Context manager que registra un span en la Trace activa
+
+    Ej:
+        with span('index.write', entity_type='ninos'):
+            ...
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return _NULL_SPAN
+    return _Span(trace, name, attrs)
+
+
+def add_span(name: str, started: float, **attrs):
+    """Registra un span ya terminado que empezó en started (time.perf_counter())"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace._append(name, started, time.perf_counter() - started, attrs)
+
+
+class Tracer:
+    """Decide qué requests se trazan y persiste los lentos"""
+
+    def __init__(self, log_path: Optional[str] = None, slow_ms: Optional[float] = None,
+                 sample_rate: Optional[float] = None, max_log_bytes: Optional[int] = None):
+        """
+        Args:
+            log_path: Archivo JSONL de requests lentos. Si es None, usa TRACE_LOG_PATH
+            slow_ms: Umbral en ms para escribir la trace. Si es None, usa TRACE_SLOW_MS
+            sample_rate: Fracción de requests trazados (0-1). Si es None, usa TRACE_SAMPLE_RATE
+            max_log_bytes: Tamaño al que se rota el log a .1. Si es None, usa TRACE_LOG_MAX_BYTES
+        """
+        self.enabled = os.getenv('TRACE_ENABLED', 'True').lower() == 'true'
+        default_path = Path(__file__).resolve().parent.parent / 'traces' / 'slow_requests.jsonl'
+        self.log_path = Path(log_path or os.getenv('TRACE_LOG_PATH', '') or default_path)
+        self.slow_ms = slow_ms if slow_ms is not None else float(os.getenv('TRACE_SLOW_MS', '1000'))
+        self.sample_rate = sample_rate if sample_rate is not None else float(os.getenv('TRACE_SAMPLE_RATE', '1'))
+        self.max_log_bytes = max_log_bytes or int(os.getenv('TRACE_LOG_MAX_BYTES', str(50 * 1024 * 1024)))
+        self.max_spans = int(os.getenv('TRACE_MAX_SPANS', '2000'))
+        self._lock = threading.Lock()
+
+    def start(self, name: str, trace_id: Optional[str] = None):
+        """
+        Activa una Trace en el contexto actual si el request es muestreado
+
+        Args:
+            name: Nombre de la trace (ej: 'POST /api/apadrinamientos/')
+            trace_id: ID recibido del cliente (X-Trace-Id), si es válido se conserva
+
+        Returns:
+            tuple: (trace, token) o (None, None) si no se traza
+        """
+        if not self.enabled:
+            return None, None
+        if trace_id is None and self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return None, None
+        if trace_id is not None and not TRACE_ID_PATTERN.match(trace_id):
+            trace_id = None
+        trace = Trace(name, trace_id, self.max_spans)
+        return trace, _current_trace.set(trace)
+
+    def finish(self, trace: Trace, token, **extra) -> bool:
+        """
+        Cierra la Trace del contexto y la escribe si superó el umbral
+
+        Returns:
+            bool: True si se escribió en el log de lentos
+        """
+        _current_trace.reset(token)
+        duration = trace.finish()
+        if duration * 1000 < self.slow_ms:
+            return False
+        self.write(trace.to_dict(**extra))
+        return True
+
+    def write(self, record: Dict[str, Any]):
+        """Agrega una línea al log (una sola escritura bajo flock, rota al superar el tamaño)"""
+        line = (json.dumps(record, ensure_ascii=False, default=str) + '\n').encode('utf-8')
+        try:
+            self.log_path.parent.mkdir(parents=True, exist_ok=True)
+            with self._lock, open(self.log_path, 'ab') as f:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                try:
+                    if f.tell() + len(line) > self.max_log_bytes and f.tell() > 0:
+                        os.replace(self.log_path, f"{self.log_path}.1")
+                        with open(self.log_path, 'ab') as rotated:
+                            rotated.write(line)
+                        return
+                    f.write(line)
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        except OSError as e:
+            print(f"Error writing slow request trace: {e}")
+
+    def find(self, trace_id: str) -> Optional[Dict[str, Any]]:
+        """Busca una trace en el log (y en el rotado); None si no está"""
+        needle = f'"trace_id": "{trace_id}"'
+        for path in (self.log_path, Path(f"{self.log_path}.1")):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        if needle in line:
+                            return json.loads(line)
+            except FileNotFoundError:
+                continue
+        return None
+
+
+# Singleton instance
+_tracer = None
+
+def get_tracer() -> Tracer:
+    """Retorna instancia singleton del Tracer"""
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer()
+    return _tracer
@@ -0,0 +1,216 @@
+"""
+SmileLink Storage - WebHDFS Stand-in
+Servidor local que implementa el subconjunto de WebHDFS que usa HDFSClient,
+respaldado por un directorio. Sirve para probar replicación y restore sin un
+clúster Hadoop:
+
+    python manage.py webhdfs_standin --root /tmp/hdfs --port 9870
+    HDFS_NAMENODE_URL=http://127.0.0.1:9870
+
+Operaciones: LISTSTATUS, GETFILESTATUS, GETHOMEDIRECTORY, OPEN (offset/length),
+MKDIRS, CREATE (con la redirección 307 de dos pasos), DELETE.
+"""
+import json
+import shutil
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Optional
+from urllib.parse import parse_qs, unquote, urlsplit
+
+
+WEBHDFS_PREFIX = '/webhdfs/v1'
+
+
+def _file_status(path: Path, suffix: str) -> dict:
+    stat = path.stat()
+    return {
+        'pathSuffix': suffix,
+        'type': 'DIRECTORY' if path.is_dir() else 'FILE',
+        'length': 0 if path.is_dir() else stat.st_size,
+        'modificationTime': int(stat.st_mtime * 1000),
+        'accessTime': int(stat.st_atime * 1000),
+        'blockSize': 134217728,
+        'replication': 1,
+        'owner': 'smilelink',
+        'group': 'supergroup',
+        'permission': '755' if path.is_dir() else '644',
+    }
+
+
+class _WebHDFSHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'SmileLinkWebHDFS/1.0'
+    # Cabeceras y cuerpo van en writes separados; con Nagle cada request espera el ACK retrasado
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass  # Silencioso: el benchmark hace decenas de miles de requests
+
+    # ------------------------------------------------------------------
+    # Helpers
+    # ------------------------------------------------------------------
+
+    def _parse(self):
+        parts = urlsplit(self.path)
+        params = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        hdfs_path = unquote(parts.path)
+        if not hdfs_path.startswith(WEBHDFS_PREFIX):
+            return None, None, params
+        hdfs_path = hdfs_path[len(WEBHDFS_PREFIX):] or '/'
+        local_path = (self.server.root / hdfs_path.lstrip('/')).resolve()
+        if local_path != self.server.root and self.server.root not in local_path.parents:
+            return None, None, params
+        return hdfs_path, local_path, params
+
+    def _send(self, code: int, body: bytes = b'', content_type: str = 'application/json', headers: Optional[dict] = None):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def _json(self, code: int, payload: dict):
+        self._send(code, json.dumps(payload).encode('utf-8'))
+
+    def _error(self, code: int, exception: str, message: str):
+        self._json(code, {'RemoteException': {
+            'exception': exception,
+            'javaClassName': f'java.io.{exception}',
+            'message': message,
+        }})
+
+    def _read_body(self) -> bytes:
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().strip().split(b';')[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            return b''.join(chunks)
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    # ------------------------------------------------------------------
+    # Verbs
+    # ------------------------------------------------------------------
+
+    def do_GET(self):
+        hdfs_path, local_path, params = self._parse()
+        op = params.get('op', '').upper()
+
+        if op == 'GETHOMEDIRECTORY':
+            return self._json(200, {'Path': '/user/smilelink'})
+        if local_path is None:
+            return self._error(400, 'IllegalArgumentException', 'Invalid path')
+        if not local_path.exists():
+            return self._error(404, 'FileNotFoundException', f'File does not exist: {hdfs_path}')
+
+        if op == 'GETFILESTATUS':
+            return self._json(200, {'FileStatus': _file_status(local_path, '')})
+
+        if op == 'LISTSTATUS':
+            if local_path.is_dir():
+                statuses = [_file_status(child, child.name) for child in sorted(local_path.iterdir())]
+            else:
+                statuses = [_file_status(local_path, '')]
+            return self._json(200, {'FileStatuses': {'FileStatus': statuses}})
+
+        if op == 'OPEN':
+            if local_path.is_dir():
+                return self._error(400, 'FileNotFoundException', f'Path is not a file: {hdfs_path}')
+            offset = int(params.get('offset') or 0)
+            length = params.get('length')
+            with open(local_path, 'rb') as f:
+                f.seek(offset)
+                data = f.read(int(length)) if length not in (None, '', 'None') else f.read()
+            return self._send(200, data, 'application/octet-stream')
+
+        return self._error(400, 'UnsupportedOperationException', f'Unsupported GET op: {op}')
+
+    def do_PUT(self):
+        hdfs_path, local_path, params = self._parse()
+        op = params.get('op', '').upper()
+        body = self._read_body()
+
+        if local_path is None:
+            return self._error(400, 'IllegalArgumentException', 'Invalid path')
+
+        if op == 'MKDIRS':
+            local_path.mkdir(parents=True, exist_ok=True)
+            return self._json(200, {'boolean': True})
+
+        if op == 'CREATE':
+            if params.get('data') != 'true':
+                # Paso 1 de WebHDFS: el namenode redirige al "datanode"
+                if local_path.exists() and params.get('overwrite', 'false').lower() != 'true':
+                    return self._error(403, 'FileAlreadyExistsException', f'{hdfs_path} already exists')
+                location = f"http://{self.headers.get('Host')}{self.path}&data=true"
+                return self._send(307, headers={'Location': location})
+
+            local_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = local_path.with_name(f".{local_path.name}.{threading.get_ident()}.tmp")
+            with open(tmp_path, 'wb') as f:
+                f.write(body)
+            tmp_path.replace(local_path)
+            return self._send(201, headers={'Location': f'webhdfs://{hdfs_path}'})
+
+        return self._error(400, 'UnsupportedOperationException', f'Unsupported PUT op: {op}')
+
+    def do_DELETE(self):
+        hdfs_path, local_path, params = self._parse()
+        if local_path is None or params.get('op', '').upper() != 'DELETE':
+            return self._error(400, 'UnsupportedOperationException', 'Unsupported DELETE')
+        if not local_path.exists():
+            return self._json(200, {'boolean': False})
+        if local_path.is_dir():
+            if params.get('recursive', 'false').lower() != 'true' and any(local_path.iterdir()):
+                return self._error(403, 'PathIsNotEmptyDirectoryException', f'{hdfs_path} is non empty')
+            shutil.rmtree(local_path)
+        else:
+            local_path.unlink()
+        return self._json(200, {'boolean': True})
+
+
+class WebHDFSStandIn:
+    """Servidor WebHDFS local respaldado por un directorio"""
+
+    def __init__(self, root: str, host: str = '127.0.0.1', port: int = 0):
+        """
+        Args:
+            root: Directorio que hace de filesystem HDFS
+            host: Interfaz donde escuchar
+            port: Puerto (0 elige uno libre)
+        """
+        self.root = Path(root).resolve()
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.server = ThreadingHTTPServer((host, port), _WebHDFSHandler)
+        self.server.daemon_threads = True
+        self.server.root = self.root
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'WebHDFSStandIn':
+        """Arranca el servidor en un hilo de fondo"""
+        self._thread = threading.Thread(target=self.server.serve_forever, name='webhdfs-standin', daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        """Atiende en el hilo actual hasta Ctrl+C"""
+        self.server.serve_forever()
+
+    def stop(self):
+        """Detiene el servidor"""
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,549 @@
+"""
+SmileLink Storage - Write Batch
+Agrupa escrituras de varias entidades y las aplica todo-o-nada mediante un
+registro de journal (redo log) confirmado con un solo fsync
+
+Confirmado el registro, los archivos se aplican sin fsync: el registro se
+renombra a '.applied' y un checkpoint periódico sincroniza en grupo los
+archivos de todos los batches aplicados antes de borrar sus registros. Si la
+máquina se reinicia antes del checkpoint, la recuperación los rehace.
+"""
+import atexit
+import fcntl
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+
+JOURNAL_DIR = '_journal'
+JOURNAL_SUFFIX = '.journal'
+APPLIED_SUFFIX = '.applied'
+
+# Registros de journal confirmados por este proceso y todavía sin aplicar: fd con flock
+_held_journals: Dict[Path, int] = {}
+_held_lock = threading.Lock()
+
+
+def _read_boot_id() -> str:
+    try:
+        with open('/proc/sys/kernel/random/boot_id', 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return ''
+
+
+# Host y arranque del sistema: una escritura sin fsync sobrevive a la muerte
+# del proceso (queda en el page cache) pero no a un reinicio de la máquina
+BOOT = f"{socket.gethostname()}:{_read_boot_id()}"
+
+
+def _fsync_dir(path: Path):
+    """Hace durable el rename dentro de un directorio (POSIX)"""
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _fsync_file(path: Path):
+    """Sincroniza a disco un archivo ya escrito"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return  # borrado o reemplazado después; lo cubre quien lo haya tocado
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path: Path, data: bytes, durable: bool = False):
+    """
+    Escribe a un temporal y renombra: los lectores ven la versión anterior o la nueva, nunca una a medias
+
+    Con durable=True el contenido se sincroniza a disco antes del rename; el
+    rename en sí lo hace durable un _fsync_dir del directorio.
+    """
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            if durable:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def write_journal_record(journal_dir: Path, record: Dict[str, Any]) -> Path:
+    """
+    Escribe y confirma un registro de journal
+
+    El registro sólo aparece con su nombre final después del fsync, así un
+    crash a mitad de escritura no deja una transacción a medias visible.
+    Queda con un flock de este proceso hasta release_journal: la
+    recuperación de otros workers no re-aplica un registro en curso.
+
+    Returns:
+        Path: Ruta del registro confirmado
+    """
+    journal_dir.mkdir(parents=True, exist_ok=True)
+    journal_path = journal_dir / f"{record['txid']}{JOURNAL_SUFFIX}"
+    tmp_path = journal_dir / f".{record['txid']}.tmp"
+
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        os.write(fd, json.dumps(record).encode('utf-8'))
+        os.fsync(fd)
+        os.replace(tmp_path, journal_path)
+        _fsync_dir(journal_dir)
+    except BaseException:
+        os.close(fd)
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+    with _held_lock:
+        _held_journals[journal_path] = fd
+    return journal_path
+
+
+def mark_applied(journal_path: Path) -> Path:
+    """
+    Renombra un registro aplicado sin fsync a '.applied', conservando su flock
+
+    El rename no se sincroniza: si se pierde, la recuperación ve el registro
+    como pendiente y lo rehace, que es lo mismo que haría con el '.applied'.
+
+    Returns:
+        Path: Nueva ruta del registro
+    """
+    applied_path = journal_path.with_suffix(APPLIED_SUFFIX)
+    os.replace(journal_path, applied_path)
+    with _held_lock:
+        fd = _held_journals.pop(journal_path, None)
+        if fd is not None:
+            _held_journals[applied_path] = fd
+    return applied_path
+
+
+def release_journal(journal_path: Path):
+    """Borra un registro ya aplicado y suelta su flock"""
+    journal_path.unlink(missing_ok=True)
+    with _held_lock:
+        fd = _held_journals.pop(journal_path, None)
+    if fd is not None:
+        os.close(fd)
+
+
+def unclaim_journal(journal_path: Path):
+    """Suelta el flock de un registro sin borrarlo (no se pudo aplicar)"""
+    with _held_lock:
+        fd = _held_journals.pop(journal_path, None)
+    if fd is not None:
+        os.close(fd)
+
+
+def claim_journals(journal_dir: Path):
+    """
+    Registros confirmados que ningún writer vivo tiene tomados, en orden de txid
+
+    Genera (ruta, registro) con el flock del registro tomado; el llamador lo
+    aplica y luego llama release_journal. Incluye los '.applied' que quedaron
+    sin checkpoint. Los temporales sin confirmar de writers muertos se
+    descartan.
+    """
+    if not journal_dir.exists():
+        return
+
+    for tmp_path in journal_dir.glob('.*.tmp'):
+        try:
+            fd = os.open(tmp_path, os.O_RDONLY)
+        except FileNotFoundError:
+            continue
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            tmp_path.unlink(missing_ok=True)
+        except BlockingIOError:
+            pass  # un writer vivo lo está escribiendo
+        finally:
+            os.close(fd)
+
+    journal_paths = list(journal_dir.glob(f"*{JOURNAL_SUFFIX}")) + list(journal_dir.glob(f"*{APPLIED_SUFFIX}"))
+    for journal_path in sorted(journal_paths, key=lambda path: path.name):
+        try:
+            fd = os.open(journal_path, os.O_RDONLY)
+        except FileNotFoundError:
+            continue
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            continue
+        if not journal_path.exists():
+            # Aplicado y borrado mientras esperábamos el lock
+            os.close(fd)
+            continue
+        with _held_lock:
+            _held_journals[journal_path] = fd
+        try:
+            with open(journal_path, 'r', encoding='utf-8') as f:
+                record = json.load(f)
+        except Exception as e:
+            print(f"Error recovering journal {journal_path.name}: {e}")
+            unclaim_journal(journal_path)
+            continue
+        yield journal_path, record
+
+
+def apply_journal_record(base_path: Path, record: Dict[str, Any], encryption=None, durable: bool = True):
+    """
+    Aplica (o re-aplica) las escrituras y borrados de un registro
+
+    Con durable=True todo queda sincronizado a disco (archivos y directorios)
+    antes de retornar y se puede borrar el registro. Con durable=False no hay
+    fsync: el registro se conserva hasta sync_journal_record.
+
+    Con encryption, los índices se actualizan con los cambios del registro
+    ('index_changes') sobre el índice actual en vez de escribir la copia
+    completa que se tomó al confirmar: al recuperar el registro de un writer
+    caído no se pisan altas posteriores de otros workers. Llamar con el
+    _index_lock del storage tomado.
+    """
+    index_changes = record.get('index_changes', {}) if encryption is not None else {}
+    directories = set()
+
+    for relative_path, token in record.get('writes', {}).items():
+        path = base_path / relative_path
+        entity_type = Path(relative_path).parent.name
+        if path.name == 'index.json.enc' and entity_type in index_changes:
+            changes = index_changes[entity_type]
+            try:
+                with open(path, 'rb') as f:
+                    index = encryption.decrypt_data(f.read())
+            except FileNotFoundError:
+                index = []
+            removed = set(changes.get('remove', []))
+            index = [entity_id for entity_id in index if entity_id not in removed]
+            known = set(index)
+            index.extend(entity_id for entity_id in changes.get('add', []) if entity_id not in known)
+            token = encryption.encrypt_data(index).decode('ascii')
+        atomic_write(path, token.encode('ascii'), durable=durable)
+        directories.add(path.parent)
+
+    for relative_path in record.get('deletes', []):
+        path = base_path / relative_path
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+        directories.add(path.parent)
+
+    if durable:
+        for directory in directories:
+            _fsync_dir(directory)
+
+
+def _record_paths(base_path: Path, record: Dict[str, Any]) -> Tuple[set, set]:
+    """Archivos escritos y directorios tocados por un registro"""
+    files = {base_path / relative_path for relative_path in record.get('writes', {})}
+    directories = {path.parent for path in files}
+    directories.update((base_path / relative_path).parent for relative_path in record.get('deletes', []))
+    return files, directories
+
+
+def sync_journal_record(base_path: Path, record: Dict[str, Any]):
+    """Sincroniza a disco lo que aplicó un registro sin fsync"""
+    files, directories = _record_paths(base_path, record)
+    for path in files:
+        _fsync_file(path)
+    for directory in directories:
+        _fsync_dir(directory)
+
+
+def _needs_redo(record: Dict[str, Any]) -> bool:
+    """
+    Si un '.applied' huérfano hay que re-aplicarlo o basta con sincronizarlo
+
+    Sólo se rehace si la máquina que lo aplicó es esta y se reinició desde
+    entonces: si el proceso murió sin reinicio, el page cache conserva lo
+    escrito; si lo aplicó otro host sobre NFS, el close ya lo envió al
+    servidor. Re-aplicarlo sin necesidad pisaría escrituras posteriores.
+    """
+    boot = record.get('boot', '')
+    host = boot.split(':', 1)[0]
+    return not boot or (host == socket.gethostname() and boot != BOOT)
+
+
+def recover_journal(base_path: Path, encryption=None) -> int:
+    """
+    Re-aplica transacciones confirmadas que no alcanzaron a aplicarse
+
+    Se llama al iniciar el storage, con su _index_lock tomado. Los registros
+    que un writer vivo todavía tiene tomados se dejan en paz. Los '.applied'
+    de un writer muerto se sincronizan, o se rehacen tras un reinicio.
+
+    Returns:
+        int: Número de transacciones recuperadas
+    """
+    recovered = 0
+    for journal_path, record in claim_journals(base_path / JOURNAL_DIR):
+        try:
+            if journal_path.suffix == APPLIED_SUFFIX and not _needs_redo(record):
+                sync_journal_record(base_path, record)
+            else:
+                apply_journal_record(base_path, record, encryption)
+                recovered += 1
+        except Exception as e:
+            print(f"Error recovering journal {journal_path.name}: {e}")
+            unclaim_journal(journal_path)
+            continue
+        release_journal(journal_path)
+
+    return recovered
+
+
+class JournalCheckpointer:
+    """
+    Hace durables en grupo los batches aplicados sin fsync
+
+    Cada JOURNAL_CHECKPOINT_SECONDS (o al juntar JOURNAL_CHECKPOINT_RECORDS
+    registros, y al salir el proceso) sincroniza una vez cada archivo y
+    directorio tocado por los registros pendientes y luego los borra.
+    """
+
+    def __init__(self, interval: float, max_pending: int):
+        self.interval = interval
+        self.max_pending = max_pending
+        self._pending: List[Tuple[Path, Path, Dict[str, Any]]] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, base_path: Path, applied_path: Path, record: Dict[str, Any]):
+        """Registra un batch aplicado sin fsync"""
+        with self._lock:
+            self._pending.append((base_path, applied_path, record))
+            pending = len(self._pending)
+            if self._thread is None and self.interval > 0:
+                self._thread = threading.Thread(target=self._run, name='journal-checkpoint', daemon=True)
+                self._thread.start()
+        if self.interval <= 0:
+            self.flush()
+        elif pending >= self.max_pending:
+            self._wake.set()
+
+    def flush(self):
+        """Sincroniza y borra todos los registros pendientes"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if not pending:
+                return
+
+            files, directories = set(), set()
+            for base_path, _, record in pending:
+                record_files, record_directories = _record_paths(base_path, record)
+                files.update(record_files)
+                directories.update(record_directories)
+            # Sin el último, un borrado perdido haría rehacer el batch tras un reinicio
+            journal_dirs = {applied_path.parent for _, applied_path, _ in pending}
+            for path in files:
+                _fsync_file(path)
+            for directory in directories:
+                self._fsync_dir(directory)
+            for _, applied_path, _ in pending:
+                release_journal(applied_path)
+            for journal_dir in journal_dirs:
+                self._fsync_dir(journal_dir)
+
+    @staticmethod
+    def _fsync_dir(directory: Path):
+        try:
+            _fsync_dir(directory)
+        except FileNotFoundError:
+            pass  # el almacenamiento se borró (p.ej. directorio temporal de tests)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error checkpointing journal: {e}")
+
+
+class WriteBatch:
+    """
+    Escrituras de varias entidades confirmadas como una unidad
+
+    Uso:
+        with storage.write_batch() as batch:
+            batch.save('apadrinamientos', 'AP010', apadrinamiento)
+            batch.save('ninos', 'N003', nino)
+        sync.sync_changes(batch.changes)
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self._saves: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._deletes: List[Tuple[str, str]] = []
+        self.committed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        return False
+
+    def _check_type(self, entity_type: str):
+        if entity_type not in self.storage.ENTITY_TYPES:
+            raise ValueError(f"Invalid entity type: {entity_type}")
+
+    def save(self, entity_type: str, entity_id: str, data: Dict[str, Any]):
+        """Prepara el guardado de una entidad"""
+        self._check_type(entity_type)
+        self._saves[(entity_type, entity_id)] = data
+
+    def delete(self, entity_type: str, entity_id: str):
+        """Prepara el borrado de una entidad"""
+        self._check_type(entity_type)
+        self._saves.pop((entity_type, entity_id), None)
+        self._deletes.append((entity_type, entity_id))
+
+    @property
+    def changes(self) -> Dict[str, List[str]]:
+        """IDs tocados por el batch agrupados por tipo: {entity_type: [ids]}"""
+        changes: Dict[str, List[str]] = {}
+        for entity_type, entity_id in list(self._saves) + self._deletes:
+            ids = changes.setdefault(entity_type, [])
+            if entity_id not in ids:
+                ids.append(entity_id)
+        return changes
+
+    def _relative(self, path: Path) -> str:
+        return str(path.relative_to(self.storage.base_path))
+
+    def commit(self) -> bool:
+        """
+        Encripta todo, confirma un registro de journal y lo aplica
+
+        Returns:
+            bool: True si el batch se confirmó
+        """
+        if self.committed:
+            raise RuntimeError('WriteBatch already committed')
+        if not self._saves and not self._deletes:
+            self.committed = True
+            return True
+
+        storage = self.storage
+        encryption = storage.encryption
+        storage._check_writable()
+
+        with storage._index_lock:
+            writes: Dict[str, str] = {}
+            deletes: List[str] = []
+
+            for (entity_type, entity_id), data in self._saves.items():
+                path = storage._get_entity_path(entity_type, entity_id)
+                writes[self._relative(path)] = encryption.encrypt_data(data).decode('ascii')
+
+            for entity_type, entity_id in self._deletes:
+                deletes.append(self._relative(storage._get_entity_path(entity_type, entity_id)))
+
+            index_changes: Dict[str, Dict[str, List[str]]] = {}
+            for entity_type, entity_ids in self.changes.items():
+                index = storage._read_index_for_update(entity_type)
+                new_index = [i for i in index if (entity_type, i) not in self._deletes]
+                known = set(new_index)
+                new_index.extend(
+                    entity_id for entity_id in entity_ids
+                    if (entity_type, entity_id) in self._saves and entity_id not in known
+                )
+                if new_index != index:
+                    path = storage._get_index_path(entity_type)
+                    writes[self._relative(path)] = encryption.encrypt_data(new_index).decode('ascii')
+                    old_ids, new_ids = set(index), set(new_index)
+                    index_changes[entity_type] = {
+                        'add': [i for i in new_index if i not in old_ids],
+                        'remove': [i for i in index if i not in new_ids],
+                    }
+
+            record = {
+                'txid': f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}",
+                'boot': BOOT,
+                'writes': writes,
+                'deletes': deletes,
+                'index_changes': index_changes,
+            }
+
+            journal_path = write_journal_record(storage.base_path / JOURNAL_DIR, record)
+            try:
+                apply_journal_record(storage.base_path, record, durable=False)
+            except Exception as e:
+                print(f"Error applying write batch {record['txid']}, retrying: {e}")
+                try:
+                    apply_journal_record(storage.base_path, record)
+                except Exception:
+                    # Confirmado pero sin aplicar: lo rehace la recuperación del próximo worker
+                    unclaim_journal(journal_path)
+                    raise
+                release_journal(journal_path)
+            else:
+                get_journal_checkpointer().add(storage.base_path, mark_applied(journal_path), record)
+
+            if storage.blob_cache is not None:
+                for relative_path in list(writes) + deletes:
+                    storage.blob_cache.invalidate(storage.base_path / relative_path)
+            
+            for entity_type, entity_ids in self.changes.items():
+                for entity_id in entity_ids:
+                    storage._invalidate_cache(entity_type, entity_id)
+
+        self.committed = True
+        return True
+
+
+# Singleton instance
+_journal_checkpointer: Optional[JournalCheckpointer] = None
+_checkpointer_lock = threading.Lock()
+
+
+def get_journal_checkpointer() -> JournalCheckpointer:
+    """Obtiene el checkpointer de journal del proceso"""
+    global _journal_checkpointer
+    if _journal_checkpointer is None:
+        with _checkpointer_lock:
+            if _journal_checkpointer is None:
+                checkpointer = JournalCheckpointer(
+                    interval=float(os.getenv('JOURNAL_CHECKPOINT_SECONDS', '1')),
+                    max_pending=int(os.getenv('JOURNAL_CHECKPOINT_RECORDS', '256')),
+                )
+                atexit.register(checkpointer.flush)
+                _journal_checkpointer = checkpointer
+    return _journal_checkpointer
+
+
+def _reset_after_fork():
+    # El hilo de checkpoint no pasa al hijo; sus pendientes son del padre
+    global _journal_checkpointer
+    _journal_checkpointer = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)